@@ -0,0 +1,118 @@
+""" Reads and writes backup files made of compressed chunks of entities.
+
+A file starts with FILE_HEADER and is followed by any number of chunks. Each
+chunk is a 4-byte big-endian length followed by that many bytes of zlib data.
+The decompressed data holds a sequence of encoded entities, each preceded by
+its own 4-byte big-endian length.
+"""
+
+import struct
+import zlib
+
+from appscale.datastore.backup.backup_exceptions import BRException
+
+# Identifies the format and version of a chunked backup file.
+FILE_HEADER = 'ASBACKUP\x01'
+
+# The number of uncompressed bytes that triggers a new chunk.
+CHUNK_SIZE = 1 << 22
+
+# The zlib level used for chunks.
+COMPRESSION_LEVEL = 6
+
+# The format of the length that precedes chunks and entities.
+LENGTH_FORMAT = '>I'
+LENGTH_SIZE = struct.calcsize(LENGTH_FORMAT)
+
+
+class ChunkedFileWriter(object):
+  """ Streams encoded entities into a chunked backup file. """
+  def __init__(self, filename, chunk_size=CHUNK_SIZE):
+    """ Opens a new backup file.
+
+    Args:
+      filename: A string specifying the location of the file.
+      chunk_size: An integer specifying how many uncompressed bytes to
+        collect before compressing and writing them.
+    """
+    self.filename = filename
+    self.chunk_size = chunk_size
+    self.entities_written = 0
+
+    self._pending = []
+    self._pending_size = 0
+    self._file = open(filename, 'wb')
+    self._file.write(FILE_HEADER)
+    self.size = len(FILE_HEADER)
+
+  def write(self, encoded_entity):
+    """ Adds an entity to the file.
+
+    Args:
+      encoded_entity: A string containing an encoded EntityProto.
+    """
+    self._pending.append(struct.pack(LENGTH_FORMAT, len(encoded_entity)))
+    self._pending.append(encoded_entity)
+    self._pending_size += LENGTH_SIZE + len(encoded_entity)
+    self.entities_written += 1
+    if self._pending_size >= self.chunk_size:
+      self.flush()
+
+  def flush(self):
+    """ Compresses and writes the pending entities as a chunk. """
+    if not self._pending:
+      return
+
+    chunk = zlib.compress(''.join(self._pending), COMPRESSION_LEVEL)
+    self._file.write(struct.pack(LENGTH_FORMAT, len(chunk)))
+    self._file.write(chunk)
+    self.size += LENGTH_SIZE + len(chunk)
+    self._pending = []
+    self._pending_size = 0
+
+  def close(self):
+    """ Writes the pending entities and closes the file. """
+    try:
+      self.flush()
+    finally:
+      self._file.close()
+
+
+def read_chunked_file(filename):
+  """ Iterates over the entities in a chunked backup file.
+
+  Args:
+    filename: A string specifying the location of the file.
+  Yields:
+    Strings containing encoded EntityProtos.
+  Raises:
+    BRException if the file is truncated or not a chunked backup file.
+  """
+  with open(filename, 'rb') as file_object:
+    if file_object.read(len(FILE_HEADER)) != FILE_HEADER:
+      raise BRException('{} is not a chunked backup file'.format(filename))
+
+    while True:
+      length_bytes = file_object.read(LENGTH_SIZE)
+      if not length_bytes:
+        return
+
+      if len(length_bytes) < LENGTH_SIZE:
+        raise BRException('{} is truncated'.format(filename))
+
+      length = struct.unpack(LENGTH_FORMAT, length_bytes)[0]
+      compressed = file_object.read(length)
+      if len(compressed) < length:
+        raise BRException('{} is truncated'.format(filename))
+
+      try:
+        chunk = zlib.decompress(compressed)
+      except zlib.error as error:
+        raise BRException('Invalid chunk in {}: {}'.format(filename, error))
+
+      position = 0
+      while position < len(chunk):
+        length = struct.unpack_from(LENGTH_FORMAT, chunk, position)[0]
+        position += LENGTH_SIZE
+        yield chunk[position:position + length]
+        position += length
@@ -3,17 +3,23 @@ app ID to the local filesystem.
 """
 import cPickle
 import errno
+import itertools
 import logging
 import multiprocessing
 import os
 import random
+import Queue
 import re
 import shutil
+import threading
 import time
 
 from appscale.datastore import appscale_datastore_batch
 from appscale.datastore import dbconstants
 from appscale.datastore import entity_utils
+from appscale.datastore.backup.chunked_file import ChunkedFileWriter
+from appscale.datastore.groomer_ranges import split_key_range
+from appscale.datastore.utils import get_write_time
 from appscale.datastore.zkappscale import zktransaction as zk
 
 # The location to look at in order to verify that an app is deployed.
@@ -32,6 +38,23 @@ class DatastoreBackup(multiprocessing.Process):
   # The backup filename suffix.
   BACKUP_FILE_SUFFIX = ".backup"
 
+  # The filename suffix for chunked snapshot backups.
+  SNAPSHOT_FILE_SUFFIX = ".snapshot"
+
+  # The filename suffix for the lists of keys that a snapshot backup left out
+  # because they were written after the snapshot time.
+  CHANGED_KEYS_FILE_SUFFIX = ".changed"
+
+  # The default number of threads that back up key ranges in snapshot mode.
+  SNAPSHOT_WORKERS = 4
+
+  # The number of key ranges to create for each snapshot worker.
+  RANGES_PER_WORKER = 8
+
+  # The seconds between checks for transactions that started before a
+  # snapshot.
+  SNAPSHOT_POLL_PERIOD = 1
+
   # The number of entities retrieved in a datastore request.
   BATCH_SIZE = 100
 
@@ -52,7 +75,7 @@ class DatastoreBackup(multiprocessing.Process):
   PROTECTED_KINDS = '(.*)_(.*)_(.*)'
 
   def __init__(self, app_id, zoo_keeper, table_name, source_code=False,
-               skip_list=()):
+               skip_list=(), snapshot=False, workers=SNAPSHOT_WORKERS):
     """ Constructor.
 
     Args:
@@ -63,6 +86,11 @@ class DatastoreBackup(multiprocessing.Process):
         False otherwise.
       skip_list: A list of Kinds to be skipped during backup; empty list if
         none.
+      snapshot: True to back up entities as of a single point in time
+        without locking them, False otherwise. Entities written after that
+        time are left out, and their keys are listed in a separate file.
+      workers: The number of threads that back up key ranges in snapshot
+        mode.
     """
     multiprocessing.Process.__init__(self)
 
@@ -71,6 +99,8 @@ class DatastoreBackup(multiprocessing.Process):
     self.table = table_name
     self.source_code = source_code
     self.skip_kinds = skip_list
+    self.snapshot = snapshot
+    self.workers = workers
 
     self.last_key = self.app_id + '\0' + dbconstants.TERMINATING_STRING
     self.backup_timestamp = time.strftime("%Y%m%d-%H%M%S")
@@ -80,6 +110,16 @@ class DatastoreBackup(multiprocessing.Process):
     self.entities_backed_up = 0
     self.db_access = None
 
+    # The current streaming scan over the entity table and the last key it
+    # returned.
+    self.entity_scan = None
+    self.entity_scan_position = None
+
+    # Guards the counters that snapshot workers update.
+    self.stats_lock = threading.Lock()
+    self.entities_changed = 0
+    self.failed_ranges = 0
+
   def stop(self):
     """ Stops the backup thread. """
     pass
@@ -150,7 +190,10 @@ class DatastoreBackup(multiprocessing.Process):
         if self.source_code:
           self.backup_source_code()
 
-        self.run_backup()
+        if self.snapshot:
+          self.run_snapshot_backup()
+        else:
+          self.run_backup()
         try:
           self.zoo_keeper.release_lock_with_path(zk.DS_BACKUP_LOCK_PATH)
         except zk.ZKTransactionException, zk_exception:
@@ -180,11 +223,22 @@ class DatastoreBackup(multiprocessing.Process):
     Returns:
       A list of entities.
     """
-    batch =  self.db_access.range_query(dbconstants.APP_ENTITY_TABLE,
-      dbconstants.APP_ENTITY_SCHEMA, first_key, self.last_key,
-      batch_size, start_inclusive=start_inclusive)
+    # Continue the current scan if the batch follows the previous one.
+    if (self.entity_scan is None or start_inclusive or
+        first_key != self.entity_scan_position):
+      self.entity_scan = self.db_access.range_query_iter(
+        dbconstants.APP_ENTITY_TABLE, dbconstants.APP_ENTITY_SCHEMA,
+        first_key, self.last_key, start_inclusive=start_inclusive,
+        page_size=batch_size)
+
+    try:
+      batch = list(itertools.islice(self.entity_scan, batch_size))
+    except dbconstants.AppScaleDBConnectionError:
+      self.entity_scan = None
+      raise
 
     if batch:
+      self.entity_scan_position = batch[-1].keys()[0]
       logging.debug("Retrieved entities from {0} to {1}".
         format(batch[0].keys()[0], batch[-1].keys()[0]))
 
@@ -215,6 +269,22 @@ class DatastoreBackup(multiprocessing.Process):
 
     return True
 
+  def internal_kind(self, kind):
+    """ Checks whether a kind is protected or private. Blob kinds are not
+    treated as internal since they hold application data.
+
+    Args:
+      kind: A str, the entity kind.
+    Returns:
+      True if entities of the kind should not be backed up, False otherwise.
+    """
+    if not re.match(self.PROTECTED_KINDS, kind) and\
+        not re.match(self.PRIVATE_KINDS, kind):
+      return False
+
+    return not re.match(self.BLOB_CHUNK_REGEX, kind) and\
+      not re.match(self.BLOB_INFO_REGEX, kind)
+
   def dump_entity(self, entity):
     """ Dumps the entity content into a backup file.
 
@@ -267,14 +337,9 @@ class DatastoreBackup(multiprocessing.Process):
     """
     key = entity.keys()[0]
     kind = entity_utils.get_kind_from_entity_key(key)
-    # Skip protected and private entities.
-    if re.match(self.PROTECTED_KINDS, kind) or\
-        re.match(self.PRIVATE_KINDS, kind):
-      # Do not skip blob entities.
-      if not re.match(self.BLOB_CHUNK_REGEX, kind) and\
-          not re.match(self.BLOB_INFO_REGEX, kind):
-        logging.debug("Skipping key: {0}".format(key))
-        return False
+    if self.internal_kind(kind):
+      logging.debug("Skipping key: {0}".format(key))
+      return False
 
     one_entity = entity[key][dbconstants.APP_ENTITY_SCHEMA[0]]
     if one_entity == dbconstants.TOMBSTONE:
@@ -399,3 +464,200 @@ class DatastoreBackup(multiprocessing.Process):
     time_taken = time.time() - start
     logging.info("Backed up {0} entities".format(self.entities_backed_up))
     logging.info("Backup took {0} seconds".format(str(time_taken)))
+
+  def get_snapshot_time(self):
+    """ Picks the point in time that a snapshot backup captures. Waits for
+    transactions that started earlier to finish, so no entity can be written
+    with an earlier timestamp once this returns.
+
+    Returns:
+      An integer specifying a write time in microseconds.
+    """
+    txn_id = self.zoo_keeper.get_transaction_id(self.app_id)
+    self.zoo_keeper.remove_tx_node(self.app_id, txn_id)
+    while True:
+      in_progress = [current for current in
+                     self.zoo_keeper.get_current_transactions(self.app_id)
+                     if current < txn_id]
+      if not in_progress:
+        break
+
+      logging.info("Waiting for {0} transactions to finish".
+        format(len(in_progress)))
+      time.sleep(self.SNAPSHOT_POLL_PERIOD)
+
+    return get_write_time(txn_id)
+
+  def get_snapshot_ranges(self):
+    """ Divides the application's entity keys into ranges for the snapshot
+    workers. The ranges follow the token ring, so each one is read from as
+    few replicas as possible.
+
+    Returns:
+      A list of (start_key, end_key) tuples with exclusive start keys and
+      inclusive end keys.
+    """
+    prefix = self.app_id + dbconstants.KEY_DELIMITER
+    ring_ranges = []
+    for start_key, end_key in self.db_access.get_key_ranges():
+      start_key = max(start_key, prefix)
+      end_key = min(end_key, self.last_key)
+      if start_key < end_key:
+        ring_ranges.append((start_key, end_key))
+
+    if not ring_ranges:
+      return []
+
+    # Every key in the application's span shares the prefix, so split on the
+    # bytes that follow it.
+    parts = max(self.workers * self.RANGES_PER_WORKER // len(ring_ranges), 1)
+    key_ranges = []
+    for start_key, end_key in ring_ranges:
+      for part_start, part_end in split_key_range(
+          start_key[len(prefix):], end_key[len(prefix):], parts):
+        key_ranges.append((prefix + part_start, prefix + part_end))
+
+    return key_ranges
+
+  def open_snapshot_file(self, worker, fileno):
+    """ Creates a new snapshot backup file for a worker.
+
+    Args:
+      worker: An int, the index of the worker.
+      fileno: An int, the number of files the worker has already created.
+    Returns:
+      A ChunkedFileWriter.
+    """
+    filename = '{0}{1}-{2}-{3}-{4}{5}'.format(self.backup_dir, self.app_id,
+      self.backup_timestamp, worker, fileno, self.SNAPSHOT_FILE_SUFFIX)
+    logging.info("Backup file: {0}".format(filename))
+    return ChunkedFileWriter(filename)
+
+  def open_changed_keys_file(self, worker):
+    """ Creates the file that lists the keys a worker left out.
+
+    Args:
+      worker: An int, the index of the worker.
+    Returns:
+      A file object.
+    """
+    filename = '{0}{1}-{2}-{3}{4}'.format(self.backup_dir, self.app_id,
+      self.backup_timestamp, worker, self.CHANGED_KEYS_FILE_SUFFIX)
+    return open(filename, 'w')
+
+  def backup_snapshot_ranges(self, worker, key_ranges, snapshot_time):
+    """ Streams key ranges into the worker's backup files until there are no
+    ranges left.
+
+    The version of an entity that was written after the snapshot time
+    replaced the one that the snapshot captured, so the entity is left out.
+    Its key is written in hex to the worker's list of changed keys.
+
+    Args:
+      worker: An int, the index of the worker.
+      key_ranges: A Queue of (start_key, end_key) tuples.
+      snapshot_time: An int, the write time that the snapshot captures.
+    """
+    writer = None
+    changed_keys = None
+    fileno = 0
+    try:
+      while True:
+        try:
+          start_key, end_key = key_ranges.get_nowait()
+        except Queue.Empty:
+          break
+
+        backed_up = 0
+        changed = 0
+        while True:
+          try:
+            for key, entity, write_time in \
+                self.db_access.entity_versions_iter(start_key, end_key):
+              kind = entity_utils.get_kind_from_entity_key(key)
+              if (self.internal_kind(kind) or
+                  any(re.match(skip_kind, kind)
+                      for skip_kind in self.skip_kinds)):
+                pass
+              elif write_time > snapshot_time:
+                if changed_keys is None:
+                  changed_keys = self.open_changed_keys_file(worker)
+
+                changed_keys.write(key.encode('hex') + '\n')
+                changed += 1
+              elif entity != dbconstants.TOMBSTONE:
+                if writer is None or writer.size >= self.MAX_FILE_SIZE:
+                  if writer is not None:
+                    writer.close()
+                    fileno += 1
+                  writer = self.open_snapshot_file(worker, fileno)
+
+                writer.write(entity)
+                backed_up += 1
+
+              start_key = key
+            break
+          except dbconstants.AppScaleDBConnectionError, connection_error:
+            logging.error("Error reading range after {0}: {1}".
+              format(repr(start_key), connection_error))
+            time.sleep(self.DB_ERROR_PERIOD)
+
+        with self.stats_lock:
+          self.entities_backed_up += backed_up
+          self.entities_changed += changed
+    except (IOError, OSError) as error:
+      logging.error("Unable to write snapshot backup file: {0}".format(error))
+      with self.stats_lock:
+        self.failed_ranges += 1
+    finally:
+      if writer is not None:
+        writer.close()
+      if changed_keys is not None:
+        changed_keys.close()
+
+  def run_snapshot_backup(self):
+    """ Runs the backup process without locking entities. Each worker reads
+    whole key ranges and streams them into its own backup files.
+    """
+    logging.info("Snapshot backup started")
+    start = time.time()
+    if not self.backup_dir:
+      self.set_filename()
+
+    while True:
+      try:
+        snapshot_time = self.get_snapshot_time()
+        break
+      except (zk.ZKTransactionException, zk.ZKInternalException), zk_exception:
+        logging.error("Unable to pick a snapshot time: {0}".
+          format(zk_exception))
+        time.sleep(self.DB_ERROR_PERIOD)
+
+    key_ranges = Queue.Queue()
+    for key_range in self.get_snapshot_ranges():
+      key_ranges.put(key_range)
+
+    workers = [threading.Thread(target=self.backup_snapshot_ranges,
+                                args=(index, key_ranges, snapshot_time))
+               for index in range(self.workers)]
+    for worker in workers:
+      worker.start()
+
+    for worker in workers:
+      worker.join()
+
+    del self.db_access
+
+    incomplete = self.failed_ranges + key_ranges.qsize()
+    if incomplete:
+      logging.error("Backup is incomplete: {0} key ranges were not backed up".
+        format(incomplete))
+
+    if self.entities_changed:
+      logging.warn("{0} entities were written after the snapshot time and "
+        "were not backed up. Their keys are listed in the {1} files".format(
+        self.entities_changed, self.CHANGED_KEYS_FILE_SUFFIX))
+
+    time_taken = time.time() - start
+    logging.info("Backed up {0} entities".format(self.entities_backed_up))
+    logging.info("Backup took {0} seconds".format(str(time_taken)))
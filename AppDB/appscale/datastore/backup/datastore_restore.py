@@ -6,6 +6,7 @@ import random
 import time
 
 from appscale.datastore import appscale_datastore_batch
+from appscale.datastore.backup.chunked_file import read_chunked_file
 from appscale.datastore.backup.datastore_backup import DatastoreBackup
 from appscale.datastore.datastore_distributed import DatastoreDistributed
 from appscale.datastore.zkappscale import zktransaction as zk
@@ -129,28 +130,43 @@ class DatastoreRestore(multiprocessing.Process):
 
     return True
 
-  def read_from_file_and_restore(self, backup_file):
-    """ Reads entities from backup file and stores them in the datastore.
+  def read_entities(self, backup_file):
+    """ Iterates over the entities in a backup file.
 
     Args:
-      backup_file: A str, the backup file location to restore from.
+      backup_file: A str, the backup file location to read from.
+    Yields:
+      Strs containing encoded entities.
     """
-    entities_to_store = []
+    if backup_file.endswith(DatastoreBackup.SNAPSHOT_FILE_SUFFIX):
+      for entity in read_chunked_file(backup_file):
+        yield entity
+      return
+
     with open(backup_file, 'rb') as file_object:
       while True:
         try:
-          entity = cPickle.load(file_object)
-          entities_to_store.append(entity)
-
-          # If batch size is met, store entities.
-          if len(entities_to_store) == self.BATCH_SIZE:
-            logging.info("Storing a batch of {0} entities...".
-              format(len(entities_to_store)))
-            self.store_entity_batch(entities_to_store)
-            entities_to_store = []
+          yield cPickle.load(file_object)
         except EOFError:
           break
 
+  def read_from_file_and_restore(self, backup_file):
+    """ Reads entities from backup file and stores them in the datastore.
+
+    Args:
+      backup_file: A str, the backup file location to restore from.
+    """
+    entities_to_store = []
+    for entity in self.read_entities(backup_file):
+      entities_to_store.append(entity)
+
+      # If batch size is met, store entities.
+      if len(entities_to_store) == self.BATCH_SIZE:
+        logging.info("Storing a batch of {0} entities...".
+          format(len(entities_to_store)))
+        self.store_entity_batch(entities_to_store)
+        entities_to_store = []
+
     if entities_to_store:
       logging.info("Storing {0} entities...".format(len(entities_to_store)))
       self.store_entity_batch(entities_to_store)
@@ -162,9 +178,9 @@ class DatastoreRestore(multiprocessing.Process):
     logging.info("Restore started")
     start = time.time()
 
-    for backup_file in glob.glob('{0}/*{1}'.
-        format(self.backup_dir, DatastoreBackup.BACKUP_FILE_SUFFIX)):
-      if backup_file.endswith(".backup"):
+    for suffix in (DatastoreBackup.BACKUP_FILE_SUFFIX,
+                   DatastoreBackup.SNAPSHOT_FILE_SUFFIX):
+      for backup_file in glob.glob('{0}/*{1}'.format(self.backup_dir, suffix)):
         logging.info("Restoring \"{0}\" data from: {1}".\
           format(self.app_id, backup_file))
         self.read_from_file_and_restore(backup_file)
@@ -5,9 +5,11 @@
 """
 import cassandra
 import datetime
+import itertools
 import logging
 import struct
 import sys
+import threading
 import time
 import uuid
 
@@ -20,6 +22,7 @@ from cassandra.query import BatchStatement
 from cassandra.query import ConsistencyLevel
 from cassandra.query import SimpleStatement
 from cassandra.query import ValueSequence
+from .entity_stats import EntityStatsBuffer
 from .large_batch import (FailedBatch,
                           LargeBatch)
 from .retry_policies import (BASIC_RETRIES,
@@ -77,6 +80,9 @@ PRIMED_KEY = 'primed'
 # The size in bytes that a batch must be to use the batches table.
 LARGE_BATCH_THRESHOLD = 5 << 10
 
+# The number of rows to fetch per page when iterating over a range.
+RANGE_QUERY_PAGE_SIZE = 1000
+
 
 def batch_size(batch):
   """ Calculates the size of a batch.
@@ -281,6 +287,89 @@ class IndexStates(object):
   SCRUB_IN_PROGRESS = 'scrub_in_progress'
 
 
+# Keeps track of how many rows each thread has read.
+_scan_counter = threading.local()
+
+
+def rows_scanned():
+  """ Reports how many rows the current thread has read.
+
+  Returns:
+    An integer.
+  """
+  return getattr(_scan_counter, 'rows', 0)
+
+
+def count_rows(count):
+  """ Adds to the number of rows the current thread has read.
+
+  Args:
+    count: An integer specifying how many rows were read.
+  """
+  _scan_counter.rows = rows_scanned() + count
+
+
+def group_rows(rows, keys_only):
+  """ Groups the columns of range query rows by key.
+
+  Args:
+    rows: An iterable of (key, column, value) rows ordered by key.
+    keys_only: Boolean if to only yield keys and not values.
+  Yields:
+    A dictionary of key=>columns/values, or a key if keys_only is set.
+  """
+  current_item = {}
+  current_key = None
+  for (key, column, value) in rows:
+    if key != current_key:
+      if current_key is not None:
+        count_rows(1)
+        yield current_key if keys_only else {current_key: current_item}
+      current_item = {}
+      current_key = key
+
+    current_item[column] = value
+
+  if current_key is not None:
+    count_rows(1)
+    yield current_key if keys_only else {current_key: current_item}
+
+
+class RangeQueryFuture(object):
+  """ The pending results of a range query started with range_query_async. """
+  def __init__(self, response_future, limit, offset, keys_only):
+    """ Creates a new RangeQueryFuture.
+
+    Args:
+      response_future: A cassandra-driver ResponseFuture.
+      limit: The maximum number of results to return.
+      offset: The number of results to skip.
+      keys_only: Boolean if to only return keys and not values.
+    """
+    self.response_future = response_future
+    self.limit = limit
+    self.offset = offset
+    self.keys_only = keys_only
+
+  def result(self):
+    """ Waits for the range query to finish.
+
+    Returns:
+      An ordered list of dictionaries of key=>columns/values, or of keys if
+      keys_only is set.
+    Raises:
+      AppScaleDBConnectionError: If the range query failed.
+    """
+    try:
+      rows = self.response_future.result()
+      return list(itertools.islice(group_rows(rows, self.keys_only),
+                                   self.offset, self.offset + self.limit))
+    except dbconstants.TRANSIENT_CASSANDRA_ERRORS:
+      message = 'Exception during range_query_async'
+      logging.exception(message)
+      raise AppScaleDBConnectionError(message)
+
+
 class DatastoreProxy(AppDBInterface):
   """ 
     Cassandra implementation of the AppDBInterface
@@ -313,9 +402,11 @@ class DatastoreProxy(AppDBInterface):
 
     self.session.default_consistency_level = ConsistencyLevel.QUORUM
     self.prepared_statements = {}
+    self.entity_stats = EntityStatsBuffer(self.session)
 
   def close(self):
     """ Close all sessions and connections to Cassandra. """
+    self.entity_stats.stop()
     self.cluster.shutdown()
 
   def batch_get_entity(self, table_name, row_keys, column_names):
@@ -358,6 +449,7 @@ class DatastoreProxy(AppDBInterface):
           results_dict[key] = {}
         results_dict[key][column] = value
 
+      count_rows(len(row_keys))
       return results_dict
     except dbconstants.TRANSIENT_CASSANDRA_ERRORS:
       message = 'Exception during batch_get_entity'
@@ -646,6 +738,16 @@ class DatastoreProxy(AppDBInterface):
     else:
       self._normal_batch(mutations, txn)
 
+    self.record_entity_changes(entity_changes)
+
+  def record_entity_changes(self, entity_changes):
+    """ Updates the entity statistics after entities have been written.
+
+    Args:
+      entity_changes: A list of changes at the entity level.
+    """
+    self.entity_stats.record(entity_changes)
+
   def batch_delete(self, table_name, row_keys, column_names=()):
     """
     Remove a set of rows corresponding to a set of keys.
@@ -776,6 +878,49 @@ class DatastoreProxy(AppDBInterface):
     Returns:
       An ordered list of dictionaries of key=>columns/values
     """
+    if not isinstance(offset, (int, long)):
+      raise TypeError('offset must be int or long')
+
+    results = self.range_query_iter(
+      table_name, column_names, start_key, end_key, limit,
+      start_inclusive=start_inclusive, end_inclusive=end_inclusive,
+      keys_only=keys_only)
+    return list(itertools.islice(results, offset, None))
+
+  def range_query_iter(self,
+                       table_name,
+                       column_names,
+                       start_key,
+                       end_key,
+                       limit=None,
+                       offset=0,
+                       start_inclusive=True,
+                       end_inclusive=True,
+                       keys_only=False,
+                       page_size=RANGE_QUERY_PAGE_SIZE):
+    """ Lazily iterates over a dense range ordered by keys.
+
+    Rows are fetched from Cassandra one page at a time, so memory use is
+    bounded by the page size rather than by the size of the range.
+
+    Args:
+      table_name: Name of table to access
+      column_names: Columns which get returned within the key range
+      start_key: String for which the query starts at
+      end_key: String for which the query ends at
+      limit: Maximum number of results to yield, or None for no limit
+      offset: The number of results to skip before yielding any
+      start_inclusive: Boolean if results should include the start_key
+      end_inclusive: Boolean if results should include the end_key
+      keys_only: Boolean if to only keys and not values
+      page_size: The number of Cassandra rows to fetch per page
+    Raises:
+      TypeError: If an argument passed in was not of the expected type.
+    Returns:
+      A generator of dictionaries of key=>columns/values, or of keys if
+      keys_only is set. Iterating over it raises AppScaleDBConnectionError if
+      a page could not be fetched.
+    """
     if not isinstance(table_name, str):
       raise TypeError('table_name must be a string')
     if not isinstance(column_names, list):
@@ -789,6 +934,91 @@ class DatastoreProxy(AppDBInterface):
     if not isinstance(offset, (int, long)):
       raise TypeError('offset must be int or long')
 
+    query, parameters = self._range_query_statement(
+      table_name, column_names, start_key, end_key, limit, offset,
+      start_inclusive, end_inclusive, page_size)
+
+    items = self._grouped_rows(query, parameters, keys_only)
+    stop = None
+    if limit is not None:
+      stop = offset + limit
+    return itertools.islice(items, offset, stop)
+
+  def range_query_async(self,
+                        table_name,
+                        column_names,
+                        start_key,
+                        end_key,
+                        limit,
+                        offset=0,
+                        start_inclusive=True,
+                        end_inclusive=True,
+                        keys_only=False):
+    """ Starts a range query without waiting for the results.
+
+    The whole range is requested as a single page, so several range queries
+    can be in flight at once.
+
+    Args:
+      table_name: Name of table to access
+      column_names: Columns which get returned within the key range
+      start_key: String for which the query starts at
+      end_key: String for which the query ends at
+      limit: Maximum number of results to return
+      offset: The number of results to skip
+      start_inclusive: Boolean if results should include the start_key
+      end_inclusive: Boolean if results should include the end_key
+      keys_only: Boolean if to only keys and not values
+    Raises:
+      TypeError: If an argument passed in was not of the expected type.
+    Returns:
+      A RangeQueryFuture.
+    """
+    if not isinstance(table_name, str):
+      raise TypeError('table_name must be a string')
+    if not isinstance(column_names, list):
+      raise TypeError('column_names must be a list')
+    if not isinstance(start_key, str):
+      raise TypeError('start_key must be a string')
+    if not isinstance(end_key, str):
+      raise TypeError('end_key must be a string')
+    if not isinstance(limit, (int, long)):
+      raise TypeError('limit must be int or long')
+    if not isinstance(offset, (int, long)):
+      raise TypeError('offset must be int or long')
+
+    page_size = len(column_names) * (limit + offset)
+    query, parameters = self._range_query_statement(
+      table_name, column_names, start_key, end_key, limit, offset,
+      start_inclusive, end_inclusive, page_size)
+    try:
+      response_future = self.session.execute_async(query,
+                                                   parameters=parameters)
+    except dbconstants.TRANSIENT_CASSANDRA_ERRORS:
+      message = 'Exception during range_query_async'
+      logging.exception(message)
+      raise AppScaleDBConnectionError(message)
+
+    return RangeQueryFuture(response_future, limit, offset, keys_only)
+
+  def _range_query_statement(self, table_name, column_names, start_key,
+                             end_key, limit, offset, start_inclusive,
+                             end_inclusive, page_size):
+    """ Builds the statement for a range query.
+
+    Args:
+      table_name: Name of table to access
+      column_names: Columns which get returned within the key range
+      start_key: String for which the query starts at
+      end_key: String for which the query ends at
+      limit: Maximum number of results to return, or None for no limit
+      offset: The number of results that will be skipped
+      start_inclusive: Boolean if results should include the start_key
+      end_inclusive: Boolean if results should include the end_key
+      page_size: The number of Cassandra rows to fetch per page
+    Returns:
+      A tuple containing a SimpleStatement and its parameters.
+    """
     if start_inclusive:
       gt_compare = '>='
     else:
@@ -800,8 +1030,11 @@ class DatastoreProxy(AppDBInterface):
       lt_compare = '<'
 
     query_limit = ''
+    fetch_size = page_size
     if limit is not None:
-      query_limit = 'LIMIT {}'.format(len(column_names) * limit)
+      row_limit = len(column_names) * (limit + offset)
+      query_limit = 'LIMIT {}'.format(row_limit)
+      fetch_size = max(min(page_size, row_limit), 1)
 
     statement = """
       SELECT * FROM "{table}" WHERE
@@ -817,31 +1050,28 @@ class DatastoreProxy(AppDBInterface):
                column=ThriftColumn.COLUMN_NAME,
                limit=query_limit)
 
-    query = SimpleStatement(statement, retry_policy=BASIC_RETRIES)
+    query = SimpleStatement(statement, retry_policy=BASIC_RETRIES,
+                            fetch_size=fetch_size)
     parameters = (bytearray(start_key), bytearray(end_key),
                   ValueSequence(column_names))
+    return query, parameters
 
+  def _grouped_rows(self, query, parameters, keys_only):
+    """ Groups the columns of a paged range query by key.
+
+    Args:
+      query: A SimpleStatement selecting key, column, and value.
+      parameters: A tuple of query parameters.
+      keys_only: Boolean if to only yield keys and not values.
+    Yields:
+      A dictionary of key=>columns/values, or a key if keys_only is set.
+    Raises:
+      AppScaleDBConnectionError: If a page could not be fetched.
+    """
     try:
       results = self.session.execute(query, parameters=parameters)
-
-      results_list = []
-      current_item = {}
-      current_key = None
-      for (key, column, value) in results:
-        if keys_only:
-          results_list.append(key)
-          continue
-
-        if key != current_key:
-          if current_item:
-            results_list.append({current_key: current_item})
-          current_item = {}
-          current_key = key
-
-        current_item[column] = value
-      if current_item:
-        results_list.append({current_key: current_item})
-      return results_list[offset:]
+      for item in group_rows(results, keys_only):
+        yield item
     except dbconstants.TRANSIENT_CASSANDRA_ERRORS:
       message = 'Exception during range_query'
       logging.exception(message)
@@ -913,6 +1143,63 @@ class DatastoreProxy(AppDBInterface):
                         dbconstants.DATASTORE_METADATA_SCHEMA)
       self.session.execute(statement, parameters)
 
+  def get_key_ranges(self):
+    """ Lists the key ranges that make up the token ring.
+
+    The cluster uses the ByteOrderedPartitioner, so each token marks the
+    inclusive end of a range of row keys.
+
+    Returns:
+      A list of (start_key, end_key) tuples that cover every key in order.
+      The start keys are exclusive and the end keys are inclusive.
+    """
+    token_map = self.cluster.metadata.token_map
+    tokens = []
+    if token_map is not None:
+      tokens = sorted(set(token.value for token in token_map.ring
+                          if token.value))
+
+    boundaries = [''] + tokens + [dbconstants.TERMINATING_STRING]
+    return zip(boundaries[:-1], boundaries[1:])
+
+  def entity_versions_iter(self, start_key, end_key,
+                           page_size=RANGE_QUERY_PAGE_SIZE):
+    """ Lazily iterates over entities along with the time they were written.
+
+    Args:
+      start_key: A string specifying the exclusive start of the range.
+      end_key: A string specifying the inclusive end of the range.
+      page_size: The number of Cassandra rows to fetch per page.
+    Yields:
+      Tuples containing the entity key, the encoded entity, and its write
+      time in microseconds.
+    Raises:
+      AppScaleDBConnectionError: If a page could not be fetched.
+    """
+    statement = """
+      SELECT {key}, {value}, WRITETIME({value}) AS write_time
+      FROM "{table}" WHERE
+      token({key}) > %s AND
+      token({key}) <= %s AND
+      {column} = %s
+      ALLOW FILTERING
+    """.format(key=ThriftColumn.KEY,
+               value=ThriftColumn.VALUE,
+               table=dbconstants.APP_ENTITY_TABLE,
+               column=ThriftColumn.COLUMN_NAME)
+    query = SimpleStatement(statement, retry_policy=BASIC_RETRIES,
+                            fetch_size=page_size)
+    parameters = (bytearray(start_key), bytearray(end_key),
+                  dbconstants.APP_ENTITY_SCHEMA[0])
+    try:
+      for row in self.session.execute(query, parameters=parameters):
+        count_rows(1)
+        yield row.key, row.value, row.write_time
+    except dbconstants.TRANSIENT_CASSANDRA_ERRORS:
+      message = 'Exception during entity_versions_iter'
+      logging.exception(message)
+      raise AppScaleDBConnectionError(message)
+
   def get_indices(self, app_id):
     """ Gets the indices of the given application.
 
@@ -0,0 +1,306 @@
+""" Keeps entity counts and sizes up to date as entities change. """
+
+import random
+import re
+import threading
+
+from appscale.common.periodic_flusher import PeriodicFlusher
+from cassandra.query import BatchStatement
+from cassandra.query import BatchType
+from cassandra.query import SimpleStatement
+
+from .retry_policies import BASIC_RETRIES
+from ..dbconstants import TRANSIENT_CASSANDRA_ERRORS
+from ..utils import get_entity_kind
+from ..utils import logger
+
+# Any kind that is of __*__ is private and should not have stats.
+PRIVATE_KINDS = '__(.*)__'
+
+# Any kind that is of _*_ is protected and should not have stats.
+PROTECTED_KINDS = '_(.*)_'
+
+# Do not generate stats for AppScale internal apps.
+APPSCALE_APPLICATIONS = ['apichecker', 'appscaledashboard']
+
+# The number of counter rows that share the updates for each statistic.
+STATS_SHARDS = 16
+
+# The number of seconds between writes of the accumulated changes.
+FLUSH_INTERVAL = 30
+
+
+class StatCategories(object):
+  """ The groupings that entity statistics are kept for. """
+  KIND = 'kind'
+  NAMESPACE = 'namespace'
+
+
+def counted(app_id, kind):
+  """ Checks whether or not an entity is included in the statistics.
+
+  Args:
+    app_id: A string specifying the project ID.
+    kind: A string specifying the entity kind.
+  Returns:
+    A boolean.
+  """
+  return (bool(app_id) and bool(kind) and
+          app_id not in APPSCALE_APPLICATIONS and
+          not re.match(PROTECTED_KINDS, kind) and
+          not re.match(PRIVATE_KINDS, kind))
+
+
+def entity_deltas(entity_changes):
+  """ Determines how a set of entity changes affects the statistics.
+
+  Args:
+    entity_changes: A list of dictionaries containing the key and the old and
+      new EntityProto for each entity, as passed to batch_mutate.
+  Returns:
+    A dictionary mapping (project, category, name) tuples to lists
+    containing the change in the number of entities and in bytes.
+  """
+  deltas = {}
+  for change in entity_changes:
+    key = change['key']
+    app_id = key.app()
+    kind = get_entity_kind(key)
+    if not counted(app_id, kind):
+      continue
+
+    count = 0
+    size = 0
+    if change['old'] is not None:
+      count -= 1
+      size -= change['old'].ByteSize()
+    if change['new'] is not None:
+      count += 1
+      size += change['new'].ByteSize()
+
+    if count == 0 and size == 0:
+      continue
+
+    for stat in [(app_id, StatCategories.KIND, kind),
+                 (app_id, StatCategories.NAMESPACE, key.name_space())]:
+      delta = deltas.setdefault(stat, [0, 0])
+      delta[0] += count
+      delta[1] += size
+
+  return deltas
+
+
+def update_counters(session, deltas, shard=None):
+  """ Adds changes to the counter table.
+
+  Args:
+    session: A cassandra-driver session.
+    deltas: A dictionary mapping (project, category, name) tuples to lists
+      containing the change in the number of entities and in bytes.
+    shard: An integer specifying the counter rows to update. By default, a
+      random shard is used.
+  """
+  if shard is None:
+    shard = random.randrange(STATS_SHARDS)
+
+  update = session.prepare("""
+    UPDATE entity_stats SET entities = entities + ?, bytes = bytes + ?
+    WHERE project = ? AND shard = ? AND category = ? AND name = ?
+  """)
+
+  # Counter updates for the same shard of a project share a partition.
+  batches = {}
+  for (project, category, name), (count, size) in deltas.iteritems():
+    if project not in batches:
+      batches[project] = BatchStatement(batch_type=BatchType.COUNTER,
+                                        retry_policy=BASIC_RETRIES)
+    batches[project].add(update, (count, size, project, shard, category,
+                                  name))
+
+  for batch in batches.itervalues():
+    session.execute(batch)
+
+
+def fetch_entity_stats(session):
+  """ Reads the current statistics for every project.
+
+  Args:
+    session: A cassandra-driver session.
+  Returns:
+    A tuple containing kind statistics and namespace statistics. Each maps
+    project IDs to a dictionary of names and their counts and sizes.
+  """
+  select = SimpleStatement("""
+    SELECT project, category, name, entities, bytes FROM entity_stats
+  """, retry_policy=BASIC_RETRIES)
+
+  totals = {StatCategories.KIND: {}, StatCategories.NAMESPACE: {}}
+  for row in session.execute(select):
+    stats = totals[row.category].setdefault(row.project, {})
+    stat = stats.setdefault(row.name, {'size': 0, 'number': 0})
+    stat['number'] += row.entities or 0
+    stat['size'] += row.bytes or 0
+
+  return totals[StatCategories.KIND], totals[StatCategories.NAMESPACE]
+
+
+def snapshot_entity_stats(session):
+  """ Reads the current counters in a form that can be stored with the
+  progress of a scan.
+
+  Args:
+    session: A cassandra-driver session.
+  Returns:
+    A list of [project, category, name, entities, bytes] lists.
+  """
+  kind_stats, namespace_stats = fetch_entity_stats(session)
+  snapshot = []
+  for category, stats in [(StatCategories.KIND, kind_stats),
+                          (StatCategories.NAMESPACE, namespace_stats)]:
+    for project, names in stats.iteritems():
+      for name, stat in names.iteritems():
+        snapshot.append([project, category, name, stat['number'],
+                         stat['size']])
+
+  return snapshot
+
+
+def stable_counters(snapshots):
+  """ Finds the counters that did not change between snapshots.
+
+  Args:
+    snapshots: A list of snapshots created by snapshot_entity_stats.
+  Returns:
+    A tuple containing a dictionary that maps the (project, category, name)
+    tuples of unchanged counters to their [entities, bytes] values, and a set
+    of the counters that changed.
+  """
+  values = [{(project, category, name): [entities, size]
+             for project, category, name, entities, size in snapshot}
+            for snapshot in snapshots]
+  stable = {}
+  changed = set()
+  for stat in set().union(*values):
+    stat_values = [snapshot.get(stat, [0, 0]) for snapshot in values]
+    if all(value == stat_values[0] for value in stat_values):
+      stable[stat] = stat_values[0]
+    else:
+      changed.add(stat)
+
+  return stable, changed
+
+
+def reconcile_entity_stats(session, kind_stats, namespace_stats, snapshots):
+  """ Corrects counters that have drifted from the counts found by a scan.
+
+  Counter updates are not idempotent, so a retried or failed update can
+  leave a counter slightly off. The counts found by a scan are only compared
+  with counters that had the same value in every snapshot taken while the
+  scan ran. Counters that changed are left for a later scan.
+
+  Args:
+    session: A cassandra-driver session.
+    kind_stats: A dictionary mapping project IDs to the number and size of
+      entities of each kind.
+    namespace_stats: A dictionary mapping project IDs to the number and size
+      of entities in each namespace.
+    snapshots: A list of snapshots created by snapshot_entity_stats while
+      the scan ran.
+  """
+  if not snapshots:
+    logger.warning('Not correcting entity statistics without snapshots')
+    return
+
+  stable, changed = stable_counters(snapshots)
+  found = {}
+  for category, exact in [(StatCategories.KIND, kind_stats),
+                          (StatCategories.NAMESPACE, namespace_stats)]:
+    for project, names in exact.iteritems():
+      for name, stat in names.iteritems():
+        found[(project, category, name)] = [stat['number'], stat['size']]
+
+  deltas = {}
+  for stat in set(found) | set(stable):
+    if stat in changed:
+      continue
+
+    exact_count, exact_size = found.get(stat, [0, 0])
+    count, size = stable.get(stat, [0, 0])
+    if exact_count != count or exact_size != size:
+      deltas[stat] = [exact_count - count, exact_size - size]
+
+  if changed:
+    logger.info('Skipping {} entity statistics that changed during the scan'.
+                format(len(changed)))
+
+  if deltas:
+    logger.info('Correcting {} entity statistics'.format(len(deltas)))
+    update_counters(session, deltas, shard=0)
+
+
+class EntityStatsBuffer(object):
+  """ Accumulates statistics changes in memory and writes them to the
+  counter table periodically. """
+  def __init__(self, session, flush_interval=FLUSH_INTERVAL):
+    """ Creates a new EntityStatsBuffer.
+
+    Args:
+      session: A cassandra-driver session.
+      flush_interval: An integer specifying how many seconds to wait between
+        writes.
+    """
+    self.session = session
+
+    self._lock = threading.Lock()
+    self._deltas = {}
+    self._flusher = PeriodicFlusher(self.flush, flush_interval)
+
+  def record(self, entity_changes):
+    """ Adds the effect of entity changes to the pending statistics.
+
+    Args:
+      entity_changes: A list of dictionaries containing the key and the old
+        and new EntityProto for each entity.
+    """
+    deltas = entity_deltas(entity_changes)
+    if not deltas:
+      return
+
+    with self._lock:
+      self._merge(deltas)
+
+    self._flusher.start()
+
+  def flush(self):
+    """ Writes the pending statistics to the counter table. """
+    with self._lock:
+      deltas = self._deltas
+      self._deltas = {}
+
+    if not deltas:
+      return
+
+    try:
+      update_counters(self.session, deltas)
+    except TRANSIENT_CASSANDRA_ERRORS:
+      logger.exception('Unable to update entity statistics')
+      with self._lock:
+        self._merge(deltas)
+
+  def stop(self):
+    """ Stops the background thread and writes the pending statistics. """
+    self._flusher.stop()
+    self.flush()
+
+  def _merge(self, deltas):
+    """ Adds changes to the pending statistics. This must be called while
+    holding the lock.
+
+    Args:
+      deltas: A dictionary mapping (project, category, name) tuples to lists
+        containing the change in the number of entities and in bytes.
+    """
+    for stat, (count, size) in deltas.iteritems():
+      pending = self._deltas.setdefault(stat, [0, 0])
+      pending[0] += count
+      pending[1] += size
@@ -175,6 +175,34 @@ def create_entity_ids_table(session):
     raise
 
 
+def create_entity_stats_table(session):
+  """ Create the table used for counting entities of each kind and namespace.
+
+  Args:
+    session: A cassandra-driver session.
+  """
+  create_table = """
+    CREATE TABLE IF NOT EXISTS entity_stats (
+      project text,
+      shard int,
+      category text,
+      name text,
+      entities counter,
+      bytes counter,
+      PRIMARY KEY ((project, shard), category, name)
+    )
+  """
+  statement = SimpleStatement(create_table, retry_policy=NO_RETRIES)
+  try:
+    session.execute(statement, timeout=SCHEMA_CHANGE_TIMEOUT)
+  except cassandra.OperationTimedOut:
+    logging.warning(
+      'Encountered an operation timeout while creating entity_stats table. '
+      'Waiting {} seconds for schema to settle.'.format(SCHEMA_CHANGE_TIMEOUT))
+    time.sleep(SCHEMA_CHANGE_TIMEOUT)
+    raise
+
+
 def prime_cassandra(replication):
   """ Create Cassandra keyspace and initial tables.
 
@@ -246,6 +274,7 @@ def prime_cassandra(replication):
   create_transactions_table(session)
   create_pull_queue_tables(cluster, session)
   create_entity_ids_table(session)
+  create_entity_stats_table(session)
 
   first_entity = session.execute(
     'SELECT * FROM "{}" LIMIT 1'.format(dbconstants.APP_ENTITY_TABLE))
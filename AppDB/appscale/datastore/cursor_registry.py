@@ -0,0 +1,166 @@
+""" Keeps the position of queries that have more results to fetch. """
+
+import collections
+import logging
+import random
+import threading
+import time
+
+# How many seconds a cursor can go unused before it is discarded.
+DEFAULT_CURSOR_TTL = 5 * 60
+
+# The most cursors that are kept at once.
+DEFAULT_MAX_CURSORS = 10000
+
+# The most bytes of encoded queries and positions that are kept at once.
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# The number of bits in a cursor ID.
+CURSOR_ID_BITS = 64
+
+
+class ServerCursor(object):
+  """ The state needed to fetch the next batch of a query. """
+  def __init__(self, query, strategy, position):
+    """ Creates a new ServerCursor.
+
+    Args:
+      query: A datastore_pb.Query.
+      strategy: A string specifying the strategy that ran the query.
+      position: A datastore_pb.CompiledCursor marking the last result.
+    """
+    self.query = query
+    self.strategy = strategy
+    self.position = position
+    self.size = query.ByteSize() + position.ByteSize()
+    self.last_used = time.time()
+
+
+class CursorRegistry(object):
+  """ Keeps ServerCursors in memory, evicting the least recently used ones
+  once there are too many or they take up too much space.
+
+  Several datastore servers run behind the load balancer, so cursor IDs are
+  chosen at random. A Next request that reaches a server that did not run
+  the query does not find a cursor instead of finding a different one.
+  """
+  def __init__(self, ttl=DEFAULT_CURSOR_TTL, max_cursors=DEFAULT_MAX_CURSORS,
+               max_bytes=DEFAULT_MAX_BYTES):
+    """ Creates a new CursorRegistry.
+
+    Args:
+      ttl: An integer specifying how many seconds an unused cursor is kept.
+      max_cursors: An integer specifying the most cursors to keep.
+      max_bytes: An integer specifying the most bytes of cursor state to keep.
+    """
+    self.ttl = ttl
+    self.max_cursors = max_cursors
+    self.max_bytes = max_bytes
+    self.logger = logging.getLogger(self.__class__.__name__)
+
+    self._lock = threading.Lock()
+    self._cursors = collections.OrderedDict()
+    self._random = random.SystemRandom()
+    self.size = 0
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  def add(self, app_id, cursor):
+    """ Stores a cursor.
+
+    Args:
+      app_id: A string specifying the project ID.
+      cursor: A ServerCursor.
+    Returns:
+      An integer that identifies the cursor.
+    """
+    with self._lock:
+      cursor_id = 0
+      while cursor_id == 0 or (app_id, cursor_id) in self._cursors:
+        cursor_id = self._random.getrandbits(CURSOR_ID_BITS)
+
+      self._cursors[(app_id, cursor_id)] = cursor
+      self.size += cursor.size
+      self._evict()
+
+    return cursor_id
+
+  def get(self, app_id, cursor_id):
+    """ Fetches a cursor and marks it as recently used.
+
+    Args:
+      app_id: A string specifying the project ID.
+      cursor_id: An integer that identifies the cursor.
+    Returns:
+      A ServerCursor or None if the cursor does not exist.
+    """
+    key = (app_id, cursor_id)
+    with self._lock:
+      self._evict()
+      cursor = self._cursors.pop(key, None)
+      if cursor is None:
+        self.misses += 1
+        return None
+
+      self.hits += 1
+      cursor.last_used = time.time()
+      self._cursors[key] = cursor
+      return cursor
+
+  def update(self, app_id, cursor_id, position):
+    """ Moves a cursor past the latest batch.
+
+    Args:
+      app_id: A string specifying the project ID.
+      cursor_id: An integer that identifies the cursor.
+      position: A datastore_pb.CompiledCursor marking the last result.
+    """
+    with self._lock:
+      cursor = self._cursors.get((app_id, cursor_id))
+      if cursor is None:
+        return
+
+      self.size -= cursor.size
+      cursor.position = position
+      cursor.size = cursor.query.ByteSize() + position.ByteSize()
+      self.size += cursor.size
+
+  def remove(self, app_id, cursor_id):
+    """ Discards a cursor.
+
+    Args:
+      app_id: A string specifying the project ID.
+      cursor_id: An integer that identifies the cursor.
+    """
+    with self._lock:
+      cursor = self._cursors.pop((app_id, cursor_id), None)
+      if cursor is not None:
+        self.size -= cursor.size
+
+  def stats(self):
+    """ Reports how the registry has been used.
+
+    Returns:
+      A dictionary containing cursor metrics.
+    """
+    with self._lock:
+      return {'cursors': len(self._cursors), 'bytes': self.size,
+              'hits': self.hits, 'misses': self.misses,
+              'evictions': self.evictions}
+
+  def _evict(self):
+    """ Discards expired cursors and the least recently used cursors that
+    exceed the limits. This must be called while holding the lock. """
+    expired_before = time.time() - self.ttl
+    while self._cursors:
+      key, cursor = next(self._cursors.iteritems())
+      if (cursor.last_used >= expired_before and
+          len(self._cursors) <= self.max_cursors and
+          self.size <= self.max_bytes):
+        break
+
+      del self._cursors[key]
+      self.size -= cursor.size
+      self.evictions += 1
+      self.logger.debug('Evicted cursor {}'.format(key))
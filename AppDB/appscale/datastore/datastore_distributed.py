@@ -1,5 +1,7 @@
 import array
+import concurrent.futures
 import datetime
+import heapq
 import itertools
 import logging
 import md5
@@ -15,7 +17,13 @@ from appscale.common.unpackaged import APPSCALE_PYTHON_APPSERVER
 from .dbconstants import APP_ENTITY_SCHEMA
 from .dbconstants import ID_KEY_LENGTH
 from .dbconstants import MAX_TX_DURATION
+from .cursor_registry import CursorRegistry
+from .cursor_registry import ServerCursor
+from .query_planner import QueryPlan
+from .query_planner import QueryPlanner
+from .query_planner import Strategy
 from .cassandra_env import cassandra_interface
+from .cassandra_env.cassandra_interface import RangeQueryFuture
 from .cassandra_env.entity_id_allocator import EntityIDAllocator
 from .cassandra_env.entity_id_allocator import ScatteredAllocator
 from .utils import clean_app_id
@@ -30,6 +38,7 @@ from .utils import group_for_key
 from .utils import reference_property_to_reference
 from .utils import UnprocessedQueryCursor
 from .zkappscale import entity_lock
+from .zkappscale.txid_releaser import TransactionIDReleaser
 from .zkappscale import zktransaction
 
 sys.path.append(APPSCALE_PYTHON_APPSERVER)
@@ -46,6 +55,7 @@ from google.appengine.datastore import entity_pb
 from google.appengine.datastore import sortable_pb_encoder
 from google.appengine.runtime import apiproxy_errors
 from google.appengine.ext import db
+from google.appengine.ext.db import stats
 from google.appengine.ext.db.metadata import Namespace
 from google.net.proto.ProtocolBuffer import ProtocolBufferDecodeError
 
@@ -107,13 +117,18 @@ class DatastoreDistributed():
   # The number of entities to fetch at a time when updating indices.
   BATCH_SIZE = 100
 
-  def __init__(self, datastore_batch, zookeeper=None, log_level=logging.INFO):
+  # The maximum number of entity groups to write concurrently for a put.
+  MAX_GROUP_WRITE_WORKERS = 8
+
+  def __init__(self, datastore_batch, zookeeper=None, log_level=logging.INFO,
+               index_cache=None):
     """
        Constructor.
      
      Args:
        datastore_batch: A reference to the batch datastore interface.
        zookeeper: A reference to the zookeeper interface.
+       index_cache: An IndexCache used to look up composite indexes.
     """
     class_name = self.__class__.__name__
     self.logger = logging.getLogger(class_name)
@@ -135,6 +150,78 @@ class DatastoreDistributed():
     # Maintain a scattered allocator for each project.
     self.scattered_allocators = {}
 
+    # Keeps composite index definitions in memory when available.
+    self.index_cache = index_cache
+
+    # Writes independent entity groups in parallel.
+    self.group_write_executor = concurrent.futures.ThreadPoolExecutor(
+      max(self.MAX_GROUP_WRITE_WORKERS, 1))
+
+    # Chooses the strategy for each query.
+    self.query_planner = QueryPlanner(self.get_kind_counts)
+
+    # Keeps the position of queries that have more results.
+    self.cursors = CursorRegistry()
+
+    # Removes the nodes of finished non-transactional writes.
+    self.txid_releaser = TransactionIDReleaser(zookeeper)
+
+  def close(self):
+    """ Removes the nodes of finished transaction IDs and closes the
+    connection to the database. """
+    self.txid_releaser.stop()
+    self.datastore_batch.close()
+
+  def get_indices(self, app_id):
+    """ Fetches the composite index definitions for a project.
+
+    Args:
+      app_id: A string specifying the project ID.
+    Returns:
+      A list of encoded entity_pb.CompositeIndex objects.
+    """
+    if self.index_cache is None:
+      return self.datastore_batch.get_indices(app_id)
+
+    return self.index_cache.get(app_id)
+
+  def get_kind_counts(self, app_id):
+    """ Fetches the entity count for each kind from the groomer's statistics.
+
+    Args:
+      app_id: A string specifying the project ID.
+    Returns:
+      A dictionary mapping kind names to entity counts.
+    """
+    query = datastore_pb.Query()
+    query.set_app(app_id)
+    query.set_kind(stats.KindStat.STORED_KIND_NAME)
+
+    counts = {}
+    for encoded_entity in self.__kind_query(query, {}, []) or []:
+      entity = entity_pb.EntityProto(encoded_entity)
+      kind_name = None
+      count = None
+      for prop in entity.property_list():
+        if prop.name() == 'kind_name':
+          kind_name = prop.value().stringvalue()
+        elif prop.name() == 'count':
+          count = prop.value().int64value()
+
+      if kind_name is not None and count is not None:
+        counts[kind_name] = count
+
+    return counts
+
+  def invalidate_indices(self, app_id):
+    """ Notifies datastore servers that a project's indexes have changed.
+
+    Args:
+      app_id: A string specifying the project ID.
+    """
+    if self.index_cache is not None:
+      self.index_cache.invalidate(app_id)
+
   def get_limit(self, query):
     """ Returns the limit that should be used for the given query.
   
@@ -387,6 +474,7 @@ class DatastoreDistributed():
     self.datastore_batch.batch_delete(dbconstants.METADATA_TABLE,
                                       index_keys, 
                                       column_names=dbconstants.METADATA_TABLE)
+    self.invalidate_indices(app_id)
 
   def create_composite_index(self, app_id, index):
     """ Stores a new index for the given application identifier.
@@ -409,6 +497,7 @@ class DatastoreDistributed():
                                           row_keys, 
                                           dbconstants.METADATA_SCHEMA, 
                                           row_values)    
+    self.invalidate_indices(app_id)
     return rand 
 
   def update_composite_index(self, app_id, index):
@@ -431,20 +520,19 @@ class DatastoreDistributed():
     )
     start_row = prefix
     end_row = prefix + self._TERM_STRING
-    start_inclusive = True
+
+    # Fetch references from the kind table since entity keys can have a
+    # parent prefix.
+    all_references = self.datastore_batch.range_query_iter(
+      table_name=dbconstants.APP_KIND_TABLE,
+      column_names=dbconstants.APP_KIND_SCHEMA,
+      start_key=start_row,
+      end_key=end_row,
+      page_size=self.BATCH_SIZE,
+    )
 
     while True:
-      # Fetch references from the kind table since entity keys can have a
-      # parent prefix.
-      references = self.datastore_batch.range_query(
-        table_name=dbconstants.APP_KIND_TABLE,
-        column_names=dbconstants.APP_KIND_SCHEMA,
-        start_key=start_row,
-        end_key=end_row,
-        limit=self.BATCH_SIZE,
-        offset=0,
-        start_inclusive=start_inclusive,
-      )
+      references = list(itertools.islice(all_references, self.BATCH_SIZE))
 
       pb_entities = self.__fetch_entities(references)
       entities = [entity_pb.EntityProto(entity) for entity in pb_entities]
@@ -456,10 +544,8 @@ class DatastoreDistributed():
       if len(references) < self.BATCH_SIZE:
         break
 
-      start_row = references[-1].keys()[0]
-      start_inclusive = self._DISABLE_INCLUSIVITY
-
     self.logger.info('Updated {} index entries.'.format(entries_updated))
+    self.invalidate_indices(app_id)
 
   def allocate_size(self, project, size):
     """ Allocates a block of IDs for a project.
@@ -510,36 +596,77 @@ class DatastoreDistributed():
         by_group[group_key] = []
       by_group[group_key].append(entity)
 
-    for encoded_group_key, entity_list in by_group.iteritems():
+    # Groups are handled in a consistent order, and all of the transaction
+    # IDs are acquired with a single ZooKeeper request.
+    group_keys = sorted(by_group.keys())
+    txids = self.zookeeper.get_transaction_ids(app, len(group_keys))
+
+    # put_group releases the transaction ID it is given. The IDs of groups
+    # that are not handed to put_group because of an earlier error are
+    # released here.
+    pending = zip(group_keys, txids)
+    futures = []
+    try:
+      while pending:
+        encoded_group_key, txid = pending[0]
+        if len(group_keys) == 1 or self.MAX_GROUP_WRITE_WORKERS <= 1:
+          pending.pop(0)
+          self.put_group(app, encoded_group_key, by_group[encoded_group_key],
+                         txid, current_values, composite_indexes)
+        else:
+          futures.append(self.group_write_executor.submit(
+            self.put_group, app, encoded_group_key,
+            by_group[encoded_group_key], txid, current_values,
+            composite_indexes))
+          pending.pop(0)
+    finally:
+      for _, txid in pending:
+        self.txid_releaser.release(app, txid)
+
+    # Wait for every group to finish before reporting the first error.
+    concurrent.futures.wait(futures)
+    for future in futures:
+      future.result()
+
+  def put_group(self, app, encoded_group_key, entity_list, txid,
+                current_values, composite_indexes=()):
+    """ Writes entities that belong to a single entity group.
+
+    Args:
+      app: A string containing the application ID.
+      encoded_group_key: An encoded entity group Reference.
+      entity_list: A list of entities in the group.
+      txid: An integer specifying the transaction ID for the group.
+      current_values: A dictionary mapping entity keys to existing values.
+      composite_indexes: A list or tuple of CompositeIndex objects.
+    """
+    try:
       group_key = entity_pb.Reference(encoded_group_key)
       lock = entity_lock.EntityLock(self.zookeeper.handle, [group_key])
-
-      txid = self.zookeeper.get_transaction_id(app, False)
-      try:
-        with lock:
-          batch = []
-          entity_changes = []
-          for entity in entity_list:
-            prefix = self.get_table_prefix(entity)
-            entity_key = get_entity_key(prefix, entity.key().path())
-
-            current_value = None
-            if current_values[entity_key]:
-              current_value = entity_pb.EntityProto(
-                current_values[entity_key][APP_ENTITY_SCHEMA[0]])
-
-            batch.extend(cassandra_interface.mutations_for_entity(
-              entity, txid, current_value, composite_indexes))
-
-            batch.append({'table': 'group_updates',
-                          'key': bytearray(encoded_group_key),
-                          'last_update': txid})
-
-            entity_changes.append(
-              {'key': entity.key(), 'old': current_value, 'new': entity})
-          self.datastore_batch.batch_mutate(app, batch, entity_changes, txid)
-      finally:
-        self.zookeeper.remove_tx_node(app, txid)
+      with lock:
+        batch = []
+        entity_changes = []
+        for entity in entity_list:
+          prefix = self.get_table_prefix(entity)
+          entity_key = get_entity_key(prefix, entity.key().path())
+
+          current_value = None
+          if current_values[entity_key]:
+            current_value = entity_pb.EntityProto(
+              current_values[entity_key][APP_ENTITY_SCHEMA[0]])
+
+          batch.extend(cassandra_interface.mutations_for_entity(
+            entity, txid, current_value, composite_indexes))
+
+          batch.append({'table': 'group_updates',
+                        'key': bytearray(encoded_group_key),
+                        'last_update': txid})
+
+          entity_changes.append(
+            {'key': entity.key(), 'old': current_value, 'new': entity})
+        self.datastore_batch.batch_mutate(app, batch, entity_changes, txid)
+    finally:
+      self.txid_releaser.release(app, txid)
 
   def delete_entities(self, group, txid, keys, composite_indexes=()):
     """ Deletes the entities and the indexes associated with them.
@@ -573,6 +700,8 @@ class DatastoreDistributed():
                     'last_update': txid})
 
       self.datastore_batch._normal_batch(batch, txid)
+      self.datastore_batch.record_entity_changes(
+        [{'key': current_value.key(), 'old': current_value, 'new': None}])
 
   def dynamic_put(self, app_id, put_request, put_response):
     """ Stores and entity and its indexes in the datastore.
@@ -875,7 +1004,7 @@ class DatastoreDistributed():
     composite_indexes = []
     filtered_indexes = []
     if delete_request.has_mark_changes():
-      all_composite_indexes = self.datastore_batch.get_indices(app_id)
+      all_composite_indexes = self.get_indices(app_id)
       for index in all_composite_indexes:
         new_index = entity_pb.CompositeIndex()
         new_index.ParseFromString(index)
@@ -914,7 +1043,7 @@ class DatastoreDistributed():
         except entity_lock.LockTimeout as timeout_error:
           raise dbconstants.AppScaleDBConnectionError(str(timeout_error))
         finally:
-          self.zookeeper.remove_tx_node(app_id, txid)
+          self.txid_releaser.release(app_id, txid)
 
   def generate_filter_info(self, filters):
     """Transform a list of filters into a more usable form.
@@ -1183,21 +1312,14 @@ class DatastoreDistributed():
 
   def __extract_entities(self, kv):
     """ Given a result from a range query on the Entity table return a 
-        list of encoded entities.
+        generator of encoded entities.
 
     Args:
       kv: Key and values from a range query on the entity table.
     Returns:
       The extracted entities.
     """
-    keys = [item.keys()[0] for item in kv]
-    results = []    
-    for index, entity in enumerate(kv):
-      key = keys[index]
-      entity = entity[key][APP_ENTITY_SCHEMA[0]]
-      results.append(entity)
-
-    return results
+    return (item.values()[0][APP_ENTITY_SCHEMA[0]] for item in kv)
 
   def ordered_ancestor_query(self, query, filter_info, order_info):
     """ Performs an ordered ancestor query. It grabs all entities of a 
@@ -1231,11 +1353,9 @@ class DatastoreDistributed():
       if query.compiled_cursor().position_list()[0].start_inclusive() == 1:
         start_inclusive = self._ENABLE_INCLUSIVITY
 
-    limit = self._MAXIMUM_RESULTS
-
     unordered = self.fetch_from_entity_table(
-      startrow, endrow, limit, 0, start_inclusive, end_inclusive, query,
-      txn_id)
+      startrow, endrow, self._MAXIMUM_RESULTS, 0, start_inclusive,
+      end_inclusive, query, txn_id, stream=True)
 
     if query.has_transaction():
       self.datastore_batch.record_reads(
@@ -1245,8 +1365,88 @@ class DatastoreDistributed():
     if query.has_kind():
       kind = query.kind()
     limit = self.get_limit(query)
-    return self.__multiorder_results(unordered, order_info, kind)[:limit]
+    return self.__multiorder_results(unordered, order_info, kind, limit)
  
+  def __ancestor_filter_query(self, query, filter_info, order_info):
+    """ Performs an ancestor query with equality filters by scanning the
+        entity group and filtering in memory.
+
+    At most _MAXIMUM_RESULTS entities are read from the group. If that is not
+    enough to find all of the results, another strategy is used instead.
+
+    Args:
+      query: The query to run.
+      filter_info: Tuple with filter operators and values.
+      order_info: Tuple with property name and the sort order.
+    Returns:
+      A list of entities or None if the query cannot be run this way.
+    Raises:
+      ZKTransactionException: If a lock could not be acquired.
+    """
+    filter_info = self.remove_exists_filters(filter_info)
+    if (not query.has_ancestor() or not query.has_kind() or
+        not filter_info or '__key__' in filter_info or order_info or
+        query.property_name_size() > 0):
+      return None
+
+    for filter_ops in filter_info.itervalues():
+      for op, _ in filter_ops:
+        if op != datastore_pb.Query_Filter.EQUAL:
+          return None
+
+    self.logger.debug('Ancestor Filter Query:\n{}'.format(query))
+    ancestor = query.ancestor()
+    prefix = self.get_table_prefix(query)
+    path = buffer(prefix + self._SEPARATOR) + encode_index_pb(ancestor.path())
+    txn_id = 0
+    if query.has_transaction():
+      txn_id = query.transaction().handle()
+
+    startrow = path
+    endrow = path + self._TERM_STRING
+    start_inclusive = self._ENABLE_INCLUSIVITY
+    if query.has_compiled_cursor() and query.compiled_cursor().position_size():
+      cursor = appscale_stub_util.ListCursor(query)
+      last_result = cursor._GetLastResult()
+      startrow = self.__get_start_key(prefix, None, None, last_result)
+      start_inclusive = self._DISABLE_INCLUSIVITY
+      if query.compiled_cursor().position_list()[0].start_inclusive() == 1:
+        start_inclusive = self._ENABLE_INCLUSIVITY
+
+    # One extra entity is requested to tell if the whole group was read.
+    unfiltered = self.fetch_from_entity_table(
+      startrow, endrow, self._MAXIMUM_RESULTS + 1, 0, start_inclusive,
+      self._ENABLE_INCLUSIVITY, query, txn_id, stream=True)
+
+    limit = self.get_limit(query)
+    results = []
+    for entities_read, encoded_entity in enumerate(unfiltered):
+      if entities_read == self._MAXIMUM_RESULTS:
+        self.logger.debug('Entity group is too large to filter in memory')
+        return None
+
+      entity = entity_pb.EntityProto(encoded_entity)
+      if entity.key().path().element_list()[-1].type() != query.kind():
+        continue
+
+      values = {}
+      for prop in entity.property_list():
+        values.setdefault(prop.name(), set()).add(
+          encode_index_pb(prop.value()))
+
+      if all(value in values.get(prop_name, ())
+             for prop_name, filter_ops in filter_info.iteritems()
+             for _, value in filter_ops):
+        results.append(encoded_entity)
+        if len(results) >= limit:
+          break
+
+    if query.has_transaction():
+      self.datastore_batch.record_reads(
+        query.app(), query.transaction().handle(), [group_for_key(ancestor)])
+
+    return results
+
   def ancestor_query(self, query, filter_info, order_info):
     """ Performs ancestor queries which is where you select 
         entities based on a particular root entitiy. 
@@ -1324,7 +1524,8 @@ class DatastoreDistributed():
                               start_inclusive, 
                               end_inclusive, 
                               query, 
-                              txn_id):
+                              txn_id,
+                              stream=False):
     """
     Fetches entities from the entity table given a query and a set of parameters.
     It will validate the results and remove tombstoned items. 
@@ -1338,39 +1539,25 @@ class DatastoreDistributed():
        end_inclusive: Boolean if we should include the end key in the result. 
        query: The query we are currently running.
        txn_id: The current transaction ID if there is one, it is 0 if there is not.
+       stream: Boolean if entities should be yielded as they are fetched.
     Returns:
-       A validated database result.
+       A validated database result. A generator if stream is set.
     """
-    final_result = []
-    while 1: 
-      result = self.datastore_batch.range_query(
-        dbconstants.APP_ENTITY_TABLE,
-        APP_ENTITY_SCHEMA,
-        startrow,
-        endrow,
-        limit,
-        offset=0,
-        start_inclusive=start_inclusive,
-        end_inclusive=end_inclusive)
-
-      prev_len = len(result)
-      last_result = None
-      if result:
-        last_result = result[-1].keys()[0]
-      else: 
-        break
+    result = self.datastore_batch.range_query_iter(
+      dbconstants.APP_ENTITY_TABLE,
+      APP_ENTITY_SCHEMA,
+      startrow,
+      endrow,
+      limit,
+      offset=offset,
+      start_inclusive=start_inclusive,
+      end_inclusive=end_inclusive)
 
-      final_result += result
+    entities = self.__extract_entities(result)
+    if stream:
+      return entities
 
-      if len(result) != prev_len:
-        startrow = last_result
-        start_inclusive = self._DISABLE_INCLUSIVITY
-        limit = limit - len(result)
-        continue 
-      else:
-        break
-
-    return self.__extract_entities(final_result)
+    return list(entities)
 
   def kindless_query(self, query, filter_info):
     """ Performs kindless queries where queries are performed 
@@ -1522,8 +1709,6 @@ class DatastoreDistributed():
       order_info: tuple with property name and the sort order.
     Returns:
       An ordered list of entities matching the query.
-    Raises:
-      AppScaleDBError: An infinite loop is detected when fetching references.
     """
     self.logger.debug('Kind Query:\n{}'.format(query))
     filter_info = self.remove_exists_filters(filter_info)
@@ -1563,20 +1748,22 @@ class DatastoreDistributed():
 
     # Since the validity of each reference is not checked until after the
     # range query has been performed, we may need to fetch additional
-    # references in order to satisfy the query.
+    # references in order to satisfy the query. The references are streamed
+    # so that fetching more continues the same scan.
+    all_references = self.datastore_batch.range_query_iter(
+      dbconstants.APP_KIND_TABLE,
+      dbconstants.APP_KIND_SCHEMA,
+      startrow,
+      endrow,
+      start_inclusive=start_inclusive,
+      end_inclusive=end_inclusive,
+      page_size=limit + dbconstants.MAX_GROUPS_FOR_XG
+    )
+
     entities = []
     current_limit = limit
     while True:
-      references = self.datastore_batch.range_query(
-        dbconstants.APP_KIND_TABLE,
-        dbconstants.APP_KIND_SCHEMA,
-        startrow,
-        endrow,
-        current_limit,
-        offset=0,
-        start_inclusive=start_inclusive,
-        end_inclusive=end_inclusive
-      )
+      references = list(itertools.islice(all_references, current_limit))
 
       new_entities = self.__fetch_entities(references)
       entities.extend(new_entities)
@@ -1602,15 +1789,6 @@ class DatastoreDistributed():
       self.logger.debug('{} references invalid. Fetching {} more references.'
         .format(invalid_refs, current_limit))
 
-      # Start from the last reference fetched.
-      last_startrow = startrow
-      startrow = references[-1].keys()[0]
-      start_inclusive = self._DISABLE_INCLUSIVITY
-
-      if startrow == last_startrow:
-        raise dbconstants.AppScaleDBError(
-          'An infinite loop was detected while fetching references.')
-
     if query.kind() == "__namespace__":
       entities = [self.default_namespace()] + entities
 
@@ -1824,7 +2002,9 @@ class DatastoreDistributed():
                      force_start_key_exclusive=False,
                      ancestor=None,
                      query=None,
-                     end_compiled_cursor=None):
+                     end_compiled_cursor=None,
+                     include_start_key=False,
+                     range_query=None):
     """ Applies property filters in the query.
 
     Args:
@@ -1839,8 +2019,11 @@ class DatastoreDistributed():
       ancestor: Optional query ancestor.
       query: Query object for debugging.
       end_compiled_cursor: A compiled cursor to resume a query.
+      include_start_key: Include the start key when a start row is given.
+      range_query: The function used to scan the index. Defaults to the
+        datastore's range_query.
     Results:
-      Returns a list of entity keys.
+      Returns a list of entity keys, or the result of range_query.
     Raises:
       NotImplementedError: For unsupported queries.
       AppScaleMisconfiguredQuery: Bad filters or orderings.
@@ -1855,6 +2038,9 @@ class DatastoreDistributed():
     endrow = None 
     column_names = dbconstants.PROPERTY_SCHEMA
 
+    if range_query is None:
+      range_query = self.datastore_batch.range_query
+
     if order_info and order_info[0][0] == property_name:
         direction = order_info[0][1]
     else:
@@ -1865,7 +2051,7 @@ class DatastoreDistributed():
     else: 
       table_name = dbconstants.DSC_PROPERTY_TABLE
   
-    if startrow: 
+    if startrow and not include_start_key:
       start_inclusive = False
 
     if end_compiled_cursor:
@@ -1887,14 +2073,14 @@ class DatastoreDistributed():
         endrow = get_index_key_from_params(params)
       if force_start_key_exclusive:
         start_inclusive = False
-      result = self.datastore_batch.range_query(table_name, 
-                                          column_names, 
-                                          startrow, 
-                                          endrow, 
-                                          limit, 
-                                          offset=0, 
-                                          start_inclusive=start_inclusive, 
-                                          end_inclusive=end_inclusive)      
+      result = range_query(table_name, 
+                           column_names,
+                           startrow,
+                           endrow,
+                           limit,
+                           offset=0,
+                           start_inclusive=start_inclusive,
+                           end_inclusive=end_inclusive)      
       return result
 
     # This query has a value it bases the query on for a property name
@@ -1966,14 +2152,14 @@ class DatastoreDistributed():
           format([startrow], [endrow]))
         return []
  
-      ret = self.datastore_batch.range_query(table_name, 
-                                          column_names, 
-                                          startrow, 
-                                          endrow, 
-                                          limit, 
-                                          offset=0, 
-                                          start_inclusive=start_inclusive, 
-                                          end_inclusive=end_inclusive)      
+      ret = range_query(table_name, 
+                        column_names,
+                        startrow,
+                        endrow,
+                        limit,
+                        offset=0,
+                        start_inclusive=start_inclusive,
+                        end_inclusive=end_inclusive)      
       return ret 
 
     # Here we have two filters and so we set the start and end key to 
@@ -2010,14 +2196,14 @@ class DatastoreDistributed():
         params = [prefix, kind, property_name, value1 + self._SEPARATOR]
         if not startrow:
           startrow = get_index_key_from_params(params)
-        else:
+        elif not include_start_key:
           start_inclusive = self._DISABLE_INCLUSIVITY
         if not endrow:
           params = [prefix, kind, property_name, value1 + \
             self._SEPARATOR + self._TERM_STRING]
           endrow = get_index_key_from_params(params)
 
-        ret = self.datastore_batch.range_query(
+        ret = range_query(
           table_name,
           column_names,
           startrow,
@@ -2043,7 +2229,8 @@ class DatastoreDistributed():
         table_name = dbconstants.ASC_PROPERTY_TABLE
         # The first operator will always be either > or >=.
         if startrow:
-          start_inclusive = self._DISABLE_INCLUSIVITY
+          if not include_start_key:
+            start_inclusive = self._DISABLE_INCLUSIVITY
         elif oper1 == datastore_pb.Query_Filter.GREATER_THAN:
           params = [prefix, kind, property_name, value1 + self._SEPARATOR + \
                     self._TERM_STRING]
@@ -2087,7 +2274,8 @@ class DatastoreDistributed():
           end_inclusive = self._ENABLE_INCLUSIVITY
 
         if startrow:
-          start_inclusive = self._DISABLE_INCLUSIVITY
+          if not include_start_key:
+            start_inclusive = self._DISABLE_INCLUSIVITY
         elif oper2 == datastore_pb.Query_Filter.LESS_THAN:
           params = [prefix, kind, property_name, value2 + self._SEPARATOR + \
                     self._TERM_STRING]
@@ -2101,14 +2289,14 @@ class DatastoreDistributed():
       if startrow > endrow:
         return []
 
-      return self.datastore_batch.range_query(table_name, 
-                                          column_names, 
-                                          startrow, 
-                                          endrow, 
-                                          limit, 
-                                          offset=0, 
-                                          start_inclusive=start_inclusive, 
-                                          end_inclusive=end_inclusive)      
+      return range_query(table_name, 
+                         column_names,
+                         startrow,
+                         endrow,
+                         limit,
+                         offset=0,
+                         start_inclusive=start_inclusive,
+                         end_inclusive=end_inclusive)      
          
     return []
 
@@ -2144,10 +2332,7 @@ class DatastoreDistributed():
     direction = datastore_pb.Query_Order.ASCENDING
 
     count = self._MAX_COMPOSITE_WINDOW
-    start_key = ""
     result_list = []
-    force_exclusive = False
-    more_results = True
     ancestor = None
     if query.has_ancestor():
       ancestor = query.ancestor()
@@ -2162,118 +2347,65 @@ class DatastoreDistributed():
     multiple_equality_filters = self.__get_multiple_equality_filters(
       query.filter_list())
 
-    while more_results:
-      reference_hash = {}
-      temp_res = {}
-      # We use what we learned from the previous scans to skip over any keys 
-      # that we know will not be a match.
-      startrow = "" 
-      # TODO Do these in parallel and measure speedup.
-      # I've tried a thread wrapper before but due to the function having
-      # self attributes it's nontrivial.
-      for prop_name in filter_info.keys():
-        filter_ops = filter_info.get(prop_name, [])
-        if start_key:
-          # Grab the reference key which is after the last delimiter. 
-          value = str(filter_ops[0][1])
-          reference_key = start_key.split(self._SEPARATOR)[-1]
-          params = [prefix, kind, prop_name, value, reference_key]
-          startrow = get_index_key_from_params(params)
-        elif query.has_compiled_cursor() and \
-          query.compiled_cursor().position_size():
-          cursor = appscale_stub_util.ListCursor(query)
-          last_result = cursor._GetLastResult()
+    # The encoded entity path that the next scans start from.
+    start_reference = None
+    include_start_key = False
+    if query.has_compiled_cursor() and \
+      query.compiled_cursor().position_size():
+      cursor = appscale_stub_util.ListCursor(query)
+      last_result = cursor._GetLastResult()
+      start_reference = str(encode_index_pb(last_result.key().path()))
+
+    while True:
+      # Scan a window of each property's index concurrently. Since every
+      # filter is an equality filter, each scan is ordered by reference.
+      pending_scans = {}
+      for prop_name, filter_ops in filter_info.iteritems():
+        startrow = ""
+        if start_reference is not None:
           value = str(filter_ops[0][1])
-          reference_key = str(encode_index_pb(last_result.key().path()))
-          params = [prefix, kind, prop_name, value, reference_key]
+          params = [prefix, kind, prop_name, value, start_reference]
           startrow = get_index_key_from_params(params)
 
         # We use equality filters only so order ops should always be ASC. 
-        order_ops = []
-        for i in order_info:
-          if i[0] == prop_name:
-            order_ops = [i]
-            break
+        order_ops = [order for order in order_info
+                     if order[0] == prop_name][:1]
+
+        pending_scans[prop_name] = self.__apply_filters(
+          filter_ops, order_ops, prop_name, kind, prefix, count, 0, startrow,
+          ancestor=ancestor, include_start_key=include_start_key,
+          range_query=self.datastore_batch.range_query_async)
+
+      scans = {}
+      for prop_name, scan in pending_scans.iteritems():
+        if isinstance(scan, RangeQueryFuture):
+          scan = scan.result()
+        scans[prop_name] = [(index.values()[0]['reference'], index.keys()[0])
+                            for index in scan]
+
+      # If any property no longer has any more items, this query is done.
+      if not all(scans.values()):
+        break
 
-        temp_res[prop_name] = self.__apply_filters(filter_ops, 
-          order_ops, 
-          prop_name, 
-          kind, 
-          prefix, 
-          count, 
-          0, 
-          startrow,
-          force_start_key_exclusive=force_exclusive,
-          ancestor=ancestor)
+      # Every reference up to the smallest last reference of the full scans
+      # has been seen by all of the scans. A scan that did not fill its
+      # window has no more references.
+      full_scan_ends = [scan[-1][0] for scan in scans.values()
+                        if len(scan) == count]
+      bound = min(full_scan_ends) if full_scan_ends else None
 
       # We do reference counting and consider any reference which matches the
-      # number of properties to be a match. Any others are discarded but it 
-      # possible they show up on subsequent scans. 
-      last_keys_of_scans = {}
-      first_keys_of_scans = {}
-      for prop_name in temp_res:
-        for indexes in temp_res[prop_name]:
-          for reference in indexes: 
-            reference_key = indexes[reference]['reference']
-            if reference_key not in reference_hash:
-              reference_hash[reference_key] = []
-
-            reference_hash[reference_key].append(
-              {'index': reference, 'prop_name': prop_name})
-          # Of the set of entity scans we use the earliest of the set as the
-          # starting point of scans to follow. This makes sure we do not miss 
-          # overlapping results because different properties had different 
-          # distributions of keys. The index value gives us the key to 
-          # the entity table (what the index points to).
-          index_key = indexes.keys()[0]
-          index_value = indexes[index_key]['reference']
-          first_keys_of_scans[prop_name] = index_value
-
-          index_key = indexes.keys()[-1]
-          index_value = indexes[index_key]['reference']
-          last_keys_of_scans[prop_name] = index_value
-
-      # We are looking for the earliest (alphabetically) of the set of last 
-      # keys. This tells us where to start our next scans. And from where 
-      # we can remove potential results.
-      start_key = ""
-      starting_prop_name = ""
-      for prop_name in first_keys_of_scans:
-        first_key = first_keys_of_scans[prop_name]
-        if not start_key or first_key < start_key: 
-          start_key = first_key
-          starting_prop_name = prop_name
- 
-      # Override the start key if one of the prop starting keys is outside the 
-      # end key of all the other props. This allows to jump over results which 
-      # would not have matched.
-      for prop_name in first_keys_of_scans:
-        first_key = first_keys_of_scans[prop_name]
-        jump_ahead = False
-        for last_prop in last_keys_of_scans:
-          if last_prop == prop_name:
-            continue
-
-          if first_key > last_keys_of_scans[last_prop]:
-            jump_ahead = True
-          else:
-            jump_ahead = False
+      # number of properties to be a match.
+      reference_hash = {}
+      for prop_name, scan in scans.iteritems():
+        for reference, index in scan:
+          if bound is not None and reference > bound:
             break
-        if jump_ahead:
-          start_key = first_key
-          starting_prop_name = prop_name
-
-      # Purge keys which did not intersect from all equality filters and those
-      # which are past the earliest reference shared by all property names 
-      # (start_key variable). 
-      keys_to_delete = []
-      for key in reference_hash:
-        if len(reference_hash[key]) != len(filter_info.keys()):
-          keys_to_delete.append(key)
-      # You cannot loop on a dictionary and delete from it at the same time.
-      # Hence why the deletes happen here.
-      for key in keys_to_delete:
-        del reference_hash[key]
+          reference_hash.setdefault(reference, []).append(
+            {'index': index, 'prop_name': prop_name})
+      for reference in reference_hash.keys():
+        if len(reference_hash[reference]) != len(filter_info):
+          del reference_hash[reference]
 
       # If we have results, we only need to fetch enough to meet the limit.
       to_fetch = limit - len(result_list)
@@ -2289,25 +2421,17 @@ class DatastoreDistributed():
 
       result_list.extend(entities)
 
-      # If the property we are setting the start key did not get the requested
-      # amount of entities then we can stop scanning, as there are no more 
-      # entities to scan from that property.
-      for prop_name in temp_res:
-        if len(temp_res[prop_name]) < count and prop_name == starting_prop_name:
-          more_results = False
-
-        # If any property no longer has any more items, this query is done.
-        if len(temp_res[prop_name]) == 0:
-          more_results = False 
-
-      # If we reached our limit of result entities, then we are done.
-      if len(result_list) >= limit:
-        more_results = False
+      if len(result_list) >= limit or bound is None:
+        break
 
-      # Do not include the first key in subsequent scans because we have 
-      # already accounted for the given entity.
-      if start_key in result_list:
-        force_exclusive = True
+      # A reference that comes before the first reference of any scan
+      # cannot be in that property's index, so the next scans can skip
+      # ahead to the largest first reference.
+      next_reference = max(scan[0][0] for scan in scans.values())
+      include_start_key = next_reference > bound
+      if not include_start_key:
+        next_reference = bound
+      start_reference = next_reference.split(self._SEPARATOR)[-1]
 
     results = result_list[:limit]
     self.logger.debug('Returning {} results'.format(len(results)))
@@ -2951,79 +3075,97 @@ class DatastoreDistributed():
       datastore_pb.Error.NEED_INDEX,
       'No composite index provided')
 
-  def __multiorder_results(self, result, order_info, kind):
+  def __multiorder_results(self, result, order_info, kind, limit=None):
     """ Takes results and applies ordering based on properties and 
         whether it should be ascending or decending. Filters out 
         any entities which do not match the given kind, if given.
 
-      Args: 
-        result: unordered results.
-        order_info: given ordering of properties.
-        kind: The kind to filter on if given.
-      Returns:
-        A list of ordered entities.
-    """
-    # TODO:
-    # We can not fully filter past one filter without getting
-    # the entire table to make sure results are in the correct order. 
-    # Composites must be implemented the correct way with specialized 
-    # indexes to get the correct result.
-    # The effect is that entities at the edge of each batch have a high 
-    # chance of being out of order with our current implementation.
-
-    # Put all the values appended based on order info into a dictionary,
-    # The key being the values appended and the value being the index
-    if not result:
-      return []
+    Entities are consumed one at a time and only the first limit of them in
+    order are kept, so the results do not need to be materialized.
 
+    Args:
+      result: An iterable of unordered encoded entities.
+      order_info: given ordering of properties.
+      kind: The kind to filter on if given.
+      limit: The maximum number of entities to return, if given.
+    Returns:
+      A list of ordered entities.
+    """
     if not order_info and not kind:
-      return result
+      return list(itertools.islice(result, limit))
 
-    vals = {}
-    for e in result:
-      key = self._SEPARATOR
-      e = entity_pb.EntityProto(e)
-      # Skip this entitiy if it does not match the given kind.
-      last_path = e.key().path().element_list()[-1]
-      if kind and last_path.type() != kind:
-        continue
-     
-      prop_list = e.property_list()
-      for ii in order_info:
-        ord_prop = ii[0]
-        ord_dir = ii[1]
-        for each in prop_list:
-          if each.name() == ord_prop:
-            if ord_dir == datastore_pb.Query_Order.DESCENDING:
-              key = str(key+ self._SEPARATOR + helper_functions.reverse_lex(
-                str(each.value())))
-            else:
-              key = str(key + self._SEPARATOR + str(each.value()))
-            break
-      # Add a unique identifier at the end because indexes can be the same.
-      key = key + str(e)
-      vals[key] = e
-    keys = sorted(vals.keys())
-    sorted_vals = [vals[ii] for ii in keys]
-    result = [e.Encode() for e in sorted_vals]
-    return result
-
-  # These are the three different types of queries attempted. Queries 
-  # can be identified by their filters and orderings.
-  # TODO: Queries have hints which help in picking which strategy to do first.
-  _QUERY_STRATEGIES = [
-      __single_property_query,   
-      __kind_query,
-      zigzag_merge_join,
-  ]
-
-  def __get_query_results(self, query):
-    """Applies the strategy for the provided query.
+    def matching_entities():
+      for encoded_entity in result:
+        entity = entity_pb.EntityProto(encoded_entity)
+        # Skip this entity if it does not match the given kind.
+        last_path = entity.key().path().element_list()[-1]
+        if kind and last_path.type() != kind:
+          continue
+
+        yield self.__order_key(entity, order_info), encoded_entity
+
+    if limit is None:
+      ordered = sorted(matching_entities())
+    else:
+      ordered = heapq.nsmallest(limit, matching_entities())
+
+    return [encoded_entity for _, encoded_entity in ordered]
+
+  @staticmethod
+  def __order_key(entity, order_info):
+    """ Builds a key that sorts entities in the order a query requests.
+
+    Values are compared by their index encoding, which preserves the
+    datastore's ordering across types. A multi-valued property is ordered by
+    its smallest value when ascending and its largest value when descending.
+    Entities with equal values are ordered by key.
+
+    Args:
+      entity: An entity_pb.EntityProto.
+      order_info: A list of (property name, direction) tuples.
+    Returns:
+      A tuple.
+    """
+    encoded_key = str(encode_index_pb(entity.key().path()))
+    values = {}
+    for prop in entity.property_list():
+      values.setdefault(prop.name(), []).append(
+        str(encode_index_pb(prop.value())))
+
+    order_key = []
+    for prop_name, direction in order_info or []:
+      if prop_name == '__key__':
+        prop_values = [encoded_key]
+      else:
+        prop_values = values.get(prop_name, [''])
+
+      if direction == datastore_pb.Query_Order.DESCENDING:
+        order_key.append(helper_functions.reverse_lex(max(prop_values)) +
+                         dbconstants.TERMINATING_STRING[0])
+      else:
+        order_key.append(min(prop_values))
+
+    order_key.append(encoded_key)
+    return tuple(order_key)
+
+  # The functions that run each query strategy. Each returns None if it
+  # cannot run the given query.
+  _QUERY_STRATEGIES = {
+    Strategy.COMPOSITE: __composite_query,
+    Strategy.SINGLE_PROPERTY: __single_property_query,
+    Strategy.KIND: __kind_query,
+    Strategy.ZIGZAG_MERGE_JOIN: zigzag_merge_join,
+    Strategy.ANCESTOR: __ancestor_filter_query,
+  }
+
+  def __get_query_results(self, query, strategy=None):
+    """Applies the cheapest strategy for the provided query.
 
     Args:    
       query: A datastore_pb.Query protocol buffer.
+      strategy: A string specifying the strategy to use instead of planning.
     Returns:
-      Result set.
+      A tuple containing the result set and the QueryPlan that was used.
     """
     if query.has_transaction() and not query.has_ancestor():
       raise apiproxy_errors.ApplicationError(
@@ -3047,28 +3189,42 @@ class DatastoreDistributed():
     filter_info = self.generate_filter_info(filters)
     order_info = self.generate_order_info(orders)
 
-    # We do the composite check first because its easy to determine if a query
-    # has a composite index.
-    results = None
-    if query.composite_index_size() > 0:
-      return self.__composite_query(query, filter_info, order_info)
+    if strategy is None:
+      plan = self.query_planner.plan(query, filter_info, order_info,
+                                     self.get_limit(query))
+    else:
+      plan = QueryPlan([(strategy, None)], self.get_limit(query))
+
+    rows_before = cassandra_interface.rows_scanned()
+    results = []
+    for strategy, estimated_rows in plan.attempts():
+      strategy_results = DatastoreDistributed._QUERY_STRATEGIES[strategy](
+        self, query, filter_info, order_info)
+      if strategy_results is not None:
+        plan.strategy = strategy
+        plan.estimated_rows = estimated_rows
+        results = strategy_results
+        break
 
-    for strategy in DatastoreDistributed._QUERY_STRATEGIES:
-      results = strategy(self, query, filter_info, order_info)
-      if results or results == []:
-        return results
+    plan.actual_rows = cassandra_interface.rows_scanned() - rows_before
+    plan.results = len(results)
+    self.query_planner.observe(query, filter_info, plan)
+    self.logger.debug('Query plan: {}'.format(plan.to_dict()))
+    return results, plan
 
-    return []
-  
-  def _dynamic_run_query(self, query, query_result):
+  def _dynamic_run_query(self, query, query_result, strategy=None):
     """Populates the query result and use that query result to 
-       encode a cursor.
+       encode a cursor. If there are more results, the query's position is
+       kept so that the next batch can be fetched with dynamic_next.
 
     Args:
       query: The query to run.
       query_result: The response given to the application server.
+      strategy: A string specifying the strategy to use instead of planning.
+    Returns:
+      The QueryPlan that was used to run the query.
     """
-    result = self.__get_query_results(query)
+    result, plan = self.__get_query_results(query, strategy)
     last_entity = None
     count = 0
     offset = query.offset()
@@ -3098,6 +3254,60 @@ class DatastoreDistributed():
       query_result.mutable_compiled_cursor().\
         CopyFrom(datastore_pb.CompiledCursor())
 
+    if (strategy is None and plan.strategy is not None and
+        query_result.more_results() and query_result.has_compiled_cursor() and
+        not query.has_transaction()):
+      position = datastore_pb.CompiledCursor()
+      position.CopyFrom(query_result.compiled_cursor())
+      cursor_id = self.cursors.add(
+        query.app(), ServerCursor(query, plan.strategy, position))
+      query_result.mutable_cursor().set_app(query.app())
+      query_result.mutable_cursor().set_cursor(cursor_id)
+
+    return plan
+
+  def dynamic_next(self, app_id, next_request, query_result):
+    """ Fetches the next batch of a query from its kept position without
+    planning the query again.
+
+    Args:
+      app_id: A string specifying the project that sent the request.
+      next_request: A datastore_pb.NextRequest.
+      query_result: A datastore_pb.QueryResult.
+    Returns:
+      The QueryPlan that was used to fetch the batch.
+    Raises:
+      ApplicationError if the cursor is not kept by this server for the
+        project.
+    """
+    cursor_id = next_request.cursor().cursor()
+    cursor = self.cursors.get(app_id, cursor_id)
+    if cursor is None or cursor.query.app() != app_id:
+      raise apiproxy_errors.ApplicationError(
+        datastore_pb.Error.BAD_REQUEST, 'Cursor {} not found'.format(cursor_id))
+
+    query = datastore_pb.Query()
+    query.CopyFrom(cursor.query)
+    query.clear_offset()
+    query.mutable_compiled_cursor().CopyFrom(cursor.position)
+    if next_request.has_count():
+      query.set_count(next_request.count())
+    if next_request.has_compile():
+      query.set_compile(next_request.compile())
+
+    plan = self._dynamic_run_query(query, query_result, cursor.strategy)
+
+    if query_result.more_results() and query_result.has_compiled_cursor():
+      position = datastore_pb.CompiledCursor()
+      position.CopyFrom(query_result.compiled_cursor())
+      self.cursors.update(app_id, cursor_id, position)
+      query_result.mutable_cursor().set_app(app_id)
+      query_result.mutable_cursor().set_cursor(cursor_id)
+    else:
+      self.cursors.remove(app_id, cursor_id)
+
+    return plan
+
   def dynamic_add_actions(self, app_id, request):
     """ Adds tasks to enqueue upon committing the transaction.
 
@@ -3201,7 +3411,7 @@ class DatastoreDistributed():
         'Too many groups in transaction')
 
     composite_indices = [entity_pb.CompositeIndex(index)
-                         for index in self.datastore_batch.get_indices(app)]
+                         for index in self.get_indices(app)]
 
     # Give multi-group entity locks a transaction ID for deadlock resolution.
     lock_id = None
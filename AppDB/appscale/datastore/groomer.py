@@ -1,5 +1,9 @@
 import datetime
+import functools
+import itertools
 import logging
+import math
+import multiprocessing
 import os
 import random
 import re
@@ -17,7 +21,10 @@ from appscale.common.unpackaged import APPSCALE_PYTHON_APPSERVER
 from appscale.common.unpackaged import DASHBOARD_DIR
 from appscale.taskqueue.distributed_tq import TaskName
 from .cassandra_env import cassandra_interface
+from .cassandra_env import entity_stats
 from .datastore_distributed import DatastoreDistributed
+from .groomer_ranges import RangeCoordinator
+from .groomer_ranges import split_key_range
 from .utils import get_composite_indexes_rows
 from .zkappscale import zktransaction as zk
 
@@ -52,10 +59,10 @@ class DatastoreGroomer(threading.Thread):
   BATCH_SIZE = 100
 
   # Any kind that is of __*__ is private and should not have stats.
-  PRIVATE_KINDS = '__(.*)__'
+  PRIVATE_KINDS = entity_stats.PRIVATE_KINDS
 
   # Any kind that is of _*_ is protected and should not have stats.
-  PROTECTED_KINDS = '_(.*)_'
+  PROTECTED_KINDS = entity_stats.PROTECTED_KINDS
 
   # The amount of time in seconds before we want to clean up task name holders.
   TASK_NAME_TIMEOUT = 24 * 60 * 60
@@ -64,7 +71,7 @@ class DatastoreGroomer(threading.Thread):
   LOG_STORAGE_TIMEOUT = 24 * 60 * 60 * 7
 
   # Do not generate stats for AppScale internal apps.
-  APPSCALE_APPLICATIONS = ['apichecker', 'appscaledashboard']
+  APPSCALE_APPLICATIONS = entity_stats.APPSCALE_APPLICATIONS
 
   # A sentinel value to signify that this app does not have composite indexes.
   NO_COMPOSITES = "NO_COMPS_INDEXES_HERE"
@@ -96,6 +103,23 @@ class DatastoreGroomer(threading.Thread):
   # Log progress every time this many seconds have passed.
   LOG_PROGRESS_FREQUENCY = 60 * 5
 
+  # Stored after a task ID when the task's progress is kept in key ranges.
+  RANGES_STATE = 'ranges'
+
+  # The number of threads that process key ranges at once.
+  RANGE_WORKERS = multiprocessing.cpu_count()
+
+  # The minimum number of key ranges to split each table scan into.
+  MIN_KEY_RANGES = 256
+
+  # The number of seconds to wait for other datastore servers to finish the
+  # ranges they claimed.
+  RANGE_POLL_PERIOD = 10
+
+  # The number of seconds between checks for key ranges to help with while
+  # another datastore server holds the groomer lock.
+  HELP_POLL_PERIOD = 5 * 60
+
   def __init__(self, zoo_keeper, table_name, ds_path):
     """ Constructor.
 
@@ -146,6 +170,10 @@ class DatastoreGroomer(threading.Thread):
             format(str(zk_exception)))
       else:
         logging.info("Did not get the groomer lock.")
+        if self.help_groom():
+          time.sleep(self.HELP_POLL_PERIOD)
+          continue
+
       sleep_time = random.randint(1, self.LOCK_POLL_PERIOD)
       logging.info('Sleeping for {:.1f} minutes.'.format(sleep_time/60.0))
       time.sleep(sleep_time)
@@ -158,17 +186,18 @@ class DatastoreGroomer(threading.Thread):
     """
     return self.zoo_keeper.get_lock_with_path(zk.DS_GROOM_LOCK_PATH)
 
-  def get_entity_batch(self, last_key):
-    """ Gets a batch of entites to operate on.
+  def iterate_entities(self, last_key, end_key=""):
+    """ Lazily iterates over the entities to operate on.
 
     Args:
       last_key: The last key from a previous query.
+      end_key: The last key to include, or an empty string for no limit.
     Returns:
-      A list of entities.
+      A generator of entities.
     """
-    return self.db_access.range_query(dbconstants.APP_ENTITY_TABLE,
-      dbconstants.APP_ENTITY_SCHEMA, last_key, "", self.BATCH_SIZE,
-      start_inclusive=False)
+    return self.db_access.range_query_iter(dbconstants.APP_ENTITY_TABLE,
+      dbconstants.APP_ENTITY_SCHEMA, last_key, end_key, start_inclusive=False,
+      page_size=self.BATCH_SIZE)
 
   def reset_statistics(self):
     """ Reinitializes statistics. """
@@ -451,22 +480,13 @@ class DatastoreGroomer(threading.Thread):
       direction: The direction of the index.
     """
     if direction == datastore_pb.Query_Order.ASCENDING:
-      table_name = dbconstants.ASC_PROPERTY_TABLE
       task_id = self.CLEAN_ASC_INDICES_TASK
     else:
-      table_name = dbconstants.DSC_PROPERTY_TABLE
       task_id = self.CLEAN_DSC_INDICES_TASK
 
-    # If we have state information beyond what function to use,
-    # load the last seen start key.
-    if len(self.groomer_state) > 1 and self.groomer_state[0] == task_id:
-      start_key = self.groomer_state[1]
-    else:
-      start_key = ''
-    end_key = dbconstants.TERMINATING_STRING
-
     # Indicate that an index scrub has started after the journal was removed.
-    if direction == datastore_pb.Query_Order.ASCENDING and not start_key:
+    resuming = self.groomer_state == [task_id, self.RANGES_STATE]
+    if direction == datastore_pb.Query_Order.ASCENDING and not resuming:
       index_state = self.db_access.get_metadata(
         cassandra_interface.INDEX_STATE_KEY)
       if index_state is None:
@@ -474,15 +494,31 @@ class DatastoreGroomer(threading.Thread):
           cassandra_interface.INDEX_STATE_KEY,
           cassandra_interface.IndexStates.SCRUB_IN_PROGRESS)
 
+    self.groom_ranges(task_id, self.range_tasks()[task_id])
+
+  def clean_up_index_range(self, direction, coordinator, key_range):
+    """ Deletes invalid single property index entries within a key range.
+
+    Args:
+      direction: The direction of the index.
+      coordinator: The RangeCoordinator that the range was claimed from.
+      key_range: A KeyRange.
+    """
+    if direction == datastore_pb.Query_Order.ASCENDING:
+      table_name = dbconstants.ASC_PROPERTY_TABLE
+    else:
+      table_name = dbconstants.DSC_PROPERTY_TABLE
+
+    all_references = self.db_access.range_query_iter(
+      table_name=table_name,
+      column_names=dbconstants.PROPERTY_SCHEMA,
+      start_key=key_range.last_key,
+      end_key=key_range.end_key,
+      start_inclusive=False,
+      page_size=self.BATCH_SIZE,
+    )
     while True:
-      references = self.db_access.range_query(
-        table_name=table_name,
-        column_names=dbconstants.PROPERTY_SCHEMA,
-        start_key=start_key,
-        end_key=end_key,
-        limit=self.BATCH_SIZE,
-        start_inclusive=False,
-      )
+      references = list(itertools.islice(all_references, self.BATCH_SIZE))
       if len(references) == 0:
         break
 
@@ -492,14 +528,8 @@ class DatastoreGroomer(threading.Thread):
           .format(self.index_entries_checked))
         self.last_logged = time.time()
       first_ref = references[0].keys()[0]
-      logging.debug('Fetched {} total refs, starting with {}, direction: {}'
-        .format(self.index_entries_checked, [first_ref], direction))
-
-      last_start_key = start_key
-      start_key = references[-1].keys()[0]
-      if start_key == last_start_key:
-        raise dbconstants.AppScaleDBError(
-          'An infinite loop was detected while fetching references.')
+      logging.debug('Fetched {} refs, starting with {}, direction: {}'
+        .format(len(references), [first_ref], direction))
 
       entities = self.fetch_entity_dict_for_references(references)
 
@@ -516,7 +546,9 @@ class DatastoreGroomer(threading.Thread):
 
       for entity_key in invalid_refs:
         self.lock_and_delete_indexes(invalid_refs[entity_key], direction, entity_key)
-      self.update_groomer_state([task_id, start_key])
+
+      key_range.last_key = references[-1].keys()[0]
+      coordinator.save(key_range)
 
   def clean_up_kind_indices(self):
     """ Deletes invalid kind index entries.
@@ -524,23 +556,33 @@ class DatastoreGroomer(threading.Thread):
     This is needed because the datastore does not delete kind index entries
     when deleting entities.
     """
-    table_name = dbconstants.APP_KIND_TABLE
     task_id = self.CLEAN_KIND_INDICES_TASK
+    self.groom_ranges(task_id, self.range_tasks()[task_id])
 
-    start_key = ''
-    end_key = dbconstants.TERMINATING_STRING
-    if len(self.groomer_state) > 1:
-      start_key = self.groomer_state[1]
+    # Indicate that the index has been scrubbed after the journal was removed.
+    index_state = self.db_access.get_metadata(
+      cassandra_interface.INDEX_STATE_KEY)
+    if index_state == cassandra_interface.IndexStates.SCRUB_IN_PROGRESS:
+      self.db_access.set_metadata(cassandra_interface.INDEX_STATE_KEY,
+                                  cassandra_interface.IndexStates.CLEAN)
 
+  def clean_up_kind_index_range(self, coordinator, key_range):
+    """ Deletes invalid kind index entries within a key range.
+
+    Args:
+      coordinator: The RangeCoordinator that the range was claimed from.
+      key_range: A KeyRange.
+    """
+    all_references = self.db_access.range_query_iter(
+      table_name=dbconstants.APP_KIND_TABLE,
+      column_names=dbconstants.APP_KIND_SCHEMA,
+      start_key=key_range.last_key,
+      end_key=key_range.end_key,
+      start_inclusive=False,
+      page_size=self.BATCH_SIZE,
+    )
     while True:
-      references = self.db_access.range_query(
-        table_name=table_name,
-        column_names=dbconstants.APP_KIND_SCHEMA,
-        start_key=start_key,
-        end_key=end_key,
-        limit=self.BATCH_SIZE,
-        start_inclusive=False,
-      )
+      references = list(itertools.islice(all_references, self.BATCH_SIZE))
       if len(references) == 0:
         break
 
@@ -553,12 +595,6 @@ class DatastoreGroomer(threading.Thread):
       logging.debug('Fetched {} kind indices, starting with {}'.
         format(len(references), [first_ref]))
 
-      last_start_key = start_key
-      start_key = references[-1].keys()[0]
-      if start_key == last_start_key:
-        raise dbconstants.AppScaleDBError(
-          'An infinite loop was detected while fetching references.')
-
       entities = self.fetch_entity_dict_for_references(references)
 
       for reference in references:
@@ -566,14 +602,8 @@ class DatastoreGroomer(threading.Thread):
         if entity_key not in entities:
           self.lock_and_delete_kind_index(reference)
 
-      self.update_groomer_state([task_id, start_key])
-
-    # Indicate that the index has been scrubbed after the journal was removed.
-    index_state = self.db_access.get_metadata(
-      cassandra_interface.INDEX_STATE_KEY)
-    if index_state == cassandra_interface.IndexStates.SCRUB_IN_PROGRESS:
-      self.db_access.set_metadata(cassandra_interface.INDEX_STATE_KEY,
-                                  cassandra_interface.IndexStates.CLEAN)
+      key_range.last_key = references[-1].keys()[0]
+      coordinator.save(key_range)
 
   def clean_up_composite_indexes(self):
     """ Deletes old composite indexes and bad references.
@@ -627,43 +657,58 @@ class DatastoreGroomer(threading.Thread):
     self.db_access.batch_delete(dbconstants.COMPOSITE_TABLE,
       row_keys, column_names=dbconstants.COMPOSITE_SCHEMA)
 
-  def initialize_kind(self, app_id, kind):
+  def initialize_kind(self, app_id, kind, stats=None):
     """ Puts a kind into the statistics object if
         it does not already exist.
     Args:
       app_id: The application ID.
       kind: A string representing an entity kind.
+      stats: The kind statistics to update. Defaults to the groomer's own.
     """
-    if app_id not in self.stats:
-      self.stats[app_id] = {kind: {'size': 0, 'number': 0}}
-    if kind not in self.stats[app_id]:
-      self.stats[app_id][kind] = {'size': 0, 'number': 0}
+    if stats is None:
+      stats = self.stats
 
-  def initialize_namespace(self, app_id, namespace):
+    if app_id not in stats:
+      stats[app_id] = {kind: {'size': 0, 'number': 0}}
+    if kind not in stats[app_id]:
+      stats[app_id][kind] = {'size': 0, 'number': 0}
+
+  def initialize_namespace(self, app_id, namespace, namespace_info=None):
     """ Puts a namespace into the namespace object if
         it does not already exist.
     Args:
       app_id: The application ID.
       namespace: A string representing a namespace.
+      namespace_info: The namespace statistics to update. Defaults to the
+        groomer's own.
     """
-    if app_id not in self.namespace_info:
-      self.namespace_info[app_id] = {namespace: {'size': 0, 'number': 0}}
+    if namespace_info is None:
+      namespace_info = self.namespace_info
 
-    if namespace not in self.namespace_info[app_id]:
-      self.namespace_info[app_id] = {namespace: {'size': 0, 'number': 0}}
-    if namespace not in self.namespace_info[app_id]:
-      self.stats[app_id][namespace] = {'size': 0, 'number': 0}
+    if app_id not in namespace_info:
+      namespace_info[app_id] = {namespace: {'size': 0, 'number': 0}}
+    if namespace not in namespace_info[app_id]:
+      namespace_info[app_id][namespace] = {'size': 0, 'number': 0}
 
-  def process_statistics(self, key, entity, size):
+  def process_statistics(self, key, entity, size, stats=None,
+                         namespace_info=None):
     """ Processes an entity and adds to the global statistics.
 
     Args:
       key: The key to the entity table.
       entity: EntityProto entity.
       size: A int of the size of the entity.
+      stats: The kind statistics to update. Defaults to the groomer's own.
+      namespace_info: The namespace statistics to update. Defaults to the
+        groomer's own.
     Returns:
       True on success, False otherwise.
     """
+    if stats is None:
+      stats = self.stats
+    if namespace_info is None:
+      namespace_info = self.namespace_info
+
     kind = utils.get_entity_kind(entity.key())
     namespace = entity.key().name_space()
 
@@ -689,14 +734,38 @@ class DatastoreGroomer(threading.Thread):
     if app_id in self.APPSCALE_APPLICATIONS:
       return True
 
-    self.initialize_kind(app_id, kind)
-    self.initialize_namespace(app_id, namespace)
-    self.namespace_info[app_id][namespace]['size'] += size
-    self.namespace_info[app_id][namespace]['number'] += 1
-    self.stats[app_id][kind]['size'] += size
-    self.stats[app_id][kind]['number'] += 1
+    self.initialize_kind(app_id, kind, stats)
+    self.initialize_namespace(app_id, namespace, namespace_info)
+    namespace_info[app_id][namespace]['size'] += size
+    namespace_info[app_id][namespace]['number'] += 1
+    stats[app_id][kind]['size'] += size
+    stats[app_id][kind]['number'] += 1
     return True
 
+  def merge_statistics(self, stats, namespace_info):
+    """ Adds statistics gathered separately to the groomer's own.
+
+    Args:
+      stats: A dictionary of kind statistics for each application.
+      namespace_info: A dictionary of namespace statistics for each
+        application.
+    """
+    for app_id, kinds in stats.iteritems():
+      app_id = str(app_id)
+      for kind, kind_stats in kinds.iteritems():
+        self.initialize_kind(app_id, kind)
+        self.stats[app_id][kind]['size'] += kind_stats['size']
+        self.stats[app_id][kind]['number'] += kind_stats['number']
+
+    for app_id, namespaces in namespace_info.iteritems():
+      app_id = str(app_id)
+      for namespace, namespace_stats in namespaces.iteritems():
+        self.initialize_namespace(app_id, namespace)
+        self.namespace_info[app_id][namespace]['size'] += \
+          namespace_stats['size']
+        self.namespace_info[app_id][namespace]['number'] += \
+          namespace_stats['number']
+
   def txn_blacklist_cleanup(self):
     """ Clean up old transactions and removed unused references
         to reap storage.
@@ -707,12 +776,15 @@ class DatastoreGroomer(threading.Thread):
     #TODO implement
     return True
 
-  def process_entity(self, entity):
+  def process_entity(self, entity, stats=None, namespace_info=None):
     """ Processes an entity by updating statistics, indexes, and removes
         tombstones.
 
     Args:
       entity: The entity to operate on.
+      stats: The kind statistics to update. Defaults to the groomer's own.
+      namespace_info: The namespace statistics to update. Defaults to the
+        groomer's own.
     Returns:
       True on success, False otherwise.
     """
@@ -724,7 +796,8 @@ class DatastoreGroomer(threading.Thread):
 
     ent_proto = entity_pb.EntityProto()
     ent_proto.ParseFromString(one_entity)
-    self.process_statistics(key, ent_proto, len(one_entity))
+    self.process_statistics(key, ent_proto, len(one_entity), stats,
+                            namespace_info)
 
     return True
 
@@ -851,37 +924,204 @@ class DatastoreGroomer(threading.Thread):
     return True
 
   def clean_up_entities(self):
-    # If we have state information beyond what function to use,
-    # load the last seen key.
-    if (len(self.groomer_state) > 1 and
-      self.groomer_state[0] == self.CLEAN_ENTITIES_TASK):
-      last_key = self.groomer_state[1]
-    else:
-      last_key = ""
+    """ Gathers statistics for every entity and corrects any drift in the
+    statistics that are kept as entities change. """
+    task_id = self.CLEAN_ENTITIES_TASK
+    snapshots = []
+    for key_range in self.groom_ranges(task_id, self.range_tasks()[task_id]):
+      self.merge_statistics(key_range.stats.get('kinds', {}),
+                            key_range.stats.get('namespaces', {}))
+      range_snapshots = key_range.stats.get('counters')
+      if not range_snapshots:
+        # The range was scanned before snapshots were taken.
+        snapshots = None
+
+      if snapshots is not None:
+        snapshots.extend(range_snapshots)
+
+    entity_stats.reconcile_entity_stats(self.db_access.session, self.stats,
+                                        self.namespace_info, snapshots or [])
+
+  def clean_up_entity_range(self, coordinator, key_range):
+    """ Gathers statistics for the entities within a key range.
+
+    The statistics are saved with the range's progress so that they are
+    counted once no matter which datastore server processes the range. The
+    entity counters are read before and after the range is scanned, so the
+    statistics are only reconciled with counters that did not change.
+
+    Args:
+      coordinator: The RangeCoordinator that the range was claimed from.
+      key_range: A KeyRange.
+    """
+    stats = key_range.stats.setdefault('kinds', {})
+    namespace_info = key_range.stats.setdefault('namespaces', {})
+    counters = key_range.stats.setdefault('counters', [])
+    counters.append(
+      entity_stats.snapshot_entity_stats(self.db_access.session))
+
+    # The scan is restarted from the last processed key after an error.
+    all_entities = None
     while True:
       try:
+        if all_entities is None:
+          all_entities = self.iterate_entities(key_range.last_key,
+                                               key_range.end_key)
+
         logging.debug('Fetching {} entities'.format(self.BATCH_SIZE))
-        entities = self.get_entity_batch(last_key)
+        entities = list(itertools.islice(all_entities, self.BATCH_SIZE))
 
         if not entities:
           break
 
         for entity in entities:
-          self.process_entity(entity)
+          self.process_entity(entity, stats, namespace_info)
 
-        last_key = entities[-1].keys()[0]
+        key_range.last_key = entities[-1].keys()[0]
         self.entities_checked += len(entities)
         if time.time() > self.last_logged + self.LOG_PROGRESS_FREQUENCY:
           logging.info('Checked {} entities'.format(self.entities_checked))
           self.last_logged = time.time()
-        self.update_groomer_state([self.CLEAN_ENTITIES_TASK, last_key])
+        coordinator.save(key_range)
       except datastore_errors.Error, error:
         logging.error("Error getting a batch: {0}".format(error))
+        all_entities = None
         time.sleep(self.DB_ERROR_PERIOD)
       except dbconstants.AppScaleDBConnectionError, connection_error:
         logging.error("Error getting a batch: {0}".format(connection_error))
+        all_entities = None
         time.sleep(self.DB_ERROR_PERIOD)
 
+    counters.append(
+      entity_stats.snapshot_entity_stats(self.db_access.session))
+    """ Lists the tasks that scan a table one key range at a time.
+
+    Returns:
+      A dictionary mapping task IDs to functions that take a RangeCoordinator
+      and a KeyRange.
+    """
+    return {
+      self.CLEAN_ENTITIES_TASK: self.clean_up_entity_range,
+      self.CLEAN_ASC_INDICES_TASK: functools.partial(
+        self.clean_up_index_range, datastore_pb.Query_Order.ASCENDING),
+      self.CLEAN_DSC_INDICES_TASK: functools.partial(
+        self.clean_up_index_range, datastore_pb.Query_Order.DESCENDING),
+      self.CLEAN_KIND_INDICES_TASK: self.clean_up_kind_index_range
+    }
+
+  def key_ranges(self):
+    """ Splits the key space into ranges that can be scanned in parallel.
+
+    Returns:
+      A list of (start_key, end_key) tuples that cover every key in order.
+    """
+    ring_ranges = self.db_access.get_key_ranges()
+    parts = int(math.ceil(float(self.MIN_KEY_RANGES) / len(ring_ranges)))
+    key_ranges = []
+    for start_key, end_key in ring_ranges:
+      key_ranges.extend(split_key_range(start_key, end_key, parts))
+
+    return key_ranges
+
+  def groom_ranges(self, task_id, process_range):
+    """ Runs a task over every key range, resuming the ranges of an
+    interrupted pass.
+
+    Args:
+      task_id: A string specifying the groomer task.
+      process_range: A function that takes a RangeCoordinator and a KeyRange.
+    Returns:
+      A list of processed KeyRanges.
+    Raises:
+      AppScaleDBError: If a range could not be processed.
+    """
+    coordinator = RangeCoordinator(self.zoo_keeper, task_id)
+    if self.groomer_state != [task_id, self.RANGES_STATE]:
+      coordinator.create(self.key_ranges())
+      self.update_groomer_state([task_id, self.RANGES_STATE])
+
+    while True:
+      if not self.process_ranges(coordinator, process_range):
+        raise dbconstants.AppScaleDBError(
+          'Unable to process all ranges for {}'.format(task_id))
+
+      key_ranges = coordinator.ranges()
+      if all(key_range.done for key_range in key_ranges):
+        break
+
+      # Other datastore servers are still processing some of the ranges.
+      # Ranges they abandon become available to claim again.
+      time.sleep(self.RANGE_POLL_PERIOD)
+
+    coordinator.clear()
+    return key_ranges
+
+  def process_ranges(self, coordinator, process_range):
+    """ Processes unclaimed key ranges with several threads until there are
+    none left.
+
+    Args:
+      coordinator: A RangeCoordinator.
+      process_range: A function that takes a RangeCoordinator and a KeyRange.
+    Returns:
+      A boolean indicating whether or not every claimed range was processed.
+    """
+    failures = []
+
+    def process_claimed_ranges():
+      """ Claims and processes ranges until none are left. """
+      while True:
+        key_range = coordinator.claim()
+        if key_range is None:
+          return
+
+        try:
+          process_range(coordinator, key_range)
+        except Exception:
+          logging.exception('Unable to process {}'.format(key_range.name))
+          coordinator.release(key_range)
+          failures.append(key_range.name)
+          return
+
+        coordinator.finish(key_range)
+
+    workers = [threading.Thread(target=process_claimed_ranges)
+               for _ in range(self.RANGE_WORKERS)]
+    for worker in workers:
+      worker.start()
+
+    for worker in workers:
+      worker.join()
+
+    return not failures
+
+  def help_groom(self):
+    """ Processes key ranges for a pass that another datastore server is
+    running.
+
+    Returns:
+      A boolean indicating whether or not a task with key ranges was running.
+    """
+    groomer_state = self.zoo_keeper.get_node(self.GROOMER_STATE_PATH)
+    if not groomer_state:
+      return False
+
+    state = groomer_state[0].split(self.GROOMER_STATE_DELIMITER)
+    range_tasks = self.range_tasks()
+    if state[1:] != [self.RANGES_STATE] or state[0] not in range_tasks:
+      return False
+
+    logging.info('Helping to groom {}'.format(state[0]))
+    self.connect_to_datastore()
+    try:
+      coordinator = RangeCoordinator(self.zoo_keeper, state[0])
+      self.process_ranges(coordinator, range_tasks[state[0]])
+    finally:
+      del self.db_access
+      del self.ds_access
+
+    return True
+
   def register_db_accessor(self, app_id):
     """ Gets a distributed datastore object to interact with
         the datastore for a certain application.
@@ -948,14 +1188,20 @@ class DatastoreGroomer(threading.Thread):
     logging.info("Removed {0} log entries.".format(counter))
     return True
 
-  def remove_old_statistics(self):
+  def remove_old_statistics(self, before=None):
     """ Does a range query on the current batch of statistics and
         deletes them.
+
+    Args:
+      before: A datetime.datetime object. If given, only statistics older
+        than this are removed.
     """
     #TODO only remove statistics older than 30 days.
     for app_id in self.stats.keys():
       self.register_db_accessor(app_id)
       query = stats.KindStat.all()
+      if before is not None:
+        query.filter('timestamp <', before)
       entities = query.run()
       logging.debug("Result from kind stat query: {0}".format(str(entities)))
       for entity in entities:
@@ -963,11 +1209,20 @@ class DatastoreGroomer(threading.Thread):
         entity.delete()
 
       query = stats.GlobalStat.all()
+      if before is not None:
+        query.filter('timestamp <', before)
       entities = query.run()
       logging.debug("Result from global stat query: {0}".format(str(entities)))
       for entity in entities:
         logging.debug("Removing global {0}".format(entity))
         entity.delete()
+
+      query = stats.NamespaceStat.all()
+      if before is not None:
+        query.filter('timestamp <', before)
+      for entity in query.run():
+        logging.debug("Removing namespace {0}".format(entity))
+        entity.delete()
       logging.debug("Done removing old stats for app {0}".format(app_id))
 
   def update_namespaces(self, timestamp):
@@ -1049,15 +1304,19 @@ class DatastoreGroomer(threading.Thread):
       logging.exception(zkie)
     self.groomer_state = state
 
-  def run_groomer(self):
-    """ Runs the grooming process. Loops on the entire dataset sequentially
-        and updates stats, indexes, and transactions.
-    """
+  def connect_to_datastore(self):
+    """ Creates the objects used to access the datastore. """
     self.db_access = appscale_datastore_batch.DatastoreFactory.getDatastore(
       self.table_name)
     self.ds_access = DatastoreDistributed(
       datastore_batch=self.db_access, zookeeper=self.zoo_keeper)
 
+  def run_groomer(self):
+    """ Runs the grooming process. Scans the entire dataset in parallel key
+        ranges and updates stats, indexes, and transactions.
+    """
+    self.connect_to_datastore()
+
     logging.info("Groomer started")
     start = time.time()
 
@@ -1135,14 +1394,8 @@ class DatastoreGroomer(threading.Thread):
 
     self.update_groomer_state([])
 
-    timestamp = datetime.datetime.utcnow()
-
-    if not self.update_statistics(timestamp):
-      logging.error("There was an error updating the statistics")
-
-    if not self.update_namespaces(timestamp):
-      logging.error("There was an error updating the namespaces")
-
+    # The statistics entities are only written by the StatsPublisher, which
+    # reads the counters that clean_up_entities corrects.
     del self.db_access
     del self.ds_access
 
@@ -1159,6 +1412,74 @@ class DatastoreGroomer(threading.Thread):
     logging.info("Groomer took {0} seconds".format(str(time_taken)))
 
 
+class StatsPublisher(threading.Thread):
+  """ Periodically copies the entity counters kept by the datastore servers
+  to the statistics entities that applications read. """
+
+  # The number of seconds between updates to the statistics entities.
+  PUBLISH_INTERVAL = 5 * 60
+
+  def __init__(self, zoo_keeper, table_name, ds_path):
+    """ Constructor.
+
+    Args:
+      zoo_keeper: ZooKeeper client.
+      table_name: The database used (ie, cassandra)
+      ds_path: The connection path to the datastore_server.
+    """
+    threading.Thread.__init__(self)
+    self.zoo_keeper = zoo_keeper
+    self.table_name = table_name
+    self.db_access = None
+    self.writer = DatastoreGroomer(zoo_keeper, table_name, ds_path)
+
+  def run(self):
+    """ Starts the main loop of the publisher thread. """
+    while True:
+      time.sleep(self.PUBLISH_INTERVAL)
+      if not self.zoo_keeper.get_lock_with_path(zk.DS_STATS_LOCK_PATH):
+        continue
+
+      try:
+        self.publish()
+      except Exception:
+        logging.exception('Unable to publish datastore statistics')
+      finally:
+        try:
+          self.zoo_keeper.release_lock_with_path(zk.DS_STATS_LOCK_PATH)
+        except (zk.ZKTransactionException, zk.ZKInternalException):
+          logging.exception('Unable to release stats lock')
+
+  def publish(self):
+    """ Writes the current entity counters as statistics entities. """
+    if self.db_access is None:
+      self.db_access = appscale_datastore_batch.DatastoreFactory.getDatastore(
+        self.table_name)
+
+    kind_stats, namespace_stats = entity_stats.fetch_entity_stats(
+      self.db_access.session)
+
+    # Kinds and namespaces without entities are not reported.
+    self.writer.stats = {
+      str(app_id): {kind: stat for kind, stat in kinds.iteritems()
+                    if stat['number'] > 0}
+      for app_id, kinds in kind_stats.iteritems()}
+    self.writer.namespace_info = {
+      str(app_id): {namespace: stat
+                    for namespace, stat in namespaces.iteritems()
+                    if stat['number'] > 0}
+      for app_id, namespaces in namespace_stats.iteritems()}
+
+    timestamp = datetime.datetime.utcnow()
+    if not self.writer.update_statistics(timestamp):
+      logging.error("There was an error updating the statistics")
+
+    if not self.writer.update_namespaces(timestamp):
+      logging.error("There was an error updating the namespaces")
+
+    self.writer.remove_old_statistics(before=timestamp)
+
+
 def main():
   """ This main function allows you to run the groomer manually. """
   zk_connection_locations = appscale_info.get_zk_locations_string()
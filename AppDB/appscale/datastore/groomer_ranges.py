@@ -0,0 +1,230 @@
+""" Splits groomer scans into key ranges that can be processed in parallel. """
+
+import json
+import logging
+
+from kazoo.exceptions import NodeExistsError
+from kazoo.exceptions import NoNodeError
+
+# The ZooKeeper node that contains the key ranges for each groomer task.
+RANGES_PATH = '/appscale/groomer_ranges'
+
+# The name of the node that marks a range as being processed.
+CLAIM_NODE = 'claim'
+
+# The number of leading key bytes used to pick split points.
+SPLIT_WIDTH = 8
+
+
+def split_key_range(start_key, end_key, parts):
+  """ Divides a key range into roughly equal parts.
+
+  The split points are chosen by interpolating between the leading bytes of
+  each key, so the parts only contain similar amounts of data when keys are
+  spread evenly.
+
+  Args:
+    start_key: A string specifying the exclusive start of the range.
+    end_key: A string specifying the inclusive end of the range.
+    parts: An integer specifying the number of parts to create.
+  Returns:
+    A list of (start_key, end_key) tuples that cover the range in order.
+  """
+  low = int(start_key[:SPLIT_WIDTH].ljust(SPLIT_WIDTH, '\x00').encode('hex'),
+            16)
+  high = int(end_key[:SPLIT_WIDTH].ljust(SPLIT_WIDTH, '\x00').encode('hex'),
+             16)
+  if parts < 2 or high - low < parts:
+    return [(start_key, end_key)]
+
+  step = (high - low) // parts
+  boundaries = [start_key]
+  for part in range(1, parts):
+    point = '{:0{width}x}'.format(low + step * part, width=SPLIT_WIDTH * 2)
+    boundaries.append(point.decode('hex'))
+
+  boundaries.append(end_key)
+  return zip(boundaries[:-1], boundaries[1:])
+
+
+class KeyRange(object):
+  """ A portion of a table scan and the progress made on it. """
+  def __init__(self, name, start_key, end_key, last_key=None, done=False,
+               stats=None):
+    """ Creates a new KeyRange.
+
+    Args:
+      name: A string that identifies the range within its task.
+      start_key: A string specifying the exclusive start of the range.
+      end_key: A string specifying the inclusive end of the range.
+      last_key: A string specifying the last key that was processed.
+      done: A boolean indicating whether or not the range was processed.
+      stats: A dictionary of statistics gathered from the range.
+    """
+    self.name = name
+    self.start_key = start_key
+    self.end_key = end_key
+    self.last_key = last_key if last_key is not None else start_key
+    self.done = done
+    self.stats = stats if stats is not None else {}
+
+  def encode(self):
+    """ Encodes the range for storage in ZooKeeper.
+
+    Returns:
+      A JSON string.
+    """
+    return json.dumps({'start': self.start_key.encode('hex'),
+                       'end': self.end_key.encode('hex'),
+                       'last': self.last_key.encode('hex'),
+                       'done': self.done,
+                       'stats': self.stats})
+
+  @classmethod
+  def decode(cls, name, data):
+    """ Restores a range stored in ZooKeeper.
+
+    Args:
+      name: A string that identifies the range within its task.
+      data: A JSON string created by encode.
+    Returns:
+      A KeyRange.
+    """
+    fields = json.loads(data)
+    return cls(name, str(fields['start']).decode('hex'),
+               str(fields['end']).decode('hex'),
+               last_key=str(fields['last']).decode('hex'),
+               done=fields['done'], stats=fields['stats'])
+
+
+class RangeCoordinator(object):
+  """ Hands out the key ranges of a groomer task.
+
+  Each range has its own checkpoint in ZooKeeper, so a task resumes from the
+  last key processed in each range. A worker claims a range with an
+  ephemeral node, which lets workers on any datastore server share a task
+  and returns a range to the pool when the worker that claimed it goes away.
+  """
+  def __init__(self, zk_transaction, task_id):
+    """ Creates a new RangeCoordinator.
+
+    Args:
+      zk_transaction: A ZKTransaction.
+      task_id: A string specifying the groomer task.
+    """
+    self.zk_client = zk_transaction.handle
+    self.task_path = '/'.join([RANGES_PATH, task_id])
+    self.logger = logging.getLogger(self.__class__.__name__)
+
+  def create(self, key_ranges):
+    """ Stores the ranges for a new pass, replacing any existing ones.
+
+    Args:
+      key_ranges: A list of (start_key, end_key) tuples.
+    """
+    self.clear()
+    for index, (start_key, end_key) in enumerate(key_ranges):
+      key_range = KeyRange('range-{:06d}'.format(index), start_key, end_key)
+      self.zk_client.create(self._range_path(key_range), key_range.encode(),
+                            makepath=True)
+
+  def ranges(self):
+    """ Fetches the current state of every range.
+
+    Returns:
+      A list of KeyRanges.
+    """
+    try:
+      names = sorted(self.zk_client.get_children(self.task_path))
+    except NoNodeError:
+      return []
+
+    key_ranges = []
+    for name in names:
+      try:
+        data, _ = self.zk_client.get('/'.join([self.task_path, name]))
+      except NoNodeError:
+        continue
+      key_ranges.append(KeyRange.decode(name, data))
+
+    return key_ranges
+
+  def claim(self):
+    """ Claims a range that is not finished or being processed.
+
+    Returns:
+      A KeyRange or None if there are no ranges left to claim.
+    """
+    for key_range in self.ranges():
+      if key_range.done:
+        continue
+
+      try:
+        self.zk_client.create(self._claim_path(key_range), ephemeral=True)
+      except (NodeExistsError, NoNodeError):
+        continue
+
+      # Another worker may have finished the range before it was claimed.
+      data, _ = self.zk_client.get(self._range_path(key_range))
+      key_range = KeyRange.decode(key_range.name, data)
+      if key_range.done:
+        self.release(key_range)
+        continue
+
+      return key_range
+
+    return None
+
+  def save(self, key_range):
+    """ Records the progress made on a claimed range.
+
+    Args:
+      key_range: A KeyRange.
+    """
+    self.zk_client.set(self._range_path(key_range), key_range.encode())
+
+  def finish(self, key_range):
+    """ Marks a claimed range as processed and releases it.
+
+    Args:
+      key_range: A KeyRange.
+    """
+    key_range.done = True
+    self.save(key_range)
+    self.release(key_range)
+
+  def release(self, key_range):
+    """ Returns a claimed range to the pool.
+
+    Args:
+      key_range: A KeyRange.
+    """
+    try:
+      self.zk_client.delete(self._claim_path(key_range))
+    except NoNodeError:
+      self.logger.warning('Claim on {} was already removed'.format(
+        key_range.name))
+
+  def clear(self):
+    """ Removes the ranges for the task. """
+    self.zk_client.delete(self.task_path, recursive=True)
+
+  def _range_path(self, key_range):
+    """ Finds the node that stores a range.
+
+    Args:
+      key_range: A KeyRange.
+    Returns:
+      A string specifying a ZooKeeper path.
+    """
+    return '/'.join([self.task_path, key_range.name])
+
+  def _claim_path(self, key_range):
+    """ Finds the node that marks a range as claimed.
+
+    Args:
+      key_range: A KeyRange.
+    Returns:
+      A string specifying a ZooKeeper path.
+    """
+    return '/'.join([self.task_path, key_range.name, CLAIM_NODE])
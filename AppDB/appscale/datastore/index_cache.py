@@ -0,0 +1,121 @@
+""" Caches composite index definitions for each project. """
+
+import logging
+import threading
+import uuid
+
+from kazoo.exceptions import NoNodeError
+
+# The ZooKeeper node that is modified whenever a project's indexes change.
+INDEX_VERSION_NODE = '/appscale/apps/{project}/index_version'
+
+
+class IndexCache(object):
+  """ Keeps encoded composite index definitions in memory.
+
+  Each datastore server watches a ZooKeeper node per cached project. Any
+  server that modifies a project's index metadata touches that node, which
+  invalidates the entry in every server's cache.
+  """
+  def __init__(self, datastore_batch, zk_client):
+    """ Creates a new IndexCache.
+
+    Args:
+      datastore_batch: A DatastoreProxy.
+      zk_client: A KazooClient.
+    """
+    self.datastore_batch = datastore_batch
+    self.zk_client = zk_client
+    self.logger = logging.getLogger(self.__class__.__name__)
+
+    self._lock = threading.Lock()
+    self._indexes = {}
+    self._versions = {}
+    self._watched = set()
+    self.hits = 0
+    self.misses = 0
+
+  def get(self, project):
+    """ Fetches the composite index definitions for a project.
+
+    Args:
+      project: A string specifying the project ID.
+    Returns:
+      A list of encoded entity_pb.CompositeIndex objects.
+    """
+    with self._lock:
+      if project in self._indexes:
+        self.hits += 1
+        return self._indexes[project]
+
+      self.misses += 1
+      needs_watch = project not in self._watched
+      self._watched.add(project)
+
+    if needs_watch:
+      self.zk_client.DataWatch(INDEX_VERSION_NODE.format(project=project),
+                               self._update_version_func(project))
+
+    with self._lock:
+      version = self._versions.get(project)
+
+    indexes = self.datastore_batch.get_indices(project)
+
+    # Only store the result if the indexes did not change during the read.
+    with self._lock:
+      if self._versions.get(project) == version:
+        self._indexes[project] = indexes
+
+    return indexes
+
+  def invalidate(self, project):
+    """ Notifies all datastore servers that a project's indexes changed.
+
+    Args:
+      project: A string specifying the project ID.
+    """
+    with self._lock:
+      self._indexes.pop(project, None)
+
+    node = INDEX_VERSION_NODE.format(project=project)
+    version = str(uuid.uuid4())
+    try:
+      self.zk_client.retry(self.zk_client.set, node, version)
+    except NoNodeError:
+      self.zk_client.retry(self.zk_client.create, node, version,
+                           makepath=True)
+
+  def hit_rate(self):
+    """ Reports how often lookups were served from memory.
+
+    Returns:
+      A float between 0 and 1.
+    """
+    lookups = self.hits + self.misses
+    if lookups == 0:
+      return 0.0
+
+    return float(self.hits) / lookups
+
+  def _update_version_func(self, project):
+    """ Creates a callback that drops a project's entry when its node changes.
+
+    Args:
+      project: A string specifying the project ID.
+    Returns:
+      A function that can be used as a DataWatch callback.
+    """
+    def update_version(data, stat):
+      """ Drops the cached indexes for a project.
+
+      Args:
+        data: The contents of the version node.
+        stat: A ZnodeStat for the version node or None.
+      """
+      with self._lock:
+        self._versions[project] = data
+        self._indexes.pop(project, None)
+
+      self.logger.debug('Index version for {} is {}'.format(project, data))
+
+    return update_version
@@ -0,0 +1,330 @@
+""" Chooses a strategy for running datastore queries based on cost estimates.
+
+Every strategy can be estimated by the number of rows it is expected to
+read. Per-kind entity counts come from the statistics that the groomer
+writes. Per-property selectivities and entity group sizes are learned from
+the queries that this server runs.
+"""
+
+import logging
+import sys
+import threading
+import time
+
+from appscale.common.unpackaged import APPSCALE_PYTHON_APPSERVER
+
+sys.path.append(APPSCALE_PYTHON_APPSERVER)
+from google.appengine.datastore import datastore_pb
+
+# How many seconds per-kind entity counts are kept before being fetched again.
+KIND_STATS_TTL = 10 * 60
+
+# The number of entities assumed for a kind without statistics.
+DEFAULT_KIND_COUNT = 1000
+
+# The number of entities assumed for an entity group that has not been
+# scanned yet.
+DEFAULT_GROUP_SIZE = 100
+
+# The fraction of a kind assumed to match an equality filter on a property
+# that has not been observed yet.
+DEFAULT_EQUALITY_SELECTIVITY = 0.1
+
+# The fraction of a kind assumed to match an inequality filter.
+DEFAULT_RANGE_SELECTIVITY = 1.0 / 3
+
+# How much a new observation moves a learned estimate.
+OBSERVATION_WEIGHT = 0.3
+
+
+class Strategy(object):
+  """ The names of the available query strategies. """
+  COMPOSITE = 'composite'
+  SINGLE_PROPERTY = 'single_property'
+  KIND = 'kind'
+  ZIGZAG_MERGE_JOIN = 'zigzag_merge_join'
+  ANCESTOR = 'ancestor'
+
+
+# The strategies that were tried in order before queries were planned. Each
+# one checks whether it can run a query, so they are still tried after the
+# estimated candidates.
+FALLBACK_STRATEGIES = (Strategy.SINGLE_PROPERTY, Strategy.KIND,
+                       Strategy.ZIGZAG_MERGE_JOIN)
+
+
+class QueryPlan(object):
+  """ The strategies considered for a query and the outcome of running it. """
+  def __init__(self, candidates, limit, fallbacks=()):
+    """ Creates a new QueryPlan.
+
+    Args:
+      candidates: A list of (strategy, estimated rows) tuples.
+      limit: An integer specifying the most results the query can fetch.
+      fallbacks: A list of strategies without estimates to try after the
+        candidates.
+    """
+    self.limit = limit
+    self.candidates = sorted(candidates, key=lambda candidate: candidate[1])
+    self.fallbacks = list(fallbacks)
+    self.strategy = None
+    self.estimated_rows = None
+    self.actual_rows = None
+    self.results = None
+
+  def to_dict(self):
+    """ Describes the plan.
+
+    Returns:
+      A JSON-serializable dictionary.
+    """
+    return {
+      'strategy': self.strategy,
+      'estimated_rows': self.estimated_rows,
+      'actual_rows': self.actual_rows,
+      'results': self.results,
+      'candidates': [{'strategy': strategy, 'estimated_rows': estimate}
+                     for strategy, estimate in self.candidates],
+      'fallbacks': self.fallbacks
+    }
+
+  def attempts(self):
+    """ Lists the strategies in the order they should be tried.
+
+    Returns:
+      A list of (strategy, estimated rows) tuples. The estimate is None for
+      fallbacks.
+    """
+    return self.candidates + [(strategy, None) for strategy in self.fallbacks]
+
+
+class QueryPlanner(object):
+  """ Estimates the cost of each strategy that can run a query. """
+  def __init__(self, kind_counts_func):
+    """ Creates a new QueryPlanner.
+
+    Args:
+      kind_counts_func: A function that takes a project ID and returns a
+        dictionary mapping kind names to entity counts.
+    """
+    self.kind_counts_func = kind_counts_func
+    self.logger = logging.getLogger(self.__class__.__name__)
+
+    self._lock = threading.Lock()
+    self._kind_counts = {}
+    self._selectivities = {}
+    self._group_sizes = {}
+
+  def plan(self, query, filter_info, order_info, limit):
+    """ Orders the strategies that might be able to run a query by cost.
+
+    Args:
+      query: A datastore_pb.Query.
+      filter_info: A dictionary mapping property names to lists of
+        (operator, value) tuples.
+      order_info: A list of (property name, direction) tuples.
+      limit: An integer specifying the most results the query can fetch.
+    Returns:
+      A QueryPlan.
+    """
+    filter_info = {prop_name: filter_ops
+                   for prop_name, filter_ops in filter_info.iteritems()
+                   if filter_ops[0][0] != datastore_pb.Query_Filter.EXISTS}
+    property_names = set(filter_info.keys())
+    property_names.update(order[0] for order in order_info)
+    property_names.discard('__key__')
+
+    equality_only = all(
+      all(op == datastore_pb.Query_Filter.EQUAL for op, _ in filter_ops)
+      for prop_name, filter_ops in filter_info.iteritems()
+      if prop_name != '__key__')
+    key_equality = all(op == datastore_pb.Query_Filter.EQUAL
+                       for op, _ in filter_info.get('__key__', []))
+    ordered_by_filters = all(order[0] in filter_info for order in order_info)
+
+    if query.has_ancestor():
+      base = self.group_size(query)
+    else:
+      base = self.kind_count(query) or DEFAULT_KIND_COUNT
+
+    selectivities = {prop_name: self._filter_selectivity(query, prop_name,
+                                                         filter_ops)
+                     for prop_name, filter_ops in filter_info.iteritems()
+                     if prop_name != '__key__'}
+
+    candidates = []
+    if query.composite_index_size() > 0:
+      matches = base
+      for selectivity in selectivities.itervalues():
+        matches *= selectivity
+      candidates.append((Strategy.COMPOSITE, min(matches, limit)))
+
+    if not property_names:
+      candidates.append((Strategy.KIND, min(base, limit)))
+
+    if len(property_names) == 1 and query.has_kind():
+      selectivity = selectivities.get(next(iter(property_names)), 1.0)
+      candidates.append((Strategy.SINGLE_PROPERTY,
+                         min(base * selectivity, limit)))
+
+    if (len(filter_info) >= 2 and equality_only and key_equality and
+        ordered_by_filters):
+      candidates.append((Strategy.ZIGZAG_MERGE_JOIN,
+                         sum(base * selectivity
+                             for selectivity in selectivities.itervalues())))
+
+    if (query.has_ancestor() and query.has_kind() and filter_info and
+        '__key__' not in filter_info and equality_only and not order_info and
+        query.property_name_size() == 0):
+      candidates.append((Strategy.ANCESTOR, base))
+
+    fallbacks = []
+    if query.composite_index_size() == 0:
+      estimated = set(strategy for strategy, _ in candidates)
+      fallbacks = [strategy for strategy in FALLBACK_STRATEGIES
+                   if strategy not in estimated]
+
+    return QueryPlan([(strategy, int(round(estimate)))
+                      for strategy, estimate in candidates], limit, fallbacks)
+
+  def observe(self, query, filter_info, plan):
+    """ Learns from a query that has finished running.
+
+    A property's selectivity can only be measured from a single-property
+    query with one equality filter that returned all of its matches. An
+    entity group's size is measured from a complete ancestor scan.
+
+    Args:
+      query: A datastore_pb.Query.
+      filter_info: A dictionary mapping property names to lists of
+        (operator, value) tuples.
+      plan: A QueryPlan that has been run.
+    """
+    if plan.strategy is None or plan.results >= plan.limit:
+      return
+
+    # A query that starts from a cursor only covers part of the range.
+    if query.has_compiled_cursor() and query.compiled_cursor().position_size():
+      return
+
+    if plan.strategy == Strategy.ANCESTOR:
+      self._update(self._group_sizes, self._group_key(query),
+                   plan.actual_rows)
+      return
+
+    if (plan.strategy != Strategy.SINGLE_PROPERTY or query.has_ancestor() or
+        len(filter_info) != 1):
+      return
+
+    prop_name, filter_ops = filter_info.items()[0]
+    if (prop_name == '__key__' or len(filter_ops) != 1 or
+        filter_ops[0][0] != datastore_pb.Query_Filter.EQUAL):
+      return
+
+    kind_count = self.kind_count(query)
+    if not kind_count:
+      return
+
+    selectivity = min(float(plan.results) / kind_count, 1.0)
+    self._update(self._selectivities, self._property_key(query, prop_name),
+                 selectivity)
+
+  def kind_count(self, query):
+    """ Looks up the number of entities of the query's kind.
+
+    Args:
+      query: A datastore_pb.Query.
+    Returns:
+      An integer or None if there are no statistics for the kind.
+    """
+    if not query.has_kind() or query.kind().startswith('__'):
+      return None
+
+    project = query.app()
+    with self._lock:
+      fetched, counts = self._kind_counts.get(project, (None, None))
+
+    if fetched is None or time.time() - fetched > KIND_STATS_TTL:
+      try:
+        counts = self.kind_counts_func(project)
+      except Exception:
+        self.logger.exception(
+          'Unable to fetch kind statistics for {}'.format(project))
+        counts = counts or {}
+
+      with self._lock:
+        self._kind_counts[project] = (time.time(), counts)
+
+    return counts.get(query.kind())
+
+  def group_size(self, query):
+    """ Estimates the number of entities in the query's entity group.
+
+    Args:
+      query: A datastore_pb.Query.
+    Returns:
+      A number.
+    """
+    with self._lock:
+      return self._group_sizes.get(self._group_key(query), DEFAULT_GROUP_SIZE)
+
+  def _filter_selectivity(self, query, prop_name, filter_ops):
+    """ Estimates the fraction of entities that match a property's filters.
+
+    Args:
+      query: A datastore_pb.Query.
+      prop_name: A string specifying the property name.
+      filter_ops: A list of (operator, value) tuples.
+    Returns:
+      A float between 0 and 1.
+    """
+    operators = [op for op, _ in filter_ops]
+    if datastore_pb.Query_Filter.EQUAL in operators:
+      with self._lock:
+        return self._selectivities.get(self._property_key(query, prop_name),
+                                       DEFAULT_EQUALITY_SELECTIVITY)
+
+    return DEFAULT_RANGE_SELECTIVITY
+
+  def _update(self, estimates, key, observation):
+    """ Moves a learned estimate towards an observation.
+
+    Args:
+      estimates: The dictionary holding the estimate.
+      key: The estimate's key.
+      observation: The observed value.
+    """
+    with self._lock:
+      if key not in estimates:
+        estimates[key] = observation
+        return
+
+      estimates[key] += OBSERVATION_WEIGHT * (observation - estimates[key])
+
+  @staticmethod
+  def _property_key(query, prop_name):
+    """ Identifies a property's selectivity estimate.
+
+    Args:
+      query: A datastore_pb.Query.
+      prop_name: A string specifying the property name.
+    Returns:
+      A tuple.
+    """
+    return query.app(), query.name_space(), query.kind(), prop_name
+
+  @staticmethod
+  def _group_key(query):
+    """ Identifies an entity group size estimate.
+
+    Entity groups of the same root kind are assumed to be of similar size.
+
+    Args:
+      query: A datastore_pb.Query.
+    Returns:
+      A tuple.
+    """
+    root_kind = None
+    if query.has_ancestor():
+      root_kind = query.ancestor().path().element(0).type()
+    return query.app(), query.name_space(), root_kind, query.kind()
@@ -28,6 +28,13 @@ def init_parser():
     default=False, help='display debug messages')
   parser.add_argument('--skip', required=False, nargs="+",
     help='skip the following kinds, separated by spaces')
+  parser.add_argument('--snapshot', action='store_true', default=False,
+    help='back up entities as of a single point in time without locking '
+         'them, using parallel workers and compressed files. Entities '
+         'written after that time are left out and listed in .changed files')
+  parser.add_argument('--workers', type=int,
+    default=DatastoreBackup.SNAPSHOT_WORKERS,
+    help='the number of key ranges to back up at once in snapshot mode')
 
   return parser
 
@@ -62,7 +69,8 @@ def main():
     skip_list = []
   logging.info("Will skip the following kinds: {0}".format(sorted(skip_list)))
   ds_backup = DatastoreBackup(args.app_id, zookeeper, table,
-    source_code=args.source_code, skip_list=sorted(skip_list))
+    source_code=args.source_code, skip_list=sorted(skip_list),
+    snapshot=args.snapshot, workers=args.workers)
   try:
     ds_backup.run()
   finally:
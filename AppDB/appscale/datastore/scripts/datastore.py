@@ -9,6 +9,7 @@ import argparse
 import json
 import logging
 import os
+import signal
 import sys
 import threading
 import time
@@ -16,14 +17,20 @@ import tornado.httpserver
 import tornado.ioloop
 import tornado.web
 
+from concurrent.futures import ThreadPoolExecutor
+from tornado import gen
+from tornado.locks import Semaphore
+
 from appscale.common import appscale_info
 from appscale.common.unpackaged import APPSCALE_PYTHON_APPSERVER
 from .. import dbconstants
 from ..appscale_datastore_batch import DatastoreFactory
 from ..datastore_distributed import DatastoreDistributed
+from ..index_cache import IndexCache
 from ..utils import (clean_app_id,
                      logger,
                      UnprocessedQueryResult)
+from ..zkappscale import entity_lock
 from ..zkappscale import zktransaction
 
 sys.path.append(APPSCALE_PYTHON_APPSERVER)
@@ -32,6 +39,7 @@ from google.appengine.api.taskqueue import taskqueue_service_pb
 from google.appengine.datastore import datastore_pb
 from google.appengine.datastore import entity_pb
 from google.appengine.ext.remote_api import remote_api_pb
+from google.appengine.runtime import apiproxy_errors
 
 # Global for accessing the datastore. An instance of DatastoreDistributed.
 datastore_access = None
@@ -43,9 +51,131 @@ zookeeper = None
 # datastore processes must be restarted and the groomer must be stopped.
 READ_ONLY = False
 
+# A request header that asks for the plan of a query to be returned.
+EXPLAIN_HEADER = 'X-Appscale-Explain'
+
+# The response header that contains the JSON-encoded query plan.
+QUERY_PLAN_HEADER = 'X-Appscale-Query-Plan'
+
 # Global stats.
 STATS = {}
 
+# Guards updates to STATS from request threads.
+STATS_LOCK = threading.Lock()
+
+# The default number of threads that handle blocking datastore work.
+DEFAULT_THREADS = 32
+
+# The maximum number of concurrent requests allowed for specific methods.
+# Long-running methods are capped so that they cannot occupy every thread.
+METHOD_CONCURRENCY = {
+  'RunQuery': 16,
+  'Next': 16,
+  'AddActions': 8,
+  'UpdateIndex': 2,
+  'DeleteIndex': 2
+}
+
+
+class RequestLimiter(object):
+  """ Runs blocking request handlers in a thread pool, limits the number of
+  requests that run concurrently for each method, and keeps track of how
+  many are waiting. """
+  def __init__(self, threads, method_limits):
+    """ Creates a new RequestLimiter.
+
+    Args:
+      threads: An integer specifying the number of threads that run
+        requests. This is also the limit for methods without a specific
+        limit.
+      method_limits: A dictionary mapping method names to limits.
+    """
+    self.threads = threads
+    self.default_limit = threads
+    self.method_limits = method_limits
+    self._executor = ThreadPoolExecutor(threads)
+    self._semaphores = {}
+    self._stats = {}
+    self._in_flight = 0
+
+  def _method_stats(self, method):
+    """ Fetches the metrics for a given method.
+
+    Args:
+      method: A string specifying the datastore method.
+    Returns:
+      A dictionary containing metrics for the method.
+    """
+    if method not in self._stats:
+      self._stats[method] = {'limit': self.method_limits.get(
+                               method, self.default_limit),
+                             'waiting': 0, 'running': 0, 'max_waiting': 0,
+                             'completed': 0, 'wait_time': 0.0}
+    return self._stats[method]
+
+  @gen.coroutine
+  def run(self, method, function, *args):
+    """ Runs a blocking function in the thread pool once the method's limit
+    allows it. This must be called from the IOLoop thread.
+
+    Args:
+      method: A string specifying the datastore method.
+      function: The function to run.
+      args: The arguments to pass to function.
+    Returns:
+      The value returned by function.
+    """
+    if method not in self._semaphores:
+      self._semaphores[method] = Semaphore(
+        self.method_limits.get(method, self.default_limit))
+
+    stats = self._method_stats(method)
+    stats['waiting'] += 1
+    stats['max_waiting'] = max(stats['max_waiting'], stats['waiting'])
+    queued = time.time()
+    try:
+      yield self._semaphores[method].acquire()
+    finally:
+      stats['waiting'] -= 1
+    stats['wait_time'] += time.time() - queued
+
+    stats['running'] += 1
+    self._in_flight += 1
+    try:
+      result = yield self._executor.submit(function, *args)
+    finally:
+      self._in_flight -= 1
+      stats['running'] -= 1
+      stats['completed'] += 1
+      self._semaphores[method].release()
+
+    raise gen.Return(result)
+
+  def stats(self):
+    """ Reports queue depths and concurrency for each method.
+
+    Returns:
+      A dictionary mapping method names to metrics.
+    """
+    return {method: dict(stats) for method, stats in self._stats.iteritems()}
+
+  def queued(self):
+    """ Reports how many requests are waiting for a thread.
+
+    Returns:
+      An integer.
+    """
+    return max(self._in_flight - self.threads, 0)
+
+  def shutdown(self):
+    """ Waits for the running requests to finish and stops the threads. """
+    self._executor.shutdown(wait=True)
+
+
+# Runs blocking datastore operations off of the IOLoop thread. An instance of
+# RequestLimiter.
+request_limiter = None
+
 
 class ClearHandler(tornado.web.RequestHandler):
   """ Defines what to do when the webserver receives a /clear HTTP request. """
@@ -53,8 +183,8 @@ class ClearHandler(tornado.web.RequestHandler):
   @tornado.web.asynchronous
   def post(self):
     """ Handles POST requests for clearing datastore server stats. """
-    global STATS
-    STATS = {}
+    with STATS_LOCK:
+      STATS.clear()
     self.write({"message": "Statistics for this server cleared."})
     self.finish()
 
@@ -101,11 +231,14 @@ class MainHandler(tornado.web.RequestHandler):
     raise NotImplementedError("Unknown request of operation {0}" \
       .format(pb_type))
   
-  @tornado.web.asynchronous
+  @gen.coroutine
   def post(self):
     """ Function which handles POST requests. Data of the request is
         the request from the AppServer in an encoded protocol buffer
-        format.
+        format. The request is handled by a worker thread so that blocking
+        database and ZooKeeper operations do not stall the IOLoop. If the
+        request has an EXPLAIN_HEADER, the plan of a query is returned in the
+        QUERY_PLAN_HEADER.
     """
     request = self.request
     http_request_data = request.body
@@ -128,31 +261,44 @@ class MainHandler(tornado.web.RequestHandler):
     # If the application identifier has the HRD string prepened, remove it.
     app_id = clean_app_id(app_id)
 
-    if pb_type == "Request":
-      self.remote_request(app_id, http_request_data)
-    else:
+    if pb_type != "Request":
       self.unknown_request(app_id, http_request_data, pb_type)
-    self.finish()
+
+    apirequest = remote_api_pb.Request()
+    apirequest.ParseFromString(http_request_data)
+    method = apirequest.method() if apirequest.has_method() else 'NOT_FOUND'
+    query_plans = None
+    if EXPLAIN_HEADER in request.headers:
+      query_plans = []
+
+    response = yield request_limiter.run(
+      method, self.remote_request, app_id, apirequest, query_plans)
+    if query_plans:
+      self.set_header(QUERY_PLAN_HEADER, json.dumps(query_plans[0].to_dict()))
+
+    self.write(response)
   
   @tornado.web.asynchronous
   def get(self):
     """ Handles get request for the web server. Returns that it is currently
         up in json.
     """
-    self.write(json.dumps(STATS))
+    with STATS_LOCK:
+      self.write(json.dumps(STATS))
     self.finish() 
 
-  def remote_request(self, app_id, http_request_data):
+  def remote_request(self, app_id, apirequest, query_plans=None):
     """ Receives a remote request to which it should give the correct 
-        response. The http_request_data holds an encoded protocol buffer
+        response. The apirequest holds an encoded protocol buffer
         of a certain type. Each type has a particular response type. 
     
     Args:
       app_id: The application ID that is sending this request.
-      http_request_data: Encoded protocol buffer.
+      apirequest: A remote_api_pb.Request.
+      query_plans: A list that the plan of a query is added to if given.
+    Returns:
+      An encoded remote_api_pb.Response.
     """
-    apirequest = remote_api_pb.Request()
-    apirequest.ParseFromString(http_request_data)
     apiresponse = remote_api_pb.Response()
     response = None
     errcode = 0
@@ -186,7 +332,12 @@ class MainHandler(tornado.web.RequestHandler):
       response, errcode, errdetail = self.delete_request(app_id, 
                                                     http_request_data)
     elif method == "RunQuery":
-      response, errcode, errdetail = self.run_query(http_request_data)
+      response, errcode, errdetail = self.run_query(http_request_data,
+                                                      query_plans)
+    elif method == "Next":
+      response, errcode, errdetail = self.next_request(app_id,
+                                                       http_request_data,
+                                                       query_plans)
     elif method == "BeginTransaction":
       response, errcode, errdetail = self.begin_transaction_request(
                                                       app_id, http_request_data)
@@ -221,15 +372,16 @@ class MainHandler(tornado.web.RequestHandler):
       errdetail = "Unknown datastore message" 
 
     time_taken = time.time() - start
-    if method in STATS:
-      if errcode in STATS[method]:
-        prev_req, pre_time = STATS[method][errcode]
-        STATS[method][errcode] = prev_req + 1, pre_time + time_taken
+    with STATS_LOCK:
+      if method in STATS:
+        if errcode in STATS[method]:
+          prev_req, pre_time = STATS[method][errcode]
+          STATS[method][errcode] = prev_req + 1, pre_time + time_taken
+        else:
+          STATS[method][errcode] = (1, time_taken)
       else:
+        STATS[method] = {}
         STATS[method][errcode] = (1, time_taken)
-    else:
-      STATS[method] = {}
-      STATS[method][errcode] = (1, time_taken)
 
     apiresponse.set_response(response)
     if errcode != 0:
@@ -237,7 +389,7 @@ class MainHandler(tornado.web.RequestHandler):
       apperror_pb.set_code(errcode)
       apperror_pb.set_detail(errdetail)
 
-    self.write(apiresponse.Encode())
+    return apiresponse.Encode()
 
   def begin_transaction_request(self, app_id, http_request_data):
     """ Handles the intial request to start a transaction. Replies with 
@@ -329,11 +481,12 @@ class MainHandler(tornado.web.RequestHandler):
              datastore_pb.Error.INTERNAL_ERROR,
              "Unable to rollback for this transaction")
 
-  def run_query(self, http_request_data):
+  def run_query(self, http_request_data, query_plans=None):
     """ High level function for running queries.
 
     Args:
       http_request_data: Stores the protocol buffer request from the AppServer.
+      query_plans: A list that the query's plan is added to if given.
     Returns:
       Returns an encoded query response.
     """
@@ -341,7 +494,9 @@ class MainHandler(tornado.web.RequestHandler):
     query = datastore_pb.Query(http_request_data)
     clone_qr_pb = UnprocessedQueryResult()
     try:
-      datastore_access._dynamic_run_query(query, clone_qr_pb)
+      plan = datastore_access._dynamic_run_query(query, clone_qr_pb)
+      if query_plans is not None:
+        query_plans.append(plan)
     except zktransaction.ZKBadRequest, zkie:
       logger.exception('Illegal arguments in transaction during {}'.
         format(query))
@@ -368,6 +523,40 @@ class MainHandler(tornado.web.RequestHandler):
              "Datastore connection error on run_query request.")
     return clone_qr_pb.Encode(), 0, ""
 
+  def next_request(self, app_id, http_request_data, query_plans=None):
+    """ Fetches the next batch of results for a query cursor.
+
+    Args:
+      app_id: The application ID that is sending this request.
+      http_request_data: Stores the protocol buffer request from the AppServer.
+      query_plans: A list that the query's plan is added to if given.
+    Returns:
+      Returns an encoded query response.
+    """
+    global datastore_access
+    next_request = datastore_pb.NextRequest(http_request_data)
+    clone_qr_pb = UnprocessedQueryResult()
+    try:
+      plan = datastore_access.dynamic_next(app_id, next_request, clone_qr_pb)
+      if query_plans is not None:
+        query_plans.append(plan)
+    except apiproxy_errors.ApplicationError as error:
+      logger.debug(error.error_detail)
+      return clone_qr_pb.Encode(), error.application_error, error.error_detail
+    except zktransaction.ZKInternalException:
+      logger.exception('ZKInternalException during {}'.format(next_request))
+      clone_qr_pb.set_more_results(False)
+      return (clone_qr_pb.Encode(),
+              datastore_pb.Error.INTERNAL_ERROR,
+              "Internal error with ZooKeeper connection.")
+    except dbconstants.AppScaleDBConnectionError:
+      logger.exception('DB connection error during next request')
+      clone_qr_pb.set_more_results(False)
+      return (clone_qr_pb.Encode(),
+              datastore_pb.Error.INTERNAL_ERROR,
+              "Datastore connection error on next request.")
+    return clone_qr_pb.Encode(), 0, ""
+
   def create_index_request(self, app_id, http_request_data):
     """ High level function for creating composite indexes.
 
@@ -687,17 +876,70 @@ class MainHandler(tornado.web.RequestHandler):
               'Datastore connection error when adding transaction tasks.')
 
 
+class ConcurrencyHandler(tornado.web.RequestHandler):
+  """ Reports how many requests are running and queued for each method. """
+  def get(self):
+    """ Handles requests for concurrency metrics. """
+    self.write({'threads': request_limiter.threads,
+                'queued': request_limiter.queued(),
+                'methods': request_limiter.stats()})
+
+
+class IndexCacheHandler(tornado.web.RequestHandler):
+  """ Reports how effective the composite index cache has been. """
+  def get(self):
+    """ Handles requests for index cache metrics. """
+    index_cache = datastore_access.index_cache
+    self.write({'hits': index_cache.hits,
+                'misses': index_cache.misses,
+                'hit_rate': index_cache.hit_rate()})
+
+
+class EntityLockHandler(tornado.web.RequestHandler):
+  """ Reports how often entity group locks were acquired without waiting and
+  which entity groups were waited on the longest. """
+  def get(self):
+    """ Handles requests for entity lock metrics. """
+    try:
+      limit = int(self.get_argument('top', 10))
+    except ValueError:
+      raise tornado.web.HTTPError(400, 'top must be an integer')
+
+    stats = entity_lock.lock_stats()
+    stats['hot_groups'] = entity_lock.hot_groups(limit)
+    self.write(stats)
+
+
+class CursorHandler(tornado.web.RequestHandler):
+  """ Reports how many query cursors are kept and how often they are used. """
+  def get(self):
+    """ Handles requests for cursor metrics. """
+    self.write(datastore_access.cursors.stats())
+
+
 pb_application = tornado.web.Application([
   ('/clear', ClearHandler),
   ('/read-only', ReadOnlyHandler),
+  ('/concurrency', ConcurrencyHandler),
+  ('/index-cache', IndexCacheHandler),
+  ('/cursors', CursorHandler),
+  ('/entity-locks', EntityLockHandler),
   (r'/*', MainHandler),
 ])
 
 
+def graceful_shutdown(*_):
+  """ Stops the IOLoop so that the datastore can clean up before exiting. """
+  logger.info('Stopping server')
+  io_loop = tornado.ioloop.IOLoop.instance()
+  io_loop.add_callback_from_signal(io_loop.stop)
+
+
 def main():
   """ Starts a web service for handing datastore requests. """
 
   global datastore_access
+  global request_limiter
   zookeeper_locations = appscale_info.get_zk_locations_string()
 
   parser = argparse.ArgumentParser()
@@ -709,6 +951,8 @@ def main():
                       help='Datastore server port')
   parser.add_argument('-v', '--verbose', action='store_true',
                       help='Output debug-level logging')
+  parser.add_argument('--threads', type=int, default=DEFAULT_THREADS,
+                      help='The number of threads that handle requests')
   args = parser.parse_args()
 
   if args.verbose:
@@ -720,10 +964,21 @@ def main():
     host=zookeeper_locations, start_gc=True, db_access=datastore_batch,
     log_level=logger.getEffectiveLevel())
 
+  index_cache = IndexCache(datastore_batch, zookeeper.handle)
   datastore_access = DatastoreDistributed(
-    datastore_batch, zookeeper=zookeeper, log_level=logger.getEffectiveLevel())
+    datastore_batch, zookeeper=zookeeper, log_level=logger.getEffectiveLevel(),
+    index_cache=index_cache)
+
+  request_limiter = RequestLimiter(args.threads, METHOD_CONCURRENCY)
 
   server = tornado.httpserver.HTTPServer(pb_application)
   server.listen(args.port)
 
+  signal.signal(signal.SIGTERM, graceful_shutdown)
+  signal.signal(signal.SIGINT, graceful_shutdown)
+
   tornado.ioloop.IOLoop.current().start()
+
+  server.stop()
+  request_limiter.shutdown()
+  datastore_access.close()
@@ -17,8 +17,11 @@ def main():
   gc_zookeeper = zk.ZKTransaction(host=zookeeper_locations, start_gc=False)
   logger.info("Using ZK locations {0}".format(zookeeper_locations))
   ds_groomer = groomer.DatastoreGroomer(gc_zookeeper, "cassandra", LOCAL_DATASTORE)
+  stats_publisher = groomer.StatsPublisher(gc_zookeeper, "cassandra",
+                                           LOCAL_DATASTORE)
   try:
     ds_groomer.start()
+    stats_publisher.start()
   except Exception, exception:
     logger.warning("An exception slipped through:")
     logger.exception(exception)
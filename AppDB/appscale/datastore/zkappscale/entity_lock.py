@@ -1,3 +1,6 @@
+import heapq
+import threading
+import time
 import uuid
 
 from kazoo.exceptions import (
@@ -20,6 +23,85 @@ LOCK_PATH_TEMPLATE = '/appscale/apps/{project}/locks/{namespace}/{group}'
 # The number of seconds to wait for a lock before raising a timeout error.
 LOCK_TIMEOUT = 10
 
+# Counts how locks were acquired and released.
+_stats = {'fast_acquires': 0, 'contended_acquires': 0, 'fast_releases': 0,
+          'contended_releases': 0}
+
+# Guards updates to _stats and _group_waits.
+_stats_lock = threading.Lock()
+
+# The most entity groups to keep wait times for.
+MAX_TRACKED_GROUPS = 1000
+
+# Maps group lock paths to the number of waits, total seconds waited, and the
+# longest wait in seconds.
+_group_waits = {}
+
+
+def _count(stat):
+  """ Increments a lock statistic.
+
+  Args:
+    stat: A string specifying the statistic.
+  """
+  with _stats_lock:
+    _stats[stat] += 1
+
+
+def _record_wait(path, seconds):
+  """ Adds a wait for a contended entity group.
+
+  Args:
+    path: A string specifying the group lock path.
+    seconds: A float specifying how long the group was waited on.
+  """
+  with _stats_lock:
+    waits = _group_waits.get(path)
+    if waits is None:
+      if len(_group_waits) >= MAX_TRACKED_GROUPS:
+        coldest = min(_group_waits, key=lambda group: _group_waits[group][1])
+        del _group_waits[coldest]
+
+      waits = _group_waits[path] = [0, 0.0, 0.0]
+
+    waits[0] += 1
+    waits[1] += seconds
+    waits[2] = max(waits[2], seconds)
+
+
+def hot_groups(limit=10):
+  """ Lists the entity groups that have been waited on the longest.
+
+  Args:
+    limit: An integer specifying the number of groups to list.
+  Returns:
+    A list of dictionaries containing wait metrics for each group.
+  """
+  with _stats_lock:
+    hottest = heapq.nlargest(limit, _group_waits.iteritems(),
+                             key=lambda item: item[1][1])
+
+  return [{'path': path, 'waits': waits, 'total_wait': total_wait,
+           'max_wait': max_wait}
+          for path, (waits, total_wait, max_wait) in hottest]
+
+
+def lock_stats():
+  """ Reports how often locks were acquired without waiting.
+
+  Returns:
+    A dictionary containing lock metrics.
+  """
+  with _stats_lock:
+    stats = dict(_stats)
+
+  acquires = stats['fast_acquires'] + stats['contended_acquires']
+  stats['fast_acquire_rate'] = 0.0
+  if acquires:
+    stats['fast_acquire_rate'] = float(stats['fast_acquires']) / acquires
+
+  return stats
+
 
 def zk_group_path(key):
   """ Retrieve the ZooKeeper lock path for a given entity key.
@@ -86,11 +168,6 @@ class EntityLock(object):
                              sleep_func=client.handler.sleep_func)
     self._lock = client.handler.lock_object()
 
-  def _ensure_path(self):
-    """ Make sure the ZooKeeper lock paths have been created. """
-    for path in self.paths:
-      self.client.ensure_path(path)
-
   def cancel(self):
     """ Cancel a pending lock acquire. """
     self.cancelled = True
@@ -112,6 +189,7 @@ class EntityLock(object):
 
     retry = self._retry.copy()
     retry.deadline = LOCK_TIMEOUT
+    self._deadline = time.time() + LOCK_TIMEOUT
 
     # Prevent other threads from acquiring the lock at the same time.
     locked = self._lock.acquire(False)
@@ -187,11 +265,12 @@ class EntityLock(object):
           raise ForceRetryError()
 
   def _inner_acquire(self):
-    """ Create contender node(s) and wait until the lock is acquired. """
-
-    # Make sure the group lock node exists.
-    self._ensure_path()
+    """ Create contender node(s) and wait until the lock is acquired.
 
+    The group lock nodes are created along with the contender nodes when they
+    do not exist, so an uncontended lock only needs to create its contenders
+    and list the other contenders once.
+    """
     nodes = [None for _ in self.paths]
     if self.create_tried:
       nodes = self._find_nodes()
@@ -208,7 +287,7 @@ class EntityLock(object):
         try:
           node = self.client.create(
             self.create_paths[index], self.data, ephemeral=True,
-            sequence=True)
+            sequence=True, makepath=True)
           break
         except NoNodeError:
           self.client.ensure_path(self.paths[index])
@@ -222,6 +301,9 @@ class EntityLock(object):
 
     self.nodes = nodes
 
+    # Maps indexes of groups that have a predecessor to when the wait began.
+    wait_started = {}
+    waited = False
     while True:
       self.wake_event.clear()
 
@@ -242,26 +324,41 @@ class EntityLock(object):
         if our_index != 0:
           predecessors.append(
             self.paths[index] + "/" + children[our_index - 1])
+          wait_started.setdefault(index, time.time())
+        elif index in wait_started:
+          _record_wait(self.paths[index],
+                       time.time() - wait_started.pop(index))
 
       if not predecessors:
+        _count('contended_acquires' if waited else 'fast_acquires')
         return True
 
+      waited = True
+
       if len(nodes) > 1:
         self._resolve_deadlocks(children_list)
 
-      # Wait for predecessor to be removed.
-      # TODO: Listen for all at the same time.
-      for index, predecessor in enumerate(predecessors):
-        self.client.add_listener(self._watch_session)
-        try:
-          if self.client.exists(predecessor, self._watch_predecessor):
-            self.wake_event.wait(LOCK_TIMEOUT)
-            if not self.wake_event.isSet():
-              error = 'Failed to acquire lock on {} after {} '\
-                'seconds'.format(self.paths, LOCK_TIMEOUT * (index + 1))
-              raise LockTimeout(error)
-        finally:
-          self.client.remove_listener(self._watch_session)
+      # Watch all of the predecessors and wake up when any of them is removed.
+      self.client.add_listener(self._watch_session)
+      try:
+        for predecessor in predecessors:
+          if not self.client.exists(predecessor, self._watch_predecessor):
+            self.wake_event.set()
+            break
+
+        remaining = self._deadline - time.time()
+        if remaining > 0:
+          self.wake_event.wait(remaining)
+
+        if not self.wake_event.isSet():
+          for index, started in wait_started.iteritems():
+            _record_wait(self.paths[index], time.time() - started)
+
+          error = 'Failed to acquire lock on {} after {} seconds'.format(
+            self.paths, LOCK_TIMEOUT)
+          raise LockTimeout(error)
+      finally:
+        self.client.remove_listener(self._watch_session)
 
   def _watch_predecessor(self, event):
     """ A callback function for handling contender deletions.
@@ -331,6 +428,10 @@ class EntityLock(object):
 
   def release(self):
     """ Release the lock immediately. """
+    if self.is_acquired and self._release_with_paths():
+      _count('fast_releases')
+      return
+
     self.client.retry(self._inner_release)
 
     # Try to clean up the group lock path.
@@ -339,8 +440,34 @@ class EntityLock(object):
         self.client.delete(path)
       except (NotEmptyError, NoNodeError):
         pass
+
+    _count('contended_releases')
     return
 
+  def _release_with_paths(self):
+    """ Removes the contender nodes and the group lock nodes in a single
+    request. This only succeeds when there are no other contenders.
+
+    Returns:
+      A boolean indicating whether or not the lock was released.
+    """
+    transaction = self.client.transaction()
+    for path, node in zip(self.paths, self.nodes):
+      transaction.delete(path + '/' + node)
+      transaction.delete(path)
+
+    try:
+      results = transaction.commit()
+    except KazooException:
+      return False
+
+    if any(isinstance(result, Exception) for result in results):
+      return False
+
+    self.is_acquired = False
+    self.nodes = [None for _ in self.paths]
+    return True
+
   def _inner_release(self):
     """ Release the lock by removing created nodes. """
     if not self.is_acquired:
@@ -0,0 +1,104 @@
+""" Removes the nodes of finished transaction IDs in batches. """
+
+import logging
+import threading
+
+from appscale.common.periodic_flusher import PeriodicFlusher
+from kazoo.exceptions import KazooException
+from kazoo.exceptions import NoNodeError
+
+from .zktransaction import ZKInternalException
+
+# How many seconds finished IDs can wait before their nodes are removed.
+# Finished IDs still appear to be in progress until then.
+RELEASE_INTERVAL = .2
+
+# The number of finished IDs that causes their nodes to be removed right away.
+RELEASE_BATCH_SIZE = 50
+
+
+class TransactionIDReleaser(object):
+  """ Removes the nodes of finished non-transactional writes together in the
+  background.
+
+  IDs are still acquired from ZooKeeper when they are needed. A transaction
+  ID is also the write timestamp of the mutations that use it, so an ID
+  reserved ahead of time could be lower than one that has already been
+  committed, and Cassandra would discard the newer write.
+  """
+  def __init__(self, zk_transaction):
+    """ Creates a new TransactionIDReleaser.
+
+    Args:
+      zk_transaction: A ZKTransaction.
+    """
+    self.zk_transaction = zk_transaction
+    self.logger = logging.getLogger(self.__class__.__name__)
+
+    self._lock = threading.Lock()
+    self._finished = {}
+    self._releaser = PeriodicFlusher(self._release_pending, RELEASE_INTERVAL)
+
+  def release(self, app_id, txid):
+    """ Marks an ID as finished.
+
+    Args:
+      app_id: A string specifying the project ID.
+      txid: A long that represents the transaction ID.
+    """
+    with self._lock:
+      self._finished.setdefault(app_id, []).append(txid)
+      release_now = len(self._finished[app_id]) >= RELEASE_BATCH_SIZE
+
+    self._releaser.start()
+    if release_now:
+      self._remove_finished(app_id)
+
+  def stop(self):
+    """ Stops the background thread and removes the nodes of finished IDs. """
+    self._releaser.stop()
+    self._release_pending()
+
+  def _release_pending(self):
+    """ Removes the nodes of every project's finished IDs. """
+    with self._lock:
+      app_ids = [app_id for app_id, txids in self._finished.iteritems()
+                 if txids]
+
+    for app_id in app_ids:
+      self._remove_finished(app_id)
+
+  def _remove_finished(self, app_id):
+    """ Removes the sequence nodes of finished IDs in one ZooKeeper request.
+
+    Args:
+      app_id: A string specifying the project ID.
+    """
+    with self._lock:
+      txids = self._finished.pop(app_id, [])
+
+    if not txids:
+      return
+
+    transaction = self.zk_transaction.handle.transaction()
+    for txid in txids:
+      transaction.delete(self.zk_transaction.get_transaction_path(app_id, txid))
+
+    try:
+      results = transaction.commit()
+    except KazooException:
+      self.logger.exception(
+        'Unable to remove {} transaction IDs'.format(len(txids)))
+      with self._lock:
+        self._finished.setdefault(app_id, []).extend(txids)
+      return
+
+    # If a node is already gone, the whole request is rejected.
+    if not any(isinstance(result, NoNodeError) for result in results):
+      return
+
+    for txid in txids:
+      try:
+        self.zk_transaction.remove_tx_node(app_id, txid)
+      except ZKInternalException:
+        self.logger.exception('Unable to remove transaction {}'.format(txid))
@@ -4,6 +4,7 @@ Distributed id and lock service for transaction support.
 """
 import kazoo.client
 import kazoo.exceptions
+import kazoo.retry
 import logging
 import os
 import re
@@ -99,6 +100,9 @@ GC_TIME_PATH = "gclast_time"
 # Lock path for the datastore groomer.
 DS_GROOM_LOCK_PATH = "/appscale_datastore_groomer"
 
+# Lock path for publishing datastore statistics.
+DS_STATS_LOCK_PATH = "/appscale_datastore_stats"
+
 # Lock path for the datastore backup.
 DS_BACKUP_LOCK_PATH = "/appscale_datastore_backup"
 
@@ -545,6 +549,60 @@ class ZKTransaction:
       self.create_node(xg_path, timestamp)
     return txn_id
 
+  def get_transaction_ids(self, app_id, count):
+    """ Acquires IDs for several non-XG transactions in one round trip.
+
+    Args:
+      app_id: A str representing the application we want to perform
+        transactions on.
+      count: An integer specifying the number of IDs to acquire.
+    Returns:
+      A list of longs that represent the new transaction IDs.
+    Raises:
+      ZKTransactionException: If the sequence nodes couldn't be created.
+    """
+    timestamp = str(time.time())
+    app_path = self.get_txn_path_before_getting_id(app_id)
+
+    def create_nodes():
+      """ Creates the sequence nodes in a single ZooKeeper transaction.
+
+      Returns:
+        A list of paths of the nodes that were created.
+      """
+      transaction = self.handle.transaction()
+      for _ in range(count):
+        transaction.create(app_path, value=timestamp, acl=ZOO_ACL_OPEN,
+                           sequence=True)
+      results = transaction.commit()
+      for result in results:
+        if isinstance(result, NoNodeError):
+          self.handle.ensure_path(self.get_transaction_prefix_path(app_id))
+          raise kazoo.retry.ForceRetryError()
+        if isinstance(result, Exception):
+          raise result
+      return results
+
+    try:
+      txn_id_paths = self.run_with_retry(create_nodes)
+    except kazoo.exceptions.KazooException as kazoo_exception:
+      self.logger.exception(kazoo_exception)
+      raise ZKTransactionException(
+        'Unable to create {} sequence nodes with path {}'.format(
+          count, app_path))
+
+    txids = []
+    for txn_id_path in txn_id_paths:
+      txn_id = long(txn_id_path.split(PATH_SEPARATOR)[-1].lstrip(
+        APP_TX_PREFIX))
+      if txn_id == 0:
+        self.logger.warning("Created sequence ID 0 - deleting it.")
+        self.run_with_retry(self.handle.delete, txn_id_path)
+        txn_id = self.create_sequence_node(app_path, timestamp)
+      txids.append(txn_id)
+
+    return txids
+
   def check_transaction(self, app_id, txid):
     """ Gets the status of the given transaction.
 
@@ -2,14 +2,20 @@
 
 """ Unit tests for backup_data.py """
 
+import Queue
+import os
 import re
+import shutil
+import tempfile
 import time
 import unittest
 
 from appscale.datastore import appscale_datastore_batch
 from appscale.datastore import entity_utils
+from appscale.datastore.backup.chunked_file import read_chunked_file
 from appscale.datastore.backup.datastore_backup import DatastoreBackup
 from appscale.datastore.dbconstants import AppScaleDBConnectionError
+from appscale.datastore.utils import get_write_time
 from appscale.datastore.zkappscale.zktransaction import ZKTransactionException
 from flexmock import flexmock
 
@@ -20,6 +26,11 @@ class FakeDatastore(object):
   def range_query(self, table, schema, start, end, batch_size,
     start_inclusive=True, end_inclusive=True):
     return []
+  def range_query_iter(self, table, schema, start, end, limit=None,
+    start_inclusive=True, end_inclusive=True, page_size=None):
+    return iter([])
+  def get_key_ranges(self):
+    return [('', 'guestbook27\x00m'), ('guestbook27\x00m', '\xff' * 500)]
 
 FAKE_ENCODED_ENTITY = \
   {'guestbook27\x00\x00Guestbook:default_guestbook\x01Greeting:1\x01':
@@ -186,6 +197,73 @@ class TestBackup(unittest.TestCase):
     fake_backup.should_receive("get_entity_batch").and_return([])
     self.assertEquals(None, fake_backup.run_backup())
 
+  def test_get_snapshot_ranges(self):
+    zookeeper = flexmock()
+    fake_backup = flexmock(DatastoreBackup('guestbook27', zookeeper,
+      "cassandra", False, [], snapshot=True, workers=2))
+    fake_backup.db_access = FakeDatastore()
+
+    key_ranges = fake_backup.get_snapshot_ranges()
+    self.assertEquals(key_ranges[0][0], 'guestbook27\x00')
+    self.assertEquals(key_ranges[-1][1], fake_backup.last_key)
+    self.assertIn('guestbook27\x00m', [end for _, end in key_ranges])
+    for (_, end_key), (start_key, _) in zip(key_ranges, key_ranges[1:]):
+      self.assertEquals(end_key, start_key)
+    self.assertTrue(all(start_key.startswith('guestbook27\x00')
+                        for start_key, _ in key_ranges))
+
+  def test_get_snapshot_time(self):
+    zookeeper = flexmock()
+    fake_backup = flexmock(DatastoreBackup('app_id', zookeeper,
+      "cassandra", False, [], snapshot=True))
+    zookeeper.should_receive('get_transaction_id').and_return(10)
+    zookeeper.should_receive('remove_tx_node').with_args('app_id', 10).once()
+
+    # Wait for transactions that started before the snapshot.
+    zookeeper.should_receive('get_current_transactions').\
+      and_return([9, 11]).and_return([11])
+    flexmock(time).should_receive('sleep').once()
+    self.assertEquals(fake_backup.get_snapshot_time(), get_write_time(10))
+
+  def test_backup_snapshot_ranges(self):
+    zookeeper = flexmock()
+    fake_backup = flexmock(DatastoreBackup('guestbook27', zookeeper,
+      "cassandra", False, ['Skipped'], snapshot=True))
+    fake_backup.backup_dir = tempfile.mkdtemp() + '/'
+    self.addCleanup(shutil.rmtree, fake_backup.backup_dir)
+
+    rows = [
+      ('guestbook27\x00\x00Greeting:1\x01', 'first', 5),
+      ('guestbook27\x00\x00Greeting:2\x01', 'changed', 20),
+      ('guestbook27\x00\x00Skipped:1\x01', 'skipped', 5),
+      ('guestbook27\x00\x00__Stat_Kind__:1\x01', 'private', 5),
+      ('guestbook27\x00\x00Greeting:3\x01', 'APPSCALE_SOFT_DELETE', 5),
+      ('guestbook27\x00\x00Greeting:4\x01', 'APPSCALE_SOFT_DELETE', 20)
+    ]
+    fake_backup.db_access = flexmock()
+    fake_backup.db_access.should_receive('entity_versions_iter').\
+      and_return(iter(rows))
+
+    key_ranges = Queue.Queue()
+    key_ranges.put(('guestbook27\x00', fake_backup.last_key))
+    fake_backup.backup_snapshot_ranges(0, key_ranges, 10)
+
+    self.assertEquals(fake_backup.entities_backed_up, 1)
+    self.assertEquals(fake_backup.entities_changed, 2)
+    backup_files = {os.path.splitext(filename)[1]: filename
+                    for filename in os.listdir(fake_backup.backup_dir)}
+    self.assertItemsEqual(backup_files.keys(), ['.changed', '.snapshot'])
+    entities = list(read_chunked_file(
+      os.path.join(fake_backup.backup_dir, backup_files['.snapshot'])))
+    self.assertListEqual(entities, ['first'])
+
+    # Entities written or deleted after the snapshot time are listed.
+    with open(os.path.join(fake_backup.backup_dir,
+                           backup_files['.changed'])) as keys:
+      changed_keys = [line.strip().decode('hex') for line in keys]
+    self.assertListEqual(changed_keys, ['guestbook27\x00\x00Greeting:2\x01',
+                                        'guestbook27\x00\x00Greeting:4\x01'])
+
 
 if __name__ == "__main__":
   unittest.main()
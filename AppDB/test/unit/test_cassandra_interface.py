@@ -74,6 +74,47 @@ class TestCassandra(unittest.TestCase):
 
     self.assertListEqual([], db.range_query("table", [], "start", "end", 0))
 
+  def test_range_query_iter(self):
+    flexmock(file_io) \
+        .should_receive('read') \
+        .and_return('127.0.0.1')
+
+    rows = [('a', 'c1', '1'), ('a', 'c2', '2'), ('b', 'c1', '3'),
+            ('b', 'c2', '4'), ('c', 'c1', '5'), ('c', 'c2', '6')]
+    flexmock(Cluster).should_receive('connect').\
+        and_return(flexmock(execute=lambda x, **y: iter(rows)))
+
+    db = cassandra_interface.DatastoreProxy()
+
+    results = db.range_query_iter("table", ['c1', 'c2'], "start", "end")
+    self.assertListEqual(
+      [{'a': {'c1': '1', 'c2': '2'}}, {'b': {'c1': '3', 'c2': '4'}},
+       {'c': {'c1': '5', 'c2': '6'}}], list(results))
+
+    results = db.range_query_iter("table", ['c1', 'c2'], "start", "end",
+                                  limit=1, offset=1)
+    self.assertListEqual([{'b': {'c1': '3', 'c2': '4'}}], list(results))
+
+    keys = db.range_query_iter("table", ['c1', 'c2'], "start", "end",
+                               keys_only=True)
+    self.assertListEqual(['a', 'b', 'c'], list(keys))
+
+  def test_range_query_async(self):
+    flexmock(file_io) \
+        .should_receive('read') \
+        .and_return('127.0.0.1')
+
+    rows = [('a', 'c1', '1'), ('b', 'c1', '2'), ('c', 'c1', '3')]
+    response_future = flexmock(result=lambda: iter(rows))
+    session = flexmock(execute_async=lambda x, **y: response_future)
+    flexmock(Cluster).should_receive('connect').and_return(session)
+
+    db = cassandra_interface.DatastoreProxy()
+
+    future = db.range_query_async("table", ['c1'], "start", "end", 2)
+    self.assertListEqual([{'a': {'c1': '1'}}, {'b': {'c1': '2'}}],
+                         future.result())
+
   def test_batch_mutate(self):
     app_id = 'guestbook'
     transaction = 1
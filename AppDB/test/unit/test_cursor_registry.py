@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+import sys
+import time
+import unittest
+
+from appscale.common.unpackaged import APPSCALE_PYTHON_APPSERVER
+from appscale.datastore.cursor_registry import CursorRegistry
+from appscale.datastore.cursor_registry import ServerCursor
+from flexmock import flexmock
+
+sys.path.append(APPSCALE_PYTHON_APPSERVER)
+from google.appengine.datastore import datastore_pb
+
+
+def make_cursor(kind='Greeting'):
+  query = datastore_pb.Query()
+  query.set_app('guestbook')
+  query.set_kind(kind)
+  return ServerCursor(query, 'kind', datastore_pb.CompiledCursor())
+
+
+class TestCursorRegistry(unittest.TestCase):
+  def test_add_and_get(self):
+    registry = CursorRegistry()
+    cursor = make_cursor()
+    cursor_id = registry.add('guestbook', cursor)
+    self.assertIs(registry.get('guestbook', cursor_id), cursor)
+    self.assertIsNone(registry.get('other-project', cursor_id))
+    self.assertEqual(registry.stats()['hits'], 1)
+    self.assertEqual(registry.stats()['misses'], 1)
+
+    registry.remove('guestbook', cursor_id)
+    self.assertIsNone(registry.get('guestbook', cursor_id))
+    self.assertEqual(registry.stats()['bytes'], 0)
+
+  def test_random_ids(self):
+    registry = CursorRegistry()
+    flexmock(registry._random).should_receive('getrandbits').\
+      and_return(0).and_return(5).and_return(5).and_return(9)
+
+    # Zero is never used, and an ID is not reused while it is kept.
+    self.assertEqual(registry.add('guestbook', make_cursor()), 5)
+    self.assertEqual(registry.add('guestbook', make_cursor()), 9)
+
+  def test_lru_eviction(self):
+    registry = CursorRegistry(max_cursors=2)
+    first = registry.add('guestbook', make_cursor())
+    second = registry.add('guestbook', make_cursor())
+    registry.get('guestbook', first)
+    registry.add('guestbook', make_cursor())
+
+    self.assertIsNotNone(registry.get('guestbook', first))
+    self.assertIsNone(registry.get('guestbook', second))
+    self.assertEqual(registry.stats()['evictions'], 1)
+
+  def test_size_eviction(self):
+    cursor = make_cursor()
+    registry = CursorRegistry(max_bytes=cursor.size * 2)
+    first = registry.add('guestbook', cursor)
+    registry.add('guestbook', make_cursor())
+    registry.add('guestbook', make_cursor())
+    self.assertIsNone(registry.get('guestbook', first))
+    self.assertEqual(registry.stats()['cursors'], 2)
+
+  def test_expiration(self):
+    registry = CursorRegistry(ttl=60)
+    flexmock(time).should_receive('time').and_return(1000)
+    cursor_id = registry.add('guestbook', make_cursor())
+
+    flexmock(time).should_receive('time').and_return(1030)
+    self.assertIsNotNone(registry.get('guestbook', cursor_id))
+
+    flexmock(time).should_receive('time').and_return(1100)
+    self.assertIsNone(registry.get('guestbook', cursor_id))
+
+  def test_update(self):
+    registry = CursorRegistry()
+    cursor_id = registry.add('guestbook', make_cursor())
+    position = datastore_pb.CompiledCursor()
+    position.add_position().set_start_key('start')
+    registry.update('guestbook', cursor_id, position)
+
+    cursor = registry.get('guestbook', cursor_id)
+    self.assertEqual(cursor.position, position)
+    self.assertEqual(registry.stats()['bytes'], cursor.size)
+
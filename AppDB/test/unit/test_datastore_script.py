@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+import json
+import threading
+import unittest
+
+from appscale.datastore.scripts import datastore
+from appscale.datastore.scripts.datastore import MainHandler
+from appscale.datastore.scripts.datastore import RequestLimiter
+from flexmock import flexmock
+from tornado import gen
+from tornado.testing import AsyncHTTPTestCase
+from tornado.testing import AsyncTestCase
+from tornado.testing import gen_test
+
+from google.appengine.ext.remote_api import remote_api_pb
+
+
+class TestRequestLimiter(AsyncTestCase):
+  def setUp(self):
+    super(TestRequestLimiter, self).setUp()
+    self.limiter = RequestLimiter(2, {'Commit': 1})
+
+  def tearDown(self):
+    self.limiter.shutdown()
+    super(TestRequestLimiter, self).tearDown()
+
+  @gen_test
+  def test_run(self):
+    result = yield self.limiter.run('Get', lambda x, y: x + y, 1, 2)
+    self.assertEqual(result, 3)
+
+    stats = self.limiter.stats()['Get']
+    self.assertEqual(stats['limit'], 2)
+    self.assertEqual(stats['completed'], 1)
+    self.assertEqual(stats['running'], 0)
+    self.assertEqual(stats['waiting'], 0)
+
+  @gen_test
+  def test_errors_release_the_method(self):
+    def fail():
+      raise ValueError('Bad request')
+
+    with self.assertRaises(ValueError):
+      yield self.limiter.run('Commit', fail)
+
+    # The failed request does not hold on to the method's only slot.
+    result = yield self.limiter.run('Commit', lambda: 'committed')
+    self.assertEqual(result, 'committed')
+    self.assertEqual(self.limiter.stats()['Commit']['completed'], 2)
+
+  @gen_test
+  def test_method_limit(self):
+    release = threading.Event()
+    first = self.limiter.run('Commit', release.wait, 5)
+    second = self.limiter.run('Commit', release.wait, 5)
+
+    stats = self.limiter.stats()['Commit']
+    self.assertEqual(stats['limit'], 1)
+    self.assertEqual(stats['running'], 1)
+    self.assertEqual(stats['waiting'], 1)
+    self.assertEqual(stats['max_waiting'], 1)
+
+    # Other methods are not limited by the busy method.
+    result = yield self.limiter.run('Get', lambda: 'found')
+    self.assertEqual(result, 'found')
+
+    release.set()
+    yield [first, second]
+    stats = self.limiter.stats()['Commit']
+    self.assertEqual(stats['completed'], 2)
+    self.assertEqual(stats['waiting'], 0)
+
+  @gen_test
+  def test_queued(self):
+    release = threading.Event()
+    running = [self.limiter.run('Get', release.wait, 5),
+               self.limiter.run('Get', release.wait, 5),
+               self.limiter.run('Commit', release.wait, 5)]
+
+    # Each method is within its limit, but there are only two threads.
+    self.assertEqual(self.limiter.threads, 2)
+    self.assertEqual(self.limiter.queued(), 1)
+
+    release.set()
+    yield running
+    self.assertEqual(self.limiter.queued(), 0)
+
+
+class TestMainHandler(AsyncHTTPTestCase):
+  def setUp(self):
+    super(TestMainHandler, self).setUp()
+    self.limiter = RequestLimiter(2, {})
+    flexmock(datastore, request_limiter=self.limiter)
+
+  def tearDown(self):
+    self.limiter.shutdown()
+    super(TestMainHandler, self).tearDown()
+
+  def get_app(self):
+    return datastore.pb_application
+
+  def send_request(self, method, headers=None):
+    request = remote_api_pb.Request()
+    request.set_service_name('datastore_v3')
+    request.set_method(method)
+    request.set_request('')
+    request_headers = {'protocolbuffertype': 'Request',
+                       'appdata': 'guestbook'}
+    request_headers.update(headers or {})
+    return self.fetch('/', method='POST', body=request.Encode(),
+                      headers=request_headers)
+
+  def test_post(self):
+    threads = []
+    def remote_request(app_id, apirequest, query_plans=None):
+      threads.append(threading.current_thread())
+      self.assertEqual(app_id, 'guestbook')
+      self.assertEqual(apirequest.method(), 'Get')
+      self.assertIsNone(query_plans)
+      return 'encoded response'
+
+    flexmock(MainHandler).should_receive('remote_request').\
+      replace_with(remote_request)
+    response = self.send_request('Get')
+    self.assertEqual(response.code, 200)
+    self.assertEqual(response.body, 'encoded response')
+
+    # The request is handled off of the IOLoop thread.
+    self.assertEqual(len(threads), 1)
+    self.assertIsNot(threads[0], threading.current_thread())
+    self.assertEqual(self.limiter.stats()['Get']['completed'], 1)
+
+  def test_query_plan(self):
+    plan = flexmock(to_dict=lambda: {'index': 'kind'})
+    def remote_request(app_id, apirequest, query_plans=None):
+      query_plans.append(plan)
+      return 'encoded response'
+
+    flexmock(MainHandler).should_receive('remote_request').\
+      replace_with(remote_request)
+    response = self.send_request(
+      'RunQuery', headers={datastore.EXPLAIN_HEADER: 'true'})
+    self.assertEqual(response.code, 200)
+    self.assertDictEqual(
+      json.loads(response.headers[datastore.QUERY_PLAN_HEADER]),
+      {'index': 'kind'})
+
+  def test_concurrency(self):
+    response = self.fetch('/concurrency')
+    self.assertEqual(response.code, 200)
+    self.assertDictEqual(json.loads(response.body),
+                         {'threads': 2, 'queued': 0, 'methods': {}})
+
+
+if __name__ == "__main__":
+  unittest.main()
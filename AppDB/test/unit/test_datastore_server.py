@@ -9,7 +9,9 @@ import unittest
 from appscale.common import appscale_info
 from appscale.common.unpackaged import APPSCALE_PYTHON_APPSERVER
 from appscale.datastore import dbconstants
+from appscale.datastore import helper_functions
 from appscale.datastore import utils
+from appscale.datastore.cursor_registry import ServerCursor
 from appscale.datastore.datastore_distributed import DatastoreDistributed
 from appscale.datastore.dbconstants import APP_ENTITY_SCHEMA
 from appscale.datastore.dbconstants import JOURNAL_SCHEMA
@@ -25,6 +27,7 @@ from appscale.datastore.cassandra_env.cassandra_interface import (
 )
 
 from appscale.datastore.utils import (
+  encode_index_pb,
   get_entity_key,
   get_entity_kind,
   get_index_key_from_params,
@@ -42,6 +45,7 @@ from google.appengine.api import api_base_pb
 from google.appengine.datastore import entity_pb
 from google.appengine.datastore import datastore_pb
 from google.appengine.ext import db
+from google.appengine.runtime.apiproxy_errors import ApplicationError
 
 
 class Item(db.Model):
@@ -55,13 +59,18 @@ class TestDatastoreServer(unittest.TestCase):
   BASIC_ENTITY = ['guestbook', 'Greeting', 'foo', 'content', 'hello world']
 
   def get_zookeeper(self):
+    zk_transaction = flexmock(delete=lambda path: None, commit=lambda: [])
     zk_handle = flexmock(handler=flexmock(event_object=lambda: None,
                                           sleep_func=lambda: None,
-                                          lock_object=lambda: None))
-    zookeeper = flexmock(handle=zk_handle)
+                                          lock_object=lambda: None),
+                         transaction=lambda: zk_transaction)
+    zookeeper = flexmock(
+      handle=zk_handle,
+      get_transaction_path=lambda app, txid: '/txids/tx{}'.format(txid))
     zookeeper.should_receive("acquire_lock").and_return(True)
     zookeeper.should_receive("release_lock").and_return(True)
     zookeeper.should_receive("get_transaction_id").and_return(1)
+    zookeeper.should_receive("get_transaction_ids").and_return([1, 2])
     zookeeper.should_receive("increment_and_get_counter").and_return(0,1000)
     zookeeper.should_receive('remove_tx_node')
     return zookeeper
@@ -367,6 +376,29 @@ class TestDatastoreServer(unittest.TestCase):
 
     dd.put_entities(app_id, entity_list)
 
+  def test_put_entities_releases_txids(self):
+    app_id = 'test'
+    db_batch = flexmock()
+    db_batch.should_receive('valid_data_version').and_return(True)
+    entity_list = [
+      self.get_new_entity_proto(app_id, "test_kind", name, "prop1name",
+                                "prop1val", ns="blah")
+      for name in ("bob", "nancy")]
+    db_batch.should_receive('batch_get_entity').and_return({})
+    dd = DatastoreDistributed(db_batch, self.get_zookeeper())
+    dd.MAX_GROUP_WRITE_WORKERS = 1
+
+    flexmock(dd.zookeeper).should_receive('get_transaction_ids').\
+      with_args(app_id, 2).and_return([5, 6])
+    flexmock(dd).should_receive('put_group').\
+      and_raise(dbconstants.AppScaleDBConnectionError("Timed out")).once()
+
+    # The group that was never written gives up its transaction ID.
+    flexmock(dd.txid_releaser).should_receive('release').\
+      with_args(app_id, 6).once()
+    self.assertRaises(dbconstants.AppScaleDBConnectionError,
+                      dd.put_entities, app_id, entity_list)
+
   def test_acquire_locks_for_trans(self):
     db_batch = flexmock()
     db_batch.should_receive('valid_data_version').and_return(True)
@@ -447,6 +479,7 @@ class TestDatastoreServer(unittest.TestCase):
     db_batch.should_receive("batch_get_entity").and_return(row_values)
     db_batch.should_receive('batch_mutate')
     db_batch.should_receive('_normal_batch')
+    db_batch.should_receive('record_entity_changes').once()
 
     dd = DatastoreDistributed(db_batch, zookeeper) 
 
@@ -488,6 +521,25 @@ class TestDatastoreServer(unittest.TestCase):
     self.assertEquals("test\x00blah\x00test_kind:nancy\x01", 
       dd.get_root_key_from_entity_key(entity_proto1.key()))
 
+  def test_dynamic_next_other_project(self):
+    db_batch = flexmock()
+    db_batch.should_receive('valid_data_version').and_return(True)
+    dd = DatastoreDistributed(db_batch, None)
+
+    query = datastore_pb.Query()
+    query.set_app('guestbook')
+    query.set_kind('Greeting')
+    cursor_id = dd.cursors.add(
+      'guestbook', ServerCursor(query, 'kind', datastore_pb.CompiledCursor()))
+
+    # A cursor is only found for the project that ran the query.
+    next_request = datastore_pb.NextRequest()
+    next_request.mutable_cursor().set_app('guestbook')
+    next_request.mutable_cursor().set_cursor(cursor_id)
+    with self.assertRaises(ApplicationError):
+      dd.dynamic_next('other-project', next_request,
+                      datastore_pb.QueryResult())
+
   def test_dynamic_get(self):
     entity_proto1 = self.get_new_entity_proto("test", "test_kind", "nancy", "prop1name", 
                                               "prop2val", ns="blah")
@@ -551,7 +603,7 @@ class TestDatastoreServer(unittest.TestCase):
     db_batch.should_receive("batch_put_entity").and_return(None)
     entity_proto1 = {'test\x00blah\x00test_kind:nancy\x01':{APP_ENTITY_SCHEMA[0]:entity_proto1.Encode(),
                       APP_ENTITY_SCHEMA[1]: 1}}
-    db_batch.should_receive("range_query").and_return([entity_proto1, tombstone1]).and_return([])
+    db_batch.should_receive("range_query_iter").and_return(iter([entity_proto1, tombstone1])).and_return(iter([]))
     zookeeper = flexmock()
     zookeeper.should_receive("get_valid_transaction_id").and_return(1)
     zookeeper.should_receive("acquire_lock").and_return(True)
@@ -590,7 +642,7 @@ class TestDatastoreServer(unittest.TestCase):
     db_batch.should_receive("batch_put_entity").and_return(None)
     entity_proto1 = {'test\x00blah\x00test_kind:nancy\x01':{APP_ENTITY_SCHEMA[0]:entity_proto1.Encode(),
                       APP_ENTITY_SCHEMA[1]: 1}}
-    db_batch.should_receive("range_query").and_return([entity_proto1, tombstone1]).and_return([])
+    db_batch.should_receive("range_query_iter").and_return(iter([entity_proto1, tombstone1])).and_return(iter([]))
     zookeeper = flexmock()
     zookeeper.should_receive("get_valid_transaction_id").and_return(1)
     zookeeper.should_receive("acquire_lock").and_return(True)
@@ -603,6 +655,40 @@ class TestDatastoreServer(unittest.TestCase):
     transaction.set_handle(2)
     dd.ordered_ancestor_query(query, filter_info, None) 
 
+  def test_ordered_ancestor_query_sorts(self):
+    root = self.get_new_entity_proto("test", "Guestbook", "root", "name", "a")
+    rows = [{'test\x00\x00Guestbook:root\x01': {
+      APP_ENTITY_SCHEMA[0]: root.Encode(), APP_ENTITY_SCHEMA[1]: 1}}]
+    for name, value in [('e1', 'b'), ('e2', 'ab'), ('e3', 'c'), ('e4', 'ab')]:
+      entity = self.get_new_entity_proto("test", "Greeting", name, "content",
+                                         value)
+      rows.append({'test\x00\x00Greeting:{}\x01'.format(name): {
+        APP_ENTITY_SCHEMA[0]: entity.Encode(), APP_ENTITY_SCHEMA[1]: 1}})
+
+    query = datastore_pb.Query()
+    query.set_app("test")
+    query.set_kind("Greeting")
+    query.mutable_ancestor().MergeFrom(root.key())
+    query.set_limit(3)
+
+    db_batch = flexmock()
+    db_batch.should_receive('valid_data_version').and_return(True)
+    db_batch.should_receive('range_query_iter').and_return(iter(rows))
+    dd = DatastoreDistributed(db_batch, self.get_zookeeper())
+
+    def names(results):
+      return [entity_pb.EntityProto(result).key().path().element(0).name()
+              for result in results]
+
+    ascending = [('content', datastore_pb.Query_Order.ASCENDING)]
+    self.assertEqual(names(dd.ordered_ancestor_query(query, {}, ascending)),
+                     ['e2', 'e4', 'e1'])
+
+    db_batch.should_receive('range_query_iter').and_return(iter(rows))
+    descending = [('content', datastore_pb.Query_Order.DESCENDING)]
+    self.assertEqual(names(dd.ordered_ancestor_query(query, {}, descending)),
+                     ['e3', 'e1', 'e2'])
+
   
   def test_kindless_query(self):
     query = datastore_pb.Query()
@@ -628,7 +714,7 @@ class TestDatastoreServer(unittest.TestCase):
     db_batch.should_receive("batch_put_entity").and_return(None)
     entity_proto1 = {'test\x00blah\x00test_kind:nancy\x01':{APP_ENTITY_SCHEMA[0]:entity_proto1.Encode(),
                       APP_ENTITY_SCHEMA[1]: 1}}
-    db_batch.should_receive("range_query").and_return([entity_proto1, tombstone1]).and_return([])
+    db_batch.should_receive("range_query_iter").and_return(iter([entity_proto1, tombstone1])).and_return(iter([]))
     zookeeper = flexmock()
     zookeeper.should_receive("get_valid_transaction_id").and_return(1)
     zookeeper.should_receive("is_in_transaction").and_return(False)
@@ -775,6 +861,106 @@ class TestDatastoreServer(unittest.TestCase):
     flexmock(query).should_receive("limit").and_return(1)
     self.assertEquals(dd.zigzag_merge_join(query, filter_info, []), None)
 
+  def test_ancestor_filter_query(self):
+    db_batch = flexmock()
+    db_batch.should_receive('valid_data_version').and_return(True)
+    dd = DatastoreDistributed(db_batch, None)
+    dd._MAXIMUM_RESULTS = 2
+    ancestor_filter_query = dd._DatastoreDistributed__ancestor_filter_query
+
+    match = self.get_new_entity_proto(*self.BASIC_ENTITY)
+    other = self.get_new_entity_proto('guestbook', 'Greeting', 'bar',
+                                      'content', 'goodbye')
+    query = datastore_pb.Query()
+    query.set_app('guestbook')
+    query.set_kind('Greeting')
+    query.mutable_ancestor().CopyFrom(match.key())
+    filter_info = {'content': [(datastore_pb.Query_Filter.EQUAL,
+                                encode_index_pb(match.property(0).value()))]}
+
+    # The matches are found when the whole group fits in the scan.
+    group = [other.Encode(), match.Encode()]
+    flexmock(dd).should_receive('fetch_from_entity_table').\
+      replace_with(lambda *args, **kwargs: iter(group))
+    self.assertListEqual(ancestor_filter_query(query, filter_info, []),
+                         [match.Encode()])
+
+    # A larger group is left to another strategy.
+    group = [other.Encode(), other.Encode(), match.Encode()]
+    self.assertIsNone(ancestor_filter_query(query, filter_info, []))
+
+  def test_zigzag_merge_join_windows(self):
+    db_batch = flexmock()
+    db_batch.should_receive('valid_data_version').and_return(True)
+    db_batch.should_receive('range_query_async')
+    dd = DatastoreDistributed(db_batch, None)
+    dd._MAX_COMPOSITE_WINDOW = 2
+
+    query = datastore_pb.Query()
+    query.set_app('guestbook')
+    query.set_kind('kind')
+    filter_info = {'prop1': [(datastore_pb.Query_Filter.EQUAL, '1')],
+                   'prop2': [(datastore_pb.Query_Filter.EQUAL, '2')]}
+
+    def reference(name):
+      return dbconstants.KEY_DELIMITER.join(['guestbook', '', name])
+
+    # Each property's index returns one window at a time.
+    windows = {'prop1': [['a', 'b'], ['c', 'd'], []],
+               'prop2': [['b', 'd'], ['d'], []]}
+    startrows = []
+
+    def apply_filters(filter_ops, order_ops, prop_name, kind, prefix, count,
+                      offset, startrow, **kwargs):
+      startrows.append((prop_name, startrow.split(
+        dbconstants.KEY_DELIMITER)[-1], kwargs['include_start_key']))
+      return [{'{}/{}'.format(prop_name, name): {'reference': reference(name)}}
+              for name in windows[prop_name].pop(0)]
+
+    flexmock(dd).should_receive('__apply_filters').replace_with(apply_filters)
+    flexmock(dd).should_receive('__fetch_and_validate_entity_set').\
+      replace_with(lambda index_dict, *args: sorted(index_dict.keys()))
+
+    results = dd.zigzag_merge_join(query, filter_info, [])
+    self.assertListEqual(results, [reference('b'), reference('d')])
+
+    # The second window starts after the bound of the first.
+    self.assertIn(('prop1', 'b', False), startrows)
+    self.assertIn(('prop2', 'd', False), startrows)
+
+  def test_apply_filters_include_start_key(self):
+    db_batch = flexmock()
+    db_batch.should_receive('valid_data_version').and_return(True)
+    dd = DatastoreDistributed(db_batch, None)
+    apply_filters = dd._DatastoreDistributed__apply_filters
+
+    scans = []
+    def range_query(table, columns, start, end, limit, **kwargs):
+      scans.append(kwargs['start_inclusive'])
+      return []
+
+    equal_and_inequality = [(datastore_pb.Query_Filter.EQUAL, '1'),
+                            (datastore_pb.Query_Filter.LESS_THAN, '5')]
+    two_inequalities = [(datastore_pb.Query_Filter.GREATER_THAN, '1'),
+                        (datastore_pb.Query_Filter.LESS_THAN, '5')]
+    descending = [('prop', datastore_pb.Query_Order.DESCENDING)]
+    # Each start row falls within the range that its filters select.
+    equal_start = get_index_key_from_params(['prefix', 'kind', 'prop', '1'])
+    ascending_start = get_index_key_from_params(['prefix', 'kind', 'prop', '3'])
+    descending_start = get_index_key_from_params(
+      ['prefix', 'kind', 'prop', helper_functions.reverse_lex('3')])
+    for filter_ops, order_info, startrow in [
+        (equal_and_inequality, None, equal_start),
+        (two_inequalities, None, ascending_start),
+        (two_inequalities, descending, descending_start)]:
+      for include_start_key in (True, False):
+        apply_filters(filter_ops, order_info, 'prop', 'kind', 'prefix', 10,
+                      0, startrow, range_query=range_query,
+                      include_start_key=include_start_key)
+
+    # The start row is only skipped when it is not meant to be included.
+    self.assertListEqual(scans, [True, False] * 3)
+
   def test_index_deletions(self):
     old_entity = self.get_new_entity_proto(*self.BASIC_ENTITY)
 
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+
+import sys
+import time
+import unittest
+
+from appscale.common.unpackaged import APPSCALE_PYTHON_APPSERVER
+from appscale.datastore.zkappscale import entity_lock
+from appscale.datastore.zkappscale.entity_lock import EntityLock
+from flexmock import flexmock
+from kazoo.exceptions import LockTimeout
+from kazoo.exceptions import NoNodeError
+from kazoo.exceptions import NotEmptyError
+
+sys.path.append(APPSCALE_PYTHON_APPSERVER)
+from google.appengine.datastore import entity_pb
+
+
+class FakeTransaction(object):
+  def __init__(self, client):
+    self.client = client
+    self.paths = []
+
+  def delete(self, path):
+    self.paths.append(path)
+
+  def commit(self):
+    """ Applies the deletes in order, keeping none of them if one fails. """
+    self.client.requests += 1
+    nodes = set(self.client.nodes)
+    for path in self.paths:
+      if path not in nodes:
+        return [NoNodeError()]
+      if any(node.startswith(path + '/') for node in nodes):
+        return [NotEmptyError()]
+      nodes.remove(path)
+
+    self.client.nodes = nodes
+    return [True for _ in self.paths]
+
+
+class FakeEvent(object):
+  """ An event that runs a callback instead of blocking. """
+  def __init__(self):
+    self.is_set = False
+    self.on_wait = lambda timeout: None
+
+  def clear(self):
+    self.is_set = False
+
+  def set(self):
+    self.is_set = True
+
+  def isSet(self):
+    return self.is_set
+
+  def wait(self, timeout):
+    self.on_wait(timeout)
+
+
+class FakeZKClient(object):
+  """ Keeps nodes in memory and counts requests. """
+  def __init__(self):
+    self.nodes = set()
+    self.requests = 0
+    self.sequence = 0
+    self.watches = {}
+    self.handler = flexmock(event_object=FakeEvent,
+                            sleep_func=lambda seconds: None,
+                            lock_object=self._lock_object)
+
+  @staticmethod
+  def _lock_object():
+    return flexmock(acquire=lambda blocking=True: True, release=lambda: None)
+
+  def create(self, path, value, ephemeral=False, sequence=False,
+             makepath=False):
+    self.requests += 1
+    parent = path.rsplit('/', 1)[0]
+    if parent not in self.nodes:
+      if not makepath:
+        raise NoNodeError()
+      self.nodes.add(parent)
+
+    if sequence:
+      path += '{:010d}'.format(self.sequence)
+      self.sequence += 1
+    self.nodes.add(path)
+    return path
+
+  def get_children(self, path):
+    self.requests += 1
+    if path not in self.nodes:
+      raise NoNodeError()
+    return [node[len(path) + 1:] for node in self.nodes
+            if node.startswith(path + '/')]
+
+  def delete(self, path):
+    self.requests += 1
+    if path not in self.nodes:
+      raise NoNodeError()
+    if any(node.startswith(path + '/') for node in self.nodes):
+      raise NotEmptyError()
+    self.nodes.remove(path)
+    for watch in self.watches.pop(path, []):
+      watch(None)
+
+  def exists(self, path, watch=None):
+    self.requests += 1
+    if path not in self.nodes:
+      return None
+    if watch is not None:
+      self.watches.setdefault(path, []).append(watch)
+    return True
+
+  def add_listener(self, listener):
+    pass
+
+  def remove_listener(self, listener):
+    pass
+
+  def ensure_path(self, path):
+    self.requests += 1
+    self.nodes.add(path)
+
+  def transaction(self):
+    return FakeTransaction(self)
+
+  def retry(self, func, *args):
+    return func(*args)
+
+
+def make_key(name):
+  key = entity_pb.Reference()
+  key.set_app('guestbook')
+  element = key.mutable_path().add_element()
+  element.set_type('Greeting')
+  element.set_name(name)
+  return key
+
+
+class TestEntityLock(unittest.TestCase):
+  def test_uncontended_lock(self):
+    client = FakeZKClient()
+    stats = entity_lock.lock_stats()
+    lock = EntityLock(client, [make_key('a')])
+    with lock:
+      self.assertEqual(client.requests, 2)
+
+    # The contender and the group node are removed in one request.
+    self.assertEqual(client.requests, 3)
+    self.assertEqual(client.nodes, set())
+
+    new_stats = entity_lock.lock_stats()
+    self.assertEqual(new_stats['fast_acquires'], stats['fast_acquires'] + 1)
+    self.assertEqual(new_stats['fast_releases'], stats['fast_releases'] + 1)
+
+  def test_release_with_other_contender(self):
+    client = FakeZKClient()
+    lock = EntityLock(client, [make_key('a')])
+    lock.acquire()
+
+    group_path = entity_lock.zk_group_path(make_key('a'))
+    client.nodes.add(group_path + '/other__lock__9999999999')
+
+    stats = entity_lock.lock_stats()
+    lock.release()
+    self.assertEqual(client.nodes, {group_path,
+                                    group_path + '/other__lock__9999999999'})
+    self.assertEqual(entity_lock.lock_stats()['contended_releases'],
+                     stats['contended_releases'] + 1)
+
+  def test_watch_all_predecessors(self):
+    client = FakeZKClient()
+    keys = [make_key('a'), make_key('b')]
+    group_paths = [entity_lock.zk_group_path(key) for key in keys]
+    others = [path + '/other__lock__0000000000' for path in group_paths]
+    client.nodes.update(group_paths + others)
+    client.sequence = 1
+
+    lock = EntityLock(client, keys, txid=5)
+    flexmock(lock).should_receive('_resolve_deadlocks')
+
+    def finish_others(timeout):
+      # Every predecessor is watched before waiting.
+      self.assertListEqual(sorted(client.watches), others)
+      self.assertLessEqual(timeout, entity_lock.LOCK_TIMEOUT)
+      for other in others:
+        client.delete(other)
+
+    lock.wake_event.on_wait = finish_others
+    self.assertTrue(lock.acquire())
+
+    hot_paths = [group['path'] for group in entity_lock.hot_groups(100)]
+    for path in group_paths:
+      self.assertIn(path, hot_paths)
+
+    lock.release()
+
+  def test_single_deadline(self):
+    client = FakeZKClient()
+    keys = [make_key('c'), make_key('d')]
+    group_paths = [entity_lock.zk_group_path(key) for key in keys]
+    others = [path + '/other__lock__0000000000' for path in group_paths]
+    client.nodes.update(group_paths + others)
+    client.sequence = 1
+
+    lock = EntityLock(client, keys, txid=5)
+    flexmock(lock).should_receive('_resolve_deadlocks')
+
+    waits = []
+    def remove_first(timeout):
+      waits.append(timeout)
+      if len(waits) == 1:
+        # Wake up the lock partway to the deadline.
+        flexmock(time).should_receive('time').and_return(
+          start + entity_lock.LOCK_TIMEOUT - 1)
+        client.delete(others[0])
+
+    start = time.time()
+    flexmock(time).should_receive('time').and_return(start)
+    lock.wake_event.on_wait = remove_first
+    self.assertRaises(LockTimeout, lock.acquire)
+
+    # The second wait only uses what is left of the overall deadline.
+    self.assertEqual(waits, [entity_lock.LOCK_TIMEOUT, 1])
+
+  def test_hot_groups(self):
+    flexmock(entity_lock, _group_waits={})
+    entity_lock._record_wait('/cold', .1)
+    entity_lock._record_wait('/hot', 2)
+    entity_lock._record_wait('/hot', 1)
+
+    groups = entity_lock.hot_groups(1)
+    self.assertListEqual(groups, [{'path': '/hot', 'waits': 2,
+                                   'total_wait': 3.0, 'max_wait': 2.0}])
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+
+import sys
+import unittest
+
+from appscale.common.unpackaged import APPSCALE_PYTHON_APPSERVER
+from appscale.datastore.cassandra_env import entity_stats
+from appscale.datastore.cassandra_env.entity_stats import EntityStatsBuffer
+from appscale.datastore.cassandra_env.entity_stats import StatCategories
+from cassandra import OperationTimedOut
+from flexmock import flexmock
+
+sys.path.append(APPSCALE_PYTHON_APPSERVER)
+from google.appengine.datastore import entity_pb
+
+
+def make_entity(kind, name, namespace='', app_id='guestbook'):
+  entity = entity_pb.EntityProto()
+  key = entity.mutable_key()
+  key.set_app(app_id)
+  key.set_name_space(namespace)
+  element = key.mutable_path().add_element()
+  element.set_type(kind)
+  element.set_name(name)
+  entity.mutable_entity_group().add_element().CopyFrom(element)
+  return entity
+
+
+class FakeBatch(object):
+  """ Keeps the parameters of each statement in a batch. """
+  def __init__(self, **kwargs):
+    self.parameters = []
+
+  def add(self, statement, parameters):
+    self.parameters.append(parameters)
+
+
+class FakeSession(object):
+  """ Records the counter updates that are executed. """
+  def __init__(self):
+    self.updates = []
+    self.rows = []
+    flexmock(entity_stats, BatchStatement=FakeBatch)
+
+  def prepare(self, statement):
+    return statement
+
+  def execute(self, statement, parameters=None):
+    if isinstance(statement, FakeBatch):
+      self.updates.extend(statement.parameters)
+      return None
+    return self.rows
+
+
+class TestEntityDeltas(unittest.TestCase):
+  def test_put_and_delete(self):
+    new = make_entity('Greeting', 'a', namespace='ns')
+    old = make_entity('Greeting', 'b', namespace='ns')
+    deltas = entity_stats.entity_deltas([
+      {'key': new.key(), 'old': None, 'new': new},
+      {'key': old.key(), 'old': old, 'new': None}
+    ])
+    self.assertEqual(deltas[('guestbook', StatCategories.KIND, 'Greeting')],
+                     [0, new.ByteSize() - old.ByteSize()])
+    self.assertEqual(deltas[('guestbook', StatCategories.NAMESPACE, 'ns')],
+                     [0, new.ByteSize() - old.ByteSize()])
+
+  def test_update(self):
+    old = make_entity('Greeting', 'a')
+    new = make_entity('Greeting', 'a')
+    new.add_property().set_name('content')
+    deltas = entity_stats.entity_deltas(
+      [{'key': new.key(), 'old': old, 'new': new}])
+    self.assertEqual(deltas[('guestbook', StatCategories.KIND, 'Greeting')],
+                     [0, new.ByteSize() - old.ByteSize()])
+
+  def test_ignored_kinds(self):
+    changes = []
+    for entity in [make_entity('__Stat_Kind__', 'a'),
+                   make_entity('_Protected_', 'a'),
+                   make_entity('Greeting', 'a', app_id='appscaledashboard')]:
+      changes.append({'key': entity.key(), 'old': None, 'new': entity})
+
+    self.assertDictEqual(entity_stats.entity_deltas(changes), {})
+
+
+class TestEntityStatsBuffer(unittest.TestCase):
+  def test_flush(self):
+    session = FakeSession()
+    stats_buffer = EntityStatsBuffer(session)
+    flexmock(stats_buffer._flusher).should_receive('start')
+
+    first = make_entity('Greeting', 'a')
+    second = make_entity('Greeting', 'b')
+    stats_buffer.record([{'key': first.key(), 'old': None, 'new': first}])
+    stats_buffer.record([{'key': second.key(), 'old': None, 'new': second}])
+    stats_buffer.flush()
+
+    size = first.ByteSize() + second.ByteSize()
+    kind_updates = [update for update in session.updates
+                    if update[4] == StatCategories.KIND]
+    self.assertEqual(len(session.updates), 2)
+    self.assertEqual(kind_updates[0][:3], (2, size, 'guestbook'))
+
+    # Nothing is written when there are no changes.
+    stats_buffer.flush()
+    self.assertEqual(len(session.updates), 2)
+
+  def test_failed_flush(self):
+    session = FakeSession()
+    stats_buffer = EntityStatsBuffer(session)
+    flexmock(stats_buffer._flusher).should_receive('start')
+    entity = make_entity('Greeting', 'a')
+    stats_buffer.record([{'key': entity.key(), 'old': None, 'new': entity}])
+
+    flexmock(entity_stats).should_receive('update_counters').\
+      and_raise(OperationTimedOut).once()
+    stats_buffer.flush()
+    self.assertEqual(
+      stats_buffer._deltas[('guestbook', StatCategories.KIND, 'Greeting')],
+      [1, entity.ByteSize()])
+
+
+class TestReconcile(unittest.TestCase):
+  def test_snapshot(self):
+    session = FakeSession()
+    session.rows = [
+      flexmock(project='guestbook', category=StatCategories.KIND,
+               name='Greeting', entities=3, bytes=30),
+      flexmock(project='guestbook', category=StatCategories.KIND,
+               name='Greeting', entities=2, bytes=20),
+      flexmock(project='guestbook', category=StatCategories.NAMESPACE,
+               name='', entities=5, bytes=50)
+    ]
+    self.assertItemsEqual(entity_stats.snapshot_entity_stats(session), [
+      ['guestbook', StatCategories.KIND, 'Greeting', 5, 50],
+      ['guestbook', StatCategories.NAMESPACE, '', 5, 50]
+    ])
+
+  def test_reconcile(self):
+    session = FakeSession()
+    snapshot = [
+      ['guestbook', StatCategories.KIND, 'Greeting', 5, 50],
+      ['guestbook', StatCategories.KIND, 'Deleted', 1, 5],
+      ['guestbook', StatCategories.NAMESPACE, '', 6, 55]
+    ]
+
+    kind_stats = {'guestbook': {'Greeting': {'number': 4, 'size': 40}}}
+    namespace_stats = {'guestbook': {'': {'number': 4, 'size': 40}}}
+    entity_stats.reconcile_entity_stats(session, kind_stats, namespace_stats,
+                                        [snapshot, snapshot])
+
+    corrections = {(update[4], update[5]): update[:2]
+                   for update in session.updates}
+    self.assertDictEqual(corrections, {
+      (StatCategories.KIND, 'Greeting'): (-1, -10),
+      (StatCategories.KIND, 'Deleted'): (-1, -5),
+      (StatCategories.NAMESPACE, ''): (-2, -15)
+    })
+    self.assertTrue(all(update[3] == 0 for update in session.updates))
+
+  def test_changed_counters_are_skipped(self):
+    session = FakeSession()
+    before = [['guestbook', StatCategories.KIND, 'Greeting', 5, 50]]
+    after = [['guestbook', StatCategories.KIND, 'Greeting', 6, 60],
+             ['guestbook', StatCategories.KIND, 'Added', 1, 5]]
+
+    # Only the kind that did not change while the scan ran is corrected.
+    kind_stats = {'guestbook': {'Greeting': {'number': 4, 'size': 40},
+                                'Other': {'number': 2, 'size': 20}}}
+    entity_stats.reconcile_entity_stats(session, kind_stats, {},
+                                        [before, after])
+    corrections = {(update[4], update[5]): update[:2]
+                   for update in session.updates}
+    self.assertDictEqual(corrections,
+                         {(StatCategories.KIND, 'Other'): (2, 20)})
+
+  def test_no_snapshots(self):
+    session = FakeSession()
+    kind_stats = {'guestbook': {'Greeting': {'number': 4, 'size': 40}}}
+    entity_stats.reconcile_entity_stats(session, kind_stats, {}, [])
+    self.assertListEqual(session.updates, [])
@@ -36,6 +36,9 @@ class FakeDatastore():
   def range_query(self, table, schema, start, end, batch_size, 
     start_inclusive=True, end_inclusive=True):
     return []
+  def range_query_iter(self, table, schema, start, end, limit=None,
+    start_inclusive=True, end_inclusive=True, page_size=None):
+    return iter([])
   def batch_delete(self, table, row_keys):
     raise dbconstants.AppScaleDBConnectionError("Bad connection")
 
@@ -107,9 +110,9 @@ class TestGroomer(unittest.TestCase):
     zookeeper = flexmock()
     dsg = groomer.DatastoreGroomer(zookeeper, "cassandra", "localhost:8888")
     dsg = flexmock(dsg)
-    dsg.should_receive("get_entity_batch").and_return([])
+    dsg.should_receive("iterate_entities").and_return(iter([]))
     dsg.should_receive("process_entity")
-    dsg.should_receive("update_statistics").and_raise(Exception)
+    dsg.should_receive("update_statistics").never()
     dsg.should_receive("remove_old_logs").and_return()
     dsg.should_receive("remove_old_tasks_entities").and_return()
     ds_factory = flexmock(appscale_datastore_batch.DatastoreFactory)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+import unittest
+
+from appscale.datastore import dbconstants
+from appscale.datastore.groomer_ranges import KeyRange
+from appscale.datastore.groomer_ranges import RangeCoordinator
+from appscale.datastore.groomer_ranges import split_key_range
+from flexmock import flexmock
+from kazoo.exceptions import NodeExistsError
+from kazoo.exceptions import NoNodeError
+
+
+class FakeZKClient(object):
+  """ Keeps node data in memory. """
+  def __init__(self):
+    self.nodes = {}
+
+  def create(self, path, value='', ephemeral=False, makepath=False):
+    if path in self.nodes:
+      raise NodeExistsError()
+    parent = path.rsplit('/', 1)[0]
+    if parent not in self.nodes and not makepath:
+      raise NoNodeError()
+    self.nodes[path] = value
+
+  def get_children(self, path):
+    if path not in self.nodes and not any(node.startswith(path + '/')
+                                          for node in self.nodes):
+      raise NoNodeError()
+    return [node[len(path) + 1:] for node in self.nodes
+            if node.startswith(path + '/') and
+            '/' not in node[len(path) + 1:]]
+
+  def get(self, path):
+    if path not in self.nodes:
+      raise NoNodeError()
+    return self.nodes[path], None
+
+  def set(self, path, value):
+    if path not in self.nodes:
+      raise NoNodeError()
+    self.nodes[path] = value
+
+  def delete(self, path, recursive=False):
+    if recursive:
+      for node in list(self.nodes):
+        if node == path or node.startswith(path + '/'):
+          del self.nodes[node]
+      return
+
+    if path not in self.nodes:
+      raise NoNodeError()
+    del self.nodes[path]
+
+
+class TestSplitKeyRange(unittest.TestCase):
+  def test_split(self):
+    key_ranges = split_key_range('', dbconstants.TERMINATING_STRING, 4)
+    self.assertEqual(len(key_ranges), 4)
+    self.assertEqual(key_ranges[0][0], '')
+    self.assertEqual(key_ranges[-1][1], dbconstants.TERMINATING_STRING)
+    for (_, end_key), (start_key, _) in zip(key_ranges, key_ranges[1:]):
+      self.assertEqual(end_key, start_key)
+
+    boundaries = [start_key for start_key, _ in key_ranges]
+    self.assertListEqual(boundaries, sorted(boundaries))
+
+  def test_narrow_range(self):
+    key_ranges = split_key_range('guestbook\x00a', 'guestbook\x00b', 4)
+    self.assertListEqual(key_ranges, [('guestbook\x00a', 'guestbook\x00b')])
+
+  def test_short_end_key(self):
+    for start_key, end_key in split_key_range('a', 'c', 3):
+      self.assertLess(start_key, end_key)
+
+
+class TestRangeCoordinator(unittest.TestCase):
+  def make_coordinator(self, zk_client):
+    return RangeCoordinator(flexmock(handle=zk_client), 'entities')
+
+  def test_claim_and_finish(self):
+    zk_client = FakeZKClient()
+    coordinator = self.make_coordinator(zk_client)
+    coordinator.create([('', 'm'), ('m', 'z')])
+
+    first = coordinator.claim()
+    second = coordinator.claim()
+    self.assertEqual((first.start_key, first.end_key), ('', 'm'))
+    self.assertEqual((second.start_key, second.end_key), ('m', 'z'))
+    self.assertIsNone(coordinator.claim())
+
+    # Released ranges resume from their last checkpoint.
+    first.last_key = 'f'
+    first.stats = {'kinds': {'guestbook': {'Greeting': {'size': 5,
+                                                         'number': 1}}}}
+    coordinator.save(first)
+    coordinator.release(first)
+    resumed = self.make_coordinator(zk_client).claim()
+    self.assertEqual(resumed.last_key, 'f')
+    self.assertEqual(resumed.stats, first.stats)
+
+    coordinator.finish(resumed)
+    coordinator.finish(second)
+    self.assertIsNone(coordinator.claim())
+    self.assertTrue(all(key_range.done for key_range in coordinator.ranges()))
+
+    coordinator.clear()
+    self.assertListEqual(coordinator.ranges(), [])
+
+  def test_binary_keys(self):
+    key_range = KeyRange('range-000000', '\x00\xff', '\xff' * 3,
+                         last_key='\x01')
+    decoded = KeyRange.decode(key_range.name, key_range.encode())
+    self.assertEqual(decoded.start_key, '\x00\xff')
+    self.assertEqual(decoded.end_key, '\xff' * 3)
+    self.assertEqual(decoded.last_key, '\x01')
+    self.assertFalse(decoded.done)
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+import unittest
+
+from appscale.datastore.index_cache import IndexCache
+from flexmock import flexmock
+from kazoo.exceptions import NoNodeError
+
+
+class FakeZKClient(object):
+  """ Records DataWatch callbacks so that tests can trigger them. """
+  def __init__(self):
+    self.watches = {}
+    self.nodes = {}
+
+  def DataWatch(self, path, func):
+    self.watches[path] = func
+    func(self.nodes.get(path), None)
+
+  def retry(self, func, *args, **kwargs):
+    return func(*args, **kwargs)
+
+  def set(self, path, value):
+    if path not in self.nodes:
+      raise NoNodeError()
+    self.nodes[path] = value
+    self.watches.get(path, lambda data, stat: None)(value, None)
+
+  def create(self, path, value, makepath=False):
+    self.nodes[path] = value
+    self.watches.get(path, lambda data, stat: None)(value, None)
+
+
+class TestIndexCache(unittest.TestCase):
+  def test_get(self):
+    db_batch = flexmock()
+    db_batch.should_receive('get_indices').with_args('guestbook').\
+      and_return(['index1']).once()
+    cache = IndexCache(db_batch, FakeZKClient())
+
+    self.assertListEqual(cache.get('guestbook'), ['index1'])
+    self.assertListEqual(cache.get('guestbook'), ['index1'])
+    self.assertEqual(cache.hits, 1)
+    self.assertEqual(cache.misses, 1)
+    self.assertEqual(cache.hit_rate(), 0.5)
+
+  def test_invalidate(self):
+    zk_client = FakeZKClient()
+    db_batch = flexmock()
+    db_batch.should_receive('get_indices').and_return(['index1']).\
+      and_return(['index1', 'index2'])
+    cache = IndexCache(db_batch, zk_client)
+    other_cache = IndexCache(db_batch, zk_client)
+
+    self.assertListEqual(cache.get('guestbook'), ['index1'])
+    other_cache.invalidate('guestbook')
+    self.assertListEqual(cache.get('guestbook'), ['index1', 'index2'])
+    self.assertEqual(cache.misses, 2)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+import sys
+import unittest
+
+from appscale.common.unpackaged import APPSCALE_PYTHON_APPSERVER
+from appscale.datastore.query_planner import QueryPlan
+from appscale.datastore.query_planner import QueryPlanner
+from appscale.datastore.query_planner import Strategy
+
+sys.path.append(APPSCALE_PYTHON_APPSERVER)
+from google.appengine.datastore import datastore_pb
+
+
+def make_query(kind='Greeting', ancestor=None):
+  query = datastore_pb.Query()
+  query.set_app('guestbook')
+  query.set_kind(kind)
+  if ancestor is not None:
+    element = query.mutable_ancestor().mutable_path().add_element()
+    element.set_type(ancestor)
+    element.set_id(1)
+  return query
+
+
+class TestQueryPlanner(unittest.TestCase):
+  EQUAL = datastore_pb.Query_Filter.EQUAL
+  GREATER_THAN = datastore_pb.Query_Filter.GREATER_THAN
+
+  def test_kind_query(self):
+    planner = QueryPlanner(lambda project: {'Greeting': 500})
+    plan = planner.plan(make_query(), {}, [], 20)
+    self.assertEqual(plan.candidates, [(Strategy.KIND, 20)])
+
+  def test_single_property_query(self):
+    planner = QueryPlanner(lambda project: {'Greeting': 500})
+    filter_info = {'author': [(self.EQUAL, 'bob')]}
+    plan = planner.plan(make_query(), filter_info, [], 1000)
+    self.assertEqual(plan.candidates, [(Strategy.SINGLE_PROPERTY, 50)])
+
+  def test_zigzag_query(self):
+    planner = QueryPlanner(lambda project: {'Greeting': 1000})
+    filter_info = {'author': [(self.EQUAL, 'bob')],
+                   'tag': [(self.EQUAL, 'news')]}
+    plan = planner.plan(make_query(), filter_info, [], 1000)
+    self.assertEqual(plan.candidates, [(Strategy.ZIGZAG_MERGE_JOIN, 200)])
+
+    # Inequality filters cannot be joined.
+    filter_info['tag'] = [(self.GREATER_THAN, 'a')]
+    plan = planner.plan(make_query(), filter_info, [], 1000)
+    self.assertEqual(plan.candidates, [])
+
+  def test_zigzag_key_filter(self):
+    planner = QueryPlanner(lambda project: {'Greeting': 1000})
+    filter_info = {'author': [(self.EQUAL, 'bob')],
+                   'tag': [(self.EQUAL, 'news')],
+                   '__key__': [(self.EQUAL, 'key')]}
+    plan = planner.plan(make_query(), filter_info, [], 1000)
+    self.assertEqual(plan.candidates, [(Strategy.ZIGZAG_MERGE_JOIN, 200)])
+
+  def test_fallbacks(self):
+    planner = QueryPlanner(lambda project: {'Greeting': 1000})
+    filter_info = {'author': [(self.EQUAL, 'bob')],
+                   'tag': [(self.GREATER_THAN, 'a')]}
+
+    # Strategies without estimates are still tried in their original order.
+    plan = planner.plan(make_query(), filter_info, [], 1000)
+    self.assertEqual(plan.attempts(), [(Strategy.SINGLE_PROPERTY, None),
+                                       (Strategy.KIND, None),
+                                       (Strategy.ZIGZAG_MERGE_JOIN, None)])
+
+    plan = planner.plan(make_query(), {'author': [(self.EQUAL, 'bob')]}, [],
+                        1000)
+    self.assertEqual(plan.attempts(), [(Strategy.SINGLE_PROPERTY, 100),
+                                       (Strategy.KIND, None),
+                                       (Strategy.ZIGZAG_MERGE_JOIN, None)])
+
+    # Queries with a composite index always use it.
+    query = make_query()
+    query.add_composite_index()
+    plan = planner.plan(query, filter_info, [], 1000)
+    self.assertEqual(plan.fallbacks, [])
+
+  def test_ancestor_query(self):
+    planner = QueryPlanner(lambda project: {})
+    filter_info = {'author': [(self.EQUAL, 'bob')]}
+    query = make_query(ancestor='Guestbook')
+    plan = planner.plan(query, filter_info, [], 1000)
+    self.assertEqual(plan.candidates[0], (Strategy.SINGLE_PROPERTY, 10))
+    self.assertIn((Strategy.ANCESTOR, 100), plan.candidates)
+
+    plan.strategy = Strategy.ANCESTOR
+    plan.actual_rows = 4
+    plan.results = 2
+    planner.observe(query, filter_info, plan)
+    self.assertEqual(planner.group_size(query), 4)
+
+  def test_ancestor_cheaper_than_join(self):
+    planner = QueryPlanner(lambda project: {'Greeting': 10})
+    for prop_name in ('author', 'tag'):
+      filter_info = {prop_name: [(self.EQUAL, 'value')]}
+      plan = planner.plan(make_query(), filter_info, [], 1000)
+      plan.strategy = Strategy.SINGLE_PROPERTY
+      plan.results = 8
+      planner.observe(make_query(), filter_info, plan)
+
+    # Joining unselective indexes reads more rows than the entity group has.
+    filter_info = {'author': [(self.EQUAL, 'value')],
+                   'tag': [(self.EQUAL, 'value')]}
+    plan = planner.plan(make_query(ancestor='Guestbook'), filter_info, [],
+                        1000)
+    self.assertEqual(plan.candidates, [(Strategy.ANCESTOR, 100),
+                                       (Strategy.ZIGZAG_MERGE_JOIN, 160)])
+
+  def test_observe_selectivity(self):
+    planner = QueryPlanner(lambda project: {'Greeting': 1000})
+    filter_info = {'author': [(self.EQUAL, 'bob')]}
+    plan = planner.plan(make_query(), filter_info, [], 1000)
+    plan.strategy = Strategy.SINGLE_PROPERTY
+    plan.actual_rows = 500
+    plan.results = 500
+    planner.observe(make_query(), filter_info, plan)
+
+    plan = planner.plan(make_query(), filter_info, [], 1000)
+    self.assertEqual(plan.candidates, [(Strategy.SINGLE_PROPERTY, 500)])
+
+    # Results cut short by the limit do not reveal the selectivity.
+    plan.strategy = Strategy.SINGLE_PROPERTY
+    plan.results = 1000
+    planner.observe(make_query(), filter_info, plan)
+    plan = planner.plan(make_query(), filter_info, [], 1000)
+    self.assertEqual(plan.candidates, [(Strategy.SINGLE_PROPERTY, 500)])
+
+  def test_kind_stats_unavailable(self):
+    def fail(project):
+      raise ValueError()
+
+    planner = QueryPlanner(fail)
+    self.assertIsNone(planner.kind_count(make_query()))
+
+  def test_to_dict(self):
+    plan = QueryPlan([(Strategy.KIND, 10), (Strategy.COMPOSITE, 5)], 10)
+    plan.strategy = Strategy.COMPOSITE
+    plan.estimated_rows = 5
+    plan.actual_rows = 7
+    plan.results = 5
+    self.assertEqual(plan.to_dict()['candidates'][0],
+                     {'strategy': Strategy.COMPOSITE, 'estimated_rows': 5})
+    self.assertEqual(plan.to_dict()['actual_rows'], 7)
@@ -4,11 +4,15 @@
 
 import argparse
 import glob
+import os
+import shutil
+import tempfile
 import time
 import unittest
 
 from appscale.datastore import appscale_datastore_batch
 from appscale.datastore import datastore_distributed
+from appscale.datastore.backup.chunked_file import ChunkedFileWriter
 from appscale.datastore.backup.datastore_restore import DatastoreRestore
 from appscale.datastore.zkappscale.zktransaction import ZKTransactionException
 from flexmock import flexmock
@@ -130,6 +134,24 @@ class TestRestore(unittest.TestCase):
 
     fake_restore.run_restore()
 
+  def test_read_entities(self):
+    zookeeper = flexmock()
+    fake_restore = flexmock(DatastoreRestore('app_id', 'backup/dir',
+      zookeeper, "cassandra"))
+    backup_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, backup_dir)
+
+    # Entities span several chunks.
+    entity = FAKE_ENCODED_ENTITY.values()[0]['entity']
+    backup_file = os.path.join(backup_dir, 'app_id-0-0.snapshot')
+    writer = ChunkedFileWriter(backup_file, chunk_size=len(entity) * 2)
+    for _ in range(5):
+      writer.write(entity)
+    writer.close()
+
+    self.assertListEqual(list(fake_restore.read_entities(backup_file)),
+                         [entity] * 5)
+
   def test_init_parser(self):
     pass
 
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+import unittest
+
+from appscale.datastore.zkappscale import txid_releaser
+from appscale.datastore.zkappscale.txid_releaser import TransactionIDReleaser
+from flexmock import flexmock
+from kazoo.exceptions import NoNodeError
+
+
+class FakeZKTransaction(object):
+  """ Records which transaction nodes were removed. """
+  def __init__(self):
+    self.removed = []
+    self.handle = flexmock(transaction=self.transaction)
+
+  def get_transaction_path(self, app_id, txid):
+    return '/appscale/apps/{}/txids/tx{:010d}'.format(app_id, txid)
+
+  def transaction(self):
+    paths = []
+    def commit():
+      self.removed.extend(paths)
+      return [True for _ in paths]
+    return flexmock(delete=paths.append, commit=commit)
+
+  def remove_tx_node(self, app_id, txid):
+    self.removed.append(self.get_transaction_path(app_id, txid))
+
+
+class TestTransactionIDReleaser(unittest.TestCase):
+  def test_release(self):
+    zk_transaction = FakeZKTransaction()
+    releaser = TransactionIDReleaser(zk_transaction)
+    # Keep the background thread from removing nodes during the test.
+    flexmock(releaser._releaser).should_receive('start')
+    txids = range(1, txid_releaser.RELEASE_BATCH_SIZE + 1)
+    for txid in txids[:-1]:
+      releaser.release('guestbook', txid)
+
+    # Finished IDs are removed together once there are enough of them.
+    self.assertListEqual(zk_transaction.removed, [])
+    releaser.release('guestbook', txids[-1])
+    self.assertEqual(len(zk_transaction.removed), len(txids))
+    releaser.stop()
+
+  def test_release_pending(self):
+    zk_transaction = FakeZKTransaction()
+    releaser = TransactionIDReleaser(zk_transaction)
+    flexmock(releaser._releaser).should_receive('start')
+    releaser.release('guestbook', 1)
+    releaser.release('other-project', 2)
+
+    # Stopping removes the nodes that are still waiting.
+    releaser.stop()
+    self.assertListEqual(sorted(zk_transaction.removed), [
+      zk_transaction.get_transaction_path('guestbook', 1),
+      zk_transaction.get_transaction_path('other-project', 2)])
+
+  def test_release_missing_node(self):
+    zk_transaction = FakeZKTransaction()
+    zk_transaction.handle = flexmock(transaction=lambda: flexmock(
+      delete=lambda path: None, commit=lambda: [NoNodeError()]))
+    releaser = TransactionIDReleaser(zk_transaction)
+    releaser.release('guestbook', 1)
+    releaser.release('guestbook', 2)
+    releaser.stop()
+    self.assertEqual(len(zk_transaction.removed), 2)
@@ -47,6 +47,27 @@ class TestZookeeperTransaction(unittest.TestCase):
       self.appid, 1))
 
 
+  def test_get_transaction_ids(self):
+    flexmock(zk.ZKTransaction)
+    zk.ZKTransaction.should_receive('get_txn_path_before_getting_id').\
+      with_args(self.appid).and_return('/rootpath/txids/tx')
+
+    zk_transaction = flexmock(create=lambda path, **kwargs: None,
+                              commit=lambda: ['/rootpath/txids/tx0000000005',
+                                              '/rootpath/txids/tx0000000006'])
+    fake_zookeeper = flexmock(name='fake_zoo',
+                              transaction=lambda: zk_transaction)
+    fake_zookeeper.should_receive('start')
+    fake_zookeeper.should_receive('retry').replace_with(
+      lambda func, *args: func(*args))
+
+    flexmock(kazoo.client)
+    kazoo.client.should_receive('KazooClient').and_return(fake_zookeeper)
+
+    transaction = zk.ZKTransaction(host="something", start_gc=False)
+    self.assertListEqual([5, 6],
+                         transaction.get_transaction_ids(self.appid, 2))
+
   def test_create_sequence_node(self):
     # mock out getTransactionRootPath
     flexmock(zk.ZKTransaction)
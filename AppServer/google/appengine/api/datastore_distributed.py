@@ -44,6 +44,7 @@ from google.appengine.datastore import datastore_pb
 from google.appengine.datastore import datastore_index
 from google.appengine.runtime import apiproxy_errors
 from google.net.proto import ProtocolBuffer
+from google.net.proto import connection_pool
 from google.appengine.datastore import entity_pb
 from google.appengine.ext.remote_api import remote_api_pb
 from google.appengine.datastore import old_datastore_stub_util
@@ -87,13 +88,15 @@ class InternalCursor():
   """ Keeps track of where we are in a query. Used for when queries are done
   in batches.
   """
-  def __init__(self, query, last_cursor, offset):
+  def __init__(self, query, last_cursor, offset, server_cursor=None):
     """ Constructor.
 
     Args:
       query: Starting query, a datastore_pb.Query.
       last_cursor: A compiled cursor, the last from a result list.
       offset: The number of entities we've seen so far.
+      server_cursor: A datastore_pb.Cursor kept by the datastore server, if
+        the server returned one.
     """
     # Count is the limit we want to hit so we know we're done.
     self.__count = _MAX_INT_32
@@ -107,6 +110,8 @@ class InternalCursor():
     # Lets us know how many results we've seen so far. When
     # this hits the count we know we're done.
     self.__offset = offset
+    # Lets the datastore server continue the query from its own state.
+    self.__server_cursor = server_cursor
 
   def get_query(self):
     return self.__query
@@ -129,6 +134,12 @@ class InternalCursor():
   def set_offset(self, offset):
     self.__offset = offset
 
+  def get_server_cursor(self):
+    return self.__server_cursor
+
+  def set_server_cursor(self, server_cursor):
+    self.__server_cursor = server_cursor
+
 class DatastoreDistributed(apiproxy_stub.APIProxyStub):
   """ A central server hooks up to a db and communicates via protocol 
       buffers.
@@ -354,7 +365,8 @@ class DatastoreDistributed(apiproxy_stub.APIProxyStub):
         1,
         self.__is_encrypted,
         KEY_LOCATION,
-        CERT_LOCATION)
+        CERT_LOCATION,
+        connection_pool=connection_pool.DEFAULT_POOL)
     except socket.error as socket_error:
       if socket_error.errno == errno.ETIMEDOUT:
         raise apiproxy_errors.ApplicationError(
@@ -477,8 +489,14 @@ class DatastoreDistributed(apiproxy_stub.APIProxyStub):
     if query_result.has_compiled_cursor():
       last_cursor = query_result.compiled_cursor()
 
+    server_cursor = None
+    if query_result.has_cursor():
+      server_cursor = datastore_pb.Cursor()
+      server_cursor.CopyFrom(query_result.cursor())
+
     if query_result.more_results():
-      new_cursor = InternalCursor(query, last_cursor, len(results))
+      new_cursor = InternalCursor(query, last_cursor, len(results),
+                                  server_cursor)
       cursor_id = self.__getCursorID()
       cursor = query_result.mutable_cursor()
       cursor.set_app(self.__app_id)
@@ -538,7 +556,33 @@ class DatastoreDistributed(apiproxy_stub.APIProxyStub):
 
     query.mutable_compiled_cursor().CopyFrom(last_cursor)
 
-    self._RemoteSend(query, query_result, "RunQuery", request_id)
+    # Let the datastore server continue from the position it kept. If it no
+    # longer has the cursor, send the whole query again.
+    server_cursor = internal_cursor.get_server_cursor()
+    internal_cursor.set_server_cursor(None)
+    sent_next = False
+    if server_cursor is not None:
+      server_request = datastore_pb.NextRequest()
+      server_request.mutable_cursor().CopyFrom(server_cursor)
+      server_request.set_count(count)
+      if next_request.has_compile():
+        server_request.set_compile(next_request.compile())
+      try:
+        self._RemoteSend(server_request, query_result, "Next", request_id)
+        sent_next = True
+      except apiproxy_errors.ApplicationError as error:
+        if error.application_error != datastore_pb.Error.BAD_REQUEST:
+          raise
+        query_result.Clear()
+
+    if not sent_next:
+      self._RemoteSend(query, query_result, "RunQuery", request_id)
+
+    if query_result.has_cursor():
+      server_cursor = datastore_pb.Cursor()
+      server_cursor.CopyFrom(query_result.cursor())
+      internal_cursor.set_server_cursor(server_cursor)
+
     results = query_result.result_list()
     for result in results:
       old_datastore_stub_util.PrepareSpecialPropertiesForLoad(result)
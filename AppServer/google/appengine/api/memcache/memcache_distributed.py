@@ -24,6 +24,7 @@ import logging
 import hashlib
 import memcache
 import os
+import socket
 import time
 
 from google.appengine.api import apiproxy_stub
@@ -40,6 +41,79 @@ from google.appengine.api.memcache import TYPE_INT
 from google.appengine.api.memcache import TYPE_LONG
 from google.appengine.api.memcache import MAX_KEY_SIZE
 
+class MemcachedServers(object):
+  """ Sends raw commands to the servers of a python-memcached client.
+
+  python-memcached does not have a public interface for sending several
+  commands to a server at once, so every use of its internals is kept here.
+  """
+
+  # The errors that mean a server's response could not be read.
+  ERRORS = (memcache._Error, memcache._ConnectionDeadError, socket.error,
+            ValueError)
+
+  def __init__(self, client):
+    """ Creates a new MemcachedServers.
+
+    Args:
+      client: A memcache.Client.
+    """
+    self._client = client
+
+  def server_for(self, key):
+    """ Finds the server that stores a key.
+
+    Args:
+      key: A string containing the internal memcache key.
+    Returns:
+      A server or None if no server is available.
+    """
+    server, _ = self._client._get_server(key)
+    return server
+
+  def send(self, server, data):
+    """ Sends commands to a server.
+
+    Args:
+      server: A server returned by server_for.
+      data: A string containing one or more encoded commands.
+    """
+    server.send_cmds(data)
+
+  def read_line(self, server):
+    """ Reads a response line from a server.
+
+    Args:
+      server: A server returned by server_for.
+    Returns:
+      A string containing the line without its terminator.
+    Raises:
+      One of ERRORS if the connection was closed.
+    """
+    return server.readline(raise_exception=True)
+
+  def read_value(self, server, flags, length):
+    """ Reads the data block that follows a VALUE line.
+
+    Args:
+      server: A server returned by server_for.
+      flags: An integer containing the flags from the VALUE line.
+      length: An integer specifying the length of the data block.
+    Returns:
+      The decoded value.
+    """
+    return self._client._recv_value(server, flags, length)
+
+  def mark_dead(self, server, error):
+    """ Stops using a server until the client retries it.
+
+    Args:
+      server: A server returned by server_for.
+      error: The exception that was raised while using the server.
+    """
+    server.mark_dead(str(error))
+
+
 class MemcacheService(apiproxy_stub.APIProxyStub):
   """Python only memcache service.
 
@@ -56,6 +130,24 @@ class MemcacheService(apiproxy_stub.APIProxyStub):
   # down).
   UPDATE_WINDOW = 60  # seconds
 
+  # The number of times to retry an increment that loses a CAS race.
+  INCREMENT_RETRIES = 5
+
+  # The memcached commands that implement each set policy.
+  _STORAGE_COMMANDS = {
+    MemcacheSetRequest.SET: 'set',
+    MemcacheSetRequest.ADD: 'add',
+    MemcacheSetRequest.REPLACE: 'replace'
+  }
+
+  # The set status for each memcached storage command response.
+  _SET_STATUSES = {
+    'STORED': MemcacheSetResponse.STORED,
+    'NOT_STORED': MemcacheSetResponse.NOT_STORED,
+    'EXISTS': MemcacheSetResponse.EXISTS,
+    'NOT_FOUND': MemcacheSetResponse.NOT_STORED
+  }
+
   def __init__(self, gettime=time.time, service_name='memcache'):
     """Initializer.
 
@@ -66,6 +158,7 @@ class MemcacheService(apiproxy_stub.APIProxyStub):
     super(MemcacheService, self).__init__(service_name)
     self._gettime = gettime
     self._memcache = None
+    self._servers = None
     self.setupMemcacheClient()
 
   def setupMemcacheClient(self):
@@ -80,6 +173,7 @@ class MemcacheService(apiproxy_stub.APIProxyStub):
     memcaches = [ip + ":" + self.MEMCACHE_PORT for ip in all_ips if ip != '']
     memcaches.sort()    
     self._memcache = memcache.Client(memcaches, debug=0)
+    self._servers = MemcachedServers(self._memcache)
 
   def _Dynamic_Get(self, request, response):
     """Implementation of gets for memcache.
@@ -88,14 +182,21 @@ class MemcacheService(apiproxy_stub.APIProxyStub):
       request: A MemcacheGetRequest protocol buffer.
       response: A MemcacheGetResponse protocol buffer.
     """
+    internal_keys = {}
     for key in set(request.key_list()):
-      internal_key = self._GetKey(request.name_space(), key)
-      value = self._memcache.get(internal_key)
-      if value is None:
+      internal_keys[self._GetKey(request.name_space(), key)] = key
+
+    if request.for_cas():
+      values = self._GetsMulti(internal_keys.keys())
+    else:
+      values = {internal_key: (value, None) for internal_key, value
+                in self._memcache.get_multi(internal_keys.keys()).iteritems()}
+
+    for internal_key, key in internal_keys.iteritems():
+      if internal_key not in values:
         continue
-      flags = 0
-      stored_flags, cas_id, stored_value = cPickle.loads(value)
-      flags |= stored_flags
+      value, cas_id = values[internal_key]
+      flags, stored_value = self._Unpack(value)
       item = response.add_item()
       item.set_key(key)
       item.set_value(stored_value)
@@ -110,43 +211,31 @@ class MemcacheService(apiproxy_stub.APIProxyStub):
       request: A MemcacheSetRequest.
       response: A MemcacheSetResponse.
     """
+    commands = []
     for item in request.item_list():
       key = self._GetKey(request.name_space(), item.key())
       set_policy = item.set_policy()
-      old_entry = self._memcache.get(key)
-      cas_id = 0
-      if old_entry:
-        _, cas_id, _ = cPickle.loads(old_entry)
-      set_status = MemcacheSetResponse.NOT_STORED
-
-      if ((set_policy == MemcacheSetRequest.SET) or
-        (set_policy == MemcacheSetRequest.ADD and old_entry is None) or
-        (set_policy == MemcacheSetRequest.REPLACE and
-        old_entry is not None)):
-
-        if (old_entry is None or set_policy == MemcacheSetRequest.SET):
-          set_status = MemcacheSetResponse.STORED
-
-      elif (set_policy == MemcacheSetRequest.CAS and item.for_cas() and
-        item.has_cas_id()):
-        if old_entry is None:
-          set_status = MemcacheSetResponse.NOT_STORED
-        elif cas_id != item.cas_id():
-          set_status = MemcacheSetResponse.EXISTS
-        else:
-          set_status = MemcacheSetResponse.STORED
-
-      if (set_status == MemcacheSetResponse.STORED
-        or set_policy == MemcacheSetRequest.REPLACE):
-
-        set_value = cPickle.dumps(
-          [item.flags(), cas_id + 1, item.value()])
-        if set_policy == MemcacheSetRequest.REPLACE:
-          self._memcache.replace(key, set_value)
-        else:
-          self._memcache.set(key, set_value, item.expiration_time())
-
-      response.add_set_status(set_status)
+      value = cPickle.dumps([item.flags(), item.value()])
+
+      if set_policy == MemcacheSetRequest.CAS:
+        # A CAS without a CAS ID cannot succeed.
+        if not (item.for_cas() and item.has_cas_id()):
+          commands.append((key, None))
+          continue
+        command = self._StorageCommand('cas', key, value,
+                                       item.expiration_time(), item.cas_id())
+      else:
+        command = self._StorageCommand(self._STORAGE_COMMANDS[set_policy],
+                                       key, value, item.expiration_time())
+      commands.append((key, command))
+
+    results = self._PipelineCommands(commands)
+    for (_, command), result in zip(commands, results):
+      if command is None:
+        response.add_set_status(MemcacheSetResponse.NOT_STORED)
+      else:
+        response.add_set_status(
+          self._SET_STATUSES.get(result, MemcacheSetResponse.ERROR))
 
   def _Dynamic_Delete(self, request, response):
     """Implementation of delete in memcache.
@@ -155,25 +244,26 @@ class MemcacheService(apiproxy_stub.APIProxyStub):
       request: A MemcacheDeleteRequest protocol buffer.
       response: A MemcacheDeleteResponse protocol buffer.
     """
+    commands = []
     for item in request.item_list():
       key = self._GetKey(request.name_space(), item.key())
-      entry = self._memcache.get(key)
-      delete_status = MemcacheDeleteResponse.DELETED
+      commands.append((key, 'delete {}\r\n'.format(key)))
 
-      if entry is None:
-        delete_status = MemcacheDeleteResponse.NOT_FOUND
+    for result in self._PipelineCommands(commands):
+      if result == 'DELETED':
+        response.add_delete_status(MemcacheDeleteResponse.DELETED)
       else:
-        self._memcache.delete(key)
-
-      response.add_delete_status(delete_status)
+        response.add_delete_status(MemcacheDeleteResponse.NOT_FOUND)
 
-  def _Increment(self, namespace, request):
+  def _Increment(self, namespace, request, current=None):
     """Internal function for incrementing from a MemcacheIncrementRequest.
 
     Args:
       namespace: A string containing the namespace for the request,
         if any. Pass an empty string if there is no namespace.
       request: A MemcacheIncrementRequest instance.
+      current: A tuple containing the value and CAS ID that were already
+        fetched for the key, if any.
 
     Returns:
       An integer or long if the offset was successful, None on error.
@@ -181,17 +271,44 @@ class MemcacheService(apiproxy_stub.APIProxyStub):
     if not request.delta():
       return None
 
-    cas_id = 0
-
     key = self._GetKey(namespace, request.key())
-    value = self._memcache.get(key)
-    if value is None:
-      if not request.has_initial_value():
+    for _ in range(self.INCREMENT_RETRIES):
+      if current is None:
+        current = self._GetsMulti([key]).get(key)
+
+      command, new_value = self._IncrementCommand(key, request, current)
+      if command is None:
         return None
-      flags, cas_id, stored_value = (
-        TYPE_INT, cas_id, str(request.initial_value()))
+
+      result = self._PipelineCommands([(key, command)])[0]
+      if result == 'STORED':
+        return new_value
+
+      # Another client modified the value first, so fetch it again.
+      current = None
+
+    logging.error('Unable to increment {}'.format(request.key()))
+    return None
+
+  def _IncrementCommand(self, key, request, current):
+    """Builds the command that applies an increment to a value.
+
+    Args:
+      key: A string containing the internal memcache key.
+      request: A MemcacheIncrementRequest instance.
+      current: A tuple containing the value and CAS ID, or None if the key
+        does not exist.
+
+    Returns:
+      A tuple containing the storage command and the new value. The command
+      is None if the increment cannot be applied.
+    """
+    if current is None:
+      if not request.has_initial_value():
+        return None, None
+      flags, stored_value = TYPE_INT, str(request.initial_value())
     else:
-      flags, cas_id, stored_value = cPickle.loads(value)
+      flags, stored_value = self._Unpack(current[0])
 
     if flags == TYPE_INT:
       new_value = int(stored_value)
@@ -203,14 +320,13 @@ class MemcacheService(apiproxy_stub.APIProxyStub):
     elif request.direction() == MemcacheIncrementRequest.DECREMENT:
       new_value = max(new_value-request.delta(), 0)
 
-    new_stored_value = cPickle.dumps([flags, cas_id + 1, str(new_value)])
-    try:
-      self._memcache.cas(key, new_stored_value)
-    except Exception, e:
-      logging.error(str(e))
-      return None
-
-    return new_value
+    new_stored_value = cPickle.dumps([flags, str(new_value)])
+    if current is None:
+      command = self._StorageCommand('add', key, new_stored_value, 0)
+    else:
+      command = self._StorageCommand('cas', key, new_stored_value, 0,
+                                     current[1])
+    return command, new_value
 
   def _Dynamic_Increment(self, request, response):
     """Implementation of increment for memcache.
@@ -229,13 +345,35 @@ class MemcacheService(apiproxy_stub.APIProxyStub):
   def _Dynamic_BatchIncrement(self, request, response):
     """Implementation of batch increment for memcache.
 
+    All of the values are fetched and updated with one pipelined request per
+    server. Items that lose a CAS race are retried individually.
+
     Args:
       request: A MemcacheBatchIncrementRequest protocol buffer.
       response: A MemcacheBatchIncrementResponse protocol buffer.
     """
     namespace = request.name_space()
-    for request_item in request.item_list():
-      new_value = self._Increment(namespace, request_item)
+    keys = [self._GetKey(namespace, request_item.key())
+            for request_item in request.item_list()]
+    values = self._GetsMulti(set(keys))
+
+    commands = []
+    new_values = []
+    for key, request_item in zip(keys, request.item_list()):
+      command = None
+      new_value = None
+      if request_item.delta():
+        command, new_value = self._IncrementCommand(
+          key, request_item, values.get(key))
+      commands.append((key, command))
+      new_values.append(new_value)
+
+    results = self._PipelineCommands(commands)
+    for index, request_item in enumerate(request.item_list()):
+      new_value = new_values[index]
+      if commands[index][1] is not None and results[index] != 'STORED':
+        new_value = self._Increment(namespace, request_item)
+
       item = response.add_item()
       if new_value is None:
         item.set_increment_status(MemcacheIncrementResponse.NOT_CHANGED)
@@ -314,3 +452,97 @@ class MemcacheService(apiproxy_stub.APIProxyStub):
     if len(server_key) > MAX_KEY_SIZE:
       server_key = hashlib.sha1(server_key).hexdigest() 
     return server_key
+
+  def _Unpack(self, value):
+    """Extracts the flags and value from a stored entry.
+
+    Args:
+      value: A string containing a pickled entry.
+    Returns:
+      A tuple containing the flags and the value.
+    """
+    entry = cPickle.loads(value)
+
+    # Entries written by earlier versions include a client-side CAS ID.
+    if len(entry) == 3:
+      return entry[0], entry[2]
+
+    return entry[0], entry[1]
+
+  def _StorageCommand(self, command, key, value, expiration, cas_id=None):
+    """Encodes a memcached storage command.
+
+    Args:
+      command: A string containing the command name (eg. 'set').
+      key: A string containing the internal memcache key.
+      value: A string containing the value to store.
+      expiration: An integer specifying when the value expires.
+      cas_id: An integer specifying the CAS unique for 'cas' commands.
+    Returns:
+      A string containing the command to send.
+    """
+    headers = [command, key, '0', str(int(expiration)), str(len(value))]
+    if cas_id is not None:
+      headers.append(str(cas_id))
+    return ' '.join(headers) + '\r\n' + value + '\r\n'
+
+  def _PipelineCommands(self, commands):
+    """Sends commands to memcached with one round trip per server.
+
+    Args:
+      commands: A list of tuples containing a key and a command. A command
+        that is None is skipped.
+    Returns:
+      A list containing the response line for each command, or None if the
+      command was skipped or the server could not be reached.
+    """
+    results = [None] * len(commands)
+    by_server = {}
+    for index, (key, command) in enumerate(commands):
+      if command is None:
+        continue
+      server = self._servers.server_for(key)
+      if server is None:
+        continue
+      by_server.setdefault(server, []).append((index, command))
+
+    for server, server_commands in by_server.iteritems():
+      try:
+        self._servers.send(
+          server, ''.join(command for _, command in server_commands))
+        for index, _ in server_commands:
+          results[index] = self._servers.read_line(server)
+      except MemcachedServers.ERRORS, error:
+        self._servers.mark_dead(server, error)
+
+    return results
+
+  def _GetsMulti(self, keys):
+    """Fetches values and their CAS uniques with one gets per server.
+
+    Args:
+      keys: An iterable of internal memcache keys.
+    Returns:
+      A dictionary mapping keys to tuples containing a value and a CAS ID.
+    """
+    by_server = {}
+    for key in keys:
+      server = self._servers.server_for(key)
+      if server is None:
+        continue
+      by_server.setdefault(server, []).append(key)
+
+    values = {}
+    for server, server_keys in by_server.iteritems():
+      try:
+        self._servers.send(server, 'gets ' + ' '.join(server_keys) + '\r\n')
+        line = self._servers.read_line(server)
+        while line != 'END':
+          _, key, flags, length, cas_id = line.split()
+          value = self._servers.read_value(server, int(flags), int(length))
+          values[key] = (value, long(cas_id))
+          line = self._servers.read_line(server)
+      except MemcachedServers.ERRORS, error:
+        self._servers.mark_dead(server, error)
+
+    return values
@@ -0,0 +1,238 @@
+import os
+import socket
+import sys
+import threading
+import unittest
+
+from flexmock import flexmock
+
+appserver = "{0}/../../../../..".format(os.path.dirname(__file__))
+sys.path.append(appserver)
+from google.appengine.api.memcache import memcache_distributed
+from google.appengine.api.memcache import memcache_service_pb
+
+
+class FakeMemcached(threading.Thread):
+  """ A minimal memcached server that implements the text protocol. """
+  def __init__(self):
+    threading.Thread.__init__(self)
+    self.daemon = True
+    self.items = {}
+    self.next_cas = 1
+    self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    self.listener.bind(('127.0.0.1', 0))
+    self.listener.listen(5)
+    self.port = self.listener.getsockname()[1]
+    self.connections = 0
+
+  def run(self):
+    while True:
+      conn, _ = self.listener.accept()
+      self.connections += 1
+      handler = threading.Thread(target=self.handle, args=(conn,))
+      handler.daemon = True
+      handler.start()
+
+  def handle(self, conn):
+    stream = conn.makefile('rb')
+    while True:
+      line = stream.readline()
+      if not line:
+        return
+      parts = line.split()
+      command = parts[0]
+      if command == 'quit':
+        conn.close()
+        return
+      if command in ('get', 'gets'):
+        for key in parts[1:]:
+          if key not in self.items:
+            continue
+          flags, value, cas = self.items[key]
+          header = 'VALUE {} {} {}'.format(key, flags, len(value))
+          if command == 'gets':
+            header += ' {}'.format(cas)
+          conn.sendall(header + '\r\n' + value + '\r\n')
+        conn.sendall('END\r\n')
+      elif command == 'delete':
+        if self.items.pop(parts[1], None) is None:
+          conn.sendall('NOT_FOUND\r\n')
+        else:
+          conn.sendall('DELETED\r\n')
+      else:
+        key, flags, length = parts[1], int(parts[2]), int(parts[4])
+        value = stream.read(length + 2)[:-2]
+        conn.sendall(self.store(command, key, flags, value, parts[5:]) + '\r\n')
+
+  def store(self, command, key, flags, value, cas):
+    exists = key in self.items
+    if command == 'add' and exists:
+      return 'NOT_STORED'
+    if command == 'replace' and not exists:
+      return 'NOT_STORED'
+    if command == 'cas':
+      if not exists:
+        return 'NOT_FOUND'
+      if self.items[key][2] != int(cas[0]):
+        return 'EXISTS'
+    self.items[key] = (flags, value, self.next_cas)
+    self.next_cas += 1
+    return 'STORED'
+
+
+class TestDistributedMemcache(unittest.TestCase):
+  def setUp(self):
+    os.environ['APPNAME'] = 'guestbook'
+    self.server = FakeMemcached()
+    self.server.start()
+    flexmock(memcache_distributed.MemcacheService).\
+      should_receive('setupMemcacheClient').and_return()
+    self.stub = memcache_distributed.MemcacheService()
+    self.stub._memcache = memcache_distributed.memcache.Client(
+      ['127.0.0.1:{}'.format(self.server.port)])
+    self.stub._servers = memcache_distributed.MemcachedServers(
+      self.stub._memcache)
+
+  def set(self, policy, items, cas_ids=None):
+    request = memcache_service_pb.MemcacheSetRequest()
+    for key, value in items:
+      item = request.add_item()
+      item.set_key(key)
+      item.set_value(value)
+      item.set_flags(0)
+      item.set_set_policy(policy)
+      if cas_ids is not None:
+        item.set_for_cas(True)
+        item.set_cas_id(cas_ids[key])
+    response = memcache_service_pb.MemcacheSetResponse()
+    self.stub._Dynamic_Set(request, response)
+    return response.set_status_list()
+
+  def get(self, keys, for_cas=False):
+    request = memcache_service_pb.MemcacheGetRequest()
+    for key in keys:
+      request.add_key(key)
+    request.set_for_cas(for_cas)
+    response = memcache_service_pb.MemcacheGetResponse()
+    self.stub._Dynamic_Get(request, response)
+    return {item.key(): item for item in response.item_list()}
+
+  def test_set_policies(self):
+    Request = memcache_service_pb.MemcacheSetRequest
+    Response = memcache_service_pb.MemcacheSetResponse
+    self.assertEqual(self.set(Request.SET, [('a', '1'), ('b', '2')]),
+                     [Response.STORED, Response.STORED])
+    self.assertEqual(self.set(Request.ADD, [('a', '3'), ('c', '4')]),
+                     [Response.NOT_STORED, Response.STORED])
+    self.assertEqual(self.set(Request.REPLACE, [('b', '5'), ('d', '6')]),
+                     [Response.STORED, Response.NOT_STORED])
+
+    items = self.get(['a', 'b', 'c', 'd'])
+    self.assertEqual({key: item.value() for key, item in items.items()},
+                     {'a': '1', 'b': '5', 'c': '4'})
+
+  def test_cas(self):
+    Request = memcache_service_pb.MemcacheSetRequest
+    Response = memcache_service_pb.MemcacheSetResponse
+    self.set(Request.SET, [('a', '1'), ('b', '2')])
+    items = self.get(['a', 'b'], for_cas=True)
+    cas_ids = {key: item.cas_id() for key, item in items.items()}
+
+    # Another client modifies 'b' after it was read.
+    self.set(Request.SET, [('b', '3')])
+    self.assertEqual(
+      self.set(Request.CAS, [('a', '4'), ('b', '5')], cas_ids),
+      [Response.STORED, Response.EXISTS])
+    self.assertEqual(self.set(Request.CAS, [('a', '6')]),
+                     [Response.NOT_STORED])
+
+    items = self.get(['a', 'b'])
+    self.assertEqual(items['a'].value(), '4')
+    self.assertEqual(items['b'].value(), '3')
+
+  def test_delete(self):
+    self.set(memcache_service_pb.MemcacheSetRequest.SET, [('a', '1')])
+    request = memcache_service_pb.MemcacheDeleteRequest()
+    request.add_item().set_key('a')
+    request.add_item().set_key('b')
+    response = memcache_service_pb.MemcacheDeleteResponse()
+    self.stub._Dynamic_Delete(request, response)
+
+    Response = memcache_service_pb.MemcacheDeleteResponse
+    self.assertEqual(response.delete_status_list(),
+                     [Response.DELETED, Response.NOT_FOUND])
+    self.assertEqual(self.get(['a']), {})
+
+  def test_legacy_entries(self):
+    key = self.stub._GetKey('', 'a')
+    self.stub._memcache.set(key, memcache_distributed.cPickle.dumps(
+      [0, 3, 'old']))
+    self.assertEqual(self.get(['a'])['a'].value(), 'old')
+
+  def test_batch_increment(self):
+    key = self.stub._GetKey('', 'a')
+    self.stub._memcache.set(key, memcache_distributed.cPickle.dumps(
+      [memcache_distributed.TYPE_INT, '5']))
+
+    request = memcache_service_pb.MemcacheBatchIncrementRequest()
+    item = request.add_item()
+    item.set_key('a')
+    item.set_delta(2)
+    item = request.add_item()
+    item.set_key('b')
+    item.set_delta(1)
+    item.set_initial_value(10)
+    item = request.add_item()
+    item.set_key('c')
+    item.set_delta(1)
+    response = memcache_service_pb.MemcacheBatchIncrementResponse()
+    self.stub._Dynamic_BatchIncrement(request, response)
+
+    Response = memcache_service_pb.MemcacheIncrementResponse
+    self.assertEqual(
+      [item.increment_status() for item in response.item_list()],
+      [Response.OK, Response.OK, Response.NOT_CHANGED])
+    self.assertEqual(response.item(0).new_value(), 7)
+    self.assertEqual(response.item(1).new_value(), 11)
+
+    # All of the items share one connection.
+    self.assertEqual(self.server.connections, 1)
+
+  def test_closed_connection(self):
+    key = self.stub._GetKey('', 'a')
+    self.assertEqual(self.stub._PipelineCommands([(key, 'quit\r\n')]), [None])
+    self.assertEqual(self.stub._GetsMulti([key]), {})
+
+
+class TestMemcachedServers(unittest.TestCase):
+  def setUp(self):
+    self.server = FakeMemcached()
+    self.server.start()
+    self.client = memcache_distributed.memcache.Client(
+      ['127.0.0.1:{}'.format(self.server.port)])
+    self.servers = memcache_distributed.MemcachedServers(self.client)
+
+  def test_commands(self):
+    self.client.set('a', 'value')
+    server = self.servers.server_for('a')
+    self.servers.send(server, 'set b 0 0 1\r\n2\r\ngets a\r\n')
+    self.assertEqual(self.servers.read_line(server), 'STORED')
+    _, key, flags, length, _ = self.servers.read_line(server).split()
+    self.assertEqual(key, 'a')
+    self.assertEqual(
+      self.servers.read_value(server, int(flags), int(length)), 'value')
+    self.assertEqual(self.servers.read_line(server), 'END')
+    self.assertEqual(self.client.get('b'), '2')
+
+  def test_closed_connection(self):
+    server = self.servers.server_for('a')
+    self.servers.send(server, 'quit\r\n')
+    with self.assertRaises(memcache_distributed.MemcachedServers.ERRORS):
+      self.servers.read_line(server)
+
+    self.servers.mark_dead(server, socket.error('Connection closed'))
+    self.assertIsNone(self.servers.server_for('a'))
+
+
+if __name__ == "__main__":
+  unittest.main()
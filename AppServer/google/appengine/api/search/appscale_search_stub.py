@@ -24,6 +24,7 @@ from google.appengine.api.search import search_service_pb
 from google.appengine.api.search import search_util
 from google.appengine.ext.remote_api import remote_api_pb                       
 from google.appengine.runtime import apiproxy_errors
+from google.net.proto import connection_pool
 
 # Where the SSL certificate is placed for encrypted communication.
 CERT_LOCATION = "/etc/appscale/certs/mycert.pem"
@@ -163,7 +164,8 @@ class SearchServiceStub(apiproxy_stub.APIProxyStub):
       1,
       False,
       KEY_LOCATION,
-      CERT_LOCATION)
+      CERT_LOCATION,
+      connection_pool=connection_pool.DEFAULT_POOL)
 
     if not api_response or not api_response.has_response():
       raise search.InternalError(
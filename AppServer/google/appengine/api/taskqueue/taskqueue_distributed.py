@@ -33,6 +33,7 @@ from google.appengine.api import apiproxy_stub
 from google.appengine.api import apiproxy_stub_map
 from google.appengine.runtime import apiproxy_errors
 from google.appengine.ext.remote_api import remote_api_pb
+from google.net.proto import connection_pool
 
 DEFAULT_RATE = '5.00/s'
 
@@ -459,7 +460,8 @@ class TaskQueueServiceStub(apiproxy_stub.APIProxyStub):
         1,
         False,
         KEY_LOCATION,
-        CERT_LOCATION)
+        CERT_LOCATION,
+        connection_pool=connection_pool.DEFAULT_POOL)
 
       if not api_response or not api_response.has_response():
         if index >= len(tq_locations) - 1:
@@ -23,6 +23,8 @@ import httplib
 import re
 import struct
 
+from google.net.proto import connection_pool as connection_pool_module
+
 __all__ = ['ProtocolMessage', 'Encoder', 'Decoder',
            'ExtendableProtocolMessage',
            'ProtocolBufferDecodeError',
@@ -107,7 +109,15 @@ class ProtocolMessage:
     self.__init__(contents=contents_)
 
   def sendCommand(self, server, url, response, follow_redirects=1,
-                  secure=0, keyfile=None, certfile=None):
+                  secure=0, keyfile=None, certfile=None,
+                  connection_pool=None):
+    # AppScale: When a connection pool is given, keep-alive connections are
+    # reused across calls instead of opening a new one for every request.
+    if connection_pool is not None:
+      return self._sendPooledCommand(server, url, response, follow_redirects,
+                                     secure, keyfile, certfile,
+                                     connection_pool)
+
     data = self.Encode()
     if secure:
       if keyfile and certfile:
@@ -117,6 +127,26 @@ class ProtocolMessage:
         conn = httplib.HTTPSConnection(server)
     else:
       conn = httplib.HTTPConnection(server)
+    self._putCommand(conn, url, data)
+    resp = conn.getresponse()
+    if follow_redirects > 0 and resp.status == 302:
+      m = URL_RE.match(resp.getheader('Location'))
+      if m:
+        protocol, server, url = m.groups()
+        return self.sendCommand(server, url, response,
+                                follow_redirects=follow_redirects - 1,
+                                secure=(protocol == 'https'),
+                                keyfile=keyfile,
+                                certfile=certfile)
+    if resp.status != 200:
+      conn.close()
+      raise ProtocolBufferReturnError(resp.status)
+    if response is not None:
+      response.ParseFromString(resp.read())
+    conn.close()
+    return response
+
+  def _putCommand(self, conn, url, data):
     conn.putrequest("POST", '/')
     conn.putheader("Content-Length", "%d" %len(data))
     # AppScale:
@@ -128,7 +158,38 @@ class ProtocolMessage:
 
     conn.endheaders()
     conn.send(data)
-    resp = conn.getresponse()
+
+  def _sendPooledCommand(self, server, url, response, follow_redirects,
+                         secure, keyfile, certfile, connection_pool):
+    # AppScale: Sends a command over a connection from connection_pool. If a
+    # reused connection turns out to have been closed by the server before it
+    # responded, the request is retried once over a new connection. Timeouts
+    # are not retried since the server might have handled the request.
+    data = self.Encode()
+    key, conn, reused = connection_pool.acquire(server, secure, keyfile,
+                                                certfile)
+    try:
+      try:
+        self._putCommand(conn, url, data)
+        resp = conn.getresponse()
+      except connection_pool_module.STALE_CONNECTION_ERRORS as error:
+        if (not reused or
+            not connection_pool_module.is_stale_connection_error(error)):
+          raise
+        conn = connection_pool.reconnect(key, conn)
+        self._putCommand(conn, url, data)
+        resp = conn.getresponse()
+
+      body = resp.read()
+    except:
+      conn.close()
+      raise
+
+    if resp.will_close:
+      conn.close()
+    else:
+      connection_pool.release(key, conn)
+
     if follow_redirects > 0 and resp.status == 302:
       m = URL_RE.match(resp.getheader('Location'))
       if m:
@@ -137,13 +198,12 @@ class ProtocolMessage:
                                 follow_redirects=follow_redirects - 1,
                                 secure=(protocol == 'https'),
                                 keyfile=keyfile,
-                                certfile=certfile)
+                                certfile=certfile,
+                                connection_pool=connection_pool)
     if resp.status != 200:
-      conn.close()
       raise ProtocolBufferReturnError(resp.status)
     if response is not None:
-      response.ParseFromString(resp.read())
-    conn.close()
+      response.ParseFromString(body)
     return response
 
   def sendSecureCommand(self, server, keyfile, certfile, url, response,
@@ -0,0 +1,203 @@
+""" A per-process pool of persistent HTTP connections.
+
+AppScale: The API stubs that talk to the datastore, taskqueue and search
+servers send one protocol buffer RPC per call. Reusing keep-alive
+connections avoids paying for a TCP (and possibly TLS) handshake on every
+call.
+"""
+
+import collections
+import errno
+import httplib
+import socket
+import threading
+import time
+
+
+# The maximum number of idle connections kept for each server.
+DEFAULT_MAX_IDLE = 16
+
+# The number of seconds an idle connection can stay in the pool.
+DEFAULT_IDLE_TIMEOUT = 60
+
+# Exceptions which can indicate that a reused connection was closed by the
+# peer. is_stale_connection_error decides whether a request can be resent.
+STALE_CONNECTION_ERRORS = (httplib.BadStatusLine, httplib.CannotSendRequest,
+                           socket.error)
+
+# Socket errors which indicate that the peer closed the connection.
+STALE_SOCKET_ERRNOS = (errno.ECONNRESET, errno.EPIPE)
+
+
+def is_stale_connection_error(error):
+  """ Checks if an error shows that the peer closed a connection before it
+  sent any part of a response.
+
+  Timeouts are never considered stale since the peer might still be handling
+  the request, and resending it could repeat a write.
+
+  Args:
+    error: An exception raised while sending a request or reading its
+      response.
+  Returns:
+    A boolean indicating whether or not the request can be resent.
+  """
+  if isinstance(error, socket.timeout):
+    return False
+
+  if isinstance(error, socket.error):
+    return error.errno in STALE_SOCKET_ERRNOS
+
+  if isinstance(error, httplib.BadStatusLine):
+    # An empty status line means that the connection closed before any
+    # response bytes arrived. Depending on the Python version, httplib
+    # reports it as an empty line or with a message.
+    return (error.line in ('', "''") or
+            error.line.startswith('No status line received'))
+
+  return isinstance(error, httplib.CannotSendRequest)
+
+
+class ConnectionPool(object):
+  """ A thread-safe pool of keep-alive HTTP connections keyed by server. """
+
+  def __init__(self, max_idle=DEFAULT_MAX_IDLE,
+               idle_timeout=DEFAULT_IDLE_TIMEOUT):
+    """ Creates a new ConnectionPool.
+
+    Args:
+      max_idle: An integer specifying how many idle connections to keep for
+        each server.
+      idle_timeout: A number specifying how many seconds an idle connection
+        can be kept before it is closed.
+    """
+    self.max_idle = max_idle
+    self.idle_timeout = idle_timeout
+    self._idle = collections.defaultdict(collections.deque)
+    self._lock = threading.Lock()
+    self._stats = {'hits': 0, 'misses': 0, 'reconnects': 0, 'evictions': 0}
+
+  def acquire(self, server, secure=False, keyfile=None, certfile=None):
+    """ Fetches an idle connection or creates a new one.
+
+    Args:
+      server: A string containing the host and port of the server.
+      secure: A boolean indicating whether or not to use HTTPS.
+      keyfile: A string specifying the location of the client key.
+      certfile: A string specifying the location of the client certificate.
+    Returns:
+      A tuple containing a pool key, an HTTP connection, and a boolean
+      indicating whether or not the connection was reused.
+    """
+    key = (server, bool(secure), keyfile, certfile)
+    now = time.time()
+    expired = []
+    connection = None
+    with self._lock:
+      idle = self._idle[key]
+      while idle:
+        candidate, released = idle.pop()
+        if now - released > self.idle_timeout:
+          expired.append(candidate)
+          continue
+        connection = candidate
+        break
+
+      # Anything left behind the expired connections is even older.
+      while idle and now - idle[0][1] > self.idle_timeout:
+        expired.append(idle.popleft()[0])
+
+      self._stats['evictions'] += len(expired)
+      if connection is None:
+        self._stats['misses'] += 1
+      else:
+        self._stats['hits'] += 1
+
+    for stale in expired:
+      stale.close()
+
+    if connection is not None:
+      return key, connection, True
+
+    return key, self._connect(server, secure, keyfile, certfile), False
+
+  def release(self, key, connection):
+    """ Returns a connection to the pool.
+
+    Args:
+      key: The pool key returned by acquire.
+      connection: An HTTP connection whose response has been read.
+    """
+    with self._lock:
+      idle = self._idle[key]
+      if len(idle) < self.max_idle:
+        idle.append((connection, time.time()))
+        return
+      self._stats['evictions'] += 1
+
+    connection.close()
+
+  def reconnect(self, key, connection):
+    """ Replaces a stale connection with a new one.
+
+    Args:
+      key: The pool key returned by acquire.
+      connection: The HTTP connection that failed.
+    Returns:
+      A new HTTP connection to the same server.
+    """
+    connection.close()
+    with self._lock:
+      self._stats['reconnects'] += 1
+    server, secure, keyfile, certfile = key
+    return self._connect(server, secure, keyfile, certfile)
+
+  def clear(self):
+    """ Closes all idle connections. """
+    with self._lock:
+      connections = [connection for idle in self._idle.values()
+                     for connection, _ in idle]
+      self._idle.clear()
+
+    for connection in connections:
+      connection.close()
+
+  def stats(self):
+    """ Reports how effective the pool has been.
+
+    Returns:
+      A dictionary containing hit, miss, reconnect, and eviction counts as
+      well as the number of idle connections.
+    """
+    with self._lock:
+      stats = dict(self._stats)
+      stats['idle'] = sum(len(idle) for idle in self._idle.values())
+
+    requests = stats['hits'] + stats['misses']
+    stats['hit_rate'] = float(stats['hits']) / requests if requests else 0.0
+    return stats
+
+  @staticmethod
+  def _connect(server, secure, keyfile, certfile):
+    """ Opens a new HTTP connection.
+
+    Args:
+      server: A string containing the host and port of the server.
+      secure: A boolean indicating whether or not to use HTTPS.
+      keyfile: A string specifying the location of the client key.
+      certfile: A string specifying the location of the client certificate.
+    Returns:
+      An HTTPConnection or HTTPSConnection.
+    """
+    if not secure:
+      return httplib.HTTPConnection(server)
+
+    if keyfile and certfile:
+      return httplib.HTTPSConnection(server, key_file=keyfile,
+                                     cert_file=certfile)
+
+    return httplib.HTTPSConnection(server)
+
+
+# The pool shared by the API stubs in this process.
+DEFAULT_POOL = ConnectionPool()
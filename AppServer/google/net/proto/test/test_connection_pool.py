@@ -0,0 +1,134 @@
+import errno
+import httplib
+import os
+import socket
+import sys
+import unittest
+from flexmock import flexmock
+
+proto = "{0}/../../../..".format(os.path.dirname(__file__))
+sys.path.append(proto)
+from google.appengine.ext.remote_api import remote_api_pb
+from google.net.proto import connection_pool
+
+
+class FakeResponse():
+  def __init__(self, body='', status=200, will_close=False):
+    self.body = body
+    self.status = status
+    self.will_close = will_close
+  def read(self):
+    return self.body
+  def getheader(self, header):
+    return None
+
+
+class FakeConnection():
+  def __init__(self, responses):
+    self.responses = responses
+    self.closed = False
+  def putrequest(self, method, url):
+    return
+  def putheader(self, header, value):
+    return
+  def endheaders(self):
+    return
+  def send(self, data):
+    return
+  def getresponse(self):
+    response = self.responses.pop(0)
+    if isinstance(response, Exception):
+      raise response
+    return response
+  def close(self):
+    self.closed = True
+
+
+class TestConnectionPool(unittest.TestCase):
+  def test_reuse(self):
+    pool = connection_pool.ConnectionPool()
+    key, conn, reused = pool.acquire('localhost:8888')
+    self.assertFalse(reused)
+    pool.release(key, conn)
+
+    key, same_conn, reused = pool.acquire('localhost:8888')
+    self.assertTrue(reused)
+    self.assertIs(same_conn, conn)
+
+    stats = pool.stats()
+    self.assertEqual(stats['hits'], 1)
+    self.assertEqual(stats['misses'], 1)
+    self.assertEqual(stats['hit_rate'], 0.5)
+
+  def test_max_idle(self):
+    pool = connection_pool.ConnectionPool(max_idle=1)
+    first = FakeConnection([])
+    second = FakeConnection([])
+    key = ('localhost:8888', False, None, None)
+    pool.release(key, first)
+    pool.release(key, second)
+    self.assertTrue(second.closed)
+    self.assertEqual(pool.stats()['idle'], 1)
+
+  def test_idle_timeout(self):
+    pool = connection_pool.ConnectionPool(idle_timeout=-1)
+    stale = FakeConnection([])
+    pool.release(('localhost:8888', False, None, None), stale)
+
+    _, conn, reused = pool.acquire('localhost:8888')
+    self.assertFalse(reused)
+    self.assertTrue(stale.closed)
+    self.assertEqual(pool.stats()['evictions'], 1)
+
+  def test_stale_connection_retry(self):
+    pool = connection_pool.ConnectionPool()
+    key = ('localhost:8888', False, None, None)
+    stale = FakeConnection([httplib.BadStatusLine('')])
+    pool.release(key, stale)
+
+    expected = remote_api_pb.Response()
+    expected.set_response('value')
+    fresh = FakeConnection([FakeResponse(expected.Encode())])
+    flexmock(pool).should_receive('_connect').and_return(fresh)
+
+    request = remote_api_pb.Request()
+    request.set_service_name('datastore_v3')
+    request.set_method('Get')
+    request.set_request('')
+    response = request.sendCommand('localhost:8888', '',
+      remote_api_pb.Response(), connection_pool=pool)
+    self.assertEqual(response.response(), 'value')
+    self.assertTrue(stale.closed)
+    self.assertFalse(fresh.closed)
+    self.assertEqual(pool.stats()['reconnects'], 1)
+    self.assertEqual(pool.stats()['idle'], 1)
+
+  def test_timeout_not_retried(self):
+    pool = connection_pool.ConnectionPool()
+    key = ('localhost:8888', False, None, None)
+    reused = FakeConnection([socket.timeout('timed out')])
+    pool.release(key, reused)
+    flexmock(pool).should_receive('_connect').never()
+
+    request = remote_api_pb.Request()
+    request.set_service_name('datastore_v3')
+    request.set_method('Put')
+    request.set_request('')
+    self.assertRaises(socket.timeout, request.sendCommand, 'localhost:8888',
+                      '', remote_api_pb.Response(), connection_pool=pool)
+    self.assertTrue(reused.closed)
+
+  def test_is_stale_connection_error(self):
+    is_stale = connection_pool.is_stale_connection_error
+    self.assertTrue(is_stale(httplib.BadStatusLine('')))
+    self.assertTrue(is_stale(socket.error(errno.ECONNRESET, 'reset')))
+    self.assertTrue(is_stale(socket.error(errno.EPIPE, 'broken pipe')))
+    self.assertTrue(is_stale(httplib.CannotSendRequest()))
+    self.assertFalse(is_stale(socket.timeout('timed out')))
+    self.assertFalse(is_stale(socket.error(errno.ETIMEDOUT, 'timed out')))
+    self.assertFalse(is_stale(httplib.BadStatusLine('garbage')))
+    self.assertFalse(is_stale(httplib.ResponseNotReady()))
+
+
+if __name__ == "__main__":
+  unittest.main()
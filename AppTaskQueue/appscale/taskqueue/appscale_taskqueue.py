@@ -17,6 +17,7 @@ from appscale.common.constants import ZK_PERSISTENT_RECONNECTS
 from appscale.common.unpackaged import APPSCALE_PYTHON_APPSERVER
 from appscale.datastore.cassandra_env.cassandra_interface import DatastoreProxy
 from . import distributed_tq
+from .rest_api import RESTBatchTasks
 from .rest_api import RESTLease
 from .rest_api import RESTQueue
 from .rest_api import RESTTask
@@ -201,8 +202,9 @@ class MainHandler(tornado.web.RequestHandler):
 def graceful_shutdown(*_):
   """ Stop accepting new requests and exit on the next I/O loop iteration.
 
-  This is safe as long as the server is synchronous. It will stop in the middle
-  of requests as soon as the server has asynchronous handlers.
+  This is safe as long as the server is synchronous. The only asynchronous
+  handler is a lease request that is waiting for tasks, and it has not leased
+  anything while it waits.
   """
   logger.info('Stopping server')
   server.stop()
@@ -241,6 +243,7 @@ def main():
     (RESTQueue.PATH, RESTQueue, {'queue_handler': task_queue}),
     (RESTTasks.PATH, RESTTasks, {'queue_handler': task_queue}),
     (RESTLease.PATH, RESTLease, {'queue_handler': task_queue}),
+    (RESTBatchTasks.PATH, RESTBatchTasks, {'queue_handler': task_queue}),
     (RESTTask.PATH, RESTTask, {'queue_handler': task_queue})
   ])
 
@@ -257,3 +260,6 @@ def main():
 
   logger.info('Starting TaskQueue server on port {}'.format(args.port))
   IOLoop.current().start()
+
+  # Write the queue statistics that have not been flushed yet.
+  task_queue.queue_manager.stats_buffer.stop()
@@ -25,13 +25,16 @@ from cassandra import (
   OperationTimedOut
 )
 from cassandra.cluster import SimpleStatement
+from cassandra.concurrent import execute_concurrent
 from cassandra.policies import FallthroughRetryPolicy
 from .queue import (
+  index_shard,
   InvalidLeaseRequest,
   PullQueue,
   PushQueue,
   TransientError
 )
+from .task import InvalidTaskInfo
 from .task import Task
 from .utils import (
   get_celery_queue_name,
@@ -39,6 +42,7 @@ from .utils import (
   logger
 )
 from .queue_manager import GlobalQueueManager
+from .queue_stats import update_task_counts
 
 sys.path.append(APPSCALE_PYTHON_APPSERVER)
 from google.appengine.api import apiproxy_stub_map
@@ -51,6 +55,97 @@ from google.appengine.runtime import apiproxy_errors
 # A policy that does not retry statements.
 NO_RETRIES = FallthroughRetryPolicy()
 
+# The number of index entries to copy at once when migrating the index.
+INDEX_MIGRATION_CONCURRENCY = 50
+
+# The number of index entries to read from the old index at a time.
+INDEX_MIGRATION_PAGE_SIZE = 1000
+
+
+def copy_index_entries(session, statements_and_params):
+  """ Writes a group of index entries to the sharded index.
+
+  Args:
+    session: A cassandra-driver session.
+    statements_and_params: A list of (statement, parameters) tuples.
+  Raises:
+    The first error encountered after all of the writes have finished.
+  """
+  results = execute_concurrent(session, statements_and_params,
+                               concurrency=INDEX_MIGRATION_CONCURRENCY,
+                               raise_on_first_error=False)
+  for success, result in results:
+    if not success:
+      raise result
+
+
+def migrate_pull_queue_index(session):
+  """ Moves entries from the unsharded index table to the sharded one.
+
+  The old table is only dropped after every entry has been copied. If a copy
+  fails, the migration starts over the next time the server starts.
+
+  Args:
+    session: A cassandra-driver session.
+  """
+  logger.info('Moving entries from pull_queue_tasks_index to '
+              'pull_queue_sharded_index')
+  select_entries = SimpleStatement("""
+    SELECT app, queue, eta, id, tag, tag_exists FROM pull_queue_tasks_index
+  """, fetch_size=INDEX_MIGRATION_PAGE_SIZE)
+  insert_entry = session.prepare("""
+    INSERT INTO pull_queue_sharded_index
+      (app, queue, shard, eta, id, tag, tag_exists)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+  """)
+
+  # Pages are fetched by this thread as the results are iterated, and each
+  # page is copied before the next one is requested.
+  copied = 0
+  statements_and_params = []
+  for row in session.execute(select_entries):
+    statements_and_params.append(
+      (insert_entry, (row.app, row.queue, index_shard(row.id), row.eta,
+                      row.id, row.tag, row.tag_exists)))
+    if len(statements_and_params) >= INDEX_MIGRATION_PAGE_SIZE:
+      copy_index_entries(session, statements_and_params)
+      copied += len(statements_and_params)
+      statements_and_params = []
+
+  if statements_and_params:
+    copy_index_entries(session, statements_and_params)
+    copied += len(statements_and_params)
+
+  logger.info('Copied {} index entries'.format(copied))
+  logger.info('Dropping pull_queue_tasks_index')
+  try:
+    session.execute('DROP TABLE pull_queue_tasks_index',
+                    timeout=SCHEMA_CHANGE_TIMEOUT)
+  except OperationTimedOut:
+    logger.warning(
+      'Encountered a timeout when dropping pull_queue_tasks_index. Waiting {} '
+      'seconds for schema to settle.'.format(SCHEMA_CHANGE_TIMEOUT))
+    time.sleep(SCHEMA_CHANGE_TIMEOUT)
+    raise
+
+
+def initialize_task_counts(session):
+  """ Counts the existing tasks in each pull queue.
+
+  Args:
+    session: A cassandra-driver session.
+  """
+  logger.info('Counting existing pull queue tasks')
+  select_tasks = SimpleStatement("""
+    SELECT app, queue FROM pull_queue_tasks
+  """, fetch_size=1000)
+  counts = {}
+  for row in session.execute(select_tasks):
+    key = (row.app, row.queue)
+    counts[key] = counts.get(key, 0) + 1
+
+  update_task_counts(session, counts, shard=0)
+
 
 def create_pull_queue_tables(cluster, session):
   """ Create the required tables for pull queues.
@@ -96,16 +191,19 @@ def create_pull_queue_tables(cluster, session):
       time.sleep(SCHEMA_CHANGE_TIMEOUT)
       raise
 
-  logger.info('Trying to create pull_queue_tasks_index')
+  # Each queue's index is split into shards so that concurrent leases do not
+  # all start with the same entries.
+  logger.info('Trying to create pull_queue_sharded_index')
   create_index_table = """
-    CREATE TABLE IF NOT EXISTS pull_queue_tasks_index (
+    CREATE TABLE IF NOT EXISTS pull_queue_sharded_index (
       app text,
       queue text,
+      shard int,
       eta timestamp,
       id text,
       tag text,
       tag_exists boolean,
-      PRIMARY KEY ((app, queue, eta), id)
+      PRIMARY KEY ((app, queue, shard, eta), id)
     ) WITH gc_grace_seconds = 120
   """
   statement = SimpleStatement(create_index_table, retry_policy=NO_RETRIES)
@@ -113,48 +211,78 @@ def create_pull_queue_tables(cluster, session):
     session.execute(statement, timeout=SCHEMA_CHANGE_TIMEOUT)
   except OperationTimedOut:
     logger.warning(
-      'Encountered an operation timeout while creating pull_queue_tasks_index.'
-      ' Waiting {} seconds for schema to settle.'
+      'Encountered an operation timeout while creating '
+      'pull_queue_sharded_index. Waiting {} seconds for schema to settle.'
         .format(SCHEMA_CHANGE_TIMEOUT))
     time.sleep(SCHEMA_CHANGE_TIMEOUT)
     raise
 
-  logger.info('Trying to create pull_queue_tags index')
+  logger.info('Trying to create pull_queue_shard_tags index')
   create_index = """
-    CREATE INDEX IF NOT EXISTS pull_queue_tags ON pull_queue_tasks_index (tag);
+    CREATE INDEX IF NOT EXISTS pull_queue_shard_tags
+    ON pull_queue_sharded_index (tag);
   """
   try:
     session.execute(create_index, timeout=SCHEMA_CHANGE_TIMEOUT)
   except (OperationTimedOut, InvalidRequest):
     logger.warning(
-      'Encountered error while creating pull_queue_tags index. Waiting {} '
-      'seconds for schema to settle.'.format(SCHEMA_CHANGE_TIMEOUT))
+      'Encountered error while creating pull_queue_shard_tags index. Waiting '
+      '{} seconds for schema to settle.'.format(SCHEMA_CHANGE_TIMEOUT))
     time.sleep(SCHEMA_CHANGE_TIMEOUT)
     raise
 
   # This additional index is needed for groupByTag=true,tag=None queries
   # because Cassandra can only do '=' queries on secondary indices.
-  logger.info('Trying to create pull_queue_tag_exists index')
+  logger.info('Trying to create pull_queue_shard_tag_exists index')
   create_index = """
-    CREATE INDEX IF NOT EXISTS pull_queue_tag_exists
-    ON pull_queue_tasks_index (tag_exists);
+    CREATE INDEX IF NOT EXISTS pull_queue_shard_tag_exists
+    ON pull_queue_sharded_index (tag_exists);
   """
   try:
     session.execute(create_index, timeout=SCHEMA_CHANGE_TIMEOUT)
   except (OperationTimedOut, InvalidRequest):
     logger.warning(
-      'Encountered error while creating pull_queue_tag_exists index. '
+      'Encountered error while creating pull_queue_shard_tag_exists index. '
+      'Waiting {} seconds for schema to settle.'.format(SCHEMA_CHANGE_TIMEOUT))
+    time.sleep(SCHEMA_CHANGE_TIMEOUT)
+    raise
+
+  if 'pull_queue_tasks_index' in keyspace_metadata.tables:
+    migrate_pull_queue_index(session)
+
+  counts_exist = 'pull_queue_task_counts' in keyspace_metadata.tables
+  logger.info('Trying to create pull_queue_task_counts')
+  create_counts_table = """
+    CREATE TABLE IF NOT EXISTS pull_queue_task_counts (
+      app text,
+      queue text,
+      shard int,
+      tasks counter,
+      PRIMARY KEY ((app, queue), shard)
+    )
+  """
+  statement = SimpleStatement(create_counts_table, retry_policy=NO_RETRIES)
+  try:
+    session.execute(statement, timeout=SCHEMA_CHANGE_TIMEOUT)
+  except OperationTimedOut:
+    logger.warning(
+      'Encountered an operation timeout while creating pull_queue_task_counts. '
       'Waiting {} seconds for schema to settle.'.format(SCHEMA_CHANGE_TIMEOUT))
     time.sleep(SCHEMA_CHANGE_TIMEOUT)
     raise
 
-  logger.info('Trying to create pull_queue_leases')
+  if not counts_exist:
+    initialize_task_counts(session)
+
+  logger.info('Trying to create pull_queue_lease_counts')
   create_leases_table = """
-    CREATE TABLE IF NOT EXISTS pull_queue_leases (
+    CREATE TABLE IF NOT EXISTS pull_queue_lease_counts (
       app text,
       queue text,
-      leased timestamp,
-      PRIMARY KEY ((app, queue, leased))
+      bucket timestamp,
+      writer uuid,
+      leased int,
+      PRIMARY KEY ((app, queue), bucket, writer)
     ) WITH gc_grace_seconds = 120
   """
   statement = SimpleStatement(create_leases_table, retry_policy=NO_RETRIES)
@@ -162,11 +290,24 @@ def create_pull_queue_tables(cluster, session):
     session.execute(statement, timeout=SCHEMA_CHANGE_TIMEOUT)
   except OperationTimedOut:
     logger.warning(
-      'Encountered an operation timeout while creating pull_queue_leases. '
-      'Waiting {} seconds for schema to settle.'.format(SCHEMA_CHANGE_TIMEOUT))
+      'Encountered an operation timeout while creating '
+      'pull_queue_lease_counts. Waiting {} seconds for schema to '
+      'settle.'.format(SCHEMA_CHANGE_TIMEOUT))
     time.sleep(SCHEMA_CHANGE_TIMEOUT)
     raise
 
+  if 'pull_queue_leases' in keyspace_metadata.tables:
+    logger.info('Dropping pull_queue_leases')
+    try:
+      session.execute('DROP TABLE pull_queue_leases',
+                      timeout=SCHEMA_CHANGE_TIMEOUT)
+    except OperationTimedOut:
+      logger.warning(
+        'Encountered a timeout when dropping pull_queue_leases. Waiting {} '
+        'seconds for schema to settle.'.format(SCHEMA_CHANGE_TIMEOUT))
+      time.sleep(SCHEMA_CHANGE_TIMEOUT)
+      raise
+
 
 class TaskName(db.Model):
   """ A datastore model for tracking task names in order to prevent
@@ -437,6 +578,7 @@ class DistributedTaskQueue():
 
     # Assign names if needed and validate tasks.
     error_found = False
+    pull_tasks = {}
     for add_request in request.add_request_list():
       task_result = response.add_taskresult()
 
@@ -447,6 +589,7 @@ class DistributedTaskQueue():
           task_result.set_result(
             taskqueue_service_pb.TaskQueueServiceError.INVALID_QUEUE_MODE)
           error_found = True
+          continue
 
         encoded_payload = base64.urlsafe_b64encode(add_request.body())
         task_info = {'payloadBase64': encoded_payload,
@@ -457,9 +600,8 @@ class DistributedTaskQueue():
           task_info['tag'] = add_request.tag()
 
         new_task = Task(task_info)
-        queue.add_task(new_task)
-        task_result.set_result(taskqueue_service_pb.TaskQueueServiceError.OK)
-        task_result.set_chosen_task_name(new_task.id)
+        queue_tasks = pull_tasks.setdefault(queue.name, (queue, []))[1]
+        queue_tasks.append((new_task, task_result))
         continue
 
       result = tq_lib.verify_task_queue_add_request(add_request.app_id(),
@@ -480,21 +622,39 @@ class DistributedTaskQueue():
       else:
         error_found = True
         task_result.set_result(result)
+
+    # Pull tasks are added with one call for each queue.
+    for queue, tasks_and_results in pull_tasks.itervalues():
+      errors = queue.add_tasks([task for task, _ in tasks_and_results])
+      for (task, task_result), error in zip(tasks_and_results, errors):
+        if isinstance(error, InvalidTaskInfo):
+          task_result.set_result(
+            taskqueue_service_pb.TaskQueueServiceError.TASK_ALREADY_EXISTS)
+        elif error is not None:
+          task_result.set_result(
+            taskqueue_service_pb.TaskQueueServiceError.TRANSIENT_ERROR)
+        else:
+          task_result.set_result(
+            taskqueue_service_pb.TaskQueueServiceError.OK)
+          task_result.set_chosen_task_name(task.id)
+
     if error_found:
       return
 
+    push_requests = []
+    push_results = []
     for add_request, task_result in zip(request.add_request_list(),
                                         response.taskresult_list()):
       if (add_request.has_mode() and
           add_request.mode() == taskqueue_service_pb.TaskQueueMode.PULL):
         continue
 
-      try:
-        self.__enqueue_push_task(add_request)
-      except apiproxy_errors.ApplicationError as error:
-        task_result.set_result(error.application_error)
-      else:
-        task_result.set_result(taskqueue_service_pb.TaskQueueServiceError.OK)
+      push_requests.append(add_request)
+      push_results.append(task_result)
+
+    results = self.__enqueue_push_tasks(push_requests)
+    for task_result, result in zip(push_results, results):
+      task_result.set_result(result)
 
   def __method_mapping(self, method):
     """ Maps an int index to a string. 
@@ -515,53 +675,116 @@ class DistributedTaskQueue():
     elif method == taskqueue_service_pb.TaskQueueQueryTasksResponse_Task.DELETE:
       return 'DELETE'
 
-  def __check_and_store_task_names(self, request):
-    """ Tries to fetch the taskqueue name, if it exists it will raise an 
-    exception. 
+  def __check_and_store_task_names(self, requests):
+    """ Checks that tasks have not been enqueued before and stores their
+    names.
+
+    We store a receipt of each enqueued task in the datastore. If we find a
+    task in the datastore, the task is rejected. Otherwise, it is assumed this
+    is the first time seeing the task and we create a receipt of the task in
+    the datastore to prevent a duplicate task from being enqueued. All of the
+    names are fetched and stored with one datastore call each.
 
-    We store a receipt of each enqueued task in the datastore. If we find that
-    task in the datastore, we will raise an exception. If the task is not
-    in the datastore, then it is assumed this is the first time seeing the
-    tasks and we create a receipt of the task in the datastore to prevent
-    a duplicate task from being enqueued.
-    
     Args:
-      request: A taskqueue_service_pb.TaskQueueAddRequest.
-    Raises:
-      A apiproxy_errors.ApplicationError of TASK_ALREADY_EXISTS.
+      requests: A list of taskqueue_service_pb.TaskQueueAddRequest objects.
+    Returns:
+      A list containing a TaskQueueServiceError code or None for each
+      request.
     """
-    task_name = request.task_name()
-    item = TaskName.get_by_key_name(task_name)
-    logger.debug("Task name {0}".format(task_name))
-    if item:
-      logger.warning("Task already exists")
-      raise apiproxy_errors.ApplicationError(
-        taskqueue_service_pb.TaskQueueServiceError.TASK_ALREADY_EXISTS)
-    else:
+    if not requests:
+      return []
+
+    task_names = [request.task_name() for request in requests]
+    existing = TaskName.get_by_key_name(task_names)
+
+    errors = [None] * len(requests)
+    new_names = []
+    new_indexes = []
+    seen = set()
+    for index, request in enumerate(requests):
+      task_name = request.task_name()
+      logger.debug("Task name {0}".format(task_name))
+      # A name that appears earlier in the batch counts as existing.
+      if existing[index] is not None or task_name in seen:
+        logger.warning("Task already exists")
+        errors[index] = \
+          taskqueue_service_pb.TaskQueueServiceError.TASK_ALREADY_EXISTS
+        continue
+
+      seen.add(task_name)
       new_name = TaskName(key_name=task_name, state=tq_lib.TASK_STATES.QUEUED,
         queue=request.queue_name(), app_id=request.app_id())
       logger.debug("Creating entity {0}".format(str(new_name)))
+      new_names.append(new_name)
+      new_indexes.append(index)
+
+    if new_names:
       try:
-        db.put(new_name)
+        db.put(new_names)
       except datastore_errors.InternalError, internal_error:
         logger.error(str(internal_error))
-        raise apiproxy_errors.ApplicationError(
-          taskqueue_service_pb.TaskQueueServiceError.DATASTORE_ERROR)
+        for index in new_indexes:
+          errors[index] = \
+            taskqueue_service_pb.TaskQueueServiceError.DATASTORE_ERROR
+
+    return errors
 
-  def __enqueue_push_task(self, request):
+  def __enqueue_push_tasks(self, requests):
     """ Enqueues a batch of push tasks.
-  
+
+    Tasks that use the same Celery application are published with one
+    producer, so they share a broker connection and channel.
+
+    Args:
+      requests: A list of taskqueue_service_pb.TaskQueueAddRequest objects.
+    Returns:
+      A list containing a TaskQueueServiceError code for each request.
+    """
+    results = []
+    for request in requests:
+      try:
+        self.__validate_push_task(request)
+      except apiproxy_errors.ApplicationError as error:
+        results.append(error.application_error)
+      else:
+        results.append(taskqueue_service_pb.TaskQueueServiceError.OK)
+
+    valid = [index for index, result in enumerate(results)
+             if result == taskqueue_service_pb.TaskQueueServiceError.OK]
+    errors = self.__check_and_store_task_names(
+      [requests[index] for index in valid])
+
+    by_celery = {}
+    for index, error in zip(valid, errors):
+      if error is not None:
+        results[index] = error
+        continue
+
+      request = requests[index]
+      push_queue = self.get_queue(request.app_id(), request.queue_name())
+      by_celery.setdefault(push_queue.celery, []).append(
+        (push_queue, request))
+
+    for celery, tasks in by_celery.iteritems():
+      with celery.producer_or_acquire() as producer:
+        for push_queue, request in tasks:
+          self.__send_push_task(push_queue, request, producer)
+
+    return results
+
+  def __send_push_task(self, push_queue, request, producer):
+    """ Publishes a push task to the broker.
+
     Args:
+      push_queue: The PushQueue the task belongs to.
       request: A taskqueue_service_pb.TaskQueueAddRequest.
+      producer: A kombu Producer.
     """
-    self.__validate_push_task(request)
-    self.__check_and_store_task_names(request)
     args = self.get_task_args(request)
     headers = self.get_task_headers(request)
     countdown = int(headers['X-AppEngine-TaskETA']) - \
                 int(datetime.datetime.now().strftime("%s"))
 
-    push_queue = self.get_queue(request.app_id(), request.queue_name())
     task_func = get_queue_function_name(push_queue.name)
     celery_queue = get_celery_queue_name(request.app_id(), push_queue.name)
 
@@ -573,6 +796,7 @@ class DistributedTaskQueue():
       countdown=countdown,
       queue=celery_queue,
       routing_key=celery_queue,
+      producer=producer,
     )
 
   def get_task_args(self, request):
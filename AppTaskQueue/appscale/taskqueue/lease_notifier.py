@@ -0,0 +1,214 @@
+""" Wakes lease requests that are waiting for tasks to be added. """
+
+import datetime
+import uuid
+
+from collections import defaultdict
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+
+# The node that contains a child for each queue and server with lease
+# requests waiting.
+WAITERS_NODE = '/appscale/projects/{project}/lease_waiters'
+
+# The node that is written to when a task is added to a queue.
+NOTIFICATION_NODE = '/appscale/projects/{project}/lease_notifications/{queue}'
+
+# The minimum number of seconds between writes to a queue's notification
+# node. Tasks added in between are announced by a single write at the end of
+# the interval.
+NOTIFICATION_INTERVAL = .5
+
+
+class LeaseNotifier(object):
+  """ Keeps track of the lease requests waiting on a project's queues.
+
+  Tasks added on this server wake local requests directly. When a server has
+  requests waiting on a queue, it registers an ephemeral node so that other
+  servers know to write to the queue's notification node when they add tasks.
+  """
+  def __init__(self, zk_client, project_id):
+    """ Creates a new LeaseNotifier.
+
+    Args:
+      zk_client: A KazooClient.
+      project_id: A string specifying a project ID.
+    """
+    self.zk_client = zk_client
+    self.project_id = project_id
+    self.server_id = uuid.uuid4().hex
+
+    # Maps queue names to a list of (tag, future) tuples.
+    self._waiters = defaultdict(list)
+
+    # Queues that have requests waiting on other servers.
+    self._remote_queues = set()
+
+    self._notification_watches = {}
+
+    # Maps queue names to the IOLoop time of their last notification.
+    self._last_notified = {}
+
+    # Maps queue names to the timeouts of notifications that are delayed.
+    self._delayed_notifications = {}
+
+    waiters_node = WAITERS_NODE.format(project=project_id)
+    self.zk_client.ensure_path(waiters_node)
+    self._waiters_watch = zk_client.ChildrenWatch(
+      waiters_node, self._update_waiters_watch)
+
+  @gen.coroutine
+  def wait(self, queue, tag, timeout):
+    """ Waits until a task is added to a queue.
+
+    Args:
+      queue: A string specifying the queue name.
+      tag: A string specifying the tag to wait for. If None, any task wakes
+        the request.
+      timeout: A number specifying how many seconds to wait.
+    Returns:
+      A boolean indicating whether or not a task was added before the
+      timeout.
+    """
+    waiter = (tag, Future())
+    self._waiters[queue].append(waiter)
+    if len(self._waiters[queue]) == 1:
+      self._register(queue)
+
+    try:
+      yield gen.with_timeout(datetime.timedelta(seconds=timeout), waiter[1])
+      raise gen.Return(True)
+    except gen.TimeoutError:
+      raise gen.Return(False)
+    finally:
+      self._waiters[queue].remove(waiter)
+      if not self._waiters[queue]:
+        del self._waiters[queue]
+        self._unregister(queue)
+
+  def task_added(self, queue, tag=None):
+    """ Wakes the requests that are waiting for a task.
+
+    Args:
+      queue: A string specifying the queue name.
+      tag: A string specifying the task's tag.
+    """
+    IOLoop.instance().add_callback(self._task_added, queue, tag)
+
+  def stop(self):
+    """ Stops watching for waiters and notifications. """
+    io_loop = IOLoop.instance()
+    for timeout in self._delayed_notifications.values():
+      io_loop.remove_timeout(timeout)
+    self._delayed_notifications.clear()
+
+    self._waiters_watch._stopped = True
+    for watch in self._notification_watches.values():
+      watch._stopped = True
+
+  def _task_added(self, queue, tag):
+    """ Wakes local waiters and lets other servers know about a new task.
+
+    Args:
+      queue: A string specifying the queue name.
+      tag: A string specifying the task's tag.
+    """
+    self._wake(queue, tag)
+
+    if queue not in self._remote_queues:
+      return
+
+    # A notification that is already scheduled covers this task.
+    if queue in self._delayed_notifications:
+      return
+
+    io_loop = IOLoop.instance()
+    next_time = self._last_notified.get(queue, 0) + NOTIFICATION_INTERVAL
+    if io_loop.time() >= next_time:
+      self._notify_remote(queue)
+    else:
+      self._delayed_notifications[queue] = io_loop.call_at(
+        next_time, self._notify_remote, queue)
+
+  def _notify_remote(self, queue):
+    """ Writes to a queue's notification node to wake remote waiters.
+
+    Args:
+      queue: A string specifying the queue name.
+    """
+    self._delayed_notifications.pop(queue, None)
+    self._last_notified[queue] = IOLoop.instance().time()
+    node = NOTIFICATION_NODE.format(project=self.project_id, queue=queue)
+    self.zk_client.set_async(node, '')
+
+  def _wake(self, queue, tag, any_tag=False):
+    """ Resolves the futures of matching waiters.
+
+    Args:
+      queue: A string specifying the queue name.
+      tag: A string specifying the task's tag.
+      any_tag: A boolean indicating that all of the queue's waiters should be
+        woken.
+    """
+    for waiter_tag, future in self._waiters.get(queue, []):
+      if future.done():
+        continue
+
+      if any_tag or waiter_tag is None or waiter_tag == tag:
+        future.set_result(None)
+
+  def _register(self, queue):
+    """ Lets other servers know that requests are waiting on a queue.
+
+    Args:
+      queue: A string specifying the queue name.
+    """
+    if queue not in self._notification_watches:
+      node = NOTIFICATION_NODE.format(project=self.project_id, queue=queue)
+      self.zk_client.ensure_path(node)
+      self._notification_watches[queue] = self.zk_client.DataWatch(
+        node, lambda data, stat, event: self._notification_watch(queue, event))
+
+    waiter_node = '/'.join([WAITERS_NODE.format(project=self.project_id),
+                            '{}:{}'.format(queue, self.server_id)])
+    self.zk_client.create_async(waiter_node, ephemeral=True)
+
+  def _unregister(self, queue):
+    """ Removes this server's registration for a queue.
+
+    Args:
+      queue: A string specifying the queue name.
+    """
+    waiter_node = '/'.join([WAITERS_NODE.format(project=self.project_id),
+                            '{}:{}'.format(queue, self.server_id)])
+    self.zk_client.delete_async(waiter_node)
+
+  def _update_waiters_watch(self, children):
+    """ Keeps track of the queues that have waiters on other servers.
+
+    Args:
+      children: A list of strings specifying the registered waiters.
+    """
+    remote_queues = set()
+    for child in children:
+      queue, server_id = child.rsplit(':', 1)
+      if server_id != self.server_id:
+        remote_queues.add(queue)
+
+    self._remote_queues = remote_queues
+
+  def _notification_watch(self, queue, event):
+    """ Handles tasks added to a queue by other servers.
+
+    Since this runs in a separate thread, it doesn't change any state directly.
+    Instead, it just acts as a bridge back to the main IO loop.
+
+    Args:
+      queue: A string specifying the queue name.
+      event: A kazoo WatchedEvent or None for the initial call.
+    """
+    if event is None:
+      return
+
+    IOLoop.instance().add_callback(self._wake, queue, None, any_tag=True)
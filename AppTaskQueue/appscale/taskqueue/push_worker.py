@@ -1,5 +1,6 @@
 """ A Celery worker script that executes push tasks with HTTP requests. """
 import datetime
+import eventlet
 import json
 import logging
 import os
@@ -9,6 +10,7 @@ from appscale.common import appscale_info
 from appscale.common import constants
 from appscale.common.unpackaged import APPSCALE_PYTHON_APPSERVER
 from celery.utils.log import get_task_logger
+from collections import defaultdict
 from eventlet.green import httplib
 from httplib import BadStatusLine
 from socket import error as SocketError
@@ -25,6 +27,14 @@ from google.appengine.api import apiproxy_stub_map
 from google.appengine.api import datastore_distributed
 from google.appengine.ext import db
 
+# The number of idle connections to keep open for each target.
+MAX_IDLE_CONNECTIONS = 10
+
+# The number of seconds between deletions of finished task names.
+TASK_NAME_FLUSH_INTERVAL = 1
+
+# The number of finished task names that triggers a deletion right away.
+TASK_NAME_BATCH_SIZE = 100
 
 app_id = os.environ['APP_ID']
 remote_host = os.environ['HOST']
@@ -44,6 +54,14 @@ ds_distrib = datastore_distributed.DatastoreDistributed(
 apiproxy_stub_map.apiproxy.RegisterStub('datastore_v3', ds_distrib)
 os.environ['APPLICATION_ID'] = 'appscaledashboard'
 
+# Open connections that are not in use, keyed by URL scheme and port. Green
+# threads only switch during I/O, so the lists do not need a lock.
+idle_connections = defaultdict(list)
+
+# The names of tasks that no longer need to be tracked.
+finished_task_names = []
+task_name_flusher = None
+
 
 def get_wait_time(retries, args):
   """ Calculates how long we should wait to execute a failed task, based on
@@ -66,6 +84,132 @@ def get_wait_time(retries, args):
   return wait_time
 
 
+def get_connection(scheme, port):
+  """ Takes an idle connection to the target or opens a new one.
+
+  Args:
+    scheme: A string specifying the URL scheme (http or https).
+    port: An integer specifying the target port.
+  Returns:
+    A tuple containing an HTTPConnection and a boolean indicating whether or
+    not it was used before.
+  """
+  idle = idle_connections[(scheme, port)]
+  if idle:
+    return idle.pop(), True
+
+  if scheme == 'https':
+    return httplib.HTTPSConnection(remote_host, port), False
+
+  return httplib.HTTPConnection(remote_host, port), False
+
+
+def release_connection(scheme, port, connection, response):
+  """ Keeps a connection open for later tasks when the target allows it.
+
+  Args:
+    scheme: A string specifying the URL scheme (http or https).
+    port: An integer specifying the target port.
+    connection: An HTTPConnection whose response has been read.
+    response: The HTTPResponse received on the connection.
+  """
+  idle = idle_connections[(scheme, port)]
+  if response.will_close or len(idle) >= MAX_IDLE_CONNECTIONS:
+    connection.close()
+    return
+
+  idle.append(connection)
+
+
+def send_request(connection, method, urlpath, headers, body, query):
+  """ Sends a task request and reads the response.
+
+  Args:
+    connection: An HTTPConnection.
+    method: A string specifying the HTTP method.
+    urlpath: A string specifying the path and query of the request.
+    headers: A dictionary of headers for the task.
+    body: A string containing the task body.
+    query: A string containing the query part of the URL.
+  Returns:
+    An HTTPResponse that has been read.
+  Raises:
+    BadStatusLine or socket.error if the request failed.
+  """
+  skip_host = False
+  if 'host' in headers or 'Host' in headers:
+    skip_host = True
+
+  skip_accept_encoding = False
+  if 'accept-encoding' in headers or 'Accept-Encoding' in headers:
+    skip_accept_encoding = True
+
+  connection.putrequest(method,
+                        urlpath,
+                        skip_host=skip_host,
+                        skip_accept_encoding=skip_accept_encoding)
+
+  for header in headers:
+    connection.putheader(header, headers[header])
+
+  if 'content-type' not in headers or 'Content-Type' not in headers:
+    if query:
+      connection.putheader('content-type', 'application/octet-stream')
+    else:
+      connection.putheader('content-type',
+                           'application/x-www-form-urlencoded')
+
+  connection.putheader("Content-Length", str(len(body)))
+  connection.endheaders()
+  if body:
+    connection.send(body)
+
+  response = connection.getresponse()
+  response.read()
+  response.close()
+  return response
+
+
+def flush_task_names():
+  """ Deletes the names of finished tasks in a single datastore request. """
+  global finished_task_names
+  task_names = finished_task_names
+  finished_task_names = []
+  if not task_names:
+    return
+
+  keys = [db.Key.from_path(TaskName.kind(), task_name)
+          for task_name in task_names]
+  try:
+    db.delete(keys)
+  except Exception:
+    # The groomer removes old task names that are left behind.
+    logger.exception('Unable to delete {} task names'.format(len(keys)))
+
+
+def flush_task_names_periodically():
+  """ Deletes the names of finished tasks until the worker exits. """
+  while True:
+    eventlet.sleep(TASK_NAME_FLUSH_INTERVAL)
+    flush_task_names()
+
+
+def delete_task_name(task_name):
+  """ Schedules the deletion of a finished task's name.
+
+  Args:
+    task_name: A string specifying the task name.
+  """
+  global task_name_flusher
+  finished_task_names.append(task_name)
+  if len(finished_task_names) >= TASK_NAME_BATCH_SIZE:
+    flush_task_names()
+    return
+
+  if task_name_flusher is None:
+    task_name_flusher = eventlet.spawn(flush_task_names_periodically)
+
+
 def execute_task(task, headers, args):
   """ Executes a task to a url with the given args.
 
@@ -105,9 +249,8 @@ def execute_task(task, headers, args):
       logger.error(
         "Task %s with id %s has expired with expiration date %s" % (
          args['task_name'], task.request.id, args['expires']))
-      item = TaskName.get_by_key_name(args['task_name'])
       celery.control.revoke(task.request.id)
-      db.delete(item)
+      delete_task_name(args['task_name'])
       return
 
     if (args['max_retries'] != 0 and
@@ -115,70 +258,45 @@ def execute_task(task, headers, args):
       logger.error("Task %s with id %s has exceeded retries: %s" % (
         args['task_name'], task.request.id,
         args['max_retries']))
-      item = TaskName.get_by_key_name(args['task_name'])
       celery.control.revoke(task.request.id)
-      db.delete(item)
+      delete_task_name(args['task_name'])
       return
 
-    if url.scheme == 'http':
-      connection = httplib.HTTPConnection(remote_host, url.port)
-    elif url.scheme == 'https':
-      connection = httplib.HTTPSConnection(remote_host, url.port)
-    else:
+    if url.scheme not in ('http', 'https'):
       logger.error("Task %s tried to use url scheme %s, "
                    "which is not supported." % (
                    args['task_name'], url.scheme))
-
-    skip_host = False
-    if 'host' in headers or 'Host' in headers:
-      skip_host = True
-
-    skip_accept_encoding = False
-    if 'accept-encoding' in headers or 'Accept-Encoding' in headers:
-      skip_accept_encoding = True
-
-    connection.putrequest(method,
-                          urlpath,
-                          skip_host=skip_host,
-                          skip_accept_encoding=skip_accept_encoding)
+      delete_task_name(args['task_name'])
+      return
 
     # Update the task headers
     headers['X-AppEngine-TaskRetryCount'] = str(task.request.retries)
     headers['X-AppEngine-TaskExecutionCount'] = str(task.request.retries)
 
-    for header in headers:
-      connection.putheader(header, headers[header])
-
-    if 'content-type' not in headers or 'Content-Type' not in headers:
-      if url.query:
-        connection.putheader('content-type', 'application/octet-stream')
-      else:
-        connection.putheader('content-type',
-                             'application/x-www-form-urlencoded')
-
-    connection.putheader("Content-Length", str(content_length))
-
     retries = int(task.request.retries) + 1
     wait_time = get_wait_time(retries, args)
 
-    try:
-      connection.endheaders()
-      if args["body"]:
-        connection.send(args['body'])
-
-      response = connection.getresponse()
-      response.read()
-      response.close()
-    except (BadStatusLine, SocketError):
-      logger.warning(
-        '{task} failed before receiving response. It will retry in {wait} '
-        'seconds.'.format(task=args['task_name'], wait=wait_time))
-      raise task.retry(countdown=wait_time)
+    response = None
+    while response is None:
+      connection, reused = get_connection(url.scheme, url.port)
+      try:
+        response = send_request(connection, method, urlpath, headers,
+                                args['body'], url.query)
+      except (BadStatusLine, SocketError):
+        connection.close()
+        # The target may have closed an idle connection, so only a failure
+        # on a new connection counts against the task.
+        if not reused:
+          logger.warning(
+            '{task} failed before receiving response. It will retry in '
+            '{wait} seconds.'.format(task=args['task_name'], wait=wait_time))
+          raise task.retry(countdown=wait_time)
+
+    release_connection(url.scheme, url.port, connection, response)
 
     if 200 <= response.status < 300:
       # Task successful.
-      item = TaskName.get_by_key_name(args['task_name'])
-      db.delete(item)
+      delete_task_name(args['task_name'])
       time_elapsed = datetime.datetime.utcnow() - start_time
       logger.info(
         '{task} received status {status} from {url} [time elapsed: {te}]'. \
@@ -1,8 +1,11 @@
 import datetime
+import heapq
 import json
+import random
 import re
 import sys
 import uuid
+import zlib
 
 from appscale.common.unpackaged import APPSCALE_PYTHON_APPSERVER
 from cassandra.concurrent import execute_concurrent
@@ -12,10 +15,12 @@ from appscale.datastore.cassandra_env.retry_policies import (
 )
 from appscale.datastore.dbconstants import TRANSIENT_CASSANDRA_ERRORS
 from cassandra.query import BatchStatement
+from cassandra.query import BatchType
 from cassandra.query import ConsistencyLevel
 from cassandra.query import SimpleStatement
 from collections import deque
 from threading import Lock
+from tornado import gen
 from .constants import AGE_LIMIT_REGEX
 from .constants import InvalidQueueConfiguration
 from .constants import RATE_REGEX
@@ -43,6 +48,9 @@ QUEUE_FIELDS = (
   {'stats': ('totalTasks', 'oldestTask', 'leasedLastMinute', 'leasedLastHour')}
 )
 
+# The number of shards that each queue's index is split into.
+INDEX_SHARDS = 16
+
 # Validation rules for queue parameters.
 QUEUE_ATTRIBUTE_RULES = {
   'rate': lambda rate: RATE_REGEX.match(rate),
@@ -67,6 +75,21 @@ def current_time_ms():
   return now.replace(microsecond=new_microsecond)
 
 
+def index_shard(task_id):
+  """ Picks the index shard for a task. A task always stays in the same
+  shard, so its index entries can be found from its ID.
+
+  Args:
+    task_id: A string containing the task ID.
+  Returns:
+    An integer specifying the shard.
+  """
+  if isinstance(task_id, unicode):
+    task_id = task_id.encode('utf-8')
+
+  return (zlib.crc32(task_id) & 0xffffffff) % INDEX_SHARDS
+
+
 def next_key(key):
   """ Calculates the next partition value of a key. Note: Cassandra BOP orders
   'b' before 'aa'.
@@ -251,15 +274,33 @@ class PullQueue(Queue):
   # The seconds to wait after fetching 0 index results before retrying.
   EMPTY_RESULTS_COOLDOWN = 5
 
-  def __init__(self, queue_info, app, db_access=None):
+  # Lease requests can wait up to a minute for tasks to be added.
+  MAX_LEASE_WAIT_TIME = 60
+
+  # The maximum number of tasks that can be added at a time.
+  MAX_ADD_AMOUNT = 1000
+
+  # The number of task inserts to run at once when adding many tasks.
+  ADD_CONCURRENCY = 50
+
+  # The maximum number of index entries to write in one batch. This keeps
+  # batches under Cassandra's batch size warning threshold.
+  INDEX_BATCH_SIZE = 100
+
+  def __init__(self, queue_info, app, db_access=None, stats_buffer=None,
+               lease_notifier=None):
     """ Create a PullQueue object.
 
     Args:
       queue_info: A dictionary containing queue info.
       app: A string containing the application ID.
       db_access: A DatastoreProxy object.
+      stats_buffer: A QueueStatsBuffer object.
+      lease_notifier: A LeaseNotifier object.
     """
     self.db_access = db_access
+    self.stats_buffer = stats_buffer
+    self.lease_notifier = lease_notifier
     self.index_cache = {'global': {}, 'by_tag': {}}
     self.index_cache_lock = Lock()
     super(PullQueue, self).__init__(queue_info, app)
@@ -276,57 +317,130 @@ class PullQueue(Queue):
     if not hasattr(task, 'payloadBase64'):
       raise InvalidTaskInfo('{} is missing a payload.'.format(task))
 
-    enqueue_time = datetime.datetime.utcnow()
-    try:
-      lease_expires = task.leaseTimestamp
-    except AttributeError:
-      lease_expires = datetime.datetime.utcfromtimestamp(0)
-
-    parameters = {
-      'app': self.app,
-      'queue': self.name,
-      'id': task.id,
-      'payload': task.payloadBase64,
-      'enqueued': enqueue_time,
-      'retry_count': 0,
-      'lease_expires': lease_expires,
-      'op_id': uuid.uuid4()
-    }
-
-    try:
-      parameters['tag'] = task.tag
-    except AttributeError:
-      parameters['tag'] = None
-
+    parameters = self._task_parameters(task, datetime.datetime.utcnow())
     self._insert_task(parameters, retries)
-
-    task.queueName = self.name
-    task.enqueueTimestamp = enqueue_time
-    task.leaseTimestamp = lease_expires
+    self.stats_buffer.record_tasks(self.app, self.name, 1)
 
     # Create an index entry so the task can be queried by ETA. This can't be
     # done in a batch because the payload from the previous insert can be up
     # to 1MB, and Cassandra does not approve of large batches.
     insert_index = SimpleStatement("""
-      INSERT INTO pull_queue_tasks_index (app, queue, eta, id, tag, tag_exists)
-      VALUES (%(app)s, %(queue)s, %(eta)s, %(id)s, %(tag)s, %(tag_exists)s)
+      INSERT INTO pull_queue_sharded_index
+        (app, queue, shard, eta, id, tag, tag_exists)
+      VALUES (%(app)s, %(queue)s, %(shard)s, %(eta)s, %(id)s, %(tag)s,
+              %(tag_exists)s)
     """, retry_policy=BASIC_RETRIES)
-    parameters = {
-      'app': self.app,
-      'queue': self.name,
-      'eta': task.get_eta(),
-      'id': task.id
-    }
-    try:
-      parameters['tag'] = task.tag
-    except AttributeError:
-      # Insert an empty string for null values so that Cassandra can query for
-      # tasks where tag is not null.
-      parameters['tag'] = ''
-    parameters['tag_exists'] = parameters['tag'] != ''
+    shard, eta, task_id, tag, tag_exists = self._index_parameters(task)
+    parameters = {'app': self.app, 'queue': self.name, 'shard': shard,
+                  'eta': eta, 'id': task_id, 'tag': tag,
+                  'tag_exists': tag_exists}
     self.db_access.session.execute(insert_index, parameters)
     logger.debug('Added task: {}'.format(task))
 
+    if self.lease_notifier is not None:
+      self.lease_notifier.task_added(self.name, getattr(task, 'tag', None))
+
+  def add_tasks(self, tasks, retries=5):
+    """ Adds several tasks to the queue.
+
+    The task entries are inserted concurrently. Their index entries are then
+    written with one unlogged batch for each index partition. When a batch
+    cannot be written, its tasks are deleted so that they can be added again.
+
+    Args:
+      tasks: A list of Task objects.
+      retries: The number of times to retry adding each task.
+    Returns:
+      A list containing None for each task that was added or the exception
+      that prevented it from being added or indexed.
+    Raises:
+      InvalidTaskInfo if too many tasks are given.
+    """
+    if len(tasks) > self.MAX_ADD_AMOUNT:
+      raise InvalidTaskInfo(
+        'Only {} tasks can be added at a time'.format(self.MAX_ADD_AMOUNT))
+
+    enqueue_time = datetime.datetime.utcnow()
+    errors = [None for _ in tasks]
+    pending = {}
+    task_ids = set()
+    for task_num, task in enumerate(tasks):
+      if not hasattr(task, 'payloadBase64'):
+        errors[task_num] = InvalidTaskInfo(
+          '{} is missing a payload.'.format(task))
+        continue
+
+      # Duplicates within the request would otherwise race each other.
+      if task.id in task_ids:
+        errors[task_num] = InvalidTaskInfo(
+          'Task name already taken: {}'.format(task.id))
+        continue
+
+      task_ids.add(task.id)
+      pending[task_num] = self._task_parameters(task, enqueue_time)
+
+    inserted = self._insert_tasks(pending, errors, retries)
+    if not inserted:
+      return errors
+
+    self.stats_buffer.record_tasks(self.app, self.name, len(inserted))
+
+    session = self.db_access.session
+    statement = """
+      INSERT INTO pull_queue_sharded_index
+        (app, queue, shard, eta, id, tag, tag_exists)
+      VALUES (?, ?, ?, ?, ?, ?, ?)
+    """
+    if statement not in self.prepared_statements:
+      self.prepared_statements[statement] = session.prepare(statement)
+    insert_index = self.prepared_statements[statement]
+
+    partitions = {}
+    for task_num in inserted:
+      index_parameters = self._index_parameters(tasks[task_num])
+      partitions.setdefault(index_parameters[:2], []).append(
+        (task_num, (self.app, self.name) + index_parameters))
+
+    batches = []
+    for entries in partitions.values():
+      for start in range(0, len(entries), self.INDEX_BATCH_SIZE):
+        batch = BatchStatement(batch_type=BatchType.UNLOGGED,
+                               retry_policy=BASIC_RETRIES)
+        batch_positions = []
+        chunk = entries[start:start + self.INDEX_BATCH_SIZE]
+        for task_num, parameters in chunk:
+          batch.add(insert_index, parameters)
+          batch_positions.append(task_num)
+
+        batches.append((batch_positions, batch))
+
+    # A failed batch does not prevent the other batches from being indexed.
+    unindexed = set()
+    for batch_positions, error in self._insert_index_batches(batches, retries):
+      logger.warning('Unable to index {} tasks: {}'.format(
+        len(batch_positions), error))
+      for task_num in batch_positions:
+        unindexed.add(task_num)
+        errors[task_num] = TransientError(
+          'Unable to index task {}: {}'.format(tasks[task_num].id, error))
+
+        # Without an index entry, the task could never be leased, and its
+        # name would stay taken.
+        try:
+          self._delete_task_and_index(tasks[task_num], retries)
+        except TRANSIENT_CASSANDRA_ERRORS as delete_error:
+          logger.error('Unable to delete unindexed task {}: {}'.format(
+            tasks[task_num].id, delete_error))
+
+    indexed = [task_num for task_num in inserted if task_num not in unindexed]
+    logger.debug('Added {} tasks'.format(len(indexed)))
+    if self.lease_notifier is not None:
+      for tag in set(getattr(tasks[task_num], 'tag', None)
+                     for task_num in indexed):
+        self.lease_notifier.task_added(self.name, tag)
+
+    return errors
+
   def get_task(self, task, omit_payload=False):
     """ Gets a task from the queue.
 
@@ -449,41 +563,22 @@ class PullQueue(Queue):
     Returns:
       A list of Task objects.
     """
-    session = self.db_access.session
+    # Start the shard scans concurrently and combine them in ETA order.
+    futures = [self._scan_shard_async(shard, page_size=limit)
+               for shard in range(INDEX_SHARDS)]
+    shard_entries = [future.result() for future in futures]
 
     tasks = []
-    start_date = datetime.datetime.utcfromtimestamp(0)
-    while True:
-      query_tasks = """
-        SELECT eta, id FROM pull_queue_tasks_index
-        WHERE token(app, queue, eta) > token(%(app)s, %(queue)s, %(eta)s)
-        AND token(app, queue, eta) < token(%(app)s, %(next_queue)s, 0)
-        LIMIT {limit}
-      """.format(limit=limit)
-      parameters = {'app': self.app, 'queue': self.name, 'eta': start_date,
-                    'next_queue': next_key(self.name)}
-      results = [result for result in session.execute(query_tasks, parameters)]
-
-      if not results:
-        break
-
-      satisfied_request = False
-      for result in results:
-        task = self.get_task(Task({'id': result.id}), omit_payload=True)
-        if task is None:
-          self._delete_index(result.eta, result.id)
-          continue
+    for result in heapq.merge(*shard_entries):
+      task = self.get_task(Task({'id': result.id}), omit_payload=True)
+      if task is None:
+        self._delete_index(result.eta, result.id)
+        continue
 
-        tasks.append(task)
-        if len(tasks) >= limit:
-          satisfied_request = True
-          break
-      if satisfied_request:
+      tasks.append(task)
+      if len(tasks) >= limit:
         break
 
-      # Update the cursor.
-      start_date = results[-1].eta
-
     return tasks
 
   def lease_tasks(self, num_tasks, lease_seconds, group_by_tag=False,
@@ -559,20 +654,35 @@ class PullQueue(Queue):
     logger.debug('Leased {} tasks [time elapsed: {}]'.format(len(leased), str(time_elapsed)))
     return leased
 
+  @gen.coroutine
+  def wait_for_tasks(self, timeout, group_by_tag=False, tag=None):
+    """ Waits until a task that a lease request could use is added.
+
+    Args:
+      timeout: A number specifying how many seconds to wait.
+      group_by_tag: A boolean indicating that only tasks of one tag should
+        be leased.
+      tag: A string containing the tag for the task.
+    Returns:
+      A boolean indicating whether or not a task was added before the
+      timeout.
+    """
+    if not group_by_tag:
+      tag = None
+
+    added = yield self.lease_notifier.wait(self.name, tag, timeout)
+    if added:
+      self._expire_empty_results()
+
+    raise gen.Return(added)
+
   def total_tasks(self):
     """ Get the total number of tasks in the queue.
 
     Returns:
       An integer specifying the number of tasks in the queue.
     """
-    select_count = """
-      SELECT COUNT(*) FROM pull_queue_tasks
-      WHERE token(app, queue, id) >= token(%(app)s, %(queue)s, '')
-      AND token(app, queue, id) < token(%(app)s, %(next_queue)s, '')
-    """
-    parameters = {'app': self.app, 'queue': self.name,
-                  'next_queue': next_key(self.name)}
-    return self.db_access.session.execute(select_count, parameters)[0].count
+    return self.stats_buffer.total_tasks(self.app, self.name)
 
   def oldest_eta(self):
     """ Get the ETA of the oldest task
@@ -583,23 +693,37 @@ class PullQueue(Queue):
     """
     session = self.db_access.session
     select_oldest = """
-      SELECT eta FROM pull_queue_tasks_index
-      WHERE token(app, queue, eta) >= token(%(app)s, %(queue)s, 0)
-      AND token(app, queue, eta) < token(%(app)s, %(next_queue)s, 0)
+      SELECT eta FROM pull_queue_sharded_index
+      WHERE token(app, queue, shard, eta) >=
+            token(%(app)s, %(queue)s, %(shard)s, 0)
+      AND token(app, queue, shard, eta) <
+          token(%(app)s, %(queue)s, %(next_shard)s, 0)
       LIMIT 1
     """
-    parameters = {'app': self.app, 'queue': self.name,
-                  'next_queue': next_key(self.name)}
-    try:
-      return session.execute(select_oldest, parameters)[0].eta
-    except IndexError:
+    futures = []
+    for shard in range(INDEX_SHARDS):
+      parameters = {'app': self.app, 'queue': self.name, 'shard': shard,
+                    'next_shard': shard + 1}
+      futures.append(session.execute_async(select_oldest, parameters))
+
+    etas = []
+    for future in futures:
+      try:
+        etas.append(future.result()[0].eta)
+      except IndexError:
+        continue
+
+    if not etas:
       return None
 
+    return min(etas)
+
   def purge(self):
     """ Remove all tasks from queue.
 
     Cassandra cannot perform a range scan during a delete, so this function
-    selects all the tasks before deleting them one at a time.
+    selects all the tasks before deleting them one at a time. Since every task
+    is visited, the queue's task count is corrected afterwards.
     """
     select_tasks = """
       SELECT id, enqueued, lease_expires FROM pull_queue_tasks
@@ -616,6 +740,11 @@ class PullQueue(Queue):
                    'leaseTimestamp': result.lease_expires}
       self._delete_task_and_index(Task(task_info))
 
+    # Tasks added during the purge are not deleted, so they are counted again.
+    remaining = sum(1 for _ in
+                    self.db_access.session.execute(select_tasks, parameters))
+    self.stats_buffer.reset_tasks(self.app, self.name, remaining)
+
   def to_json(self, include_stats=False, fields=None):
     """ Generate a JSON representation of the queue.
 
@@ -674,6 +803,167 @@ class PullQueue(Queue):
 
     return result.op_id == op_id
 
+  def _task_parameters(self, task, enqueue_time):
+    """ Prepares a task for insertion and fills in its queue details.
+
+    Args:
+      task: A Task object.
+      enqueue_time: A datetime object specifying when the task was added.
+    Returns:
+      A dictionary specifying the task entry.
+    """
+    try:
+      lease_expires = task.leaseTimestamp
+    except AttributeError:
+      lease_expires = datetime.datetime.utcfromtimestamp(0)
+
+    parameters = {
+      'app': self.app,
+      'queue': self.name,
+      'id': task.id,
+      'payload': task.payloadBase64,
+      'enqueued': enqueue_time,
+      'retry_count': 0,
+      'lease_expires': lease_expires,
+      'op_id': uuid.uuid4()
+    }
+
+    try:
+      parameters['tag'] = task.tag
+    except AttributeError:
+      parameters['tag'] = None
+
+    task.queueName = self.name
+    task.enqueueTimestamp = enqueue_time
+    task.leaseTimestamp = lease_expires
+    return parameters
+
+  def _index_parameters(self, task):
+    """ Fetches the index entry values for a task.
+
+    Args:
+      task: A Task object.
+    Returns:
+      A tuple containing the shard, ETA, ID, tag, and tag_exists values.
+    """
+    try:
+      tag = task.tag
+    except AttributeError:
+      # Insert an empty string for null values so that Cassandra can query for
+      # tasks where tag is not null.
+      tag = ''
+
+    return index_shard(task.id), task.get_eta(), task.id, tag, tag != ''
+
+  def _insert_tasks(self, pending, errors, retries):
+    """ Inserts task entries into pull_queue_tasks concurrently.
+
+    Args:
+      pending: A dictionary mapping request positions to task parameters.
+      errors: A list of errors to fill in for tasks that are not inserted.
+      retries: The number of times to try each insert.
+    Returns:
+      A list of request positions for the tasks that were inserted.
+    """
+    session = self.db_access.session
+    statement = """
+      INSERT INTO pull_queue_tasks (
+        app, queue, id, payload,
+        enqueued, lease_expires, retry_count, tag, op_id
+      )
+      VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+      IF NOT EXISTS
+    """
+    if statement not in self.prepared_statements:
+      self.prepared_statements[statement] = session.prepare(statement)
+    insert_task = self.prepared_statements[statement]
+    insert_task.retry_policy = NO_RETRIES
+
+    inserted = []
+    retried = set()
+    while pending and retries > 0:
+      retries -= 1
+      positions = sorted(pending)
+      statements_and_params = []
+      for task_num in positions:
+        parameters = pending[task_num]
+        statements_and_params.append((insert_task, (
+          parameters['app'], parameters['queue'], parameters['id'],
+          parameters['payload'], parameters['enqueued'],
+          parameters['lease_expires'], parameters['retry_count'],
+          parameters['tag'], parameters['op_id'])))
+
+      results = execute_concurrent(session, statements_and_params,
+                                   concurrency=self.ADD_CONCURRENCY,
+                                   raise_on_first_error=False)
+      for task_num, (success, result) in zip(positions, results):
+        parameters = pending[task_num]
+        if not success:
+          if not isinstance(result, TRANSIENT_CASSANDRA_ERRORS):
+            # Other errors are not retried, but they do not prevent the rest
+            # of the tasks from being inserted and indexed.
+            del pending[task_num]
+            errors[task_num] = result
+            continue
+
+          retried.add(task_num)
+          errors[task_num] = TransientError(
+            'Unable to insert task {}: {}'.format(parameters['id'], result))
+          continue
+
+        del pending[task_num]
+        # A timed out attempt may have been applied.
+        if (result.was_applied or (task_num in retried and
+            self._task_mutated_by_id(parameters['id'],
+                                     parameters['op_id']))):
+          errors[task_num] = None
+          inserted.append(task_num)
+        else:
+          errors[task_num] = InvalidTaskInfo(
+            'Task name already taken: {}'.format(parameters['id']))
+
+      if pending and retries > 0:
+        logger.warning(
+          'Encountered errors while inserting {} tasks. Retrying.'.format(
+            len(pending)))
+
+    return sorted(inserted)
+
+  def _insert_index_batches(self, batches, retries):
+    """ Writes batches of index entries concurrently.
+
+    Index inserts are idempotent, so the batches that fail are sent again.
+
+    Args:
+      batches: A list of tuples containing the request positions of the tasks
+        in a batch and the BatchStatement that indexes them.
+      retries: The number of times to try each batch.
+    Returns:
+      A list of tuples containing the request positions of the tasks in each
+      batch that could not be written and the last error for that batch.
+    """
+    session = self.db_access.session
+    failed = []
+    while batches and retries > 0:
+      retries -= 1
+      futures = [(batch_positions, batch, session.execute_async(batch))
+                 for batch_positions, batch in batches]
+      batches = []
+      failed = []
+      for batch_positions, batch, future in futures:
+        try:
+          future.result()
+        except Exception as error:
+          batches.append((batch_positions, batch))
+          failed.append((batch_positions, error))
+
+      if batches and retries > 0:
+        logger.warning(
+          'Encountered errors while indexing {} tasks. Retrying.'.format(
+            sum(len(batch_positions) for batch_positions, _ in batches)))
+
+    return failed
+
   def _insert_task(self, parameters, retries):
     """ Insert task entry into pull_queue_tasks.
 
@@ -752,11 +1042,33 @@ class PullQueue(Queue):
     if not self._task_mutated_by_id(parameters['id'], parameters['op_id']):
       raise InvalidLeaseRequest('The task lease has expired.')
 
-  def _query_index(self, num_tasks, group_by_tag=False, tag=None):
-    """ Query the index table for available tasks.
+  def _scan_shard_async(self, shard, page_size):
+    """ Starts a scan of the entries in an index shard in ETA order.
+
+    Args:
+      shard: An integer specifying the index shard.
+      page_size: An integer specifying the number of entries to fetch at a
+        time.
+    Returns:
+      A ResponseFuture whose result fetches further pages as it is iterated.
+    """
+    query_tasks = SimpleStatement("""
+      SELECT eta, id FROM pull_queue_sharded_index
+      WHERE token(app, queue, shard, eta) >=
+            token(%(app)s, %(queue)s, %(shard)s, 0)
+      AND token(app, queue, shard, eta) <
+          token(%(app)s, %(queue)s, %(next_shard)s, 0)
+    """, fetch_size=page_size)
+    parameters = {'app': self.app, 'queue': self.name, 'shard': shard,
+                  'next_shard': shard + 1}
+    return self.db_access.session.execute_async(query_tasks, parameters)
+
+  def _query_index(self, num_tasks, shard, group_by_tag=False, tag=None):
+    """ Query an index shard for available tasks.
 
     Args:
       num_tasks: An integer specifying the number of tasks to lease.
+      shard: An integer specifying the index shard.
       group_by_tag: A boolean indicating that only tasks of one tag should
         be leased.
       tag: A string containing the tag for the task.
@@ -766,27 +1078,37 @@ class PullQueue(Queue):
     """
     if group_by_tag:
       query_tasks = """
-        SELECT eta, id FROM pull_queue_tasks_index
-        WHERE token(app, queue, eta) >= token(%(app)s, %(queue)s, 0)
-        AND token(app, queue, eta) <= token(%(app)s, %(queue)s, dateof(now()))
+        SELECT eta, id FROM pull_queue_sharded_index
+        WHERE token(app, queue, shard, eta) >=
+              token(%(app)s, %(queue)s, %(shard)s, 0)
+        AND token(app, queue, shard, eta) <=
+            token(%(app)s, %(queue)s, %(shard)s, dateof(now()))
         AND tag = %(tag)s
         LIMIT {limit}
       """.format(limit=num_tasks)
-      parameters = {'app': self.app, 'queue': self.name, 'tag': tag}
+      parameters = {'app': self.app, 'queue': self.name, 'shard': shard,
+                    'tag': tag}
       results = self.db_access.session.execute(query_tasks, parameters)
     else:
       query_tasks = """
-        SELECT eta, id FROM pull_queue_tasks_index
-        WHERE token(app, queue, eta) >= token(%(app)s, %(queue)s, 0)
-        AND token(app, queue, eta) <= token(%(app)s, %(queue)s, dateof(now()))
+        SELECT eta, id FROM pull_queue_sharded_index
+        WHERE token(app, queue, shard, eta) >=
+              token(%(app)s, %(queue)s, %(shard)s, 0)
+        AND token(app, queue, shard, eta) <=
+            token(%(app)s, %(queue)s, %(shard)s, dateof(now()))
         LIMIT {limit}
       """.format(limit=num_tasks)
-      parameters = {'app': self.app, 'queue': self.name}
+      parameters = {'app': self.app, 'queue': self.name, 'shard': shard}
       results = self.db_access.session.execute(query_tasks, parameters)
     return results
 
   def _query_available_tasks(self, num_tasks, group_by_tag=False, tag=None):
-    """ Query the cache or index table for available tasks.
+    """ Query the index shards for available tasks.
+
+    Each request starts with a random shard so that concurrent leases tend to
+    compete for different tasks. When that shard runs short, the request
+    takes tasks from the other shards in turn. The shards are not walked
+    while every shard's cache shows that it recently had no tasks.
 
     Args:
       num_tasks: An integer specifying the number of tasks to lease.
@@ -794,41 +1116,74 @@ class PullQueue(Queue):
         be leased.
       tag: A string containing the tag for the task.
 
+    Returns:
+      A list of index results.
+    """
+    if self._index_recently_empty(group_by_tag, tag):
+      return []
+
+    first_shard = random.randrange(INDEX_SHARDS)
+    results = []
+    for offset in range(INDEX_SHARDS):
+      shard = (first_shard + offset) % INDEX_SHARDS
+      results.extend(self._query_available_shard_tasks(
+        num_tasks - len(results), shard, group_by_tag, tag))
+      if len(results) >= num_tasks:
+        break
+
+    return results
+
+  def _query_available_shard_tasks(self, num_tasks, shard, group_by_tag=False,
+                                   tag=None):
+    """ Query the cache or an index shard for available tasks.
+
+    Args:
+      num_tasks: An integer specifying the number of tasks to lease.
+      shard: An integer specifying the index shard.
+      group_by_tag: A boolean indicating that only tasks of one tag should
+        be leased.
+      tag: A string containing the tag for the task.
+
     Returns:
       A list of index results.
     """
     # If the request is larger than the max cache size, don't use the cache.
     if num_tasks > self.MAX_CACHE_SIZE:
-      return self._query_index(num_tasks, group_by_tag, tag)
+      return list(self._query_index(num_tasks, shard, group_by_tag, tag))
 
     with self.index_cache_lock:
       if group_by_tag:
         if tag not in self.index_cache['by_tag']:
           self.index_cache['by_tag'][tag] = {}
-        tag_cache = self.index_cache['by_tag'][tag]
+        shard_caches = self.index_cache['by_tag'][tag]
       else:
-        tag_cache = self.index_cache['global']
+        shard_caches = self.index_cache['global']
+
+      if shard not in shard_caches:
+        shard_caches[shard] = {}
+      tag_cache = shard_caches[shard]
 
       # If results have never been fetched, populate the cache.
+      fetched = False
       if not tag_cache:
-        results = self._query_index(self.MAX_CACHE_SIZE, group_by_tag, tag)
+        results = self._query_index(self.MAX_CACHE_SIZE, shard, group_by_tag,
+                                    tag)
         tag_cache['queue'] = deque(results)
         tag_cache['last_fetch'] = datetime.datetime.now()
         tag_cache['last_results'] = len(tag_cache['queue'])
+        fetched = True
 
       # If 0 results were fetched recently, don't try fetching again.
-      recently = datetime.datetime.now() - datetime.timedelta(
-        seconds=self.EMPTY_RESULTS_COOLDOWN)
-      if (not tag_cache['queue'] and tag_cache['last_results'] == 0 and
-          tag_cache['last_fetch'] > recently):
+      if self._recently_empty(tag_cache):
         return []
 
       # If the cache is outdated or insufficient, update it.
       outdated = datetime.datetime.now() - datetime.timedelta(
         seconds=self.MAX_CACHE_DURATION)
-      if (num_tasks > len(tag_cache['queue']) or
-          tag_cache['last_fetch'] < outdated):
-        results = self._query_index(self.MAX_CACHE_SIZE, group_by_tag, tag)
+      if not fetched and (num_tasks > len(tag_cache['queue']) or
+                          tag_cache['last_fetch'] < outdated):
+        results = self._query_index(self.MAX_CACHE_SIZE, shard, group_by_tag,
+                                    tag)
         tag_cache['queue'] = deque(results)
         tag_cache['last_fetch'] = datetime.datetime.now()
         tag_cache['last_results'] = len(tag_cache['queue'])
@@ -843,6 +1198,52 @@ class PullQueue(Queue):
 
       return results
 
+  def _recently_empty(self, tag_cache):
+    """ Checks if a shard's cache recently fetched 0 index results.
+
+    Args:
+      tag_cache: A dictionary containing the cache for one shard.
+    Returns:
+      A boolean indicating whether or not the shard can be skipped.
+    """
+    if not tag_cache:
+      return False
+
+    recently = datetime.datetime.now() - datetime.timedelta(
+      seconds=self.EMPTY_RESULTS_COOLDOWN)
+    return (not tag_cache['queue'] and tag_cache['last_results'] == 0 and
+            tag_cache['last_fetch'] > recently)
+
+  def _index_recently_empty(self, group_by_tag=False, tag=None):
+    """ Checks if every shard's cache recently fetched 0 index results.
+
+    Args:
+      group_by_tag: A boolean indicating that only tasks of one tag should
+        be leased.
+      tag: A string containing the tag for the task.
+    Returns:
+      A boolean indicating whether or not the shards can be skipped.
+    """
+    with self.index_cache_lock:
+      if group_by_tag:
+        shard_caches = self.index_cache['by_tag'].get(tag, {})
+      else:
+        shard_caches = self.index_cache['global']
+
+      return (len(shard_caches) == INDEX_SHARDS and
+              all(self._recently_empty(tag_cache)
+                  for tag_cache in shard_caches.itervalues()))
+
+  def _expire_empty_results(self):
+    """ Allows the index to be queried again after fetching 0 results. """
+    with self.index_cache_lock:
+      shard_caches_list = [self.index_cache['global']]
+      shard_caches_list.extend(self.index_cache['by_tag'].values())
+      for shard_caches in shard_caches_list:
+        for shard, tag_cache in shard_caches.items():
+          if tag_cache and not tag_cache['queue']:
+            del shard_caches[shard]
+
   def _get_earliest_tag(self):
     """ Get the tag with the earliest ETA.
 
@@ -850,7 +1251,8 @@ class PullQueue(Queue):
       A string containing a tag or None.
     """
     get_earliest_tag = """
-      SELECT tag FROM pull_queue_tasks_index WHERE tag_exists = true LIMIT 1
+      SELECT tag FROM pull_queue_sharded_index
+      WHERE tag_exists = true LIMIT 1
     """
     try:
       tag = self.db_access.session.execute(get_earliest_tag)[0].tag
@@ -965,7 +1367,10 @@ class PullQueue(Queue):
 
       self._increment_count_async(task)
       index_update_futures.append(self._update_index_async(index, task))
-      self._update_stats()
+
+    leased_count = sum(1 for task in leased if task is not None)
+    if leased_count:
+      self.stats_buffer.record_leases(self.app, self.name, leased_count)
 
     # Make sure all of the index updates complete successfully.
     for index_update in index_update_futures:
@@ -987,10 +1392,12 @@ class PullQueue(Queue):
     old_eta = old_index.eta
     update_index = BatchStatement(retry_policy=BASIC_RETRIES)
 
+    shard = index_shard(task.id)
     statement = """
-      DELETE FROM pull_queue_tasks_index
+      DELETE FROM pull_queue_sharded_index
       WHERE app=?
       AND queue=?
+      AND shard=?
       AND eta=?
       AND id=?
     """
@@ -998,12 +1405,13 @@ class PullQueue(Queue):
       self.prepared_statements[statement] = session.prepare(statement)
     delete_old_index = self.prepared_statements[statement]
 
-    parameters = [self.app, self.name, old_eta, task.id]
+    parameters = [self.app, self.name, shard, old_eta, task.id]
     update_index.add(delete_old_index, parameters)
 
     statement = """
-      INSERT INTO pull_queue_tasks_index (app, queue, eta, id, tag, tag_exists)
-      VALUES (?, ?, ?, ?, ?, ?)
+      INSERT INTO pull_queue_sharded_index
+        (app, queue, shard, eta, id, tag, tag_exists)
+      VALUES (?, ?, ?, ?, ?, ?, ?)
     """
     if statement not in self.prepared_statements:
       self.prepared_statements[statement] = session.prepare(statement)
@@ -1015,8 +1423,8 @@ class PullQueue(Queue):
       tag = ''
     tag_exists = tag != ''
 
-    parameters = [self.app, self.name, task.leaseTimestamp, task.id, tag,
-                  tag_exists]
+    parameters = [self.app, self.name, shard, task.leaseTimestamp, task.id,
+                  tag, tag_exists]
     update_index.add(create_new_index, parameters)
 
     return self.db_access.session.execute_async(update_index)
@@ -1029,14 +1437,15 @@ class PullQueue(Queue):
       task_id: A string containing the task ID.
     """
     delete_index = """
-      DELETE FROM pull_queue_tasks_index
+      DELETE FROM pull_queue_sharded_index
       WHERE app = %(app)s
       AND queue = %(queue)s
+      AND shard = %(shard)s
       AND eta = %(eta)s
       AND id = %(id)s
     """
-    parameters = {'app': self.app, 'queue': self.name, 'eta': eta,
-                  'id': task_id}
+    parameters = {'app': self.app, 'queue': self.name,
+                  'shard': index_shard(task_id), 'eta': eta, 'id': task_id}
     self.db_access.session.execute(delete_index, parameters)
 
   def _delete_task_and_index(self, task, retries=5):
@@ -1052,7 +1461,8 @@ class PullQueue(Queue):
     """, retry_policy=NO_RETRIES)
     parameters = {'app': self.app, 'queue': self.name, 'id': task.id}
     try:
-      self.db_access.session.execute(delete_task, parameters=parameters)
+      result = self.db_access.session.execute(delete_task,
+                                              parameters=parameters)
     except TRANSIENT_CASSANDRA_ERRORS as error:
       retries_left = retries - 1
       if retries_left <= 0:
@@ -1061,16 +1471,21 @@ class PullQueue(Queue):
         'Encountered error while deleting task: {}. Retrying.'.format(error))
       return self._delete_task_and_index(task, retries=retries_left)
 
+    if result.was_applied:
+      self.stats_buffer.record_tasks(self.app, self.name, -1)
+
     delete_task_index = SimpleStatement("""
-      DELETE FROM pull_queue_tasks_index
+      DELETE FROM pull_queue_sharded_index
       WHERE app = %(app)s
       AND queue = %(queue)s
+      AND shard = %(shard)s
       AND eta = %(eta)s
       AND id = %(id)s
     """)
     parameters = {
       'app': self.app,
       'queue': self.name,
+      'shard': index_shard(task.id),
       'eta': task.get_eta(),
       'id': task.id
     }
@@ -1095,23 +1510,6 @@ class PullQueue(Queue):
     if task.leaseTimestamp != index.eta:
       self._update_index_async(index, task).result()
 
-  def _update_stats(self):
-    """ Write queue metadata for keeping track of statistics. """
-    session = self.db_access.session
-    # Stats are only kept for one hour.
-    ttl = 60 * 60
-    statement = """
-      INSERT INTO pull_queue_leases (app, queue, leased)
-      VALUES (?, ?, ?)
-      USING TTL {ttl}
-    """.format(ttl=ttl)
-    if statement not in self.prepared_statements:
-      self.prepared_statements[statement] = session.prepare(statement)
-    record_lease = self.prepared_statements[statement]
-
-    parameters = [self.app, self.name, datetime.datetime.utcnow()]
-    self.db_access.session.execute_async(record_lease, parameters)
-
   def _get_stats(self, fields):
     """ Fetch queue statistics.
 
@@ -1120,7 +1518,6 @@ class PullQueue(Queue):
     Returns:
       A dictionary containing queue statistics.
     """
-    session = self.db_access.session
     stats = {}
 
     if 'totalTasks' in fields:
@@ -1131,29 +1528,14 @@ class PullQueue(Queue):
       oldest_eta = self.oldest_eta() or epoch
       stats['oldestTask'] = int((oldest_eta - epoch).total_seconds())
 
+    now = datetime.datetime.utcnow()
     if 'leasedLastMinute' in fields:
-      select_count = """
-        SELECT COUNT(*) from pull_queue_leases
-        WHERE token(app, queue, leased) > token(%(app)s, %(queue)s, %(ts)s)
-        AND token(app, queue, leased) <=
-            token(%(app)s, %(queue)s, dateof(now()))
-      """
-      start_time = datetime.datetime.utcnow() - datetime.timedelta(seconds=60)
-      parameters = {'app': self.app, 'queue': self.name, 'ts': start_time}
-      leased_last_minute = session.execute(select_count, parameters)[0].count
-      stats['leasedLastMinute'] = leased_last_minute
+      stats['leasedLastMinute'] = self.stats_buffer.leased_since(
+        self.app, self.name, now - datetime.timedelta(seconds=60))
 
     if 'leasedLastHour' in fields:
-      select_count = """
-        SELECT COUNT(*) from pull_queue_leases
-        WHERE token(app, queue, leased) > token(%(app)s, %(queue)s, %(ts)s)
-        AND token(app, queue, leased) <=
-            token(%(app)s, %(queue)s, dateof(now()))
-      """
-      start_time = datetime.datetime.utcnow() - datetime.timedelta(minutes=60)
-      parameters = {'app': self.app, 'queue': self.name, 'ts': start_time}
-      leased_last_hour = session.execute(select_count, parameters)[0].count
-      stats['leasedLastHour'] = leased_last_hour
+      stats['leasedLastHour'] = self.stats_buffer.leased_since(
+        self.app, self.name, now - datetime.timedelta(minutes=60))
 
     return stats
 
@@ -5,24 +5,29 @@ import json
 from tornado.ioloop import IOLoop
 
 from appscale.taskqueue.utils import create_celery_for_app
+from .lease_notifier import LeaseNotifier
 from .queue import PullQueue
 from .queue import PushQueue
+from .queue_stats import QueueStatsBuffer
 from .utils import logger
 
 
 class ProjectQueueManager(dict):
   """ Keeps track of queue configuration details for a single project. """
-  def __init__(self, zk_client, db_access, project_id):
+  def __init__(self, zk_client, db_access, project_id, stats_buffer=None):
     """ Creates a new ProjectQueueManager.
 
     Args:
       zk_client: A KazooClient.
       db_access: A DatastoreProxy.
       project_id: A string specifying a project ID.
+      stats_buffer: A QueueStatsBuffer shared by the project's pull queues.
     """
     super(ProjectQueueManager, self).__init__()
     self.project_id = project_id
     self.db_access = db_access
+    self.stats_buffer = stats_buffer
+    self.lease_notifier = LeaseNotifier(zk_client, project_id)
     queues_node = '/appscale/projects/{}/queues'.format(project_id)
     self.watch = zk_client.DataWatch(queues_node, self._update_queues_watch)
     self.celery = None
@@ -56,7 +61,8 @@ class ProjectQueueManager(dict):
         self[queue_name] = PushQueue(queue_info, self.project_id)
       else:
         self[queue_name] = PullQueue(queue_info, self.project_id,
-                                     self.db_access)
+                                     self.db_access, self.stats_buffer,
+                                     self.lease_notifier)
 
     # Establish a new Celery connection based on the new queues, and close the
     # old one.
@@ -76,6 +82,7 @@ class ProjectQueueManager(dict):
   def stop(self):
     """ Removes all cached queue configuration and closes connection. """
     self.watch._stopped = True
+    self.lease_notifier.stop()
     if self.celery is not None:
       self.celery.close()
 
@@ -104,6 +111,7 @@ class GlobalQueueManager(dict):
     super(GlobalQueueManager, self).__init__()
     self.zk_client = zk_client
     self.db_access = db_access
+    self.stats_buffer = QueueStatsBuffer(db_access.session)
     zk_client.ensure_path('/appscale/projects')
     zk_client.ChildrenWatch('/appscale/projects', self._update_projects_watch)
 
@@ -122,7 +130,7 @@ class GlobalQueueManager(dict):
     for project_id in new_project_list:
       if project_id not in self:
         self[project_id] = ProjectQueueManager(self.zk_client, self.db_access,
-                                               project_id)
+                                               project_id, self.stats_buffer)
 
   def _update_projects_watch(self, new_projects):
     """ Handles creation and deletion of projects.
@@ -0,0 +1,279 @@
+""" Keeps pull queue statistics up to date as tasks change. """
+
+import datetime
+import random
+import threading
+import uuid
+
+from appscale.common.periodic_flusher import PeriodicFlusher
+from appscale.datastore.cassandra_env.retry_policies import BASIC_RETRIES
+from appscale.datastore.dbconstants import TRANSIENT_CASSANDRA_ERRORS
+from cassandra.query import SimpleStatement
+from .utils import logger
+
+# The number of counter rows that share the task count of each queue.
+COUNT_SHARDS = 16
+
+# The number of seconds covered by each lease count.
+LEASE_BUCKET_SECONDS = 10
+
+# The number of seconds that lease counts are kept for.
+LEASE_HISTORY_SECONDS = 60 * 60
+
+# The number of seconds between writes of the accumulated changes.
+FLUSH_INTERVAL = 5
+
+
+def lease_bucket(timestamp):
+  """ Finds the lease count that a time belongs to.
+
+  Args:
+    timestamp: A datetime object.
+  Returns:
+    A datetime object specifying the start of the bucket.
+  """
+  epoch = datetime.datetime.utcfromtimestamp(0)
+  seconds = int((timestamp - epoch).total_seconds())
+  return epoch + datetime.timedelta(
+    seconds=seconds - seconds % LEASE_BUCKET_SECONDS)
+
+
+def prepare_count_update(session):
+  """ Prepares the statement that changes a task count.
+
+  Args:
+    session: A cassandra-driver session.
+  Returns:
+    A PreparedStatement.
+  """
+  update = session.prepare("""
+    UPDATE pull_queue_task_counts SET tasks = tasks + ?
+    WHERE app = ? AND queue = ? AND shard = ?
+  """)
+  update.retry_policy = BASIC_RETRIES
+  return update
+
+
+def update_task_counts(session, deltas, shard=None, update=None):
+  """ Adds changes to the task count table.
+
+  Args:
+    session: A cassandra-driver session.
+    deltas: A dictionary mapping (app, queue) tuples to the change in the
+      number of tasks.
+    shard: An integer specifying the counter rows to update. By default, a
+      random shard is used.
+    update: A PreparedStatement from prepare_count_update. By default, the
+      statement is prepared.
+  """
+  if shard is None:
+    shard = random.randrange(COUNT_SHARDS)
+
+  if update is None:
+    update = prepare_count_update(session)
+
+  for (app, queue), delta in deltas.iteritems():
+    if delta:
+      session.execute(update, (delta, app, queue, shard))
+
+
+class QueueStatsBuffer(object):
+  """ Accumulates pull queue statistics in memory and writes them to
+  Cassandra periodically.
+
+  Task counts are kept in counter columns that are sharded to spread out
+  the updates. A count can drift when a retried update was already applied
+  or when a server stops before writing its changes. Purging the queue
+  corrects it.
+
+  Lease counts are kept by each server for short time buckets. Each server
+  overwrites its own totals, and the rows expire after an hour.
+  """
+  def __init__(self, session, flush_interval=FLUSH_INTERVAL):
+    """ Creates a new QueueStatsBuffer.
+
+    Args:
+      session: A cassandra-driver session.
+      flush_interval: An integer specifying how many seconds to wait between
+        writes.
+    """
+    self.session = session
+    self.writer = uuid.uuid4()
+
+    self._lock = threading.Lock()
+    self._task_deltas = {}
+    self._leases = {}
+    self._unwritten_buckets = set()
+    self._count_update = None
+    self._flusher = PeriodicFlusher(self.flush, flush_interval)
+
+  def record_tasks(self, app, queue, delta):
+    """ Records a change in the number of tasks in a queue.
+
+    Args:
+      app: A string specifying the project ID.
+      queue: A string specifying the queue name.
+      delta: An integer specifying the change in the number of tasks.
+    """
+    with self._lock:
+      key = (app, queue)
+      self._task_deltas[key] = self._task_deltas.get(key, 0) + delta
+
+    self._flusher.start()
+
+  def record_leases(self, app, queue, count):
+    """ Records tasks that were leased.
+
+    Args:
+      app: A string specifying the project ID.
+      queue: A string specifying the queue name.
+      count: An integer specifying the number of tasks leased.
+    """
+    key = (app, queue, lease_bucket(datetime.datetime.utcnow()))
+    with self._lock:
+      self._leases[key] = self._leases.get(key, 0) + count
+      self._unwritten_buckets.add(key)
+
+    self._flusher.start()
+
+  def total_tasks(self, app, queue):
+    """ Fetches the number of tasks in a queue.
+
+    Args:
+      app: A string specifying the project ID.
+      queue: A string specifying the queue name.
+    Returns:
+      An integer specifying the number of tasks in the queue.
+    """
+    select_counts = """
+      SELECT tasks FROM pull_queue_task_counts
+      WHERE app = %(app)s AND queue = %(queue)s
+    """
+    parameters = {'app': app, 'queue': queue}
+    total = sum(row.tasks for row in
+                self.session.execute(select_counts, parameters))
+    with self._lock:
+      total += self._task_deltas.get((app, queue), 0)
+
+    return max(total, 0)
+
+  def leased_since(self, app, queue, start_time):
+    """ Fetches the number of tasks leased from a queue since a given time.
+
+    The count includes the whole bucket that start_time falls in, so it can
+    include leases from up to LEASE_BUCKET_SECONDS earlier.
+
+    Args:
+      app: A string specifying the project ID.
+      queue: A string specifying the queue name.
+      start_time: A datetime object.
+    Returns:
+      An integer specifying the number of tasks leased.
+    """
+    first_bucket = lease_bucket(start_time)
+    select_leases = """
+      SELECT writer, leased FROM pull_queue_lease_counts
+      WHERE app = %(app)s AND queue = %(queue)s AND bucket >= %(bucket)s
+    """
+    parameters = {'app': app, 'queue': queue, 'bucket': first_bucket}
+    total = sum(row.leased for row in
+                self.session.execute(select_leases, parameters)
+                if row.writer != self.writer)
+
+    # This server's own counts are taken from memory since they may not have
+    # been written yet.
+    with self._lock:
+      total += sum(count for (lease_app, lease_queue, bucket), count
+                   in self._leases.iteritems()
+                   if lease_app == app and lease_queue == queue and
+                   bucket >= first_bucket)
+
+    return total
+
+  def reset_tasks(self, app, queue, total):
+    """ Corrects the task count of a queue.
+
+    Args:
+      app: A string specifying the project ID.
+      queue: A string specifying the queue name.
+      total: An integer specifying the actual number of tasks.
+    """
+    current = self.total_tasks(app, queue)
+    if current != total:
+      self._update_task_counts({(app, queue): total - current}, shard=0)
+
+  def flush(self):
+    """ Writes the pending statistics. """
+    oldest_bucket = lease_bucket(
+      datetime.datetime.utcnow() -
+      datetime.timedelta(seconds=LEASE_HISTORY_SECONDS))
+    with self._lock:
+      task_deltas = self._task_deltas
+      self._task_deltas = {}
+      lease_counts = {key: self._leases[key]
+                      for key in self._unwritten_buckets
+                      if key in self._leases}
+      self._unwritten_buckets = set()
+      for key in list(self._leases):
+        if key[2] < oldest_bucket:
+          del self._leases[key]
+
+    if task_deltas:
+      try:
+        self._update_task_counts(task_deltas)
+      except TRANSIENT_CASSANDRA_ERRORS:
+        logger.exception('Unable to update queue task counts')
+        with self._lock:
+          for key, delta in task_deltas.iteritems():
+            self._task_deltas[key] = self._task_deltas.get(key, 0) + delta
+
+    if lease_counts:
+      self._write_lease_counts(lease_counts)
+
+  def stop(self):
+    """ Stops the background thread and writes the pending statistics. """
+    self._flusher.stop()
+    self.flush()
+
+  def _update_task_counts(self, deltas, shard=None):
+    """ Adds changes to the task count table with a statement that is only
+    prepared once.
+
+    Args:
+      deltas: A dictionary mapping (app, queue) tuples to the change in the
+        number of tasks.
+      shard: An integer specifying the counter rows to update.
+    """
+    if self._count_update is None:
+      self._count_update = prepare_count_update(self.session)
+
+    update_task_counts(self.session, deltas, shard=shard,
+                       update=self._count_update)
+
+  def _write_lease_counts(self, lease_counts):
+    """ Writes this server's lease totals.
+
+    Args:
+      lease_counts: A dictionary mapping (app, queue, bucket) tuples to the
+        number of tasks leased.
+    """
+    insert = SimpleStatement("""
+      INSERT INTO pull_queue_lease_counts (app, queue, bucket, writer, leased)
+      VALUES (%(app)s, %(queue)s, %(bucket)s, %(writer)s, %(leased)s)
+      USING TTL {ttl}
+    """.format(ttl=LEASE_HISTORY_SECONDS + LEASE_BUCKET_SECONDS),
+      retry_policy=BASIC_RETRIES)
+    futures = {}
+    for (app, queue, bucket), leased in lease_counts.iteritems():
+      parameters = {'app': app, 'queue': queue, 'bucket': bucket,
+                    'writer': self.writer, 'leased': leased}
+      futures[(app, queue, bucket)] = self.session.execute_async(
+        insert, parameters)
+
+    for key, future in futures.iteritems():
+      try:
+        future.result()
+      except TRANSIENT_CASSANDRA_ERRORS:
+        logger.exception('Unable to write lease count')
+        with self._lock:
+          self._unwritten_buckets.add(key)
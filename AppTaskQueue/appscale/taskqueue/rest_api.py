@@ -1,12 +1,14 @@
 """ Handlers for implementing v1beta2 of the taskqueue REST API. """
 import json
 import re
+import time
 import tornado.escape
 
 from appscale.common.constants import HTTPCodes
 from task import InvalidTaskInfo
 from task import Task
 from task import TASK_FIELDS
+from tornado import gen
 from tornado.web import MissingArgumentError
 from tornado.web import RequestHandler
 from .queue import (InvalidLeaseRequest,
@@ -182,6 +184,101 @@ class RESTTasks(RequestHandler):
     self.write(json.dumps(task.json_safe_dict(fields=fields)))
 
 
+class RESTBatchTasks(RequestHandler):
+  PATH = '{}/([a-zA-Z0-9-]+)/tasks/batch'.format(REST_PREFIX)
+
+  def initialize(self, queue_handler):
+    """ Provide access to the queue handler. """
+    self.queue_handler = queue_handler
+
+  def post(self, project, queue):
+    """ Insert several tasks into an existing queue.
+
+    The request body contains a list of tasks under "items". The response
+    contains an item for each task, which is either the inserted task or an
+    error.
+
+    Args:
+      project: A string containing an application ID.
+      queue: A string containing a queue name.
+    """
+    try:
+      task_infos = tornado.escape.json_decode(self.request.body)['items']
+    except (ValueError, KeyError, TypeError):
+      write_error(self, HTTPCodes.BAD_REQUEST,
+                  'The request body must contain a list of tasks.')
+      return
+
+    if not isinstance(task_infos, list):
+      write_error(self, HTTPCodes.BAD_REQUEST,
+                  'The request body must contain a list of tasks.')
+      return
+
+    if len(task_infos) > PullQueue.MAX_ADD_AMOUNT:
+      write_error(self, HTTPCodes.BAD_REQUEST,
+                  'Only {} tasks can be added at a time.'.format(
+                    PullQueue.MAX_ADD_AMOUNT))
+      return
+
+    tasks = []
+    for task_info in task_infos:
+      if not isinstance(task_info, dict) or 'payloadBase64' not in task_info:
+        write_error(self, HTTPCodes.BAD_REQUEST,
+                    'payloadBase64 must be specified.')
+        return
+
+      if not BASE64_CHARS_RE.match(task_info['payloadBase64']):
+        write_error(self, HTTPCodes.BAD_REQUEST,
+                    'Invalid payloadBase64 value.')
+        return
+
+      try:
+        tasks.append(Task(task_info))
+      except TypeError:
+        write_error(self, HTTPCodes.BAD_REQUEST,
+                    'Invalid payloadBase64 value.')
+        return
+
+    requested_fields = self.get_argument('fields', None)
+    if requested_fields is None:
+      fields = ('kind', {'items': TASK_FIELDS})
+    else:
+      fields = parse_fields(requested_fields)
+
+    queue = self.queue_handler.get_queue(project, queue)
+    if queue is None:
+      write_error(self, HTTPCodes.NOT_FOUND, 'Queue not found.')
+      return
+
+    if not isinstance(queue, PullQueue):
+      write_error(self, HTTPCodes.BAD_REQUEST,
+                  'Tasks can only be inserted into pull queues.')
+      return
+
+    errors = queue.add_tasks(tasks)
+
+    task_list = {}
+    if 'kind' in fields:
+      task_list['kind'] = 'taskqueues#tasks'
+
+    for field in fields:
+      if not isinstance(field, dict) or 'items' not in field:
+        continue
+
+      task_list['items'] = []
+      for task, error in zip(tasks, errors):
+        if isinstance(error, InvalidTaskInfo):
+          task_list['items'].append({'error': {
+            'code': HTTPCodes.BAD_REQUEST, 'message': error.message}})
+        elif error is not None:
+          task_list['items'].append({'error': {
+            'code': HTTPCodes.INTERNAL_ERROR, 'message': str(error)}})
+        else:
+          task_list['items'].append(task.json_safe_dict(fields=field['items']))
+
+    self.write(json.dumps(task_list))
+
+
 class RESTLease(RequestHandler):
   PATH = '{}/([a-zA-Z0-9-]+)/tasks/lease'.format(REST_PREFIX)
 
@@ -189,9 +286,17 @@ class RESTLease(RequestHandler):
     """ Provide access to the queue handler. """
     self.queue_handler = queue_handler
 
+  # The number of seconds a waiting request sleeps before checking the queue
+  # again in case a notification was missed.
+  RECHECK_INTERVAL = 10
+
+  @gen.coroutine
   def post(self, project, queue):
     """ Acquire a lease on the topmost N unowned tasks in a queue.
 
+    If waitSecs is given and no tasks are available, the request waits for
+    tasks to be added to the queue until that many seconds have passed.
+
     Args:
       project: A string containing an application ID.
       queue: A string containing a queue name.
@@ -224,6 +329,18 @@ class RESTLease(RequestHandler):
 
     tag = self.get_argument('tag', None)
 
+    try:
+      wait_seconds = int(self.get_argument('waitSecs', 0))
+    except ValueError:
+      write_error(self, HTTPCodes.BAD_REQUEST, 'waitSecs must be an integer.')
+      return
+
+    if wait_seconds < 0 or wait_seconds > PullQueue.MAX_LEASE_WAIT_TIME:
+      write_error(self, HTTPCodes.BAD_REQUEST,
+                  'waitSecs must be between 0 and {}.'.format(
+                    PullQueue.MAX_LEASE_WAIT_TIME))
+      return
+
     requested_fields = self.get_argument('fields', None)
     if requested_fields is None:
       fields = ('kind', {'items': TASK_FIELDS})
@@ -235,14 +352,23 @@ class RESTLease(RequestHandler):
       write_error(self, HTTPCodes.NOT_FOUND, 'Queue not found.')
       return
 
-    try:
-      tasks = queue.lease_tasks(num_tasks, lease_seconds, group_by_tag, tag)
-    except InvalidLeaseRequest as lease_error:
-      write_error(self, HTTPCodes.BAD_REQUEST, lease_error.message)
-      return
-    except TransientError as lease_error:
-      write_error(self, HTTPCodes.INTERNAL_ERROR, str(lease_error))
-      return
+    deadline = time.time() + wait_seconds
+    while True:
+      try:
+        tasks = queue.lease_tasks(num_tasks, lease_seconds, group_by_tag, tag)
+      except InvalidLeaseRequest as lease_error:
+        write_error(self, HTTPCodes.BAD_REQUEST, lease_error.message)
+        return
+      except TransientError as lease_error:
+        write_error(self, HTTPCodes.INTERNAL_ERROR, str(lease_error))
+        return
+
+      time_left = deadline - time.time()
+      if tasks or time_left <= 0:
+        break
+
+      yield queue.wait_for_tasks(min(time_left, self.RECHECK_INTERVAL),
+                                 group_by_tag, tag)
 
     task_list = {}
     if 'kind' in fields:
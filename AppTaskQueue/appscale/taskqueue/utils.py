@@ -127,4 +127,8 @@ def create_celery_for_app(app, rates):
   # celery.readthedocs.org/en/latest/userguide/optimizing.html#worker-settings.
   celery.conf.CELERYD_PREFETCH_MULTIPLIER = 1
 
+  # Wait for the broker to confirm each published task so that a task is
+  # only reported as added once RabbitMQ has accepted it.
+  celery.conf.BROKER_TRANSPORT_OPTIONS = {'confirm_publish': True}
+
   return celery
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+import unittest
+
+from appscale.taskqueue import lease_notifier
+from appscale.taskqueue.lease_notifier import LeaseNotifier
+from flexmock import flexmock
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.testing import AsyncTestCase
+from tornado.testing import gen_test
+
+
+class FakeWatch(object):
+  """ Stands in for a kazoo watch. """
+  def __init__(self, path, func):
+    self.path = path
+    self.func = func
+    self._stopped = False
+
+
+class FakeZKClient(object):
+  """ Records the nodes that are written. """
+  def __init__(self):
+    self.children_watches = []
+    self.data_watches = []
+    self.created = []
+    self.deleted = []
+    self.notified = []
+
+  def ensure_path(self, path):
+    pass
+
+  def ChildrenWatch(self, path, func):
+    watch = FakeWatch(path, func)
+    self.children_watches.append(watch)
+    return watch
+
+  def DataWatch(self, path, func):
+    watch = FakeWatch(path, func)
+    self.data_watches.append(watch)
+    return watch
+
+  def create_async(self, path, ephemeral=False):
+    self.created.append(path)
+
+  def delete_async(self, path):
+    self.deleted.append(path)
+
+  def set_async(self, path, value):
+    self.notified.append(path)
+
+
+class TestLeaseNotifier(AsyncTestCase):
+  def get_new_ioloop(self):
+    # The notifier uses the global IOLoop.
+    return IOLoop.instance()
+
+  def setUp(self):
+    super(TestLeaseNotifier, self).setUp()
+    self.zk_client = FakeZKClient()
+    self.notifier = LeaseNotifier(self.zk_client, 'guestbook')
+
+  def tearDown(self):
+    self.notifier.stop()
+    super(TestLeaseNotifier, self).tearDown()
+
+  @gen_test
+  def test_local_wake_up(self):
+    waiter = self.notifier.wait('queue1', None, 5)
+    self.assertEqual(len(self.zk_client.created), 1)
+    self.assertTrue(self.zk_client.created[0].endswith(
+      'queue1:{}'.format(self.notifier.server_id)))
+
+    self.notifier.task_added('queue1', 'tag1')
+    added = yield waiter
+    self.assertTrue(added)
+    self.assertEqual(len(self.zk_client.deleted), 1)
+
+    # There are no remote waiters to notify.
+    self.assertListEqual(self.zk_client.notified, [])
+
+  @gen_test
+  def test_tag_matching(self):
+    tagged = self.notifier.wait('queue1', 'tag1', .2)
+    untagged = self.notifier.wait('queue1', None, 5)
+    self.notifier.task_added('queue1', 'tag2')
+
+    self.assertTrue((yield untagged))
+    self.assertFalse((yield tagged))
+
+  @gen_test
+  def test_timeout(self):
+    other_queue = self.notifier.wait('queue2', None, .1)
+    self.notifier.task_added('queue1')
+    added = yield other_queue
+    self.assertFalse(added)
+    self.assertNotIn('queue2', self.notifier._waiters)
+
+  @gen_test
+  def test_remote_wake_up(self):
+    waiter = self.notifier.wait('queue1', 'tag1', 5)
+    notification_watch = self.zk_client.data_watches[0]
+
+    # The initial call of the watch does not wake anything.
+    notification_watch.func('', None, None)
+    notification_watch.func('', None, 'changed')
+    self.assertTrue((yield waiter))
+
+  @gen_test
+  def test_remote_notifications_are_throttled(self):
+    interval = .2
+    flexmock(lease_notifier, NOTIFICATION_INTERVAL=interval)
+    self.zk_client.children_watches[0].func(
+      ['queue1:other-server', 'queue2:{}'.format(self.notifier.server_id)])
+
+    for _ in range(5):
+      self.notifier.task_added('queue1')
+
+    # This server's own waiters are not notified through ZooKeeper.
+    self.notifier.task_added('queue2')
+
+    yield gen.moment
+    self.assertEqual(len(self.zk_client.notified), 1)
+
+    # The tasks that were added during the interval are announced once.
+    yield gen.sleep(interval * 2)
+    self.assertEqual(len(self.zk_client.notified), 2)
+    self.assertTrue(all(node.endswith('/queue1')
+                        for node in self.zk_client.notified))
+
+
+if __name__ == "__main__":
+  unittest.main()
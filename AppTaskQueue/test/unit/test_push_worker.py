@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+
+import datetime
+import os
+import tempfile
+import unittest
+
+from appscale.common import appscale_info
+from appscale.taskqueue import utils
+from collections import defaultdict
+from flexmock import flexmock
+from httplib import BadStatusLine
+
+
+def import_push_worker():
+  """ Imports the worker script without a Celery broker or a datastore. """
+  config = tempfile.NamedTemporaryFile(suffix='.json')
+  config.write('{}')
+  config.flush()
+  os.environ.setdefault('APP_ID', 'guestbook')
+  os.environ.setdefault('HOST', 'localhost')
+  flexmock(utils).should_receive('get_celery_configuration_path').\
+    and_return(config.name)
+  flexmock(utils).should_receive('create_celery_for_app').\
+    and_return(flexmock(conf={'CELERY_QUEUES': []}))
+  flexmock(appscale_info).should_receive('get_db_proxy').\
+    and_return('192.168.0.1')
+  from appscale.taskqueue import push_worker
+  config.close()
+  return push_worker
+
+push_worker = import_push_worker()
+
+
+class FakeConnection(object):
+  """ Records whether or not the connection was closed. """
+  def __init__(self):
+    self.closed = False
+
+  def close(self):
+    self.closed = True
+
+
+class RetryTask(Exception):
+  """ Stands in for the exception that Celery raises to retry a task. """
+  pass
+
+
+def make_args(url='http://localhost:8080/task'):
+  return {'task_name': 'task1', 'url': url, 'method': 'POST', 'body': '',
+          'expires': datetime.datetime.now() + datetime.timedelta(days=1),
+          'max_retries': 0, 'min_backoff_sec': 1, 'max_doublings': 2,
+          'max_backoff_sec': 10}
+
+
+class TestConnections(unittest.TestCase):
+  def setUp(self):
+    flexmock(push_worker, idle_connections=defaultdict(list))
+
+  def test_reuse(self):
+    connection = FakeConnection()
+    flexmock(push_worker.httplib).should_receive('HTTPConnection').\
+      with_args('localhost', 8080).and_return(connection).once()
+
+    self.assertEqual(push_worker.get_connection('http', 8080),
+                     (connection, False))
+    push_worker.release_connection('http', 8080, connection,
+                                   flexmock(will_close=False))
+    self.assertEqual(push_worker.get_connection('http', 8080),
+                     (connection, True))
+    self.assertFalse(connection.closed)
+
+  def test_targets_are_separate(self):
+    connection = FakeConnection()
+    push_worker.release_connection('http', 8080, connection,
+                                   flexmock(will_close=False))
+
+    https_connection = FakeConnection()
+    flexmock(push_worker.httplib).should_receive('HTTPSConnection').\
+      with_args('localhost', 8080).and_return(https_connection).once()
+    self.assertEqual(push_worker.get_connection('https', 8080),
+                     (https_connection, False))
+
+  def test_closed_by_target(self):
+    connection = FakeConnection()
+    push_worker.release_connection('http', 8080, connection,
+                                   flexmock(will_close=True))
+    self.assertTrue(connection.closed)
+    self.assertListEqual(push_worker.idle_connections[('http', 8080)], [])
+
+  def test_idle_limit(self):
+    flexmock(push_worker, MAX_IDLE_CONNECTIONS=2)
+    connections = [FakeConnection() for _ in range(3)]
+    for connection in connections:
+      push_worker.release_connection('http', 8080, connection,
+                                     flexmock(will_close=False))
+
+    self.assertListEqual(push_worker.idle_connections[('http', 8080)],
+                         connections[:2])
+    self.assertTrue(connections[2].closed)
+
+
+class TestExecuteTask(unittest.TestCase):
+  def setUp(self):
+    flexmock(push_worker, idle_connections=defaultdict(list))
+    self.task = flexmock(request=flexmock(id='celery-id', retries=0))
+
+  def test_stale_connection_is_replaced(self):
+    stale = FakeConnection()
+    push_worker.idle_connections[('http', 8080)].append(stale)
+    new = FakeConnection()
+    flexmock(push_worker.httplib).should_receive('HTTPConnection').\
+      and_return(new).once()
+
+    response = flexmock(status=200, will_close=False)
+    flexmock(push_worker).should_receive('send_request').\
+      and_raise(BadStatusLine('')).and_return(response).twice()
+    flexmock(push_worker).should_receive('delete_task_name').\
+      with_args('task1').once()
+    self.task.should_receive('retry').never()
+
+    status = push_worker.execute_task(self.task, {}, make_args())
+
+    # The failure on the idle connection does not count against the task.
+    self.assertEqual(status, 200)
+    self.assertTrue(stale.closed)
+    self.assertListEqual(push_worker.idle_connections[('http', 8080)], [new])
+
+  def test_new_connection_failure_is_retried(self):
+    connection = FakeConnection()
+    flexmock(push_worker.httplib).should_receive('HTTPConnection').\
+      and_return(connection).once()
+    flexmock(push_worker).should_receive('send_request').\
+      and_raise(BadStatusLine('')).once()
+    self.task.should_receive('retry').and_return(RetryTask()).once()
+
+    with self.assertRaises(RetryTask):
+      push_worker.execute_task(self.task, {}, make_args())
+
+    self.assertTrue(connection.closed)
+    self.assertListEqual(push_worker.idle_connections[('http', 8080)], [])
+
+
+class TestDeleteTaskName(unittest.TestCase):
+  def setUp(self):
+    flexmock(push_worker, finished_task_names=[], task_name_flusher=None)
+
+  def test_flush_at_batch_size(self):
+    flexmock(push_worker, TASK_NAME_BATCH_SIZE=3)
+    flexmock(push_worker.eventlet).should_receive('spawn').\
+      with_args(push_worker.flush_task_names_periodically).\
+      and_return('flusher').once()
+    deleted = []
+    flexmock(push_worker.db).should_receive('delete').\
+      replace_with(lambda keys: deleted.append(keys)).once()
+
+    push_worker.delete_task_name('task1')
+    push_worker.delete_task_name('task2')
+    self.assertListEqual(deleted, [])
+
+    push_worker.delete_task_name('task3')
+    self.assertEqual(len(deleted), 1)
+    self.assertListEqual([key.name() for key in deleted[0]],
+                         ['task1', 'task2', 'task3'])
+    self.assertListEqual(push_worker.finished_task_names, [])
+    self.assertEqual(push_worker.task_name_flusher, 'flusher')
+
+  def test_flush_error(self):
+    push_worker.finished_task_names.append('task1')
+    flexmock(push_worker.db).should_receive('delete').\
+      and_raise(Exception('Datastore unavailable')).once()
+
+    # The groomer cleans up the names that are not deleted.
+    push_worker.flush_task_names()
+    self.assertListEqual(push_worker.finished_task_names, [])
+
+  def test_empty_flush(self):
+    flexmock(push_worker.db).should_receive('delete').never()
+    push_worker.flush_task_names()
+
+
+if __name__ == "__main__":
+  unittest.main()
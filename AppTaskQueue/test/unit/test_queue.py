@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+
+import datetime
+import unittest
+import uuid
+
+from appscale.taskqueue import queue as queue_module
+from appscale.taskqueue.queue import INDEX_SHARDS
+from appscale.taskqueue.queue import PullQueue
+from appscale.taskqueue.queue import TransientError
+from appscale.taskqueue.queue import index_shard
+from appscale.taskqueue.task import InvalidTaskInfo
+from appscale.taskqueue.task import Task
+from cassandra import InvalidRequest
+from cassandra import OperationTimedOut
+from collections import namedtuple
+from flexmock import flexmock
+
+IndexEntry = namedtuple('IndexEntry', ['eta', 'id'])
+
+
+class FakeStatement(object):
+  """ Stands in for a prepared statement. """
+  def __init__(self, query_string):
+    self.query_string = query_string
+
+
+class FakeBatch(object):
+  """ Keeps the parameters of each statement in a batch. """
+  def __init__(self, **kwargs):
+    self.parameters = []
+
+  def add(self, statement, parameters):
+    self.parameters.append(parameters)
+
+
+class FakeFuture(object):
+  """ Resolves to None or raises the given error. """
+  def __init__(self, error=None):
+    self.error = error
+
+  def result(self):
+    if self.error is not None:
+      raise self.error
+
+
+class FakeSession(object):
+  """ Records the index entries that are written. """
+  def __init__(self, failing_ids=(), failures=None):
+    self.failing_ids = failing_ids
+    self.failures = failures
+    self.attempts = 0
+    self.indexed = []
+    flexmock(queue_module, BatchStatement=FakeBatch)
+
+  def prepare(self, statement):
+    return FakeStatement(statement)
+
+  def execute_async(self, batch):
+    task_ids = [parameters[4] for parameters in batch.parameters]
+    if any(task_id in self.failing_ids for task_id in task_ids):
+      self.attempts += 1
+      if self.failures is None or self.attempts <= self.failures:
+        return FakeFuture(OperationTimedOut())
+
+    self.indexed.extend(task_ids)
+    return FakeFuture()
+
+
+def make_queue(session, lease_notifier=None):
+  db_access = flexmock(session=session)
+  stats_buffer = flexmock(record_tasks=lambda app, queue, count: None)
+  return PullQueue({'name': 'pull-queue', 'mode': 'pull'}, 'guestbook',
+                   db_access=db_access, stats_buffer=stats_buffer,
+                   lease_notifier=lease_notifier)
+
+
+def mock_inserts(responses):
+  """ Replaces execute_concurrent with one that returns canned results.
+
+  Args:
+    responses: A list of dictionaries, one for each expected call, that map
+      task IDs to (success, result) tuples.
+  Returns:
+    A list that is filled with the task IDs sent with each call.
+  """
+  calls = []
+  def execute_concurrent(session, statements_and_params, **kwargs):
+    task_ids = [parameters[2] for _, parameters in statements_and_params]
+    calls.append(task_ids)
+    response = responses[len(calls) - 1]
+    return [response[task_id] for task_id in task_ids]
+
+  flexmock(queue_module).should_receive('execute_concurrent').\
+    replace_with(execute_concurrent)
+  return calls
+
+
+def make_task(task_id, tag=None):
+  task_info = {'id': task_id, 'payloadBase64': 'cGF5bG9hZA=='}
+  if tag is not None:
+    task_info['tag'] = tag
+
+  return Task(task_info)
+
+
+class TestPullQueueAddTasks(unittest.TestCase):
+  def test_timed_out_inserts_are_checked(self):
+    session = FakeSession()
+    queue = make_queue(session)
+    applied = flexmock(was_applied=True)
+    not_applied = flexmock(was_applied=False)
+
+    # The second task's first attempt times out but is applied, so the retry
+    # finds the entry that it wrote.
+    calls = mock_inserts([
+      {'task1': (True, applied), 'task2': (False, OperationTimedOut()),
+       'task3': (True, not_applied)},
+      {'task2': (True, not_applied)}
+    ])
+    flexmock(queue).should_receive('_task_mutated_by_id').\
+      with_args('task2', uuid.UUID).and_return(True).once()
+
+    tasks = [make_task('task1'), make_task('task2'), make_task('task3')]
+    errors = queue.add_tasks(tasks)
+
+    self.assertListEqual(calls, [['task1', 'task2', 'task3'], ['task2']])
+    self.assertIsNone(errors[0])
+    self.assertIsNone(errors[1])
+    self.assertIsInstance(errors[2], InvalidTaskInfo)
+    self.assertListEqual(sorted(session.indexed), ['task1', 'task2'])
+
+  def test_transient_errors_are_retried(self):
+    session = FakeSession()
+    queue = make_queue(session)
+    calls = mock_inserts([{'task1': (False, OperationTimedOut())}] * 2)
+
+    errors = queue.add_tasks([make_task('task1')], retries=2)
+
+    self.assertListEqual(calls, [['task1'], ['task1']])
+    self.assertIsInstance(errors[0], TransientError)
+    self.assertListEqual(session.indexed, [])
+
+  def test_other_insert_errors(self):
+    session = FakeSession()
+    queue = make_queue(session)
+    error = InvalidRequest('Bad request')
+    calls = mock_inserts([
+      {'task1': (True, flexmock(was_applied=True)), 'task2': (False, error)}])
+
+    errors = queue.add_tasks([make_task('task1'), make_task('task2')])
+
+    # The failed insert is not retried, and the other task is still indexed.
+    self.assertListEqual(calls, [['task1', 'task2']])
+    self.assertListEqual(errors, [None, error])
+    self.assertListEqual(session.indexed, ['task1'])
+
+  def test_duplicate_names(self):
+    session = FakeSession()
+    queue = make_queue(session)
+    calls = mock_inserts([
+      {'task1': (True, flexmock(was_applied=True)),
+       'task2': (True, flexmock(was_applied=True))}])
+
+    tasks = [make_task('task1'), make_task('task2'), make_task('task1')]
+    errors = queue.add_tasks(tasks)
+
+    # Only the first task with a given name is inserted.
+    self.assertListEqual(calls, [['task1', 'task2']])
+    self.assertListEqual(errors[:2], [None, None])
+    self.assertIsInstance(errors[2], InvalidTaskInfo)
+    self.assertListEqual(sorted(session.indexed), ['task1', 'task2'])
+
+  def test_index_errors(self):
+    session = FakeSession(failing_ids=['task2'])
+    lease_notifier = flexmock()
+    lease_notifier.should_receive('task_added').\
+      with_args('pull-queue', 'tag1').once()
+    lease_notifier.should_receive('task_added').\
+      with_args('pull-queue', 'tag2').never()
+    queue = make_queue(session, lease_notifier)
+    mock_inserts([
+      {'task1': (True, flexmock(was_applied=True)),
+       'task2': (True, flexmock(was_applied=True))}])
+
+    # The task that cannot be indexed is deleted so that it can be added
+    # again.
+    tasks = [make_task('task1', 'tag1'), make_task('task2', 'tag2')]
+    flexmock(queue).should_receive('_delete_task_and_index').\
+      with_args(tasks[1], 3).once()
+    errors = queue.add_tasks(tasks, retries=3)
+
+    self.assertIsNone(errors[0])
+    self.assertIsInstance(errors[1], TransientError)
+    self.assertListEqual(session.indexed, ['task1'])
+    self.assertEqual(session.attempts, 3)
+
+  def test_index_errors_are_retried(self):
+    session = FakeSession(failing_ids=['task2'], failures=1)
+    queue = make_queue(session)
+    mock_inserts([
+      {'task1': (True, flexmock(was_applied=True)),
+       'task2': (True, flexmock(was_applied=True))}])
+    flexmock(queue).should_receive('_delete_task_and_index').never()
+
+    errors = queue.add_tasks([make_task('task1'), make_task('task2')])
+
+    self.assertListEqual(errors, [None, None])
+    self.assertListEqual(session.indexed, ['task1', 'task2'])
+    self.assertEqual(session.attempts, 2)
+
+  def test_unindexed_tasks_are_uncounted(self):
+    session = FakeSession(failing_ids=['task1'])
+    recorded = []
+    stats_buffer = flexmock(
+      record_tasks=lambda app, queue, count: recorded.append(count))
+    queue = PullQueue({'name': 'pull-queue', 'mode': 'pull'}, 'guestbook',
+                      db_access=flexmock(session=session),
+                      stats_buffer=stats_buffer)
+    mock_inserts([{'task1': (True, flexmock(was_applied=True))}])
+
+    deleted = []
+    session.execute = lambda statement, parameters: (
+      deleted.append(parameters['id']) or flexmock(was_applied=True))
+    errors = queue.add_tasks([make_task('task1')], retries=1)
+
+    # The task row and any index entry are removed, and the count that was
+    # recorded for the task is reversed.
+    self.assertIsInstance(errors[0], TransientError)
+    self.assertListEqual(deleted, ['task1', 'task1'])
+    self.assertListEqual(recorded, [1, -1])
+
+
+def mock_shards(queue, shard_entries):
+  """ Replaces index queries with ones that serve the given entries.
+
+  Args:
+    queue: A PullQueue.
+    shard_entries: A dictionary mapping shards to lists of IndexEntries.
+  Returns:
+    A list that is filled with the shard of each query.
+  """
+  queried = []
+  def query_index(num_tasks, shard, group_by_tag=False, tag=None):
+    queried.append(shard)
+    return shard_entries.get(shard, [])[:num_tasks]
+
+  flexmock(queue).should_receive('_query_index').replace_with(query_index)
+  return queried
+
+
+class TestPullQueueShards(unittest.TestCase):
+  def test_index_shard(self):
+    task_ids = ['task{}'.format(task_num) for task_num in range(100)]
+    shards = [index_shard(task_id) for task_id in task_ids]
+
+    # A task's shard only depends on its ID.
+    self.assertListEqual(shards, [index_shard(task_id)
+                                  for task_id in task_ids])
+    self.assertTrue(all(0 <= shard < INDEX_SHARDS for shard in shards))
+    self.assertGreater(len(set(shards)), 1)
+
+  def test_work_stealing(self):
+    queue = make_queue(FakeSession())
+    now = datetime.datetime.utcnow()
+    entries = {14: [IndexEntry(now, 'task1')],
+               0: [IndexEntry(now, 'task{}'.format(task_num))
+                   for task_num in range(2, 7)]}
+    queried = mock_shards(queue, entries)
+    flexmock(queue_module.random).should_receive('randrange').and_return(14)
+
+    # The starting shard runs short, so the following shards are used until
+    # the request is filled.
+    results = queue._query_available_tasks(3)
+    self.assertListEqual([result.id for result in results],
+                         ['task1', 'task2', 'task3'])
+    self.assertListEqual(queried, [14, 15, 0])
+
+  def test_empty_index(self):
+    queue = make_queue(FakeSession())
+    queried = mock_shards(queue, {})
+    self.assertListEqual(queue._query_available_tasks(5), [])
+    self.assertListEqual(sorted(queried), range(INDEX_SHARDS))
+
+    # Once every shard is known to be empty, the shards are not walked.
+    flexmock(queue).should_receive('_query_available_shard_tasks').never()
+    self.assertListEqual(queue._query_available_tasks(5), [])
+
+    # Other tags are tracked separately.
+    self.assertFalse(queue._index_recently_empty(True, 'tag1'))
+
+  def test_empty_results_expire(self):
+    queue = make_queue(FakeSession())
+    queried = mock_shards(queue, {})
+    queue._query_available_tasks(5)
+
+    now = datetime.datetime.utcnow()
+    entries = {3: [IndexEntry(now, 'task1')]}
+    queried = mock_shards(queue, entries)
+    queue._expire_empty_results()
+    results = queue._query_available_tasks(5)
+    self.assertListEqual([result.id for result in results], ['task1'])
+    self.assertIn(3, queried)
+
+  def test_list_tasks(self):
+    now = datetime.datetime.utcnow()
+    shard_entries = {
+      2: [IndexEntry(now, 'task1'),
+          IndexEntry(now + datetime.timedelta(seconds=2), 'task3')],
+      9: [IndexEntry(now + datetime.timedelta(seconds=1), 'task2')]}
+    scanned = []
+    def execute_async(statement, parameters):
+      scanned.append(parameters['shard'])
+      entries = shard_entries.get(parameters['shard'], [])
+      return flexmock(result=lambda: iter(entries))
+
+    queue = make_queue(flexmock(execute_async=execute_async))
+    flexmock(queue).should_receive('get_task').replace_with(
+      lambda task, omit_payload: task)
+
+    # Every shard is scanned, and the entries are combined in ETA order.
+    tasks = queue.list_tasks(limit=2)
+    self.assertListEqual(scanned, range(INDEX_SHARDS))
+    self.assertListEqual([task.id for task in tasks], ['task1', 'task2'])
+
+
+class TestPullQueuePurge(unittest.TestCase):
+  def test_purge_corrects_count(self):
+    now = datetime.datetime.utcnow()
+    rows = [flexmock(id=task_id, enqueued=now, lease_expires=now)
+            for task_id in ['task1', 'task2']]
+
+    # A task is added while the purge runs, so it is still counted.
+    added = flexmock(id='task3', enqueued=now, lease_expires=now)
+    session = flexmock()
+    session.should_receive('execute').\
+      and_return(rows).and_return([added]).twice()
+    stats_buffer = flexmock()
+    stats_buffer.should_receive('reset_tasks').\
+      with_args('guestbook', 'pull-queue', 1).once()
+    queue = PullQueue({'name': 'pull-queue', 'mode': 'pull'}, 'guestbook',
+                      db_access=flexmock(session=session),
+                      stats_buffer=stats_buffer)
+
+    deleted = []
+    flexmock(queue).should_receive('_delete_task_and_index').\
+      replace_with(lambda task: deleted.append(task.id))
+    queue.purge()
+    self.assertListEqual(deleted, ['task1', 'task2'])
+
+
+if __name__ == "__main__":
+  unittest.main()
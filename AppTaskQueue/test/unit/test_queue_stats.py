@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+
+import datetime
+import unittest
+
+from appscale.taskqueue import queue_stats
+from appscale.taskqueue.queue_stats import COUNT_SHARDS
+from appscale.taskqueue.queue_stats import LEASE_HISTORY_SECONDS
+from appscale.taskqueue.queue_stats import QueueStatsBuffer
+from appscale.taskqueue.queue_stats import lease_bucket
+from cassandra import OperationTimedOut
+from flexmock import flexmock
+
+
+class FakeStatement(object):
+  """ Stands in for a prepared statement. """
+  def __init__(self, query_string):
+    self.query_string = query_string
+
+
+class FakeFuture(object):
+  """ Resolves to None or raises the given error. """
+  def __init__(self, error=None):
+    self.error = error
+
+  def result(self):
+    if self.error is not None:
+      raise self.error
+
+
+class FakeSession(object):
+  """ Records the count updates and lease writes that are executed. """
+  def __init__(self):
+    self.prepared = 0
+    self.updates = []
+    self.lease_writes = []
+    self.count_rows = []
+    self.lease_rows = []
+    self.lease_error = None
+
+  def prepare(self, statement):
+    self.prepared += 1
+    return FakeStatement(statement)
+
+  def execute(self, statement, parameters=None):
+    if isinstance(statement, FakeStatement):
+      self.updates.append(parameters)
+      return None
+
+    if 'pull_queue_task_counts' in statement:
+      return self.count_rows
+
+    return [row for row in self.lease_rows
+            if row.bucket >= parameters['bucket']]
+
+  def execute_async(self, statement, parameters):
+    self.lease_writes.append(parameters)
+    return FakeFuture(self.lease_error)
+
+
+class TestLeaseBucket(unittest.TestCase):
+  def test_lease_bucket(self):
+    timestamp = datetime.datetime(2017, 6, 1, 12, 30, 17, 500)
+    self.assertEqual(lease_bucket(timestamp),
+                     datetime.datetime(2017, 6, 1, 12, 30, 10))
+    self.assertEqual(lease_bucket(lease_bucket(timestamp)),
+                     lease_bucket(timestamp))
+
+
+class TestQueueStatsBuffer(unittest.TestCase):
+  def make_buffer(self, session):
+    stats_buffer = QueueStatsBuffer(session)
+    # Keep the background thread from flushing during the test.
+    flexmock(stats_buffer._flusher).should_receive('start')
+    return stats_buffer
+
+  def test_task_counts(self):
+    session = FakeSession()
+    stats_buffer = self.make_buffer(session)
+    stats_buffer.record_tasks('guestbook', 'queue1', 3)
+    stats_buffer.record_tasks('guestbook', 'queue1', -1)
+    stats_buffer.record_tasks('guestbook', 'queue2', 0)
+
+    # Changes that have not been written are included in the total.
+    session.count_rows = [flexmock(tasks=4), flexmock(tasks=1)]
+    self.assertEqual(stats_buffer.total_tasks('guestbook', 'queue1'), 7)
+
+    stats_buffer.flush()
+    self.assertEqual(len(session.updates), 1)
+    delta, app, queue, shard = session.updates[0]
+    self.assertEqual((delta, app, queue), (2, 'guestbook', 'queue1'))
+    self.assertIn(shard, range(COUNT_SHARDS))
+
+    # The update statement is only prepared once.
+    stats_buffer.record_tasks('guestbook', 'queue1', 1)
+    stats_buffer.flush()
+    self.assertEqual(len(session.updates), 2)
+    self.assertEqual(session.prepared, 1)
+
+    # Nothing is written when there are no changes.
+    stats_buffer.flush()
+    self.assertEqual(len(session.updates), 2)
+
+  def test_negative_total(self):
+    session = FakeSession()
+    stats_buffer = self.make_buffer(session)
+    session.count_rows = [flexmock(tasks=-2)]
+    self.assertEqual(stats_buffer.total_tasks('guestbook', 'queue1'), 0)
+
+  def test_failed_count_update(self):
+    session = FakeSession()
+    stats_buffer = self.make_buffer(session)
+    stats_buffer.record_tasks('guestbook', 'queue1', 2)
+
+    flexmock(queue_stats).should_receive('update_task_counts').\
+      and_raise(OperationTimedOut).once()
+    stats_buffer.flush()
+
+    # The changes are kept so that the next flush can write them.
+    stats_buffer.record_tasks('guestbook', 'queue1', 1)
+    self.assertEqual(stats_buffer._task_deltas[('guestbook', 'queue1')], 3)
+
+  def test_leases(self):
+    session = FakeSession()
+    stats_buffer = self.make_buffer(session)
+    now = datetime.datetime.utcnow()
+    stats_buffer.record_leases('guestbook', 'queue1', 2)
+    stats_buffer.record_leases('guestbook', 'queue1', 3)
+    stats_buffer.record_leases('guestbook', 'queue2', 7)
+
+    # This server's rows are ignored in favor of its counts in memory.
+    old_bucket = lease_bucket(now - datetime.timedelta(hours=1))
+    session.lease_rows = [
+      flexmock(writer='other', leased=4, bucket=lease_bucket(now)),
+      flexmock(writer='other', leased=6, bucket=old_bucket),
+      flexmock(writer=stats_buffer.writer, leased=5,
+               bucket=lease_bucket(now))
+    ]
+    start_time = now - datetime.timedelta(minutes=1)
+    self.assertEqual(
+      stats_buffer.leased_since('guestbook', 'queue1', start_time), 9)
+
+    stats_buffer.flush()
+    written = {(write['queue'], write['leased'])
+               for write in session.lease_writes}
+    self.assertSetEqual(written, {('queue1', 5), ('queue2', 7)})
+    self.assertTrue(all(write['writer'] == stats_buffer.writer
+                        for write in session.lease_writes))
+
+    # Buckets are only rewritten when they change.
+    stats_buffer.flush()
+    self.assertEqual(len(session.lease_writes), 2)
+
+  def test_failed_lease_write(self):
+    session = FakeSession()
+    stats_buffer = self.make_buffer(session)
+    stats_buffer.record_leases('guestbook', 'queue1', 2)
+
+    session.lease_error = OperationTimedOut()
+    stats_buffer.flush()
+    self.assertEqual(len(stats_buffer._unwritten_buckets), 1)
+
+    session.lease_error = None
+    stats_buffer.flush()
+    self.assertEqual(len(session.lease_writes), 2)
+    self.assertSetEqual(stats_buffer._unwritten_buckets, set())
+
+  def test_old_leases_dropped(self):
+    session = FakeSession()
+    stats_buffer = self.make_buffer(session)
+    old_bucket = lease_bucket(
+      datetime.datetime.utcnow() -
+      datetime.timedelta(seconds=LEASE_HISTORY_SECONDS * 2))
+    stats_buffer._leases[('guestbook', 'queue1', old_bucket)] = 3
+    stats_buffer.record_leases('guestbook', 'queue1', 1)
+
+    stats_buffer.flush()
+    self.assertListEqual([bucket for _, _, bucket in stats_buffer._leases],
+                         [lease_bucket(datetime.datetime.utcnow())])
+
+  def test_reset_tasks(self):
+    session = FakeSession()
+    stats_buffer = self.make_buffer(session)
+    session.count_rows = [flexmock(tasks=6), flexmock(tasks=4)]
+
+    # The correction is written to the first shard.
+    stats_buffer.reset_tasks('guestbook', 'queue1', 3)
+    self.assertListEqual(session.updates, [(-7, 'guestbook', 'queue1', 0)])
+
+    # Nothing is written when the count is already correct.
+    stats_buffer.reset_tasks('guestbook', 'queue1', 10)
+    self.assertEqual(len(session.updates), 1)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+import json
+import unittest
+
+from appscale.taskqueue.queue import PullQueue
+from appscale.taskqueue.rest_api import RESTLease
+from appscale.taskqueue.task import Task
+from flexmock import flexmock
+from tornado import gen
+from tornado.testing import AsyncHTTPTestCase
+from tornado.web import Application
+
+
+class FakeQueue(object):
+  """ Returns tasks once enough waits have finished. """
+  def __init__(self, waits_before_tasks):
+    self.waits_before_tasks = waits_before_tasks
+    self.leases = 0
+    self.waits = []
+
+  def lease_tasks(self, num_tasks, lease_seconds, group_by_tag, tag):
+    self.leases += 1
+    if len(self.waits) < self.waits_before_tasks:
+      return []
+
+    return [Task({'id': 'task1', 'queueName': 'pull-queue',
+                  'payloadBase64': 'cGF5bG9hZA=='})]
+
+  @gen.coroutine
+  def wait_for_tasks(self, timeout, group_by_tag=False, tag=None):
+    self.waits.append((timeout, group_by_tag, tag))
+    raise gen.Return(True)
+
+
+class TestRESTLease(AsyncHTTPTestCase):
+  def get_app(self):
+    self.queue_handler = flexmock()
+    return Application([(RESTLease.PATH, RESTLease,
+                         {'queue_handler': self.queue_handler})])
+
+  def lease(self, queue, arguments):
+    self.queue_handler.should_receive('get_queue').\
+      with_args('guestbook', 'pull-queue').and_return(queue)
+    url = ('/taskqueue/v1beta2/projects/guestbook/taskqueues/pull-queue/'
+           'tasks/lease?leaseSecs=30&numTasks=1&{}'.format(arguments))
+    return self.fetch(url, method='POST', body='')
+
+  def test_no_wait(self):
+    queue = FakeQueue(waits_before_tasks=1)
+    response = self.lease(queue, 'waitSecs=0')
+    self.assertEqual(response.code, 200)
+    self.assertNotIn('items', json.loads(response.body))
+    self.assertEqual(queue.leases, 1)
+    self.assertListEqual(queue.waits, [])
+
+  def test_wait_for_tasks(self):
+    queue = FakeQueue(waits_before_tasks=2)
+    response = self.lease(queue, 'waitSecs=30&groupByTag=true&tag=tag1')
+    self.assertEqual(response.code, 200)
+    self.assertEqual(len(json.loads(response.body)['items']), 1)
+
+    # The request waits and checks the queue again until a task is leased.
+    self.assertEqual(queue.leases, 3)
+    self.assertEqual(len(queue.waits), 2)
+    for timeout, group_by_tag, tag in queue.waits:
+      self.assertLessEqual(timeout, RESTLease.RECHECK_INTERVAL)
+      self.assertTrue(group_by_tag)
+      self.assertEqual(tag, 'tag1')
+
+  def test_timeout(self):
+    queue = FakeQueue(waits_before_tasks=1)
+    flexmock(queue).should_receive('wait_for_tasks').\
+      replace_with(lambda timeout, group_by_tag, tag: gen.sleep(timeout))
+    response = self.lease(queue, 'waitSecs=1')
+    self.assertEqual(response.code, 200)
+    self.assertNotIn('items', json.loads(response.body))
+
+    # The deadline is checked after each lease attempt.
+    self.assertGreaterEqual(queue.leases, 2)
+
+  def test_invalid_wait(self):
+    queue = FakeQueue(waits_before_tasks=0)
+    response = self.lease(
+      queue, 'waitSecs={}'.format(PullQueue.MAX_LEASE_WAIT_TIME + 1))
+    self.assertEqual(response.code, 400)
+    self.assertEqual(queue.leases, 0)
+
+
+if __name__ == "__main__":
+  unittest.main()
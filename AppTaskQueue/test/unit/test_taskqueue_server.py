@@ -1,13 +1,26 @@
 #!/usr/bin/env python
 
+import contextlib
+import datetime
+import time
 import unittest
 
 from appscale.datastore.cassandra_env.cassandra_interface import DatastoreProxy
+from appscale.taskqueue import distributed_tq
 from appscale.taskqueue.distributed_tq import DistributedTaskQueue
+from appscale.taskqueue.distributed_tq import TaskName
+from appscale.taskqueue.queue import PullQueue
+from appscale.taskqueue.queue import PushQueue
+from appscale.taskqueue.queue import TransientError
+from appscale.taskqueue.queue import index_shard
 from appscale.taskqueue.queue_manager import GlobalQueueManager
+from appscale.taskqueue.task import InvalidTaskInfo
+from cassandra import OperationTimedOut
 from flexmock import flexmock
 
+from appscale.common import appscale_info
 from appscale.common import file_io
+from google.appengine.api.taskqueue import taskqueue_service_pb
 
 
 def mock_file_io():
@@ -18,6 +31,64 @@ def mock_file_io():
      .should_receive("write").and_return(None)
 
 
+class FakeMigrationSession(object):
+  """ Serves old index entries and records the schema changes. """
+  def __init__(self, rows):
+    self.rows = rows
+    self.dropped = False
+
+  def prepare(self, statement):
+    return statement
+
+  def execute(self, statement, parameters=None, timeout=None):
+    if statement == 'DROP TABLE pull_queue_tasks_index':
+      self.dropped = True
+      return None
+
+    return iter(self.rows)
+
+
+class TestMigratePullQueueIndex(unittest.TestCase):
+  def make_rows(self, count):
+    eta = datetime.datetime.utcnow()
+    return [flexmock(app='guestbook', queue='pull-queue', eta=eta,
+                     id='task{}'.format(task_num), tag=None,
+                     tag_exists=False)
+            for task_num in range(count)]
+
+  def test_migrate(self):
+    session = FakeMigrationSession(self.make_rows(5))
+    flexmock(distributed_tq, INDEX_MIGRATION_PAGE_SIZE=2)
+    copied = []
+    def execute_concurrent(session, statements_and_params, **kwargs):
+      self.assertFalse(kwargs.get('results_generator', False))
+      copied.append([parameters[4] for _, parameters in statements_and_params])
+      for _, parameters in statements_and_params:
+        self.assertEqual(parameters[2], index_shard(parameters[4]))
+      return [(True, None) for _ in statements_and_params]
+
+    flexmock(distributed_tq).should_receive('execute_concurrent').\
+      replace_with(execute_concurrent)
+    distributed_tq.migrate_pull_queue_index(session)
+
+    # Each page is copied before the old table is dropped.
+    self.assertListEqual(copied, [['task0', 'task1'], ['task2', 'task3'],
+                                  ['task4']])
+    self.assertTrue(session.dropped)
+
+  def test_failed_copy(self):
+    session = FakeMigrationSession(self.make_rows(3))
+    error = OperationTimedOut()
+    flexmock(distributed_tq).should_receive('execute_concurrent').\
+      and_return([(True, None), (False, error), (True, None)])
+
+    # The old table is kept when any entry was not copied.
+    with self.assertRaises(OperationTimedOut):
+      distributed_tq.migrate_pull_queue_index(session)
+
+    self.assertFalse(session.dropped)
+
+
 class TestDistributedTaskQueue(unittest.TestCase):
   """
   A set of test cases for the distributed taskqueue module
@@ -67,6 +138,95 @@ class TestDistributedTaskQueue(unittest.TestCase):
       and_return(flexmock())
     dtq = DistributedTaskQueue(db_access, zk_client)
 
+  def test_bulk_add_push_tasks(self):
+    mock_file_io()
+    flexmock(DatastoreProxy).should_receive('__init__')
+    db_access = flexmock()
+    zk_client = flexmock()
+    flexmock(GlobalQueueManager).should_receive('__new__').\
+      and_return(flexmock())
+    dtq = DistributedTaskQueue(db_access, zk_client)
+
+    sent = []
+    producers = []
+
+    @contextlib.contextmanager
+    def producer_or_acquire():
+      producers.append('producer')
+      yield 'producer'
+
+    celery = flexmock(producer_or_acquire=producer_or_acquire)
+    celery.should_receive('send_task').replace_with(
+      lambda *args, **kwargs: sent.append(kwargs['producer']))
+    queue = PushQueue({'name': 'default'}, 'app')
+    queue.celery = celery
+    flexmock(dtq).should_receive('get_queue').and_return(queue)
+    flexmock(appscale_info).should_receive('get_secret').and_return('secret')
+
+    # The third task was already enqueued, and the fourth repeats a name.
+    flexmock(TaskName).should_receive('get_by_key_name').\
+      and_return([None, None, flexmock(), None]).once()
+    flexmock(distributed_tq.db).should_receive('put').\
+      with_args(list).once()
+
+    request = taskqueue_service_pb.TaskQueueBulkAddRequest()
+    for name in ['task1', 'task2', 'task3', 'task1']:
+      add_request = request.add_add_request()
+      add_request.set_app_id('app')
+      add_request.set_queue_name('default')
+      add_request.set_task_name(name)
+      add_request.set_url('/worker')
+      add_request.set_eta_usec(int(time.time() * 1000000))
+    response = taskqueue_service_pb.TaskQueueBulkAddResponse()
+    dtq._DistributedTaskQueue__bulk_add(request, response)
+
+    Error = taskqueue_service_pb.TaskQueueServiceError
+    self.assertListEqual(
+      [result.result() for result in response.taskresult_list()],
+      [Error.OK, Error.OK, Error.TASK_ALREADY_EXISTS,
+       Error.TASK_ALREADY_EXISTS])
+    self.assertListEqual(sent, ['producer', 'producer'])
+    self.assertListEqual(producers, ['producer'])
+
+  def test_bulk_add_pull_tasks(self):
+    mock_file_io()
+    flexmock(DatastoreProxy).should_receive('__init__')
+    db_access = flexmock()
+    zk_client = flexmock()
+    flexmock(GlobalQueueManager).should_receive('__new__').\
+      and_return(flexmock())
+    dtq = DistributedTaskQueue(db_access, zk_client)
+
+    queue = PullQueue({'name': 'pull-queue', 'mode': 'pull'}, 'app')
+    flexmock(dtq).should_receive('get_queue').and_return(queue)
+
+    # All of the queue's tasks are added with one call.
+    flexmock(queue).should_receive('add_tasks').with_args(list).\
+      and_return([None, InvalidTaskInfo('Task name already taken'),
+                  TransientError('Unable to insert task')]).once()
+
+    request = taskqueue_service_pb.TaskQueueBulkAddRequest()
+    for name in ['task1', 'task2', 'task3']:
+      add_request = request.add_add_request()
+      add_request.set_app_id('app')
+      add_request.set_queue_name('pull-queue')
+      add_request.set_task_name(name)
+      add_request.set_mode(taskqueue_service_pb.TaskQueueMode.PULL)
+      add_request.set_body('payload')
+      add_request.set_eta_usec(int(time.time() * 1000000))
+    response = taskqueue_service_pb.TaskQueueBulkAddResponse()
+    dtq._DistributedTaskQueue__bulk_add(request, response)
+
+    Error = taskqueue_service_pb.TaskQueueServiceError
+    self.assertListEqual(
+      [result.result() for result in response.taskresult_list()],
+      [Error.OK, Error.TASK_ALREADY_EXISTS, Error.TRANSIENT_ERROR])
+    self.assertListEqual(
+      [result.has_chosen_task_name()
+       for result in response.taskresult_list()],
+      [True, False, False])
+    self.assertEqual(response.taskresult(0).chosen_task_name(), 'task1')
+
   def test_modify_task_lease(self):
     mock_file_io()
     flexmock(DatastoreProxy).should_receive('__init__')
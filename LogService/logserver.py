@@ -1,21 +1,39 @@
 
+import bisect
 import capnp  # pylint: disable=unused-import
+import glob
 import logging_capnp
+import mmap
 import os
 import re
 import struct
 import time
+import zlib
 
 from cStringIO import StringIO
 from twisted.internet import protocol
+from twisted.internet import reactor
+from twisted.internet import threads
 from twisted.python import log
 
 MAX_LOG_FILE_SIZE = 1024 * 1024 * 1024
 
+# A failed compaction is retried after this many seconds, doubling after each
+# failure up to the maximum.
+COMPACTION_RETRY_DELAY = 60
+MAX_COMPACTION_RETRY_DELAY = 60 * 60
+
+# Searches return the results found so far after these many seconds.
+SEARCH_SOFT_TIME_LIMIT = 5
+SEARCH_HARD_TIME_LIMIT = 25
+
 _I_SIZE = struct.calcsize('I')
-_qI_SIZE = struct.calcsize('qI')
 _PAGE_SIZE = 1000
 _ONE_BINARY = struct.pack('I', 1)
+_REQUEST_ID_SIZE = 10
+_RIDX_ENTRY_SIZE = _REQUEST_ID_SIZE + _I_SIZE
+_REQUEST_ID_RUN_SIZE = 100000
+_BLOCK_HEADER = struct.Struct('III')
 
 def readLogRecord(handle, parse=False):
   buf = handle.read(_I_SIZE)
@@ -25,12 +43,199 @@ def readLogRecord(handle, parse=False):
   buf = handle.read(length)
   return (buf, logging_capnp.RequestLog.from_bytes(buf)) if parse else buf
 
+def readLogRecordAt(buf, position):
+  length, = struct.unpack_from('I', buf, position)
+  start = position + _I_SIZE
+  return buf[start:start + length], start + length
+
+def compactLogFile(filename, summaries, compressedFilename):
+  # Compress each page of a log file into its own block. The block header
+  # holds the page's position in the original file, so record offsets and
+  # request ID indexes remain valid.
+  tmpFilename = '%s.tmp' % compressedFilename
+  try:
+    with open(filename, 'rb') as handle, open(tmpFilename, 'wb') as output:
+      for summary in summaries:
+        handle.seek(summary.start)
+        block = zlib.compress(handle.read(summary.end - summary.start))
+        output.write(_BLOCK_HEADER.pack(summary.start, summary.end, len(block)))
+        output.write(block)
+  except Exception:
+    if os.path.exists(tmpFilename):
+      os.unlink(tmpFilename)
+    raise
+  os.rename(tmpFilename, compressedFilename)
+
 def calculateOffset(log_file_id, position):
   return struct.pack('HI', log_file_id, position)
 
 def parseOffset(offset):
   return struct.unpack('HI', offset)
 
+def readRequestIdEntries(requestIdIndexFilename):
+  with open(requestIdIndexFilename, 'rb') as fh:
+    buf = fh.read()
+  return [buf[i:i+_RIDX_ENTRY_SIZE]
+          for i in xrange(0, len(buf) - _RIDX_ENTRY_SIZE + 1,
+                          _RIDX_ENTRY_SIZE)]
+
+def buildRequestIdIndex(requestIdIndexFilename, sortedIndexFilename):
+  writeSortedIndex(readRequestIdEntries(requestIdIndexFilename),
+                   sortedIndexFilename)
+
+def writeSortedIndex(entries, sortedIndexFilename):
+  # Sort the (requestId, position) entries of a log file by request ID. The
+  # sort is stable, so the first record for a duplicated ID is still found.
+  entries = sorted(entries, key=lambda entry: entry[:_REQUEST_ID_SIZE])
+  tmpFilename = '%s.tmp' % sortedIndexFilename
+  with open(tmpFilename, 'wb') as fh:
+    fh.write(''.join(entries))
+  os.rename(tmpFilename, sortedIndexFilename)
+
+class SortedRequestIdIndex(object):
+  """ A memory-mapped request ID index that is sorted by request ID. """
+
+  def __init__(self, filename):
+    self._handle = open(filename, 'rb')
+    size = os.fstat(self._handle.fileno()).st_size
+    self._count = size / _RIDX_ENTRY_SIZE
+    self._map = None
+    # Empty files cannot be mapped.
+    if self._count:
+      self._map = mmap.mmap(self._handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+  def __len__(self):
+    return self._count
+
+  def __getitem__(self, index):
+    start = index * _RIDX_ENTRY_SIZE
+    return self._map[start:start + _REQUEST_ID_SIZE]
+
+  def lookup(self, requestIds):
+    # Resolve the IDs in sorted order so that each search only has to cover
+    # the part of the index after the previous match.
+    lo = 0
+    for requestId in sorted(set(requestIds)):
+      lo = bisect.bisect_left(self, requestId, lo)
+      if lo == self._count:
+        break
+      if self[lo] == requestId:
+        start = lo * _RIDX_ENTRY_SIZE + _REQUEST_ID_SIZE
+        position, = struct.unpack('I', self._map[start:start + _I_SIZE])
+        yield requestId, position
+
+  def close(self):
+    if self._map is not None:
+      self._map.close()
+    self._handle.close()
+
+class PageSummary(object):
+  """ Describes a page of log records so searches can skip it without
+  decoding any of the records. """
+
+  _HEADER = struct.Struct('IIqqiI')
+
+  def __init__(self, start, end=None, minEndTime=None, maxEndTime=None,
+               maxLevel=-1, versions=None):
+    self.start = start
+    self.end = start if end is None else end
+    self.minEndTime = minEndTime
+    self.maxEndTime = maxEndTime
+    self.maxLevel = maxLevel
+    self.versions = set() if versions is None else versions
+    self.count = 0
+
+  def add(self, record, end):
+    self.end = end
+    self.count += 1
+    if self.minEndTime is None or record.endTime < self.minEndTime:
+      self.minEndTime = record.endTime
+    if self.maxEndTime is None or record.endTime > self.maxEndTime:
+      self.maxEndTime = record.endTime
+    for appLog in record.appLogs:
+      self.maxLevel = max(self.maxLevel, appLog.level)
+    self.versions.add(majorVersion(record))
+
+  def encode(self):
+    versions = '\n'.join(sorted(self.versions))
+    return self._HEADER.pack(self.start, self.end, self.minEndTime or 0,
+                             self.maxEndTime or 0, self.maxLevel,
+                             len(versions)) + versions
+
+  @classmethod
+  def decode(cls, buf, pos):
+    start, end, minEndTime, maxEndTime, maxLevel, length = \
+      cls._HEADER.unpack_from(buf, pos)
+    pos += cls._HEADER.size
+    versions = set(buf[pos:pos + length].split('\n'))
+    summary = cls(start, end, minEndTime, maxEndTime, maxLevel, versions)
+    return summary, pos + length
+
+def majorVersion(record):
+  if not record.versionId:
+    return ''
+  return record.versionId.split('.', 1)[0]
+
+class SearchFilter(object):
+  """ Applies the conditions of a search query to pages and records. """
+
+  def __init__(self, query):
+    self.startTime = query.startTime
+    self.endTime = query.endTime
+    self.minimumLogLevel = query.minimumLogLevel
+    self.versionIds = set(query.versionIds)
+
+  def pageRange(self, summaries):
+    # Records are appended as requests finish, so end times mostly increase
+    # through a file. The running maximum and trailing minimum of the page
+    # end times always do, which allows a binary search for the pages
+    # that can match.
+    lo = 0
+    hi = len(summaries)
+    if self.startTime:
+      runningMax = []
+      for summary in summaries:
+        previous = runningMax[-1] if runningMax else summary.maxEndTime
+        runningMax.append(max(previous, summary.maxEndTime))
+      lo = bisect.bisect_left(runningMax, self.startTime)
+    if self.endTime:
+      trailingMin = []
+      for summary in reversed(summaries):
+        previous = trailingMin[-1] if trailingMin else summary.minEndTime
+        trailingMin.append(min(previous, summary.minEndTime))
+      trailingMin.reverse()
+      hi = bisect.bisect_right(trailingMin, self.endTime)
+    return lo, max(lo, hi)
+
+  def includesPage(self, summary):
+    if self.minimumLogLevel and summary.maxLevel < self.minimumLogLevel:
+      return False
+    if '' not in summary.versions and not summary.versions & self.versionIds:
+      return False
+    if self.startTime and summary.maxEndTime < self.startTime:
+      return False
+    if self.endTime and summary.minEndTime > self.endTime:
+      return False
+    return True
+
+  def includesRecord(self, record):
+    if self.minimumLogLevel:
+      include = False
+      for appLog in record.appLogs:
+        if appLog.level >= self.minimumLogLevel:
+          include = True
+          break
+      if not include:
+        return False
+    version = majorVersion(record)
+    if version and version not in self.versionIds:
+      return False
+    if self.startTime and self.startTime > record.startTime:
+      return False
+    if self.endTime and self.endTime < record.endTime:
+      return False
+    return True
+
 class AppLogFile(object):
   MODE_SEARCH = 1
   MODE_WRITE = 2
@@ -41,25 +246,203 @@ class AppLogFile(object):
     self._filename = os.path.join(root_path, 'logservice_%s.%s.log' % (app_id, log_file_id))
     self._requestIdIndexFilename = '%s.ridx' % self._filename
     self._pageIndexFilename = '%s.pidx' % self._filename
+    self._pageSummaryFilename = '%s.psum' % self._filename
+    self._sortedIndexFilename = '%s.sidx' % self._filename
+    self._compressedFilename = '%s.z' % self._filename
+    self._sortedIndex = None
+    self._handle = None
+    self._map = None
+    self._blocks = None
     if mode == AppLogFile.MODE_WRITE:
       self._handle = open(self._filename, 'ab')
-      self._pageIndexHandle = open(self._pageIndexFilename, 'ab')
       self._requestIdIndexHandle = open(self._requestIdIndexFilename, 'ab')
+      # The active log file keeps the request IDs of its latest records in
+      # memory. Older ones are written to sorted runs, so memory use does not
+      # grow with the size of the log file.
+      self._requestIdPositions = dict()
+      self._requestIdRuns = list()
+      self._removeRequestIdRuns()
+      for entry in readRequestIdEntries(self._requestIdIndexFilename):
+        position, = struct.unpack('I', entry[_REQUEST_ID_SIZE:])
+        self._indexRequestId(entry[:_REQUEST_ID_SIZE], position)
+      self._pageSummaries = self._loadPageSummaries()
+      self._currentPage = PageSummary(os.path.getsize(self._filename))
     else:
-      self._handle = open(self._filename, 'rb')
-      self._pageIndexHandle = open(self._pageIndexFilename, 'rb')
       self._requestIdIndexHandle = open(self._requestIdIndexFilename, 'rb')
-    self._indexSize = self._requestIdIndexHandle.tell() / 14
+      # Runs are left behind by a writer that did not shut down cleanly.
+      self._removeRequestIdRuns()
+      # Until the sorted index has been built with buildSortedIndex, lookups
+      # read the whole request ID index.
+      if os.path.exists(self._sortedIndexFilename):
+        self._sortedIndex = SortedRequestIdIndex(self._sortedIndexFilename)
+      if os.path.exists(self._compressedFilename):
+        self._pageSummaries = self._loadPageSummaries(summarizeTail=False)
+        self.useCompressed()
+      else:
+        self._handle = open(self._filename, 'rb')
+        self._pageSummaries = self._loadPageSummaries()
+        self._map = self._mapFile()
+
+  def _mapFile(self):
+    # Empty files cannot be mapped.
+    if not os.path.getsize(self._filename):
+      return None
+    with open(self._filename, 'rb') as handle:
+      return mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+  def _loadPageSummaries(self, summarizeTail=True):
+    summaries = list()
+    if os.path.exists(self._pageSummaryFilename):
+      with open(self._pageSummaryFilename, 'rb') as fh:
+        buf = fh.read()
+      pos = 0
+      while pos < len(buf):
+        summary, pos = PageSummary.decode(buf, pos)
+        summaries.append(summary)
+
+    if not summarizeTail:
+      return summaries
+
+    # Summarize any records that were written without one, such as the end
+    # of a log file whose writer did not shut down cleanly or log files that
+    # were created before page summaries existed.
+    position = summaries[-1].end if summaries else 0
+    size = os.path.getsize(self._filename)
+    if position >= size:
+      return summaries
+    missing = list()
+    with open(self._filename, 'rb') as handle:
+      handle.seek(position)
+      page = PageSummary(position)
+      while position + _I_SIZE <= size:
+        length, = struct.unpack('I', handle.read(_I_SIZE))
+        # Ignore a record that was only partially written.
+        if position + _I_SIZE + length > size:
+          break
+        record = logging_capnp.RequestLog.from_bytes(handle.read(length))
+        position += _I_SIZE + length
+        page.add(record, position)
+        if page.count == _PAGE_SIZE:
+          missing.append(page)
+          page = PageSummary(page.end)
+      if page.count:
+        missing.append(page)
+    with open(self._pageSummaryFilename, 'ab') as fh:
+      fh.write(''.join(summary.encode() for summary in missing))
+    return summaries + missing
+
+  def _closePage(self):
+    if not self._currentPage.count:
+      return
+    with open(self._pageSummaryFilename, 'ab') as fh:
+      fh.write(self._currentPage.encode())
+    self._pageSummaries.append(self._currentPage)
+    self._currentPage = PageSummary(self._currentPage.end)
+
+  def isCompressed(self):
+    return self._blocks is not None
+
+  def hasSortedIndex(self):
+    return self._sortedIndex is not None
+
+  def buildSortedIndex(self):
+    """ Writes the request ID index of a rotated log file sorted by request
+    ID. This only reads the unsorted index, so it can run outside of the
+    reactor thread. """
+    if self.mode != AppLogFile.MODE_SEARCH:
+      raise ValueError("Cannot sort the AppLogFile that is being written")
+    buildRequestIdIndex(self._requestIdIndexFilename,
+                        self._sortedIndexFilename)
+
+  def useSortedIndex(self):
+    """ Switches request ID lookups to the sorted index. """
+    self._sortedIndex = SortedRequestIdIndex(self._sortedIndexFilename)
+
+  def _indexRequestId(self, requestId, position):
+    self._requestIdPositions.setdefault(requestId, position)
+    if len(self._requestIdPositions) < _REQUEST_ID_RUN_SIZE:
+      return
+    filename = '%s.%d' % (self._sortedIndexFilename, len(self._requestIdRuns))
+    writeSortedIndex(
+      ['%s%s' % (requestId, struct.pack('I', position))
+       for requestId, position in self._requestIdPositions.iteritems()],
+      filename)
+    self._requestIdRuns.append(SortedRequestIdIndex(filename))
+    self._requestIdPositions = dict()
+
+  def _removeRequestIdRuns(self):
+    for filename in glob.glob('%s.*' % self._sortedIndexFilename):
+      os.unlink(filename)
+
+  def _lookupUnsorted(self, requestIds):
+    found = dict()
+    for entry in readRequestIdEntries(self._requestIdIndexFilename):
+      requestId = entry[:_REQUEST_ID_SIZE]
+      if requestId in requestIds and requestId not in found:
+        found[requestId], = struct.unpack('I', entry[_REQUEST_ID_SIZE:])
+    return found.items()
+
+  def compact(self):
+    """ Writes a compressed copy of a rotated log file. This only reads
+    the original file, so it can run outside of the reactor thread. """
+    if self.mode != AppLogFile.MODE_SEARCH:
+      raise ValueError("Cannot compact the AppLogFile that is being written")
+    compactLogFile(self._filename, self._pageSummaries,
+                   self._compressedFilename)
+
+  def useCompressed(self):
+    """ Switches to the compressed copy and removes the original file. """
+    if self._map is not None:
+      self._map.close()
+      self._map = None
+    if self._handle is not None:
+      self._handle.close()
+    self._handle = open(self._compressedFilename, 'rb')
+    self._blocks = dict()
+    position = 0
+    size = os.path.getsize(self._compressedFilename)
+    while position < size:
+      self._handle.seek(position)
+      start, end, length = _BLOCK_HEADER.unpack(
+        self._handle.read(_BLOCK_HEADER.size))
+      self._blocks[start] = (position + _BLOCK_HEADER.size, length)
+      position += _BLOCK_HEADER.size + length
+    self._blockStarts = sorted(self._blocks)
+    if os.path.exists(self._filename):
+      os.unlink(self._filename)
+
+  def _readBlock(self, start):
+    position, length = self._blocks[start]
+    self._handle.seek(position)
+    return zlib.decompress(self._handle.read(length))
+
+  def diskSize(self):
+    return sum(os.path.getsize(filename) for filename in self._filenames()
+               if os.path.exists(filename))
+
+  def _filenames(self):
+    return (self._filename, self._compressedFilename,
+            self._requestIdIndexFilename, self._pageIndexFilename,
+            self._pageSummaryFilename, self._sortedIndexFilename)
 
   def close(self):
+    if self.mode == AppLogFile.MODE_WRITE:
+      self._closePage()
     self._handle.close()
-    self._pageIndexHandle.close()
     self._requestIdIndexHandle.close()
+    if self._sortedIndex is not None:
+      self._sortedIndex.close()
+    if self.mode == AppLogFile.MODE_WRITE:
+      for run in self._requestIdRuns:
+        run.close()
+      self._removeRequestIdRuns()
+    if self._map is not None:
+      self._map.close()
 
   def delete(self):
-    os.unlink(self._filename)
-    os.unlink(self._requestIdIndexFilename)
-    os.unlink(self._pageIndexFilename)
+    for filename in self._filenames():
+      if os.path.exists(filename):
+        os.unlink(filename)
 
   def write(self, buf):
     if self.mode != AppLogFile.MODE_WRITE:
@@ -73,86 +456,95 @@ class AppLogFile(object):
     # Index the new logline
     if requestLog.requestId:
       self._requestIdIndexHandle.write('%s%s' % (requestLog.requestId, struct.pack('I', position)))
-    if self._indexSize % _PAGE_SIZE == 0:
-      self._pageIndexHandle.write(struct.pack('qI', requestLog.endTime, position))
-      self._pageIndexHandle.flush()
+      self._indexRequestId(requestLog.requestId, position)
+    self._currentPage.add(requestLog, self._handle.tell())
+    if self._currentPage.count == _PAGE_SIZE:
       self._handle.flush()
       self._requestIdIndexHandle.flush()
-    self._indexSize += 1
+      self._closePage()
     return position, requestLog
 
   def get(self, requestIds):
     if self.mode == AppLogFile.MODE_WRITE:
-      self._requestIdIndexHandle.flush()
       self._handle.flush()
-      index_handle = open(self._requestIdIndexFilename, 'rb')
+      # Older runs are searched first, so the first record for a duplicated
+      # ID is still found.
+      matches = list()
+      remaining = set(requestIds)
+      for run in self._requestIdRuns:
+        for requestId, position in run.lookup(remaining):
+          matches.append((requestId, position))
+          remaining.discard(requestId)
+      matches.extend((requestId, self._requestIdPositions[requestId])
+                     for requestId in remaining
+                     if requestId in self._requestIdPositions)
       handle = open(self._filename, 'rb')
+    elif self._sortedIndex is None:
+      matches = self._lookupUnsorted(set(requestIds))
+      handle = self._handle
     else:
-      index_handle = self._requestIdIndexHandle
+      matches = list(self._sortedIndex.lookup(requestIds))
       handle = self._handle
     try:
-      index_handle.seek(0)
-      while True:
-        buf = index_handle.read(14000)
-        if not buf:
-          break
-        i = 0
-        while True:
-          key = buf[i:i+10]
-          if not key:
-            break
-          if key in requestIds:
-            requestIds.remove(key)
-            position, = struct.unpack('I', buf[i+10:i+14])
-            handle.seek(position)
-            record = readLogRecord(handle, False)
-            yield key, record
-            if not requestIds:
-              break
-          i += 14
-          if not requestIds:
-            break
+      # Read the records in file order.
+      matches.sort(key=lambda match: match[1])
+      blockStart = None
+      for requestId, position in matches:
+        requestIds.remove(requestId)
+        if self.isCompressed():
+          index = bisect.bisect_right(self._blockStarts, position) - 1
+          if self._blockStarts[index] != blockStart:
+            blockStart = self._blockStarts[index]
+            block = self._readBlock(blockStart)
+          record, _ = readLogRecordAt(block, position - blockStart)
+          yield requestId, record
+        else:
+          handle.seek(position)
+          yield requestId, readLogRecord(handle, False)
     finally:
       if self.mode == AppLogFile.MODE_WRITE:
         handle.close()
-        index_handle.close()
 
-  def iterpages(self):
-    if self.mode == AppLogFile.MODE_WRITE:
-      self._pageIndexHandle.flush()
-      with open(self._pageIndexFilename, 'rb') as fh:
-        pages = fh.read()
-    else:
-      self._pageIndexHandle.seek(0)
-      pages = self._pageIndexHandle.read()
-    for pos in xrange(len(pages)-_qI_SIZE, -1, -_qI_SIZE):
-      yield struct.unpack('qI', pages[pos:pos+_qI_SIZE])
-
-  def iterrecords(self, start_position, end_position):
+  def searchPages(self, searchFilter, beforePosition=None):
+    """ Yields a list of (buf, record) tuples that match the filter for each
+    page, starting with the most recent page. Only records that start before
+    beforePosition are included. """
     if self.mode == AppLogFile.MODE_WRITE:
       self._handle.flush()
-      handle = open(self._filename, 'rb')
+      summaries = list(self._pageSummaries)
+      if self._currentPage.count:
+        summaries.append(self._currentPage)
+      fileMap = self._mapFile()
     else:
-      handle = self._handle
+      summaries = self._pageSummaries
+      fileMap = self._map
+    if fileMap is None and not self.isCompressed():
+      return
     try:
-      handle.seek(start_position)
-      if end_position != -1:
-        buf = handle.read(end_position - start_position)
-      else:
-        buf = handle.read()
+      lo, hi = searchFilter.pageRange(summaries)
+      for summary in reversed(summaries[lo:hi]):
+        if beforePosition is not None and summary.start >= beforePosition:
+          continue
+        if not searchFilter.includesPage(summary):
+          continue
+        results = list()
+        if self.isCompressed():
+          page, base = self._readBlock(summary.start), summary.start
+        else:
+          page, base = fileMap, 0
+        pos = summary.start
+        while pos < summary.end:
+          if beforePosition is not None and pos >= beforePosition:
+            break
+          buf, next_pos = readLogRecordAt(page, pos - base)
+          pos = next_pos + base
+          record = logging_capnp.RequestLog.from_bytes(buf)
+          if searchFilter.includesRecord(record):
+            results.append((buf, record))
+        yield results
     finally:
       if self.mode == AppLogFile.MODE_WRITE:
-        handle.close()
-    pos = 0
-    while pos < len(buf):
-      buf2 = buf[pos:pos+_I_SIZE]
-      pos += _I_SIZE
-      if not buf2:
-        break
-      length, = struct.unpack('I', buf2)
-      buf2 = buf[pos:pos+length]
-      pos += length
-      yield buf2, logging_capnp.RequestLog.from_bytes(buf2)
+        fileMap.close()
 
 class AppRegistry(object):
 
@@ -162,35 +554,119 @@ class AppRegistry(object):
     self._app_id = app_id
     self._root_path = root_path
     self._log_files = list()
-    ids = [0]
+    self._compaction_queue = list()
+    self._compacting = False
+    self._compaction_retry_delays = dict()
+    ids = set([0])
     for f in os.listdir(root_path):
-      m = re.match('^logservice_%s\\.(\\d+)\\.log$' % app_id, f)
-      if not m:
-        continue
-      log_file_id = int(m.groups()[0])
-      ids.append(log_file_id)
-      self._log_files.append(AppLogFile(root_path, app_id, log_file_id,
-                                        AppLogFile.MODE_SEARCH))
-    self._log_files.sort(key=lambda x: x.log_file_id)
+      m = re.match('^logservice_%s\\.(\\d+)\\.log(\\.z)?$' % app_id, f)
+      if m:
+        ids.add(int(m.groups()[0]))
+    for log_file_id in sorted(ids - set([0])):
+      alf = AppLogFile(root_path, app_id, log_file_id, AppLogFile.MODE_SEARCH)
+      self._log_files.append(alf)
+      if not alf.hasSortedIndex():
+        self.sortRequestIdIndex(alf)
+      if not alf.isCompressed():
+        self.scheduleCompaction(alf)
     self._writer = AppLogFile(root_path, app_id, max(ids) + 1, AppLogFile.MODE_WRITE)
+    self.enforceRetention()
 
   def write(self, buf):
     position, requestLog = self._writer.write(buf)
     if position > MAX_LOG_FILE_SIZE:
       self._writer.close()
-      self._log_files.append(AppLogFile(self._root_path, self._app_id,
-                                        self._writer.log_file_id,
-                                        AppLogFile.MODE_SEARCH))
+      alf = AppLogFile(self._root_path, self._app_id, self._writer.log_file_id,
+                       AppLogFile.MODE_SEARCH)
+      self._log_files.append(alf)
+      self.sortRequestIdIndex(alf)
       self._writer = AppLogFile(self._root_path, self._app_id,
                                 self._writer.log_file_id + 1,
                                 AppLogFile.MODE_WRITE)
-      log_file_count = len(self._log_files) - 1
-      if log_file_count * MAX_LOG_FILE_SIZE > self._factory.size * 1024 ** 3:
-        lf = self._log_files.pop(0)
-        lf.close()
-        lf.delete()
+      self.scheduleCompaction(alf)
     self.broadcastToFollowers(requestLog, buf)
 
+  def enforceRetention(self):
+    # Rotated log files are compressed, so the size of the files on disk
+    # decides how much history fits in the configured space. The oldest files
+    # are removed first. Removal stops at a file that is waiting for its first
+    # compaction, since compressing it may bring the files within the budget.
+    # A file whose compaction failed is removed like a compressed one.
+    retention = self._factory.size * 1024 ** 3 - MAX_LOG_FILE_SIZE
+    used = sum(alf.diskSize() for alf in self._log_files)
+    for lf in list(self._log_files):
+      if used <= retention:
+        break
+      if (not lf.isCompressed() and
+          lf.log_file_id not in self._compaction_retry_delays):
+        break
+      self._log_files.remove(lf)
+      self._compaction_retry_delays.pop(lf.log_file_id, None)
+      used -= lf.diskSize()
+      lf.close()
+      lf.delete()
+
+  def sortRequestIdIndex(self, alf):
+    # Sorting the request ID index of a large log file takes a while, so it
+    # happens in the reactor's thread pool.
+    deferred = threads.deferToThread(alf.buildSortedIndex)
+    deferred.addCallback(lambda _: self._finishSorting(alf))
+    deferred.addErrback(log.err)
+
+  def _finishSorting(self, alf):
+    if alf in self._log_files:
+      alf.useSortedIndex()
+    else:
+      # The log file was removed while its index was being sorted.
+      alf.delete()
+
+  def scheduleCompaction(self, alf):
+    self._compaction_queue.append(alf)
+    self._compactNext()
+
+  def _compactNext(self):
+    # Compact one log file at a time in the reactor's thread pool.
+    if self._compacting or not self._compaction_queue:
+      return
+    alf = self._compaction_queue.pop(0)
+    if alf not in self._log_files:
+      self._compactNext()
+      return
+    self._compacting = True
+    deferred = threads.deferToThread(alf.compact)
+    deferred.addCallback(lambda _: self._finishCompaction(alf))
+    deferred.addErrback(self._compactionFailed, alf)
+    deferred.addBoth(self._compactionDone)
+
+  def _finishCompaction(self, alf):
+    self._compaction_retry_delays.pop(alf.log_file_id, None)
+    if alf in self._log_files:
+      alf.useCompressed()
+      log.msg("Compacted log file {} of {}".format(alf.log_file_id,
+                                                   self._app_id))
+      self.enforceRetention()
+    else:
+      # The log file was removed while it was being compacted.
+      alf.delete()
+
+  def _compactionFailed(self, failure, alf):
+    # Errors such as a full disk can clear up, so the file is compacted again
+    # later. Until then, retention is allowed to remove it.
+    log.err(failure, "Unable to compact log file {} of {}".format(
+      alf.log_file_id, self._app_id))
+    if alf not in self._log_files:
+      return
+    delay = self._compaction_retry_delays.get(alf.log_file_id,
+                                              COMPACTION_RETRY_DELAY / 2) * 2
+    delay = min(delay, MAX_COMPACTION_RETRY_DELAY)
+    self._compaction_retry_delays[alf.log_file_id] = delay
+    reactor.callLater(delay, self.scheduleCompaction, alf)
+    self.enforceRetention()
+
+  def _compactionDone(self, _):
+    self._compacting = False
+    self._compactNext()
+
   def iter(self):
     yield self._writer
     for alf in self._log_files:
@@ -204,10 +680,18 @@ class AppRegistry(object):
       for requestId, record in alf.get(lookupRequestIds):
         yield requestId, record
 
-  def iterpages(self):
-    for alf in self.iter():
-      for endTime, position in alf.iterpages():
-         yield endTime, position, alf
+  def searchPages(self, searchFilter, offset=None):
+    if offset:
+      offsetLogFileId, offsetPosition = parseOffset(offset)
+    for alf in [self._writer] + list(reversed(self._log_files)):
+      beforePosition = None
+      if offset:
+        if alf.log_file_id > offsetLogFileId:
+          continue
+        if alf.log_file_id == offsetLogFileId:
+          beforePosition = offsetPosition
+      for results in alf.searchPages(searchFilter, beforePosition):
+        yield results
 
   def registerFollower(self, protocol, query):
     self._followers[protocol] = query
@@ -289,54 +773,16 @@ class Protocol(protocol.Protocol):
 
   def processActionQuerySearch(self, query):
     results = list()
-    versionIds = list(query.versionIds)
-    if query.offset:
-      query_log_file_id, query_position = parseOffset(query.offset)
-    oldestRecord = None
     start = time.time()
-    previousALF = None
-    previousPosition = -1
-    for endTime, position, alf in self.app_registry.iterpages():
-      if query.endTime and query.endTime < endTime:
-        continue
-      if query.offset:
-        if alf.log_file_id > query_log_file_id:
-          continue
-        if alf.log_file_id == query_log_file_id and position > query_position:
-          continue
-      end_position = previousPosition if alf == previousALF else -1
-      for buf, record in alf.iterrecords(position, end_position):
-        if not oldestRecord or oldestRecord.startTime > record.startTime:
-          oldestRecord = record
-        if query.endTime and query.endTime < endTime:
-          break
-        if query.offset:
-          log_file_id, position = parseOffset(record.offset)
-          if log_file_id == query_log_file_id and position >= query_position:
-            break
-        if query.minimumLogLevel:
-          include = False
-          for appLog in record.appLogs:
-            if appLog.level >= query.minimumLogLevel:
-              include = True
-              break
-          if not include:
-            continue
-        if record.versionId and not record.versionId.split('.', 1)[0] in versionIds:
-          continue
-        if query.startTime and query.startTime > record.startTime:
-          continue
-        results.append((buf, record))
-      if query.startTime and oldestRecord.endTime < query.startTime:
-        break
+    searchFilter = SearchFilter(query)
+    for pageResults in self.app_registry.searchPages(searchFilter, query.offset):
+      results.extend(pageResults)
       if len(results) >= query.count:
         break
-      if results and time.time() - start > 5:
+      if results and time.time() - start > SEARCH_SOFT_TIME_LIMIT:
         break
-      if time.time() - start > 25:
+      if time.time() - start > SEARCH_HARD_TIME_LIMIT:
         break
-      previousALF = alf
-      previousPosition = position
     results.sort(key=lambda entry: entry[1].endTime, reverse=query.reverse)
     self.sendQueryResult([b for b, _ in results])
 
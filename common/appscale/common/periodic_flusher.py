@@ -0,0 +1,64 @@
+""" Runs a flush function in the background at a fixed interval. """
+
+import logging
+import threading
+
+
+class PeriodicFlusher(object):
+  """ Calls a function from a daemon thread until stopped.
+
+  The thread is started the first time there is something to flush, so
+  buffers that are never used do not create a thread.
+  """
+  def __init__(self, flush, interval):
+    """ Creates a new PeriodicFlusher.
+
+    Args:
+      flush: A function that takes no arguments.
+      interval: A number specifying how many seconds to wait between calls.
+    """
+    self.flush = flush
+    self.interval = interval
+    self.logger = logging.getLogger(self.__class__.__name__)
+
+    self._lock = threading.Lock()
+    self._stop_cv = threading.Condition(self._lock)
+    self._thread = None
+    self._running = False
+
+  def start(self):
+    """ Starts the background thread if it is not running. """
+    with self._lock:
+      if self._running:
+        return
+
+      self._running = True
+      self._thread = threading.Thread(target=self._flush_periodically)
+      self._thread.daemon = True
+      self._thread.start()
+
+  def stop(self):
+    """ Stops the background thread and waits for it to finish. """
+    with self._lock:
+      self._running = False
+      self._stop_cv.notify_all()
+      thread = self._thread
+      self._thread = None
+
+    if thread is not None and thread is not threading.current_thread():
+      thread.join()
+
+  def _flush_periodically(self):
+    """ Calls the flush function until stopped. """
+    while True:
+      with self._lock:
+        self._stop_cv.wait(self.interval)
+        if not self._running:
+          return
+
+      # An unexpected error should not stop the pending work from being
+      # flushed later.
+      try:
+        self.flush()
+      except Exception:
+        self.logger.exception('Unable to flush')
@@ -0,0 +1,59 @@
+import threading
+import unittest
+
+from appscale.common.periodic_flusher import PeriodicFlusher
+
+
+class TestPeriodicFlusher(unittest.TestCase):
+  def test_flushes_until_stopped(self):
+    flushed = threading.Event()
+    calls = []
+    def flush():
+      calls.append(None)
+      flushed.set()
+
+    flusher = PeriodicFlusher(flush, .01)
+    flusher.start()
+    flusher.start()
+    self.assertTrue(flushed.wait(5))
+
+    flusher.stop()
+    count = len(calls)
+    flushed.clear()
+    self.assertFalse(flushed.wait(.05))
+    self.assertEqual(len(calls), count)
+
+  def test_flush_error(self):
+    flushed = threading.Event()
+    calls = []
+    def flush():
+      calls.append(None)
+      if len(calls) == 1:
+        raise ValueError('Bad flush')
+      flushed.set()
+
+    # The thread keeps running after the first flush fails.
+    flusher = PeriodicFlusher(flush, .01)
+    flusher.start()
+    self.assertTrue(flushed.wait(5))
+    flusher.stop()
+
+  def test_stop_without_start(self):
+    calls = []
+    flusher = PeriodicFlusher(lambda: calls.append(None), .01)
+    flusher.stop()
+    self.assertListEqual(calls, [])
+
+  def test_restart(self):
+    flushed = threading.Event()
+    flusher = PeriodicFlusher(flushed.set, .01)
+    flusher.start()
+    flusher.stop()
+
+    flusher.start()
+    self.assertTrue(flushed.wait(5))
+    flusher.stop()
+
+
+if __name__ == "__main__":
+  unittest.main()